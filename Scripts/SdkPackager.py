@@ -257,12 +257,14 @@ if '-microsoft-' in SDK_TARGET:
     wrapper_files = [
         ('Source/Python/wrappers', 'mp4dash.bat','bin'),
         ('Source/Python/wrappers', 'mp4dashclone.bat','bin'),
+        ('Source/Python/wrappers', 'mp4hlsclone.bat','bin'),
         ('Source/Python/wrappers', 'mp4hls.bat','bin')
     ]
 else:
     wrapper_files = [
         ('Source/Python/wrappers', 'mp4dash','bin'),
         ('Source/Python/wrappers', 'mp4dashclone','bin'),
+        ('Source/Python/wrappers', 'mp4hlsclone','bin'),
         ('Source/Python/wrappers', 'mp4hls','bin')
     ]
 CopyFiles(wrapper_files)
@@ -779,6 +779,12 @@ AP4_SampleDescription_AsMpegAudio(AP4_SampleDescription* self)
     return AP4_DYNAMIC_CAST(AP4_MpegAudioSampleDescription, self);
 }
 
+AP4_ProtectedSampleDescription*
+AP4_SampleDescription_AsProtected(AP4_SampleDescription* self)
+{
+    return AP4_DYNAMIC_CAST(AP4_ProtectedSampleDescription, self);
+}
+
 AP4_UI32
 AP4_AudioSampleDescription_GetSampleRate(AP4_AudioSampleDescription* self)
 {
@@ -1297,8 +1303,16 @@ public:
     AP4_DelegatorAtomInspector(AP4_AtomInspectorDelegate* delegate) :
         m_Delegate(delegate) {}
     ~AP4_DelegatorAtomInspector();
-    void StartElement(const char* name, const char* extra);
-    void EndElement();
+    void StartAtom(const char* name,
+                   AP4_UI08    version,
+                   AP4_UI32    flags,
+                   AP4_Size    header_size,
+                   AP4_UI64    size);
+    void EndAtom();
+    void StartDescriptor(const char* name,
+                         AP4_Size    header_size,
+                         AP4_UI64    size);
+    void EndDescriptor();
     void AddField(const char* name, AP4_UI64 value, FormatHint hint);
     void AddFieldF(const char* name, float value, FormatHint hint);
     void AddField(const char* name, const char* value, FormatHint hint);
@@ -1318,13 +1332,46 @@ AP4_DelegatorAtomInspector::~AP4_DelegatorAtomInspector()
 }
 
 void
-AP4_DelegatorAtomInspector::StartElement(const char* name, const char* extra)
+AP4_DelegatorAtomInspector::StartAtom(const char* name,
+                                      AP4_UI08    version,
+                                      AP4_UI32    flags,
+                                      AP4_Size    header_size,
+                                      AP4_UI64    size)
+{
+    // same format as the AP4_PrintInspector atom headers
+    char extra[32] = "";
+    if (header_size == 28 || header_size == 12 || header_size == 20) {
+        if (version && flags) {
+            AP4_FormatString(extra, sizeof(extra), ", version=%d, flags=%x", version, flags);
+        } else if (version) {
+            AP4_FormatString(extra, sizeof(extra), ", version=%d", version);
+        } else if (flags) {
+            AP4_FormatString(extra, sizeof(extra), ", flags=%x", flags);
+        }
+    }
+    char info[128];
+    AP4_FormatString(info, sizeof(info), "size=%d+%lld%s", header_size, size-header_size, extra);
+    m_Delegate->StartElement(m_Delegate, name, info);
+}
+
+void
+AP4_DelegatorAtomInspector::EndAtom()
+{
+    m_Delegate->EndElement(m_Delegate); 
+}
+
+void
+AP4_DelegatorAtomInspector::StartDescriptor(const char* name,
+                                            AP4_Size    header_size,
+                                            AP4_UI64    size)
 {
-    m_Delegate->StartElement(m_Delegate, name, extra);
+    char info[128];
+    AP4_FormatString(info, sizeof(info), "size=%d+%lld", header_size, size-header_size);
+    m_Delegate->StartElement(m_Delegate, name, info);
 }
 
 void
-AP4_DelegatorAtomInspector::EndElement()
+AP4_DelegatorAtomInspector::EndDescriptor()
 {
     m_Delegate->EndElement(m_Delegate); 
 }
@@ -0,0 +1,206 @@
+__author__    = 'Gilles Boccon-Gibod (bok@bok.net)'
+__copyright__ = 'Copyright 2011-2020 Axiomatic Systems, LLC.'
+
+###
+# Python bindings for the Bento4 C API.
+# The bindings use ctypes over the Bento4C shared library, which is built
+# with 'cmake -DBUILD_BENTO4C=ON'. The library is looked up in this order:
+# the BENTO4_LIBRARY environment variable (full path of the library), the
+# directory of this package, and the system library path.
+
+import os
+import sys
+import os.path as path
+from ctypes import CDLL, CFUNCTYPE, Structure, POINTER, c_int, c_uint, c_uint8, c_uint16, c_uint32, c_uint64, \
+                   c_float, c_char_p, c_void_p
+from ctypes.util import find_library
+
+# basic types
+AP4_Result    = c_int
+AP4_Size      = c_uint32
+AP4_Ordinal   = c_uint
+AP4_Cardinal  = c_uint
+AP4_UI08      = c_uint8
+AP4_UI16      = c_uint16
+AP4_UI32      = c_uint32
+AP4_UI64      = c_uint64
+AP4_Position  = c_uint64
+AP4_LargeSize = c_uint64
+
+if sys.platform == 'darwin':
+    LIBRARY_NAMES = ['libBento4C.dylib']
+elif sys.platform == 'win32':
+    LIBRARY_NAMES = ['Bento4C.dll', 'Bento4CDll.dll']
+else:
+    LIBRARY_NAMES = ['libBento4C.so']
+
+def find_bento4_library():
+    if os.environ.get('BENTO4_LIBRARY'):
+        return os.environ['BENTO4_LIBRARY']
+    for name in LIBRARY_NAMES:
+        filename = path.join(path.dirname(path.abspath(__file__)), name)
+        if path.exists(filename):
+            return filename
+    return find_library('Bento4C') or find_library('Bento4CDll')
+
+def load_bento4_library():
+    filename = find_bento4_library()
+    if filename is None:
+        raise ImportError('Bento4C shared library not found (build it with cmake -DBUILD_BENTO4C=ON, and set BENTO4_LIBRARY to its path)')
+    try:
+        return CDLL(filename)
+    except OSError as e:
+        raise ImportError('cannot load the Bento4C shared library from '+filename+': '+str(e))
+
+bento4dll = load_bento4_library()
+
+# delegate structures
+class AtomInspectorDelegate(Structure):
+    pass
+
+StartElementProc   = CFUNCTYPE(None, c_void_p, c_char_p, c_char_p)
+EndElementProc     = CFUNCTYPE(None, c_void_p)
+AddIntFieldProc    = CFUNCTYPE(None, c_void_p, c_char_p, AP4_UI64, c_int)
+AddFloatFieldProc  = CFUNCTYPE(None, c_void_p, c_char_p, c_float, c_int)
+AddStringFieldProc = CFUNCTYPE(None, c_void_p, c_char_p, c_char_p, c_int)
+AddBytesFieldProc  = CFUNCTYPE(None, c_void_p, c_char_p, POINTER(c_uint8), AP4_Size, c_int)
+DestroyProc        = CFUNCTYPE(None, c_void_p)
+
+AtomInspectorDelegate._fields_ = [
+    ('start_element',    StartElementProc),
+    ('end_element',      EndElementProc),
+    ('add_int_field',    AddIntFieldProc),
+    ('add_float_field',  AddFloatFieldProc),
+    ('add_string_field', AddStringFieldProc),
+    ('add_bytes_field',  AddBytesFieldProc),
+    ('destroy',          DestroyProc)
+]
+
+# function prototypes (name, result type, argument types)
+PROTOTYPES = [
+    # byte streams
+    ('AP4_ByteStream_AddReference',  None,       [c_void_p]),
+    ('AP4_ByteStream_Release',       None,       [c_void_p]),
+    ('AP4_ByteStream_ReadPartial',   AP4_Result, [c_void_p, c_void_p, AP4_Size, POINTER(AP4_Size)]),
+    ('AP4_ByteStream_Read',          AP4_Result, [c_void_p, c_void_p, AP4_Size]),
+    ('AP4_ByteStream_WritePartial',  AP4_Result, [c_void_p, c_void_p, AP4_Size, POINTER(AP4_Size)]),
+    ('AP4_ByteStream_Write',         AP4_Result, [c_void_p, c_void_p, AP4_Size]),
+    ('AP4_ByteStream_Seek',          AP4_Result, [c_void_p, AP4_Position]),
+    ('AP4_ByteStream_Tell',          AP4_Result, [c_void_p, POINTER(AP4_Position)]),
+    ('AP4_ByteStream_GetSize',       AP4_Result, [c_void_p, POINTER(AP4_LargeSize)]),
+    ('AP4_ByteStream_CopyTo',        AP4_Result, [c_void_p, c_void_p, AP4_LargeSize]),
+    ('AP4_SubStream_Create',                c_void_p, [c_void_p, AP4_Position, AP4_LargeSize]),
+    ('AP4_MemoryByteStream_Create',         c_void_p, [AP4_Size]),
+    ('AP4_MemoryByteStream_FromBuffer',     c_void_p, [c_void_p, AP4_Size]),
+    ('AP4_MemoryByteStream_AdaptDataBuffer', c_void_p, [c_void_p]),
+    ('AP4_FileByteStream_Create',           c_void_p, [c_char_p, c_int, POINTER(AP4_Result)]),
+
+    # data buffers
+    ('AP4_DataBuffer_Create',        c_void_p,   [AP4_Size]),
+    ('AP4_DataBuffer_FromData',      c_void_p,   [c_void_p, AP4_Size]),
+    ('AP4_DataBuffer_Destroy',       None,       [c_void_p]),
+    ('AP4_DataBuffer_GetData',       c_void_p,   [c_void_p]),
+    ('AP4_DataBuffer_GetDataSize',   AP4_Size,   [c_void_p]),
+    ('AP4_DataBuffer_SetData',       AP4_Result, [c_void_p, c_void_p, AP4_Size]),
+    ('AP4_DataBuffer_SetDataSize',   AP4_Result, [c_void_p, AP4_Size]),
+    ('AP4_DataBuffer_Reserve',       AP4_Result, [c_void_p, AP4_Size]),
+    ('AP4_DataBuffer_GetBufferSize', AP4_Size,   [c_void_p]),
+
+    # files
+    ('AP4_File_FromStream',          c_void_p,   [c_void_p, c_int]),
+    ('AP4_File_GetMovie',            c_void_p,   [c_void_p]),
+    ('AP4_File_GetFileType',         AP4_Result, [c_void_p, POINTER(AP4_UI32), POINTER(AP4_UI32), POINTER(AP4_Cardinal)]),
+    ('AP4_File_GetCompatibleBrand',  AP4_Result, [c_void_p, AP4_Ordinal, POINTER(AP4_UI32)]),
+    ('AP4_File_IsMoovBeforeMdat',    c_int,      [c_void_p]),
+    ('AP4_File_Inspect',             AP4_Result, [c_void_p, c_void_p]),
+    ('AP4_File_Destroy',             None,       [c_void_p]),
+
+    # movies
+    ('AP4_Movie_GetTrackCount',      AP4_Cardinal, [c_void_p]),
+    ('AP4_Movie_GetTrackByIndex',    c_void_p,     [c_void_p, AP4_Ordinal]),
+    ('AP4_Movie_GetTrackById',       c_void_p,     [c_void_p, AP4_UI32]),
+    ('AP4_Movie_GetTrackByType',     c_void_p,     [c_void_p, c_int, AP4_Ordinal]),
+    ('AP4_Movie_GetTimeScale',       AP4_UI32,     [c_void_p]),
+    ('AP4_Movie_GetDuration',        AP4_UI64,     [c_void_p]),
+    ('AP4_Movie_GetDurationMs',      AP4_UI32,     [c_void_p]),
+
+    # tracks
+    ('AP4_Track_GetType',                      c_int,       [c_void_p]),
+    ('AP4_Track_GetHandlerType',               AP4_UI32,    [c_void_p]),
+    ('AP4_Track_GetDuration',                  AP4_UI64,    [c_void_p]),
+    ('AP4_Track_GetDurationMs',                AP4_UI32,    [c_void_p]),
+    ('AP4_Track_GetSampleCount',               AP4_Cardinal, [c_void_p]),
+    ('AP4_Track_GetSample',                    AP4_Result,  [c_void_p, AP4_Ordinal, c_void_p]),
+    ('AP4_Track_ReadSample',                   AP4_Result,  [c_void_p, AP4_Ordinal, c_void_p, c_void_p]),
+    ('AP4_Track_GetSampleIndexForTimeStampMs', AP4_Result,  [c_void_p, AP4_UI32, POINTER(AP4_Ordinal)]),
+    ('AP4_Track_GetNearestSyncSampleIndex',    AP4_Ordinal, [c_void_p, AP4_Ordinal, c_int]),
+    ('AP4_Track_GetSampleDescription',         c_void_p,    [c_void_p, AP4_Ordinal]),
+    ('AP4_Track_GetId',                        AP4_UI32,    [c_void_p]),
+    ('AP4_Track_GetMediaTimeScale',            AP4_UI32,    [c_void_p]),
+    ('AP4_Track_GetMediaDuration',             AP4_UI64,    [c_void_p]),
+    ('AP4_Track_GetName',                      c_char_p,    [c_void_p]),
+    ('AP4_Track_GetLanguage',                  c_char_p,    [c_void_p]),
+
+    # sample descriptions
+    ('AP4_SampleDescription_GetType',          c_int,    [c_void_p]),
+    ('AP4_SampleDescription_GetFormat',        AP4_UI32, [c_void_p]),
+    ('AP4_SampleDescription_AsAudio',          c_void_p, [c_void_p]),
+    ('AP4_SampleDescription_AsVideo',          c_void_p, [c_void_p]),
+    ('AP4_SampleDescription_AsAvc',            c_void_p, [c_void_p]),
+    ('AP4_SampleDescription_AsMpeg',           c_void_p, [c_void_p]),
+    ('AP4_SampleDescription_AsMpegAudio',      c_void_p, [c_void_p]),
+    ('AP4_SampleDescription_AsProtected',      c_void_p, [c_void_p]),
+    ('AP4_AudioSampleDescription_GetSampleRate',         AP4_UI32, [c_void_p]),
+    ('AP4_AudioSampleDescription_GetSampleSize',         AP4_UI16, [c_void_p]),
+    ('AP4_AudioSampleDescription_GetChannelCount',       AP4_UI16, [c_void_p]),
+    ('AP4_VideoSampleDescription_GetWidth',              AP4_UI32, [c_void_p]),
+    ('AP4_VideoSampleDescription_GetHeight',             AP4_UI16, [c_void_p]),
+    ('AP4_VideoSampleDescription_GetDepth',              AP4_UI16, [c_void_p]),
+    ('AP4_VideoSampleDescription_GetCompressorName',     c_char_p, [c_void_p]),
+    ('AP4_AvcSampleDescription_GetConfigurationVersion', AP4_UI08, [c_void_p]),
+    ('AP4_AvcSampleDescription_GetProfile',              AP4_UI08, [c_void_p]),
+    ('AP4_AvcSampleDescription_GetLevel',                AP4_UI08, [c_void_p]),
+    ('AP4_AvcSampleDescription_GetProfileCompatibility', AP4_UI08, [c_void_p]),
+    ('AP4_AvcSampleDescription_GetNaluLengthSize',       AP4_UI08, [c_void_p]),
+    ('AP4_AvcSampleDescription_GetSequenceParameterCount', AP4_Cardinal, [c_void_p]),
+    ('AP4_AvcSampleDescription_GetSequenceParameter',    c_void_p, [c_void_p, AP4_Ordinal]),
+    ('AP4_AvcSampleDescription_GetPictureParameterCount', AP4_Cardinal, [c_void_p]),
+    ('AP4_AvcSampleDescription_GetPictureParameter',     c_void_p, [c_void_p, AP4_Ordinal]),
+    ('AP4_AvcSampleDescription_GetRawBytes',             c_void_p, [c_void_p]),
+    ('AP4_AvcSampleDescription_GetProfileName',          c_char_p, [AP4_UI08]),
+    ('AP4_MpegSampleDescription_GetStreamType',          AP4_UI08, [c_void_p]),
+    ('AP4_MpegSampleDescription_GetObjectTypeId',        AP4_UI08, [c_void_p]),
+    ('AP4_MpegSampleDescription_GetBufferSize',          AP4_UI32, [c_void_p]),
+    ('AP4_MpegSampleDescription_GetMaxBitrate',          AP4_UI32, [c_void_p]),
+    ('AP4_MpegSampleDescription_GetAvgBitrate',          AP4_UI32, [c_void_p]),
+    ('AP4_MpegSampleDescription_GetDecoderInfo',         c_void_p, [c_void_p]),
+    ('AP4_MpegAudioSampleDescription_GetMpeg4AudioObjectType',      AP4_UI08, [c_void_p]),
+    ('AP4_MpegAudioSampleDescription_GetMpegAudioObjectTypeString', c_char_p, [AP4_UI08]),
+    ('AP4_ProtectedSampleDescription_GetOriginalSampleDescription', c_void_p, [c_void_p]),
+    ('AP4_ProtectedSampleDescription_GetOriginalFormat',            AP4_UI32, [c_void_p]),
+    ('AP4_ProtectedSampleDescription_GetSchemeType',                AP4_UI32, [c_void_p]),
+    ('AP4_ProtectedSampleDescription_GetSchemeVersion',             AP4_UI32, [c_void_p]),
+    ('AP4_ProtectedSampleDescription_GetSchemeUri',                 c_char_p, [c_void_p]),
+
+    # samples
+    ('AP4_Sample_CreateEmpty',         c_void_p,     []),
+    ('AP4_Sample_Destroy',             None,         [c_void_p]),
+    ('AP4_Sample_ReadData',            AP4_Result,   [c_void_p, c_void_p]),
+    ('AP4_Sample_GetOffset',           AP4_Position, [c_void_p]),
+    ('AP4_Sample_GetSize',             AP4_Size,     [c_void_p]),
+    ('AP4_Sample_GetDescriptionIndex', AP4_Ordinal,  [c_void_p]),
+    ('AP4_Sample_GetDts',              AP4_UI64,     [c_void_p]),
+    ('AP4_Sample_GetCts',              AP4_UI64,     [c_void_p]),
+    ('AP4_Sample_GetDuration',         AP4_UI32,     [c_void_p]),
+    ('AP4_Sample_IsSync',              c_int,        [c_void_p]),
+
+    # inspectors
+    ('AP4_AtomInspector_Destroy',      None,     [c_void_p]),
+    ('AP4_PrintInspector_Create',      c_void_p, [c_void_p]),
+    ('AP4_AtomInspector_FromDelegate', c_void_p, [POINTER(AtomInspectorDelegate)])
+]
+
+for (name, restype, argtypes) in PROTOTYPES:
+    function = getattr(bento4dll, name)
+    function.restype  = restype
+    function.argtypes = argtypes
@@ -0,0 +1,517 @@
+__author__    = 'Gilles Boccon-Gibod (bok@bok.net)'
+__copyright__ = 'Copyright 2011-2020 Axiomatic Systems, LLC.'
+
+###
+# Files, movies, tracks, samples and sample descriptions.
+# The objects returned by a File (its Movie, Tracks and SampleDescriptions)
+# belong to the file, and keep it alive.
+
+import struct
+from ctypes import byref
+from bento4 import bento4dll as dll, AP4_UI32, AP4_Cardinal, AP4_Ordinal
+from bento4.errors import check_result
+from bento4.streams import DataBuffer, FileByteStream
+
+def atom_type(name):
+    """
+    Four character code of an atom name, as an integer.
+    """
+    return struct.unpack('>I', name.encode('latin-1'))[0]
+
+def atom_name(type):
+    return struct.pack('>I', type).decode('latin-1')
+
+def avc_profile_name(profile):
+    name = dll.AP4_AvcSampleDescription_GetProfileName(profile)
+    return name.decode('latin-1') if name is not None else None
+
+def mpeg_audio_object_type_name(object_type):
+    name = dll.AP4_MpegAudioSampleDescription_GetMpegAudioObjectTypeString(object_type)
+    return name.decode('latin-1') if name is not None else None
+
+def decode_string(value):
+    return value.decode('utf-8', 'replace') if value is not None else None
+
+#############################################
+class File:
+    FILE_BRAND_QT__ = atom_type('qt  ')
+    FILE_BRAND_ISOM = atom_type('isom')
+    FILE_BRAND_MP41 = atom_type('mp41')
+    FILE_BRAND_MP42 = atom_type('mp42')
+    FILE_BRAND_3GP1 = atom_type('3gp1')
+    FILE_BRAND_3GP2 = atom_type('3gp2')
+    FILE_BRAND_3GP3 = atom_type('3gp3')
+    FILE_BRAND_3GP4 = atom_type('3gp4')
+    FILE_BRAND_3GP5 = atom_type('3gp5')
+    FILE_BRAND_3G2A = atom_type('3g2a')
+    FILE_BRAND_MMP4 = atom_type('mmp4')
+    FILE_BRAND_M4A_ = atom_type('M4A ')
+    FILE_BRAND_M4P_ = atom_type('M4P ')
+    FILE_BRAND_MJP2 = atom_type('mjp2')
+
+    def __init__(self, name=None, stream=None, moov_only=False):
+        """
+        Parse a file, from its name or from a ByteStream. With moov_only, the
+        parsing stops after the moov atom.
+        """
+        if stream is None:
+            if name is None:
+                raise ValueError('a file name or a stream is required')
+            stream = FileByteStream(name)
+        self.stream = stream
+        self.handle = dll.AP4_File_FromStream(stream.handle, 1 if moov_only else 0)
+        self._movie = None
+
+    def __del__(self):
+        if getattr(self, 'handle', None):
+            dll.AP4_File_Destroy(self.handle)
+            self.handle = None
+
+    @property
+    def type(self):
+        """
+        (major brand, minor version, [compatible brands])
+        """
+        (major_brand, minor_version, brand_count) = (AP4_UI32(), AP4_UI32(), AP4_Cardinal())
+        result = dll.AP4_File_GetFileType(self.handle, byref(major_brand), byref(minor_version), byref(brand_count))
+        if result != 0:
+            return None
+        compatible_brands = []
+        brand = AP4_UI32()
+        for i in range(brand_count.value):
+            check_result(dll.AP4_File_GetCompatibleBrand(self.handle, i, byref(brand)))
+            compatible_brands.append(brand.value)
+        return (major_brand.value, minor_version.value, compatible_brands)
+
+    @property
+    def moov_is_before_mdat(self):
+        return dll.AP4_File_IsMoovBeforeMdat(self.handle) != 0
+
+    @property
+    def movie(self):
+        if self._movie is None:
+            handle = dll.AP4_File_GetMovie(self.handle)
+            if handle:
+                self._movie = Movie(handle, self)
+        return self._movie
+
+    def inspect(self, inspector):
+        check_result(dll.AP4_File_Inspect(self.handle, inspector.handle))
+
+#############################################
+class Movie:
+    def __init__(self, handle, file):
+        self.handle = handle
+        self.file   = file
+        self._tracks = None
+
+    @property
+    def timescale(self):
+        return dll.AP4_Movie_GetTimeScale(self.handle)
+
+    @property
+    def duration(self):
+        """
+        (duration, timescale)
+        """
+        return (dll.AP4_Movie_GetDuration(self.handle), self.timescale)
+
+    @property
+    def duration_ms(self):
+        return dll.AP4_Movie_GetDurationMs(self.handle)
+
+    @property
+    def tracks(self):
+        """
+        Tracks, indexed by track ID, in file order.
+        """
+        if self._tracks is None:
+            self._tracks = {}
+            for i in range(dll.AP4_Movie_GetTrackCount(self.handle)):
+                track = Track(dll.AP4_Movie_GetTrackByIndex(self.handle, i), self)
+                self._tracks[track.id] = track
+        return self._tracks
+
+    def track_by_type(self, type, index=0):
+        tracks = [track for track in self.tracks.values() if track.type == type]
+        return tracks[index] if index < len(tracks) else None
+
+#############################################
+class Track:
+    TYPE_UNKNOWN   = 0
+    TYPE_AUDIO     = 1
+    TYPE_VIDEO     = 2
+    TYPE_SYSTEM    = 3
+    TYPE_HINT      = 4
+    TYPE_TEXT      = 5
+    TYPE_JPEG      = 6
+    TYPE_RTP       = 7
+    TYPE_SUBTITLES = 8
+
+    HANDLER_TYPE_SOUN = atom_type('soun')
+    HANDLER_TYPE_VIDE = atom_type('vide')
+    HANDLER_TYPE_HINT = atom_type('hint')
+    HANDLER_TYPE_MDIR = atom_type('mdir')
+    HANDLER_TYPE_TEXT = atom_type('text')
+    HANDLER_TYPE_TX3G = atom_type('tx3g')
+    HANDLER_TYPE_JPEG = atom_type('jpeg')
+    HANDLER_TYPE_ODSM = atom_type('odsm')
+    HANDLER_TYPE_SDSM = atom_type('sdsm')
+
+    def __init__(self, handle, movie):
+        self.handle = handle
+        self.movie  = movie
+        self._sample_descriptions = {}
+
+    @property
+    def id(self):
+        return dll.AP4_Track_GetId(self.handle)
+
+    @property
+    def type(self):
+        return dll.AP4_Track_GetType(self.handle)
+
+    @property
+    def handler_type(self):
+        return dll.AP4_Track_GetHandlerType(self.handle)
+
+    @property
+    def duration(self):
+        """
+        (duration, timescale), in the timescale of the movie
+        """
+        return (dll.AP4_Track_GetDuration(self.handle), self.movie.timescale)
+
+    @property
+    def duration_ms(self):
+        return dll.AP4_Track_GetDurationMs(self.handle)
+
+    @property
+    def media_duration(self):
+        """
+        (duration, timescale), in the timescale of the media
+        """
+        return (dll.AP4_Track_GetMediaDuration(self.handle), dll.AP4_Track_GetMediaTimeScale(self.handle))
+
+    @property
+    def media_timescale(self):
+        return dll.AP4_Track_GetMediaTimeScale(self.handle)
+
+    @property
+    def sample_count(self):
+        return dll.AP4_Track_GetSampleCount(self.handle)
+
+    @property
+    def name(self):
+        return decode_string(dll.AP4_Track_GetName(self.handle))
+
+    @property
+    def language(self):
+        return decode_string(dll.AP4_Track_GetLanguage(self.handle))
+
+    def sample_description(self, index):
+        if index not in self._sample_descriptions:
+            handle = dll.AP4_Track_GetSampleDescription(self.handle, index)
+            self._sample_descriptions[index] = MakeSampleDescription(handle, self) if handle else None
+        return self._sample_descriptions[index]
+
+    @property
+    def sample_descriptions(self):
+        descriptions = []
+        while True:
+            description = self.sample_description(len(descriptions))
+            if description is None:
+                return descriptions
+            descriptions.append(description)
+
+    def sample(self, index):
+        """
+        Sample at index (starting at 0), without its data.
+        """
+        sample = Sample(self)
+        check_result(dll.AP4_Track_GetSample(self.handle, index, sample.handle))
+        return sample
+
+    def read_sample(self, index):
+        """
+        Sample at index (starting at 0), with its data.
+        """
+        sample = Sample(self)
+        buffer = DataBuffer()
+        check_result(dll.AP4_Track_ReadSample(self.handle, index, sample.handle, buffer.handle))
+        sample.buffer = buffer
+        return sample
+
+    def sample_iterator(self, start=0, end=None, with_data=True):
+        if end is None:
+            end = self.sample_count
+        for index in range(start, end):
+            yield self.read_sample(index) if with_data else self.sample(index)
+
+    def sample_index_for_timestamp_ms(self, timestamp):
+        index = AP4_Ordinal()
+        check_result(dll.AP4_Track_GetSampleIndexForTimeStampMs(self.handle, timestamp, byref(index)))
+        return index.value
+
+    def nearest_sync_sample_index(self, index, before=True):
+        return dll.AP4_Track_GetNearestSyncSampleIndex(self.handle, index, 1 if before else 0)
+
+#############################################
+class Sample:
+    def __init__(self, track):
+        self.track  = track
+        self.handle = dll.AP4_Sample_CreateEmpty()
+        self.buffer = None
+
+    def __del__(self):
+        if getattr(self, 'handle', None):
+            dll.AP4_Sample_Destroy(self.handle)
+            self.handle = None
+
+    @property
+    def data(self):
+        """
+        Sample data, as a memoryview (read when first accessed if needed).
+        """
+        if self.buffer is None:
+            buffer = DataBuffer()
+            check_result(dll.AP4_Sample_ReadData(self.handle, buffer.handle))
+            self.buffer = buffer
+        return self.buffer.data
+
+    @property
+    def offset(self):
+        return dll.AP4_Sample_GetOffset(self.handle)
+
+    @property
+    def size(self):
+        return dll.AP4_Sample_GetSize(self.handle)
+
+    @property
+    def description_index(self):
+        return dll.AP4_Sample_GetDescriptionIndex(self.handle)
+
+    @property
+    def dts(self):
+        return dll.AP4_Sample_GetDts(self.handle)
+
+    @property
+    def cts(self):
+        return dll.AP4_Sample_GetCts(self.handle)
+
+    @property
+    def duration(self):
+        return dll.AP4_Sample_GetDuration(self.handle)
+
+    @property
+    def is_sync(self):
+        return dll.AP4_Sample_IsSync(self.handle) != 0
+
+#############################################
+def GetBufferData(handle, owner):
+    return bytes(DataBuffer(handle=handle, owner=owner).data) if handle else None
+
+class SampleDescription:
+    TYPE_UNKNOWN   = 0
+    TYPE_MPEG      = 1
+    TYPE_PROTECTED = 2
+    TYPE_SUBTITLES = 3
+    TYPE_AVC       = 4
+    TYPE_HEVC      = 5
+
+    def __init__(self, handle, owner):
+        self.handle = handle
+        self.owner  = owner
+
+    @property
+    def type(self):
+        return dll.AP4_SampleDescription_GetType(self.handle)
+
+    @property
+    def format(self):
+        return dll.AP4_SampleDescription_GetFormat(self.handle)
+
+class AudioSampleDescription(SampleDescription):
+    @property
+    def audio_handle(self):
+        return dll.AP4_SampleDescription_AsAudio(self.handle)
+
+    @property
+    def sample_rate(self):
+        return dll.AP4_AudioSampleDescription_GetSampleRate(self.audio_handle)
+
+    @property
+    def sample_size(self):
+        return dll.AP4_AudioSampleDescription_GetSampleSize(self.audio_handle)
+
+    @property
+    def channel_count(self):
+        return dll.AP4_AudioSampleDescription_GetChannelCount(self.audio_handle)
+
+class VideoSampleDescription(SampleDescription):
+    @property
+    def video_handle(self):
+        return dll.AP4_SampleDescription_AsVideo(self.handle)
+
+    @property
+    def width(self):
+        return dll.AP4_VideoSampleDescription_GetWidth(self.video_handle)
+
+    @property
+    def height(self):
+        return dll.AP4_VideoSampleDescription_GetHeight(self.video_handle)
+
+    @property
+    def depth(self):
+        return dll.AP4_VideoSampleDescription_GetDepth(self.video_handle)
+
+    @property
+    def compressor_name(self):
+        return decode_string(dll.AP4_VideoSampleDescription_GetCompressorName(self.video_handle))
+
+class MpegSampleDescription(SampleDescription):
+    @property
+    def mpeg_handle(self):
+        return dll.AP4_SampleDescription_AsMpeg(self.handle)
+
+    @property
+    def stream_type(self):
+        return dll.AP4_MpegSampleDescription_GetStreamType(self.mpeg_handle)
+
+    @property
+    def object_type_id(self):
+        return dll.AP4_MpegSampleDescription_GetObjectTypeId(self.mpeg_handle)
+
+    @property
+    def buffer_size(self):
+        return dll.AP4_MpegSampleDescription_GetBufferSize(self.mpeg_handle)
+
+    @property
+    def max_bitrate(self):
+        return dll.AP4_MpegSampleDescription_GetMaxBitrate(self.mpeg_handle)
+
+    @property
+    def avg_bitrate(self):
+        return dll.AP4_MpegSampleDescription_GetAvgBitrate(self.mpeg_handle)
+
+    @property
+    def decoder_info(self):
+        return GetBufferData(dll.AP4_MpegSampleDescription_GetDecoderInfo(self.mpeg_handle), self)
+
+class MpegAudioSampleDescription(AudioSampleDescription, MpegSampleDescription):
+    @property
+    def mpeg4_audio_object_type(self):
+        return dll.AP4_MpegAudioSampleDescription_GetMpeg4AudioObjectType(dll.AP4_SampleDescription_AsMpegAudio(self.handle))
+
+class MpegVideoSampleDescription(VideoSampleDescription, MpegSampleDescription):
+    pass
+
+class AvcSampleDescription(VideoSampleDescription):
+    @property
+    def avc_handle(self):
+        return dll.AP4_SampleDescription_AsAvc(self.handle)
+
+    @property
+    def configuration_version(self):
+        return dll.AP4_AvcSampleDescription_GetConfigurationVersion(self.avc_handle)
+
+    @property
+    def profile(self):
+        return dll.AP4_AvcSampleDescription_GetProfile(self.avc_handle)
+
+    @property
+    def level(self):
+        return dll.AP4_AvcSampleDescription_GetLevel(self.avc_handle)
+
+    @property
+    def profile_compatibility(self):
+        return dll.AP4_AvcSampleDescription_GetProfileCompatibility(self.avc_handle)
+
+    @property
+    def nalu_length_size(self):
+        return dll.AP4_AvcSampleDescription_GetNaluLengthSize(self.avc_handle)
+
+    @property
+    def sequence_parameters(self):
+        handle = self.avc_handle
+        return [GetBufferData(dll.AP4_AvcSampleDescription_GetSequenceParameter(handle, i), self)
+                for i in range(dll.AP4_AvcSampleDescription_GetSequenceParameterCount(handle))]
+
+    @property
+    def picture_parameters(self):
+        handle = self.avc_handle
+        return [GetBufferData(dll.AP4_AvcSampleDescription_GetPictureParameter(handle, i), self)
+                for i in range(dll.AP4_AvcSampleDescription_GetPictureParameterCount(handle))]
+
+    @property
+    def raw_bytes(self):
+        return GetBufferData(dll.AP4_AvcSampleDescription_GetRawBytes(self.avc_handle), self)
+
+class ProtectedSampleDescription(SampleDescription):
+    @property
+    def protected_handle(self):
+        return dll.AP4_SampleDescription_AsProtected(self.handle)
+
+    @property
+    def original_format(self):
+        return dll.AP4_ProtectedSampleDescription_GetOriginalFormat(self.protected_handle)
+
+    @property
+    def scheme_type(self):
+        return dll.AP4_ProtectedSampleDescription_GetSchemeType(self.protected_handle)
+
+    @property
+    def scheme_version(self):
+        return dll.AP4_ProtectedSampleDescription_GetSchemeVersion(self.protected_handle)
+
+    @property
+    def scheme_uri(self):
+        return decode_string(dll.AP4_ProtectedSampleDescription_GetSchemeUri(self.protected_handle))
+
+    @property
+    def original_sample_description(self):
+        handle = dll.AP4_ProtectedSampleDescription_GetOriginalSampleDescription(self.protected_handle)
+        return MakeSampleDescription(handle, self) if handle else None
+
+def MakeSampleDescription(handle, owner):
+    # pick the most specific class for the description
+    if dll.AP4_SampleDescription_AsProtected(handle):
+        return ProtectedSampleDescription(handle, owner)
+    if dll.AP4_SampleDescription_AsAvc(handle):
+        return AvcSampleDescription(handle, owner)
+    is_mpeg  = bool(dll.AP4_SampleDescription_AsMpeg(handle))
+    is_audio = bool(dll.AP4_SampleDescription_AsAudio(handle))
+    is_video = bool(dll.AP4_SampleDescription_AsVideo(handle))
+    if is_mpeg and dll.AP4_SampleDescription_AsMpegAudio(handle):
+        return MpegAudioSampleDescription(handle, owner)
+    if is_mpeg and is_video:
+        return MpegVideoSampleDescription(handle, owner)
+    if is_mpeg:
+        return MpegSampleDescription(handle, owner)
+    if is_audio:
+        return AudioSampleDescription(handle, owner)
+    if is_video:
+        return VideoSampleDescription(handle, owner)
+    return SampleDescription(handle, owner)
+
+#############################################
+# Module Exports
+#############################################
+__all__ = [
+    'atom_type',
+    'atom_name',
+    'avc_profile_name',
+    'mpeg_audio_object_type_name',
+    'File',
+    'Movie',
+    'Track',
+    'Sample',
+    'SampleDescription',
+    'AudioSampleDescription',
+    'VideoSampleDescription',
+    'MpegSampleDescription',
+    'MpegAudioSampleDescription',
+    'MpegVideoSampleDescription',
+    'AvcSampleDescription',
+    'ProtectedSampleDescription'
+]
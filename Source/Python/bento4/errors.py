@@ -0,0 +1,55 @@
+__author__    = 'Gilles Boccon-Gibod (bok@bok.net)'
+__copyright__ = 'Copyright 2011-2020 Axiomatic Systems, LLC.'
+
+###
+# Result codes of the Bento4 C API
+
+SUCCESS                               =  0
+FAILURE                               = -1
+ERROR_OUT_OF_MEMORY                   = -2
+ERROR_INVALID_PARAMETERS              = -3
+ERROR_NO_SUCH_FILE                    = -4
+ERROR_PERMISSION_DENIED               = -5
+ERROR_CANNOT_OPEN_FILE                = -6
+ERROR_EOS                             = -7
+ERROR_WRITE_FAILED                    = -8
+ERROR_READ_FAILED                     = -9
+ERROR_INVALID_FORMAT                  = -10
+ERROR_NO_SUCH_ITEM                    = -11
+ERROR_OUT_OF_RANGE                    = -12
+ERROR_INTERNAL                        = -13
+ERROR_INVALID_STATE                   = -14
+ERROR_LIST_EMPTY                      = -15
+ERROR_LIST_OPERATION_ABORTED          = -16
+ERROR_INVALID_RTP_CONSTRUCTOR_TYPE    = -17
+ERROR_NOT_SUPPORTED                   = -18
+ERROR_INVALID_TRACK_TYPE              = -19
+ERROR_INVALID_RTP_PACKET_EXTRA_DATA   = -20
+ERROR_BUFFER_TOO_SMALL                = -21
+ERROR_NOT_ENOUGH_DATA                 = -22
+
+RESULT_NAMES = dict([(value, name) for (name, value) in list(globals().items()) if name == 'FAILURE' or name.startswith('ERROR_')])
+
+class Bento4Error(Exception):
+    def __init__(self, result, message=None):
+        self.result = result
+        description = RESULT_NAMES.get(result, 'ERROR %d' % result)
+        super().__init__(description if message is None else message+' ('+description+')')
+
+class EndOfStreamError(Bento4Error):
+    pass
+
+def check_result(result, message=None):
+    if result != SUCCESS:
+        if result == ERROR_EOS:
+            raise EndOfStreamError(result, message)
+        raise Bento4Error(result, message)
+
+#############################################
+# Module Exports
+#############################################
+__all__ = [
+    'Bento4Error',
+    'EndOfStreamError',
+    'check_result'
+]
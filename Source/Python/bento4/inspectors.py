@@ -0,0 +1,118 @@
+__author__    = 'Gilles Boccon-Gibod (bok@bok.net)'
+__copyright__ = 'Copyright 2011-2020 Axiomatic Systems, LLC.'
+
+###
+# Atom inspectors.
+# A DelegateInspector forwards the inspection events of the library to its
+# python methods, which subclasses override.
+
+import xml.etree.ElementTree as xml
+from ctypes import byref, string_at, cast
+from bento4 import bento4dll as dll, AtomInspectorDelegate, StartElementProc, EndElementProc, \
+                   AddIntFieldProc, AddFloatFieldProc, AddStringFieldProc, AddBytesFieldProc, DestroyProc
+
+# field format hints
+HINT_NONE    = 0
+HINT_HEX     = 1
+HINT_BOOLEAN = 2
+
+def decode_string(value):
+    return value.decode('utf-8', 'replace') if value is not None else ''
+
+#############################################
+class AtomInspector:
+    def __init__(self, handle):
+        self.handle = handle
+
+    def __del__(self):
+        if getattr(self, 'handle', None):
+            dll.AP4_AtomInspector_Destroy(self.handle)
+            self.handle = None
+
+class PrintInspector(AtomInspector):
+    """
+    Prints the atoms to a ByteStream, in the format of mp4dump.
+    """
+    def __init__(self, stream):
+        self.stream = stream
+        super().__init__(dll.AP4_PrintInspector_Create(stream.handle))
+
+class DelegateInspector(AtomInspector):
+    def __init__(self):
+        # the callbacks must stay referenced as long as the inspector exists
+        self.delegate = AtomInspectorDelegate(
+            StartElementProc(lambda _, name, extra: self.start_element(decode_string(name), decode_string(extra))),
+            EndElementProc(lambda _: self.end_element()),
+            AddIntFieldProc(lambda _, name, value, hint: self.add_int_field(decode_string(name), value, hint)),
+            AddFloatFieldProc(lambda _, name, value, hint: self.add_float_field(decode_string(name), value, hint)),
+            AddStringFieldProc(lambda _, name, value, hint: self.add_string_field(decode_string(name), decode_string(value), hint)),
+            AddBytesFieldProc(lambda _, name, data, size, hint: self.add_bytes_field(decode_string(name), string_at(data, size), hint)),
+            cast(None, DestroyProc))
+        super().__init__(dll.AP4_AtomInspector_FromDelegate(byref(self.delegate)))
+
+    def start_element(self, name, extra):
+        pass
+
+    def end_element(self):
+        pass
+
+    def add_int_field(self, name, value, hint):
+        pass
+
+    def add_float_field(self, name, value, hint):
+        pass
+
+    def add_string_field(self, name, value, hint):
+        pass
+
+    def add_bytes_field(self, name, value, hint):
+        pass
+
+class XmlInspector(DelegateInspector):
+    """
+    Builds an ElementTree of the atoms: one 'atom' element per atom, with
+    'name' and 'extra' attributes, and one 'field' element per field.
+    """
+    def __init__(self):
+        super().__init__()
+        self.root  = xml.Element('atoms')
+        self.stack = [self.root]
+
+    def start_element(self, name, extra):
+        element = xml.SubElement(self.stack[-1], 'atom', name=name)
+        if extra:
+            element.set('extra', extra)
+        self.stack.append(element)
+
+    def end_element(self):
+        self.stack.pop()
+
+    def add_field(self, name, value):
+        xml.SubElement(self.stack[-1], 'field', name=name, value=value)
+
+    def add_int_field(self, name, value, hint):
+        if hint == HINT_HEX:
+            self.add_field(name, '%x' % value)
+        elif hint == HINT_BOOLEAN:
+            self.add_field(name, 'true' if value else 'false')
+        else:
+            self.add_field(name, str(value))
+
+    def add_float_field(self, name, value, hint):
+        self.add_field(name, '%f' % value)
+
+    def add_string_field(self, name, value, hint):
+        self.add_field(name, value)
+
+    def add_bytes_field(self, name, value, hint):
+        self.add_field(name, value.hex())
+
+#############################################
+# Module Exports
+#############################################
+__all__ = [
+    'AtomInspector',
+    'PrintInspector',
+    'DelegateInspector',
+    'XmlInspector'
+]
@@ -0,0 +1,166 @@
+__author__    = 'Gilles Boccon-Gibod (bok@bok.net)'
+__copyright__ = 'Copyright 2011-2020 Axiomatic Systems, LLC.'
+
+###
+# Byte streams and data buffers.
+# The contents of a DataBuffer are exposed without copying, as a memoryview
+# on the memory of the AP4_DataBuffer. The memoryview keeps the buffer alive.
+
+from ctypes import byref, c_ubyte
+from bento4 import bento4dll as dll, AP4_Result, AP4_Size, AP4_Position, AP4_LargeSize
+from bento4.errors import check_result, Bento4Error, ERROR_CANNOT_OPEN_FILE
+
+#############################################
+class DataBuffer:
+    """
+    An AP4_DataBuffer. Buffers created from python own their memory, buffers
+    returned by the library belong to the object that returned them (the
+    owner is kept alive as long as the DataBuffer).
+    """
+    def __init__(self, data=None, size=0, handle=None, owner=None):
+        if handle is not None:
+            self.handle = handle
+            self.owner  = owner
+            return
+        self.owner = None
+        if data is not None:
+            data = bytes(data)
+            self.handle = dll.AP4_DataBuffer_FromData(data, len(data))
+        else:
+            self.handle = dll.AP4_DataBuffer_Create(size)
+
+    def __del__(self):
+        if getattr(self, 'handle', None) and self.owner is None:
+            dll.AP4_DataBuffer_Destroy(self.handle)
+            self.handle = None
+
+    def __len__(self):
+        return dll.AP4_DataBuffer_GetDataSize(self.handle)
+
+    def __bytes__(self):
+        return bytes(self.data)
+
+    @property
+    def data(self):
+        size = len(self)
+        if size == 0:
+            return memoryview(b'')
+        array = (c_ubyte * size).from_address(dll.AP4_DataBuffer_GetData(self.handle))
+        array.buffer = self # keep the buffer alive as long as the view
+        return memoryview(array).cast('B')
+
+    @property
+    def buffer_size(self):
+        return dll.AP4_DataBuffer_GetBufferSize(self.handle)
+
+    def set_data(self, data):
+        data = bytes(data)
+        check_result(dll.AP4_DataBuffer_SetData(self.handle, data, len(data)))
+
+    def set_data_size(self, size):
+        check_result(dll.AP4_DataBuffer_SetDataSize(self.handle, size))
+
+    def reserve(self, size):
+        check_result(dll.AP4_DataBuffer_Reserve(self.handle, size))
+
+#############################################
+class ByteStream:
+    """
+    Base class of the byte streams, wrapping a referenced AP4_ByteStream.
+    """
+    def __init__(self, handle):
+        if not handle:
+            raise Bento4Error(ERROR_CANNOT_OPEN_FILE)
+        self.handle = handle
+
+    def __del__(self):
+        if getattr(self, 'handle', None):
+            dll.AP4_ByteStream_Release(self.handle)
+            self.handle = None
+
+    def read(self, size):
+        """
+        Read up to size bytes, returns fewer bytes at the end of the stream.
+        """
+        buffer = (c_ubyte * size)()
+        total = 0
+        bytes_read = AP4_Size()
+        while total < size:
+            result = dll.AP4_ByteStream_ReadPartial(self.handle, byref(buffer, total), size-total, byref(bytes_read))
+            if result != 0 or bytes_read.value == 0:
+                break
+            total += bytes_read.value
+        return bytes(buffer[:total])
+
+    def read_exactly(self, size):
+        buffer = (c_ubyte * size)()
+        check_result(dll.AP4_ByteStream_Read(self.handle, buffer, size))
+        return bytes(buffer)
+
+    def write(self, data):
+        data = bytes(data)
+        check_result(dll.AP4_ByteStream_Write(self.handle, data, len(data)))
+
+    def seek(self, position):
+        check_result(dll.AP4_ByteStream_Seek(self.handle, position))
+
+    def tell(self):
+        position = AP4_Position()
+        check_result(dll.AP4_ByteStream_Tell(self.handle, byref(position)))
+        return position.value
+
+    @property
+    def size(self):
+        size = AP4_LargeSize()
+        check_result(dll.AP4_ByteStream_GetSize(self.handle, byref(size)))
+        return size.value
+
+    def copy_to(self, receiver, size):
+        check_result(dll.AP4_ByteStream_CopyTo(self.handle, receiver.handle, size))
+
+class FileByteStream(ByteStream):
+    MODE_READ       = 0
+    MODE_WRITE      = 1
+    MODE_READ_WRITE = 2
+
+    def __init__(self, name, mode=MODE_READ):
+        result = AP4_Result()
+        handle = dll.AP4_FileByteStream_Create(name.encode('utf-8'), mode, byref(result))
+        check_result(result.value, 'cannot open '+name)
+        super().__init__(handle)
+        self.name = name
+
+class MemoryByteStream(ByteStream):
+    """
+    A byte stream in memory. The stream reads and writes the memory of a
+    DataBuffer, which can be passed in, or is created from 'data' or with
+    'size' zero bytes.
+    """
+    def __init__(self, data=None, size=0, buffer=None):
+        if buffer is None:
+            buffer = DataBuffer(data=data if data is not None else bytes(size))
+        self.buffer = buffer
+        super().__init__(dll.AP4_MemoryByteStream_AdaptDataBuffer(buffer.handle))
+
+    @property
+    def data(self):
+        return self.buffer.data
+
+class SubStream(ByteStream):
+    """
+    A window of size bytes, starting at position, of another stream.
+    """
+    def __init__(self, container, position, size):
+        self.container = container
+        super().__init__(dll.AP4_SubStream_Create(container.handle, position, size))
+
+#############################################
+# Module Exports
+#############################################
+__all__ = [
+    'DataBuffer',
+    'ByteStream',
+    'FileByteStream',
+    'MemoryByteStream',
+    'SubStream'
+]
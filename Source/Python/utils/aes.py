@@ -2,6 +2,12 @@
 
 import copy
 
+# optional native backend
+try:
+    from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
+except ImportError:
+    Cipher = None
+
 shifts = [[[0, 0], [1, 3], [2, 2], [3, 1]],
           [[0, 0], [1, 5], [2, 4], [3, 3]],
           [[0, 0], [1, 7], [3, 5], [4, 4]]]
@@ -327,6 +333,45 @@ class rijndael:
             result.append((Si[ t[(i + s3) % BC]        & 0xFF] ^  tt       ) & 0xFF)
         return bytes(result)
 
+class ecb:
+    # AES-ECB over any number of 16-byte blocks, with a single expanded key.
+    # Uses the 'cryptography' module when it is installed, and falls back
+    # to the pure python rijndael implementation otherwise.
+    # A 'cryptography' context is created for each call, so that the same
+    # object can be used from several threads.
+    def __init__(self, key):
+        self.key = bytes(key)
+        self.cipher = rijndael(key) if Cipher is None else None
+
+    def encrypt(self, plaintext):
+        if len(plaintext) % 16:
+            raise ValueError('plaintext not an integral number of blocks')
+        if Cipher is not None:
+            return Cipher(algorithms.AES(self.key), modes.ECB()).encryptor().update(bytes(plaintext))
+        encrypt = self.cipher.encrypt
+        return b''.join([encrypt(plaintext[x:x+16]) for x in range(0, len(plaintext), 16)])
+
+    def decrypt(self, ciphertext):
+        if len(ciphertext) % 16:
+            raise ValueError('ciphertext not an integral number of blocks')
+        if Cipher is not None:
+            return Cipher(algorithms.AES(self.key), modes.ECB()).decryptor().update(bytes(ciphertext))
+        decrypt = self.cipher.decrypt
+        return b''.join([decrypt(ciphertext[x:x+16]) for x in range(0, len(ciphertext), 16)])
+
+    def ctr(self, iv, data):
+        # AES-CTR encryption/decryption of data, with a 64-bit block counter
+        # in the last 8 bytes of the 16-byte IV (as used by MPEG Common Encryption)
+        block_count = (len(data)+15)//16
+        counter = int.from_bytes(iv[8:16], 'big')
+        if Cipher is not None and counter+block_count <= 0xFFFFFFFFFFFFFFFF:
+            # the counter doesn't wrap, so a 128-bit counter gives the same key stream
+            return Cipher(algorithms.AES(self.key), modes.CTR(bytes(iv))).encryptor().update(bytes(data))
+        prefix = bytes(iv[0:8])
+        counters = b''.join([prefix+((counter+i) & 0xFFFFFFFFFFFFFFFF).to_bytes(8, 'big') for i in range(block_count)])
+        key_stream = self.encrypt(counters)[:len(data)]
+        return (int.from_bytes(data, 'big') ^ int.from_bytes(key_stream, 'big')).to_bytes(len(data), 'big')
+
 def cbc_encrypt(plaintext, key, IV):
     # padding
     padding_size = 16 - (len(plaintext) % 16)
@@ -1,80 +1,239 @@
 #! /usr/bin/env python3
 
-import mp4utils
+__author__    = 'Gilles Boccon-Gibod (bok@bok.net)'
+__copyright__ = 'Copyright 2011-2020 Axiomatic Systems, LLC.'
+
+###
+# Verify the sidx and mfra/tfra indexes of fragmented MP4 files.
+# The indexes are parsed directly from the files (only the atom headers,
+# the index atoms and the referenced moof atoms are read), every reference
+# is checked against the actual atom offsets, and many files can be checked
+# in parallel. The exit code is 0 when all the files are valid, 1 when an
+# index is invalid, and 2 when a file could not be read or parsed.
+
+from optparse import OptionParser
+from concurrent.futures import ProcessPoolExecutor
 import sys
+import os
 import os.path as path
+import json
+import bisect
+import struct
 
 SCRIPT_PATH = path.abspath(path.dirname(__file__))
 sys.path += [SCRIPT_PATH]
 
-platform = sys.platform
-if platform.startswith('linux'):
-    platform = 'linux-x86'
-elif platform.startswith('darwin'):
-    platform = 'macosx'
-
-class Options(object): pass
-
-options = Options()
-options.debug = False
-options.verbose = False
-options.min_buffer_time = 0.0
-options.exec_dir = path.join(SCRIPT_PATH, 'bin', platform)
-
-class Sidx(object): pass
-
-mp4_file = mp4utils.Mp4File(options, mp4utils.MediaSource(options, sys.argv[1]))
-moof_offsets = []
-sidx_anchors = []
-for atom in mp4_file.atoms:
-	if atom.type == 'moof':
-		moof_offsets.append(atom.position)
-	elif atom.type == 'sidx':
-		sidx_anchors.append(atom.position+atom.size)
-
-print('sidx anchors:', sidx_anchors)
-print(len(moof_offsets), 'moof boxes found:', moof_offsets)
-
-sidx = None
-sidx_index = 0
-for atom in mp4_file.tree:
-	if atom['name'] == 'sidx':
-		sidx = Sidx()
-		sidx.entries = []
-		sidx.reference_id = int(atom['reference_ID'])
-		sidx.timescale = int(atom['timescale'])
-		sidx.earliest_presentation_time = int(atom['earliest_presentation_time'])
-		sidx.first_offset = int(atom['first_offset'])
-		for (name, value) in list(atom.items()):
-			if name.startswith('entry '):
-				entry = {}
-				for field in value.split(', '):
-					(field_name, field_value) = field.split('=')
-					entry[field_name] = int(field_value)
-				sidx.entries.append(entry)
-
-		count = 0
-		offset = sidx.first_offset
-		for entry in sidx.entries:
-			#print entry
-			if entry['reference_type'] == 0:
-				#print sidx_anchors[sidx_index]+offset
-				if sidx_anchors[sidx_index]+offset not in moof_offsets:
-					print('sidx offset', sidx_anchors[sidx_index], '+', offset, 'does not point to a moof box')
-			offset += entry['referenced_size']
-		sidx_index += 1
-		print('sidx OK')
-	elif atom['name'] == 'mfra':
-		for child in atom['children']:
-			if child['name'] == 'tfra':
-				for (name, value) in list(child.items()):
-					if name.startswith('entry'):
-						entry = {}
-						for field in value.split(', '):
-							(field_name, field_value) = field.split('=')
-							entry[field_name] = int(field_value)
-						if entry['moof_offset'] not in moof_offsets:
-							print('tfra offset', entry['moof_offset'], 'does not point to a moof box')
-		print('mfra OK')
-
-print('=== Done ===')
+from mp4atoms import Atom, ScanAtoms, ParseAtoms, SegmentIndex, TrackFragmentRandomAccess, TrackFragmentHeader, TrackRun
+
+EXIT_OK      = 0
+EXIT_INVALID = 1
+EXIT_ERROR   = 2
+
+MP4_FILE_EXTENSIONS = ['.mp4', '.m4a', '.m4v', '.m4s', '.mov', '.ismv', '.isma', '.cmfv', '.cmfa', '.cmft']
+
+def IsAtomStart(offsets, offset):
+    index = bisect.bisect_left(offsets, offset)
+    return index < len(offsets) and offsets[index] == offset
+
+class IndexVerifier:
+    def __init__(self, filename):
+        self.filename             = filename
+        self.errors               = []
+        self.moofs                = {}
+        self.moof_offsets         = []
+        self.sidx_offsets         = []
+        self.atom_offsets         = []
+        self.sidx_count           = 0
+        self.sidx_reference_count = 0
+        self.tfra_entry_count     = 0
+        self.has_mfra             = False
+
+    def Error(self, message):
+        self.errors.append(message)
+
+    def ReadPayload(self, position, header_size, size):
+        self.file.seek(position+header_size)
+        payload = self.file.read(size-header_size)
+        if len(payload) != size-header_size:
+            raise ValueError('truncated atom at %d' % position)
+        return payload
+
+    def Verify(self):
+        with open(self.filename, 'rb') as self.file:
+            # the top level atoms are scanned in file order, so the offset lists are sorted
+            sidx_atoms = []
+            mfra_atom = None
+            file_size = 0
+            for (type, position, header_size, size) in ScanAtoms(self.file):
+                self.atom_offsets.append(position)
+                if type == 'moof':
+                    self.moof_offsets.append(position)
+                    self.moofs[position] = (header_size, size)
+                elif type == 'sidx':
+                    self.sidx_offsets.append(position)
+                    sidx_atoms.append((position, header_size, size))
+                elif type == 'mfra':
+                    mfra_atom = (position, header_size, size)
+                file_size = position+size
+            self.atom_offsets.append(file_size)
+
+            for (position, header_size, size) in sidx_atoms:
+                self.VerifySegmentIndex(position, header_size, size)
+            if mfra_atom:
+                self.has_mfra = True
+                self.VerifyRandomAccess(*mfra_atom)
+
+    def VerifySegmentIndex(self, position, header_size, size):
+        sidx = SegmentIndex(self.ReadPayload(position, header_size, size))
+        self.sidx_count += 1
+
+        # the offsets are relative to the first byte after the sidx atom
+        offset = position+size+sidx.first_offset
+        for (index, reference) in enumerate(sidx.references):
+            (reference_type, referenced_size) = reference[:2]
+            self.sidx_reference_count += 1
+            if reference_type == 1:
+                if not IsAtomStart(self.sidx_offsets, offset):
+                    self.Error('sidx@%d reference %d: offset %d does not point to a sidx atom' % (position, index, offset))
+            elif not IsAtomStart(self.moof_offsets, offset):
+                self.Error('sidx@%d reference %d: offset %d does not point to a moof atom' % (position, index, offset))
+            if not IsAtomStart(self.atom_offsets, offset+referenced_size):
+                self.Error('sidx@%d reference %d: range %d-%d does not end on an atom boundary' % (position, index, offset, offset+referenced_size-1))
+            offset += referenced_size
+
+    def VerifyRandomAccess(self, position, header_size, size):
+        for atom in ParseAtoms(self.ReadPayload(position, header_size, size), containers=set()):
+            if atom.type == 'tfra':
+                tfra = TrackFragmentRandomAccess(atom.payload)
+                for (index, entry) in enumerate(tfra.entries):
+                    self.tfra_entry_count += 1
+                    self.VerifyRandomAccessEntry(tfra.track_id, index, entry)
+            elif atom.type == 'mfro':
+                (mfra_size,) = struct.unpack_from('>I', atom.payload, 4)
+                if mfra_size != size:
+                    self.Error('mfro size %d does not match the mfra size %d' % (mfra_size, size))
+
+    def VerifyRandomAccessEntry(self, track_id, index, entry):
+        (_, moof_offset, traf_number, trun_number, sample_number) = entry
+        prefix = 'tfra track %d entry %d' % (track_id, index)
+        if not IsAtomStart(self.moof_offsets, moof_offset):
+            self.Error('%s: offset %d does not point to a moof atom' % (prefix, moof_offset))
+            return
+
+        # the traf, trun and sample numbers all start at 1
+        trafs = self.GetMoof(moof_offset).FindChildren('traf')
+        if not 1 <= traf_number <= len(trafs):
+            self.Error('%s: traf number %d not found in moof@%d' % (prefix, traf_number, moof_offset))
+            return
+        traf = trafs[traf_number-1]
+        tfhd = traf.FindChild('tfhd')
+        if tfhd is None or TrackFragmentHeader(tfhd.payload).track_id != track_id:
+            self.Error('%s: traf %d of moof@%d is not for track %d' % (prefix, traf_number, moof_offset, track_id))
+            return
+        truns = traf.FindChildren('trun')
+        if not 1 <= trun_number <= len(truns):
+            self.Error('%s: trun number %d not found in moof@%d' % (prefix, trun_number, moof_offset))
+            return
+        sample_count = TrackRun(truns[trun_number-1].payload).sample_count
+        if not 1 <= sample_number <= sample_count:
+            self.Error('%s: sample number %d not found in moof@%d (%d samples)' % (prefix, sample_number, moof_offset, sample_count))
+
+    def GetMoof(self, offset):
+        # the moof atoms are only parsed when a tfra entry points to them
+        moof = self.moofs[offset]
+        if not isinstance(moof, Atom):
+            (header_size, size) = moof
+            children = ParseAtoms(self.ReadPayload(offset, header_size, size), containers={'traf'})
+            moof = self.moofs[offset] = Atom('moof', children=children, position=offset, size=size)
+        return moof
+
+def VerifyFile(filename, require_index=False):
+    verifier = IndexVerifier(filename)
+    report = {'filename': filename}
+    try:
+        verifier.Verify()
+    except (IOError, ValueError, struct.error) as e:
+        report['status'] = 'error'
+        report['errors'] = [str(e)]
+        return report
+    if require_index and not verifier.sidx_count and not verifier.has_mfra:
+        verifier.Error('no sidx or mfra index found')
+    report.update({
+        'status':               'invalid' if verifier.errors else 'ok',
+        'moof_count':           len(verifier.moof_offsets),
+        'sidx_count':           verifier.sidx_count,
+        'sidx_reference_count': verifier.sidx_reference_count,
+        'tfra_entry_count':     verifier.tfra_entry_count,
+        'errors':               verifier.errors
+    })
+    return report
+
+def FindFiles(paths):
+    filenames = []
+    for name in paths:
+        if path.isdir(name):
+            for (dir, subdirs, files) in os.walk(name):
+                subdirs.sort()
+                filenames += [path.join(dir, file) for file in sorted(files) if path.splitext(file)[1].lower() in MP4_FILE_EXTENSIONS]
+        else:
+            filenames.append(name)
+    return filenames
+
+def VerifyFiles(filenames, jobs, require_index=False):
+    if jobs > 1 and len(filenames) > 1:
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            return list(executor.map(VerifyFile, filenames, [require_index]*len(filenames), chunksize=max(1, len(filenames)//(4*jobs))))
+    return [VerifyFile(filename, require_index) for filename in filenames]
+
+def main():
+    parser = OptionParser(usage="%prog [options] <file-or-directory> [<file-or-directory> ...]",
+                          description="Verify the sidx and mfra/tfra indexes of fragmented MP4 files. Directories are searched recursively for MP4 files.")
+    parser.add_option('-q', '--quiet', dest="quiet", action='store_true', default=False,
+                      help="Only print the files with errors")
+    parser.add_option('-j', '--jobs', dest="jobs", type='int', default=os.cpu_count() or 1,
+                      help="Number of files verified in parallel (default: number of CPUs)")
+    parser.add_option('', '--report', dest="report", metavar="<filename>",
+                      help="Write a JSON report to <filename> (use '-' for stdout)")
+    parser.add_option('', '--require-index', dest="require_index", action='store_true', default=False,
+                      help="Treat files without any sidx or mfra index as invalid")
+    (options, args) = parser.parse_args()
+    if len(args) == 0:
+        parser.print_help()
+        sys.exit(EXIT_ERROR)
+
+    filenames = FindFiles(args)
+    results = VerifyFiles(filenames, options.jobs, options.require_index)
+
+    summary = {'files': len(results)}
+    for status in ['ok', 'invalid', 'error']:
+        summary[status] = len([result for result in results if result['status'] == status])
+    if summary['error'] or not results:
+        exit_code = EXIT_ERROR
+    elif summary['invalid']:
+        exit_code = EXIT_INVALID
+    else:
+        exit_code = EXIT_OK
+    summary['exit_code'] = exit_code
+
+    if options.report != '-':
+        for result in results:
+            if result['status'] == 'ok':
+                if not options.quiet:
+                    print('%s: OK (%d moof, %d sidx references, %d tfra entries)' % (result['filename'], result['moof_count'], result['sidx_reference_count'], result['tfra_entry_count']))
+            else:
+                print('%s: %s' % (result['filename'], result['status'].upper()))
+                for error in result['errors']:
+                    print('    '+error)
+    if options.report:
+        report = json.dumps({'summary': summary, 'files': results}, indent=4)
+        if options.report == '-':
+            print(report)
+        else:
+            with open(options.report, 'w') as report_file:
+                report_file.write(report)
+
+    return exit_code
+
+###########################
+if __name__ == '__main__':
+    sys.exit(main())
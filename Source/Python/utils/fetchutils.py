@@ -0,0 +1,483 @@
+__author__    = 'Gilles Boccon-Gibod (bok@bok.net)'
+__copyright__ = 'Copyright 2011-2020 Axiomatic Systems, LLC.'
+
+import os
+import os.path as path
+import time
+import json
+import mmap
+import hashlib
+import threading
+import http.client
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
+from mp4utils import MakeTempFilename, WriteFileAtomically
+
+HTTP_REDIRECT_STATUSES = (301, 302, 303, 307, 308)
+HTTP_RETRY_STATUSES    = (408, 429, 500, 502, 503, 504)
+HTTP_MAX_REDIRECTS     = 5
+READ_CHUNK_SIZE        = 65536
+
+class FetchError(Exception):
+    def __init__(self, url, message, status=None):
+        super().__init__(url+': '+message)
+        self.url = url
+        self.status = status
+
+class FetchResult:
+    def __init__(self, url, status, headers, data):
+        self.url     = url
+        self.status  = status
+        self.headers = headers
+        self.data    = data
+        self.size    = len(data) if data is not None else 0
+        self.filename = None
+        self.from_journal = False
+
+class ConnectionPool:
+    """Keeps idle HTTP connections, per (scheme, host, port), for reuse"""
+    def __init__(self, timeout):
+        self.timeout = timeout
+        self.idle = {}
+        self.lock = threading.Lock()
+
+    def Acquire(self, scheme, netloc):
+        key = (scheme, netloc)
+        with self.lock:
+            idle = self.idle.get(key)
+            if idle:
+                return (idle.pop(), True)
+        return (self.Create(scheme, netloc), False)
+
+    def Create(self, scheme, netloc):
+        if scheme == 'https':
+            return http.client.HTTPSConnection(netloc, timeout=self.timeout)
+        else:
+            return http.client.HTTPConnection(netloc, timeout=self.timeout)
+
+    def Release(self, scheme, netloc, connection):
+        with self.lock:
+            self.idle.setdefault((scheme, netloc), []).append(connection)
+
+    def Close(self):
+        with self.lock:
+            for connections in self.idle.values():
+                for connection in connections:
+                    connection.close()
+            self.idle = {}
+
+class ByteBudget:
+    """Bounds the number of bytes held in memory by concurrent fetches"""
+    def __init__(self, limit):
+        self.limit = limit
+        self.in_use = 0
+        self.condition = threading.Condition()
+
+    def Acquire(self, size, wait=True):
+        with self.condition:
+            # a single request larger than the limit is allowed when nothing else is in flight
+            while wait and self.in_use and self.in_use + size > self.limit:
+                self.condition.wait()
+            self.in_use += size
+
+    def Release(self, size):
+        with self.condition:
+            self.in_use -= size
+            self.condition.notify_all()
+
+class Journal:
+    """Append-only record of the files that were completely fetched.
+
+    Each line is a JSON object with the local path (relative to the journal
+    directory), the URL, the size and sha256 of the file that was written,
+    and the ETag/Last-Modified validators returned by the server.
+    """
+    def __init__(self, filename, resume=False):
+        self.filename = filename
+        self.root_dir = path.dirname(filename)
+        self.entries = {}
+        self.lock = threading.Lock()
+        if resume and path.exists(filename):
+            with open(filename, 'r') as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        # partial last line from an interrupted run
+                        continue
+                    self.entries[entry['path']] = entry
+
+        # rewrite the journal, keeping only the latest entry for each path
+        self.file = open(filename+'.new', 'w')
+        for entry in self.entries.values():
+            self.file.write(json.dumps(entry)+'\n')
+        self.file.flush()
+        os.replace(filename+'.new', filename)
+
+    def Key(self, filename):
+        return path.relpath(filename, self.root_dir).replace(os.sep, '/')
+
+    def Lookup(self, filename):
+        return self.entries.get(self.Key(filename))
+
+    def IsComplete(self, entry, url, filename):
+        # a file is complete if it was fetched from the same URL and is still intact
+        if entry is None or entry['url'] != url:
+            return False
+        try:
+            if path.getsize(filename) != entry['size']:
+                return False
+            with open(filename, 'rb') as f:
+                return hashlib.sha256(f.read()).hexdigest() == entry['sha256']
+        except OSError:
+            return False
+
+    def Record(self, filename, result, size, sha256):
+        entry = {
+            'path':          self.Key(filename),
+            'url':           result.url,
+            'size':          size,
+            'sha256':        sha256,
+            'etag':          result.headers.get('ETag'),
+            'last_modified': result.headers.get('Last-Modified')
+        }
+        with self.lock:
+            self.entries[entry['path']] = entry
+            self.file.write(json.dumps(entry)+'\n')
+            self.file.flush()
+
+    def Close(self):
+        with self.lock:
+            self.file.close()
+
+class Fetcher:
+    """Concurrent HTTP/file fetch engine.
+
+    Requests are executed by a pool of worker threads, over keep-alive
+    connections pooled per host. Transient failures are retried with an
+    exponential backoff, and the payloads held in memory are bounded by
+    max_in_flight_bytes. Files are written atomically (temp file + rename).
+    """
+    def __init__(self, parallel=4, retries=3, backoff=0.5, max_in_flight_bytes=64*1024*1024, timeout=30, verbose=False,
+                 journal=None, revalidate=False):
+        self.parallel = max(parallel, 1)
+        self.retries  = retries
+        self.backoff  = backoff
+        self.verbose  = verbose
+        self.journal  = journal
+        self.revalidate = revalidate
+        self.pool     = ConnectionPool(timeout)
+        self.budget   = ByteBudget(max_in_flight_bytes)
+        self.executor = ThreadPoolExecutor(max_workers=self.parallel)
+        self.created_dirs = set()
+        self.dirs_lock = threading.Lock()
+
+    def Close(self):
+        self.executor.shutdown(wait=True)
+        self.pool.Close()
+        if self.journal:
+            self.journal.Close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.Close()
+
+    def Submit(self, url, filename, process=None, headers=None, use_journal=True, spans=None):
+        """Fetch url into filename in the background, and return a Future.
+
+        If not None, process is called with the fetched data and returns the
+        data that will be written to the file (bytes, or a list of bytes that
+        are written one after the other).
+        If not None, spans is a list of (offset, size) byte ranges: each one is
+        fetched with a ranged request, and the file is the concatenation of
+        the ranges. The ranges are written to the file as they are fetched, and
+        the data passed to process is then a read-only memory map of the file.
+        When a journal is used, files that are already complete are not fetched
+        again, or, when revalidating, are fetched with a conditional request.
+        """
+        return self.executor.submit(self.FetchToFile, url, filename, process, headers, use_journal, spans)
+
+    def FetchToFile(self, url, filename, process=None, headers=None, use_journal=True, spans=None):
+        if self.journal is not None and use_journal:
+            entry = self.journal.Lookup(filename)
+            if self.journal.IsComplete(entry, url, filename):
+                if not self.revalidate:
+                    result = FetchResult(url, None, {}, None)
+                    result.filename = filename
+                    result.from_journal = True
+                    return result
+                headers = dict(headers or {})
+                if entry['etag']:
+                    headers['If-None-Match'] = entry['etag']
+                if entry['last_modified']:
+                    headers['If-Modified-Since'] = entry['last_modified']
+
+        if spans is not None:
+            return self.FetchSpansToFile(url, filename, spans, process, headers, use_journal)
+
+        result = self.Fetch(url, headers, hold_budget=True)
+        try:
+            if result.data is not None:
+                data = result.data
+                if process is not None:
+                    data = process(data)
+                self.WriteFile(filename, data)
+                self.RecordFile(filename, result, data, use_journal)
+            else:
+                result.from_journal = (result.status == 304)
+            result.filename = filename
+            return result
+        finally:
+            self.budget.Release(result.size)
+
+    def RecordFile(self, filename, result, data, use_journal):
+        if self.journal is None or not use_journal:
+            return
+        chunks = data if isinstance(data, list) else [data]
+        digest = hashlib.sha256()
+        for chunk in chunks:
+            digest.update(chunk)
+        self.journal.Record(filename, result, sum([len(chunk) for chunk in chunks]), digest.hexdigest())
+
+    def Fetch(self, url, headers=None, hold_budget=False):
+        """Fetch url, with retries, and return a FetchResult.
+
+        A status of 304 results in a FetchResult with no data. If hold_budget
+        is True, the caller must release result.size bytes from the budget.
+        """
+        attempt = 0
+        while True:
+            try:
+                result = self.FetchOnce(url, headers)
+                break
+            except FetchError as e:
+                if e.status is not None and e.status not in HTTP_RETRY_STATUSES:
+                    raise
+                error = e
+            except (OSError, http.client.HTTPException) as e:
+                error = FetchError(url, str(e) or e.__class__.__name__)
+
+            if attempt >= self.retries:
+                raise error
+            delay = self.backoff * (2 ** attempt)
+            attempt += 1
+            if self.verbose:
+                print('WARNING: %s, retrying in %.1fs' % (error, delay))
+            time.sleep(delay)
+
+        if not hold_budget:
+            self.budget.Release(result.size)
+        return result
+
+    def FetchSpansToFile(self, url, filename, spans, process=None, headers=None, use_journal=True):
+        """Fetch byte ranges of url into filename, one after the other.
+
+        Each range is written to a temporary file, and its bytes released from
+        the budget, before the next one is requested, so that the bytes held
+        by a fetch never exceed the size of its largest range.
+        """
+        self.MakeDirs(path.dirname(filename))
+        temp_filename = MakeTempFilename(filename)
+        try:
+            (result, size, sha256) = self.FetchSpansToTempFile(url, temp_filename, spans, headers)
+            if result.data is None:
+                # not modified: the other ranges are not needed
+                os.unlink(temp_filename)
+                result.from_journal = True
+            elif process is None:
+                os.replace(temp_filename, filename)
+                if self.journal is not None and use_journal:
+                    self.journal.Record(filename, result, size, sha256)
+            else:
+                with open(temp_filename, 'rb') as f:
+                    with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                        data = process(mapped)
+                os.unlink(temp_filename)
+                self.WriteFile(filename, data)
+                self.RecordFile(filename, result, data, use_journal)
+        except:
+            try:
+                os.unlink(temp_filename)
+            except OSError:
+                pass
+            raise
+        result.data = None
+        result.filename = filename
+        return result
+
+    def FetchSpansToTempFile(self, url, temp_filename, spans, headers):
+        # returns the result of the first range request, with the size and sha256 of the written data
+        digest = hashlib.sha256()
+        written = 0
+        whole = None
+        with open(temp_filename, 'wb') as f:
+            try:
+                for (offset, size) in spans:
+                    if whole is None:
+                        range_headers = dict(headers or {})
+                        range_headers['Range'] = 'bytes=%d-%d' % (offset, offset+size-1)
+                        response = self.Fetch(url, range_headers, hold_budget=True)
+                        if written == 0:
+                            result = response
+                        if response.data is None:
+                            return (response, 0, None)
+                        data = response.data
+                        if response.status == 200:
+                            # the server ignored the range and returned the whole resource,
+                            # which is held until all the ranges are extracted from it
+                            whole = response
+                            data = whole.data[offset:offset+size]
+                        else:
+                            self.budget.Release(response.size)
+                    else:
+                        data = whole.data[offset:offset+size]
+                    if len(data) != size:
+                        raise FetchError(url, 'short byte range (%d of %d bytes at %d)' % (len(data), size, offset))
+                    f.write(data)
+                    digest.update(data)
+                    written += size
+            finally:
+                if whole is not None:
+                    self.budget.Release(whole.size)
+        return (result, written, digest.hexdigest())
+
+    def FetchOnce(self, url, headers=None):
+        if url.startswith('file://'):
+            return self.ReadLocalFile(url)
+
+        for _ in range(HTTP_MAX_REDIRECTS+1):
+            parsed_url = urllib.parse.urlsplit(url)
+            if parsed_url.scheme not in ('http', 'https'):
+                raise FetchError(url, 'unsupported URL scheme')
+            target = parsed_url.path or '/'
+            if parsed_url.query:
+                target += '?'+parsed_url.query
+
+            (connection, reused) = self.pool.Acquire(parsed_url.scheme, parsed_url.netloc)
+            try:
+                try:
+                    connection.request('GET', target, headers=headers or {})
+                    response = connection.getresponse()
+                except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError):
+                    if not reused:
+                        raise
+                    # the server closed an idle keep-alive connection, try a fresh one
+                    connection.close()
+                    connection = self.pool.Create(parsed_url.scheme, parsed_url.netloc)
+                    connection.request('GET', target, headers=headers or {})
+                    response = connection.getresponse()
+
+                result = self.ReadResponse(url, response)
+            except:
+                connection.close()
+                raise
+
+            if response.will_close:
+                connection.close()
+            else:
+                self.pool.Release(parsed_url.scheme, parsed_url.netloc, connection)
+
+            if result.status in HTTP_REDIRECT_STATUSES:
+                location = result.headers.get('Location')
+                if location is None:
+                    raise FetchError(url, 'redirect without a location', result.status)
+                url = urllib.parse.urljoin(url, location)
+                continue
+            return result
+
+        raise FetchError(url, 'too many redirects')
+
+    def ReadResponse(self, url, response):
+        status = response.status
+        headers = response.headers
+        if status in HTTP_REDIRECT_STATUSES or status == 304:
+            response.read()
+            return FetchResult(url, status, headers, None)
+        if status < 200 or status >= 300:
+            response.read()
+            raise FetchError(url, 'HTTP error %d' % status, status)
+
+        # reserve the budget before reading the payload
+        content_length = response.getheader('Content-Length')
+        reserved = int(content_length) if content_length is not None else 0
+        self.budget.Acquire(reserved)
+        try:
+            chunks = []
+            size = 0
+            while True:
+                chunk = response.read(READ_CHUNK_SIZE)
+                if not chunk:
+                    break
+                chunks.append(chunk)
+                size += len(chunk)
+                if size > reserved:
+                    # no Content-Length: account for the data without blocking,
+                    # since waiting while holding a partial reservation could deadlock
+                    self.budget.Acquire(size-reserved, wait=False)
+                    reserved = size
+        except:
+            self.budget.Release(reserved)
+            raise
+        if size < reserved:
+            self.budget.Release(reserved-size)
+            if content_length is not None:
+                raise FetchError(url, 'truncated response (%d of %s bytes)' % (size, content_length))
+
+        return FetchResult(url, status, headers, b''.join(chunks))
+
+    def ReadLocalFile(self, url):
+        filename = url[7:]
+        try:
+            size = path.getsize(filename)
+        except OSError as e:
+            raise FetchError(url, str(e), 404)
+        self.budget.Acquire(size)
+        try:
+            with open(filename, 'rb') as f:
+                data = f.read()
+        except:
+            self.budget.Release(size)
+            raise
+        if len(data) != size:
+            self.budget.Release(size)
+            raise FetchError(url, 'file changed while reading')
+        return FetchResult(url, 200, {}, data)
+
+    def MakeDirs(self, dir):
+        if not dir:
+            return
+        with self.dirs_lock:
+            if dir in self.created_dirs:
+                return
+            os.makedirs(dir, exist_ok=True)
+            self.created_dirs.add(dir)
+
+    def WriteFile(self, filename, data):
+        WriteFileAtomically(filename, data, self.MakeDirs)
+
+def CoalesceRanges(ranges):
+    """Merge (offset, size) byte ranges that overlap or are adjacent.
+
+    Returns the sorted list of merged (offset, size) ranges.
+    """
+    spans = []
+    for (offset, size) in sorted(ranges):
+        if spans and offset <= spans[-1][0]+spans[-1][1]:
+            (span_offset, span_size) = spans[-1]
+            spans[-1] = (span_offset, max(span_size, offset+size-span_offset))
+        else:
+            spans.append((offset, size))
+    return spans
+
+#############################################
+# Module Exports
+#############################################
+__all__ = [
+    'FetchError',
+    'FetchResult',
+    'Journal',
+    'Fetcher',
+    'CoalesceRanges'
+]
@@ -0,0 +1,178 @@
+__author__    = 'Gilles Boccon-Gibod (bok@bok.net)'
+__copyright__ = 'Copyright 2011-2020 Axiomatic Systems, LLC.'
+
+###
+# Incremental packaging jobs.
+# The work of a packaging job is divided in tasks (preparing a source,
+# splitting a track, copying a media file, ...), each identified by a name,
+# with a fingerprint of everything that it depends on: the identity of its
+# input files and the values of the options that it uses. A job manifest,
+# kept in a job directory between runs, records the fingerprint of each task
+# and the outputs that it produced, with their size, modification time and
+# digest. A task is only done again when its fingerprint changes, or when
+# one of its outputs is missing or was modified since it was produced.
+
+import os
+import os.path as path
+import json
+import hashlib
+from mp4utils import WriteFileAtomically
+from sinkutils import HashFile
+
+JOB_MANIFEST_NAME    = 'job.json'
+JOB_MANIFEST_VERSION = 1
+JOB_STAMP_NAME       = 'stamp'
+
+def GetFileIdentity(filename):
+    stat = os.stat(filename)
+    return [path.realpath(filename), stat.st_size, stat.st_mtime_ns]
+
+def MakeFingerprint(*values):
+    return hashlib.sha1(json.dumps(values, sort_keys=True).encode('utf-8')).hexdigest()
+
+def ListFilesModifiedSince(root_dir, stamp):
+    """Return the files under root_dir that were modified since a stamp (see JobManifest.MakeStamp)"""
+    filenames = []
+    for (dirpath, _, names) in os.walk(root_dir):
+        for name in names:
+            filename = path.join(dirpath, name)
+            if os.stat(filename).st_mtime_ns >= stamp:
+                filenames.append(filename)
+    return sorted(filenames)
+
+def RemoveEmptyDirs(dir, root_dir):
+    # remove a directory and its parents, up to root_dir, for as long as they are empty
+    while path.realpath(dir) != path.realpath(root_dir):
+        try:
+            os.rmdir(dir)
+        except OSError:
+            return
+        dir = path.dirname(dir)
+
+class JobManifest:
+    """
+    State of a packaging job. A job manifest without a directory is inert:
+    no task is ever done, and nothing is recorded, so that the packagers can
+    use it unconditionally.
+    The outputs of a task are recorded relative to a root directory, and the
+    outputs of the previous run that are not produced again are stale.
+    """
+    def __init__(self, job_dir):
+        self.job_dir  = job_dir
+        self.inputs   = []
+        self.tasks    = {}
+        self.previous = {}
+        if job_dir is None:
+            return
+        os.makedirs(job_dir, exist_ok=True)
+        try:
+            with open(path.join(job_dir, JOB_MANIFEST_NAME), 'r') as f:
+                manifest = json.load(f)
+            if manifest.get('version') == JOB_MANIFEST_VERSION:
+                self.previous = manifest['tasks']
+        except (IOError, ValueError):
+            # no job manifest, or an unusable one: everything will be done
+            pass
+
+    def GetWorkFilename(self, name):
+        """Return the name of a file in the job directory, where intermediate files are kept"""
+        return path.join(self.job_dir, name)
+
+    def MakeStamp(self):
+        """
+        Return a time to compare file modification times with. It is the
+        modification time of a file written now, since the file systems keep
+        modification times with a coarser clock than the system time.
+        """
+        stamp_filename = path.join(self.job_dir, JOB_STAMP_NAME)
+        with open(stamp_filename, 'w') as f:
+            f.write('')
+        return os.stat(stamp_filename).st_mtime_ns
+
+    def AddInput(self, filename):
+        if self.job_dir is not None:
+            self.inputs.append(GetFileIdentity(filename))
+
+    def IsDone(self, name, fingerprint):
+        """Return True if a task was done with the same fingerprint, and its outputs are intact"""
+        entry = self.previous.get(name)
+        if self.job_dir is None or entry is None or entry['fingerprint'] != fingerprint:
+            return False
+        for (output_name, output) in entry['outputs'].items():
+            try:
+                stat = os.stat(path.join(entry['root'], output_name))
+            except OSError:
+                return False
+            if stat.st_size != output['size'] or stat.st_mtime_ns != output['mtime']:
+                return False
+        return True
+
+    def Keep(self, name):
+        """Record a task that is not done again, with the outputs of its previous run"""
+        if self.job_dir is not None:
+            self.tasks[name] = self.previous[name]
+
+    def KeepAll(self, prefix=''):
+        """Record all the tasks of the previous run whose name starts with prefix"""
+        for name in self.previous:
+            if name.startswith(prefix) and name not in self.tasks:
+                self.Keep(name)
+
+    def GetData(self, name):
+        """Return the data recorded with a task by the previous run"""
+        return self.previous.get(name, {}).get('data', {})
+
+    def Record(self, name, fingerprint, root_dir, filenames, digests=None, data=None):
+        """
+        Record a task that was done, with the files that it produced. digests
+        may map the names of outputs, relative to root_dir, to digests that are
+        already known, and data is a JSON-serializable dictionary of values
+        that a later run needs when it does not do the task again.
+        """
+        if self.job_dir is None:
+            return
+        outputs = {}
+        for filename in filenames:
+            output_name = path.relpath(filename, root_dir).replace(os.sep, '/')
+            stat = os.stat(filename)
+            digest = (digests or {}).get(output_name) or HashFile(filename)
+            outputs[output_name] = {'size': stat.st_size, 'mtime': stat.st_mtime_ns, 'digest': digest}
+        self.tasks[name] = {'fingerprint': fingerprint, 'root': path.abspath(root_dir), 'outputs': outputs}
+        if data:
+            self.tasks[name]['data'] = data
+
+    def GetStaleFiles(self):
+        """Return the outputs of the previous run that were not produced by this one"""
+        outputs = set()
+        for entry in self.tasks.values():
+            for output_name in entry['outputs']:
+                outputs.add(path.join(entry['root'], output_name))
+        stale = set()
+        for entry in self.previous.values():
+            for output_name in entry['outputs']:
+                filename = path.join(entry['root'], output_name)
+                if filename not in outputs:
+                    stale.add((filename, entry['root']))
+        return sorted(stale)
+
+    def Save(self):
+        """Remove the stale outputs, and write the job manifest for the next run"""
+        if self.job_dir is None:
+            return
+        for (filename, root_dir) in self.GetStaleFiles():
+            if path.exists(filename):
+                os.unlink(filename)
+            RemoveEmptyDirs(path.dirname(filename), root_dir)
+        manifest = {'version': JOB_MANIFEST_VERSION, 'inputs': self.inputs, 'tasks': self.tasks}
+        WriteFileAtomically(path.join(self.job_dir, JOB_MANIFEST_NAME),
+                            json.dumps(manifest, indent=2, sort_keys=True).encode('utf-8'))
+
+#############################################
+# Module Exports
+#############################################
+__all__ = [
+    'GetFileIdentity',
+    'MakeFingerprint',
+    'ListFilesModifiedSince',
+    'JobManifest'
+]
@@ -3,27 +3,25 @@
 __author__    = 'Gilles Boccon-Gibod (bok@bok.net)'
 __copyright__ = 'Copyright 2011-2012 Axiomatic Systems, LLC.'
 
-###
-# NOTE: this script needs Bento4 command line binaries to run
-# You must place the 'mp4info' and 'mp4encrypt' binaries
-# in a directory named 'bin/<platform>' at the same level as where
-# this script is.
-# <platform> depends on the platform you're running on:
-# Mac OSX   --> platform = macosx
-# Linux x86 --> platform = linux-x86
-# Windows   --> platform = win32
-
 ### Imports
 import sys
 import os
 import os.path as path
 from optparse import OptionParser
 import urllib.request, urllib.error, urllib.parse
-import shutil
-import json
-import sys
+import re
+import math
+import itertools
+import functools
+import io
+import copy
+import time
+import collections
+from fractions import Fraction
 from xml.etree import ElementTree
-from subprocess import check_output, CalledProcessError
+from fetchutils import Fetcher, FetchError, Journal
+from mp4utils import WriteFileAtomically
+from mp4cenc import CencEncryptor, CheckEncryptionBackend
 
 # constants
 DASH_NS_URN_COMPAT = 'urn:mpeg:DASH:schema:MPD:2011'
@@ -32,52 +30,107 @@ DASH_NS_COMPAT     = '{'+DASH_NS_URN_COMPAT+'}'
 DASH_NS            = '{'+DASH_NS_URN+'}'
 MARLIN_MAS_NS_URN  = 'urn:marlin:mas:1-0:services:schemas:mpd'
 MARLIN_MAS_NS      = '{'+MARLIN_MAS_NS_URN+'}'
+JOURNAL_FILENAME   = '.mp4-dash-clone-journal'
+DEFAULT_POLL_INTERVAL = 2
+
+URL_TEMPLATE_VARIABLES = {
+    'RepresentationID': 'representation_id',
+    'Number':           'number',
+    'Bandwidth':        'bandwidth',
+    'Time':             'time'
+}
+URL_TEMPLATE_PATTERN = re.compile(r'\$(?:(RepresentationID|Number|Bandwidth|Time)(%0?[0-9]*[diouxX])?)?\$')
+ISO8601_DURATION_PATTERN = re.compile(r'^P(?:([0-9.]+)Y)?(?:([0-9.]+)M)?(?:([0-9.]+)W)?(?:([0-9.]+)D)?(?:T(?:([0-9.]+)H)?(?:([0-9.]+)M)?(?:([0-9.]+)S)?)?$')
+ISO8601_DURATION_UNITS   = [365*24*3600, 30*24*3600, 7*24*3600, 24*3600, 3600, 60, 1]
+
+class UrlTemplate:
+    """A SegmentTemplate URL, parsed once into a %-format string.
+
+    Identifiers for which no value is given are left unchanged in the URL.
+    """
+    def __init__(self, template):
+        self.parts = []
+        position = 0
+        for match in URL_TEMPLATE_PATTERN.finditer(template):
+            if match.start() > position:
+                self.parts.append(template[position:match.start()])
+            if match.group(1) is None:
+                self.parts.append('$')
+            else:
+                name = URL_TEMPLATE_VARIABLES[match.group(1)]
+                format = match.group(2)
+                if format is None:
+                    format = 's' if name == 'representation_id' else 'd'
+                else:
+                    format = format[1:]
+                self.parts.append((name, format, match.group(0)))
+            position = match.end()
+        if position < len(template):
+            self.parts.append(template[position:])
+
+        self.variables = set([part[0] for part in self.parts if isinstance(part, tuple)])
+        self.format = ''.join([part.replace('%', '%%') if isinstance(part, str) else '%%(%s)%s' % part[:2] for part in self.parts])
+
+    def Format(self, representation_id=None, bandwidth=None, time=None, number=None):
+        values = {
+            'representation_id': representation_id,
+            'bandwidth':         bandwidth,
+            'time':              time,
+            'number':            number
+        }
+        for name in self.variables:
+            if values[name] is None:
+                return self.FormatPartially(values)
+            if name != 'representation_id':
+                values[name] = int(values[name])
+        return self.format % values
+
+    def Bind(self, representation_id, bandwidth):
+        """Return a function (time, number) -> URL for one representation"""
+        values = {'representation_id': representation_id, 'bandwidth': bandwidth}
+        if any([values.get(name, 0) is None for name in self.variables]):
+            return lambda time, number: self.Format(representation_id, bandwidth, time, number)
+
+        # substitute the representation identifiers once
+        format = ''
+        for part in self.parts:
+            if isinstance(part, str):
+                format += part.replace('%', '%%')
+            elif part[0] in values:
+                value = values[part[0]] if part[0] == 'representation_id' else int(values[part[0]])
+                format += (('%'+part[1]) % value).replace('%', '%%')
+            else:
+                format += '%%(%s)%s' % part[:2]
+        return lambda time, number: format % {'time': time, 'number': number}
+
+    def FormatPartially(self, values):
+        result = []
+        for part in self.parts:
+            if isinstance(part, str):
+                result.append(part)
+            elif values[part[0]] is None:
+                result.append(part[2])
+            elif part[0] == 'representation_id':
+                result.append(('%'+part[1]) % values[part[0]])
+            else:
+                result.append(('%'+part[1]) % int(values[part[0]]))
+        return ''.join(result)
 
-def Bento4Command(name, *args, **kwargs):
-    cmd = [path.join(Options.exec_dir, name)]
-    for kwarg in kwargs:
-        arg = kwarg.replace('_', '-')
-        cmd.append('--'+arg)
-        if not isinstance(kwargs[kwarg], bool):
-            cmd.append(kwargs[kwarg])
-    cmd += args
-    #print cmd
-    try:
-        return check_output(cmd)
-    except CalledProcessError as e:
-        #print e
-        raise Exception("binary tool failed with error %d" % e.returncode)
-
-def Mp4Info(filename, **args):
-    return Bento4Command('mp4info', filename, **args)
-
-def GetTrackIds(mp4):
-    track_ids = []
-    json_info = Mp4Info(mp4, format='json')
-    info = json.loads(json_info, strict=False)
-
-    for track in info['tracks']:
-        track_ids.append(track['id'])
-
-    return track_ids
+@functools.lru_cache(maxsize=256)
+def CompileUrlTemplate(template):
+    return UrlTemplate(template)
 
 def ProcessUrlTemplate(template, representation_id, bandwidth, time, number):
-    if representation_id is not None: result = template.replace('$RepresentationID$', representation_id)
-    if number is not None:
-        nstart = result.find('$Number')
-        if nstart >= 0:
-            nend = result.find('$', nstart+1)
-            if nend >= 0:
-                var = result[nstart+1 : nend]
-                if 'Number%' in var:
-                    value = var[6:] % (int(number))
-                else:
-                    value = number
-                result = result.replace('$'+var+'$', value)
-    if bandwidth is not None:         result = result.replace('$Bandwidth$', bandwidth)
-    if time is not None:              result = result.replace('$Time$', time)
-    result = result.replace('$$', '$')
-    return result
+    return CompileUrlTemplate(template).Format(representation_id, bandwidth, time, number)
+
+def ParseDuration(duration):
+    # ISO 8601 duration (xs:duration), as an exact number of seconds
+    if duration is None:
+        return None
+    match = ISO8601_DURATION_PATTERN.match(duration.strip())
+    if match is None:
+        raise Exception('Invalid duration: '+duration)
+    return sum([Fraction(value)*unit for (value, unit) in zip(match.groups(), ISO8601_DURATION_UNITS) if value is not None], Fraction(0))
 
 class DashSegmentBaseInfo:
     def __init__(self, xml):
@@ -98,9 +151,11 @@ class DashSegmentBaseInfo:
 
                 if type == 'SegmentTemplate':
                     self.initialization = e.get('initialization')
-                    self.media          = e.get('media')
-                    self.timescale      = e.get('timescale')
-                    self.startNumber    = e.get('startNumber')
+                    # only set the attributes that are present, so that the others are inherited
+                    for attribute in ['media', 'timescale', 'startNumber', 'duration', 'presentationTimeOffset']:
+                        value = e.get(attribute)
+                        if value is not None:
+                            setattr(self, attribute, value)
 
                 # segment timeline
                 st = e.find(DASH_NS+'SegmentTimeline')
@@ -181,35 +236,73 @@ class DashRepresentation:
         else:
             return self.GenerateSegmentUrlsFromList()
 
+    def HasKnownSegmentCount(self):
+        if self.segment_base_type != 'SegmentTemplate':
+            return True
+        return self.SegmentBaseLookup('segment_timeline') is not None or self.GetSegmentCount() is not None
+
+    def GetSegmentCount(self):
+        # number of segments of a SegmentTemplate without a SegmentTimeline,
+        # or None if it can't be computed from the MPD
+        duration = self.SegmentBaseLookup('duration')
+        period_duration = self.AttributeLookup('period_duration')
+        if duration is None or period_duration is None:
+            return None
+        timescale = int(self.SegmentBaseLookup('timescale') or 1)
+        return math.ceil(period_duration*timescale/int(duration))
+
     def GenerateSegmentUrlsFromTemplate(self):
         media = self.SegmentBaseLookup('media')
         if media is None:
             print('WARNING: no media attribute found for representation')
             return
 
-        timeline = self.SegmentBaseLookup('segment_timeline')
-        if timeline is None:
-            start = self.SegmentBaseLookup('startNumber')
-            if start is None:
-                current_number = 1
+        if self.SegmentBaseLookup('segment_timeline') is None:
+            format = CompileUrlTemplate(media).Bind(self.id, self.bandwidth)
+            start_number = int(self.SegmentBaseLookup('startNumber') or 1)
+            segment_count = self.GetSegmentCount()
+            if segment_count is None:
+                # unknown duration: stop at the first segment that can't be fetched
+                numbers = itertools.count(start_number)
             else:
-                current_number = int(start)
-            while True:
-                url = ProcessUrlTemplate(media, representation_id=self.id, bandwidth=self.bandwidth, time="0", number=str(current_number))
-                current_number += 1
+                numbers = range(start_number, start_number+segment_count)
+            duration = int(self.SegmentBaseLookup('duration') or 0)
+            segment_time = int(self.SegmentBaseLookup('presentationTimeOffset') or 0)
+            for number in numbers:
+                yield format(segment_time, number)
+                segment_time += duration
+        else:
+            for (_, _, _, url) in self.GenerateTimelineSegments():
                 yield url
 
-        else:
-            current_number = 1
-            current_time = 0
-            for s in timeline:
-                if 't' in s:
-                    current_time = s['t']
-                for _ in range(1+s['r']):
-                    url = ProcessUrlTemplate(media, representation_id=self.id, bandwidth=self.bandwidth, time=str(current_time), number=str(current_number))
-                    current_number += 1
-                    current_time += s['d']
-                    yield url
+    def GenerateTimelineSegments(self):
+        # (time, duration, number, url) for each segment of the SegmentTimeline
+        format = CompileUrlTemplate(self.SegmentBaseLookup('media')).Bind(self.id, self.bandwidth)
+        number = int(self.SegmentBaseLookup('startNumber') or 1)
+        for (segment_time, duration) in self.GenerateTimelineTimes(self.SegmentBaseLookup('segment_timeline')):
+            yield (segment_time, duration, number, format(segment_time, number))
+            number += 1
+
+    def GenerateTimelineTimes(self, timeline):
+        current_time = 0
+        for (index, s) in enumerate(timeline):
+            if 't' in s:
+                current_time = s['t']
+            repeat_count = s['r']
+            if repeat_count < 0:
+                # repeat until the start of the next entry, or the end of the period
+                if index+1 < len(timeline) and 't' in timeline[index+1]:
+                    end_time = timeline[index+1]['t']
+                else:
+                    period_duration = self.AttributeLookup('period_duration')
+                    if period_duration is None:
+                        raise Exception('Open-ended SegmentTimeline entry in a period with no known duration')
+                    timescale = int(self.SegmentBaseLookup('timescale') or 1)
+                    end_time = int(self.SegmentBaseLookup('presentationTimeOffset') or 0)+math.ceil(period_duration*timescale)
+                repeat_count = max(math.ceil((end_time-current_time)/s['d'])-1, 0)
+            for _ in range(1+repeat_count):
+                yield (current_time, s['d'])
+                current_time += s['d']
 
     def GenerateSegmentUrlsFromList(self):
         segs = self.xml.find(DASH_NS+'SegmentList').findall(DASH_NS+'SegmentURL')
@@ -240,6 +333,8 @@ class DashPeriod:
         self.xml = xml
         self.parent = parent
         self.segment_base = DashSegmentBaseInfo(xml)
+        self.period_start = ParseDuration(xml.get('start'))
+        self.period_duration = ParseDuration(xml.get('duration'))
         self.adaptation_sets = []
         for s in self.xml.findall(DASH_NS+'AdaptationSet'):
             self.adaptation_sets.append(DashAdaptationSet(s, self))
@@ -258,6 +353,7 @@ class DashMPD:
         self.type = xml.get('type')
         for p in self.xml.findall(DASH_NS+'Period'):
             self.periods.append(DashPeriod(p, self))
+        self.ComputePeriodTiming(ParseDuration(xml.get('mediaPresentationDuration')))
 
         # compute base URL (note: we'll just use the MPD URL for now)
         self.base_urls = [url]
@@ -265,11 +361,31 @@ class DashMPD:
         if base_url is not None:
             self.base_urls = [base_url.text]
 
+    def ComputePeriodTiming(self, presentation_duration):
+        # fill in the start and duration of the periods when they are implicit
+        for (index, period) in enumerate(self.periods):
+            if period.period_start is None:
+                if index == 0:
+                    period.period_start = Fraction(0)
+                else:
+                    previous = self.periods[index-1]
+                    if previous.period_start is not None and previous.period_duration is not None:
+                        period.period_start = previous.period_start+previous.period_duration
+        for (index, period) in enumerate(self.periods):
+            if period.period_duration is not None or period.period_start is None:
+                continue
+            if index+1 < len(self.periods):
+                end = self.periods[index+1].period_start
+            else:
+                end = presentation_duration
+            if end is not None:
+                period.period_duration = end-period.period_start
+
     def __str__(self):
         result = "MPD:\n" + '\n'.join([str(p) for p in self.periods])
         return result
 
-def ParseMpd(url, xml):
+def ParseMpd(url, xml, allow_dynamic=False):
     mpd_tree = ElementTree.XML(xml)
     if mpd_tree.tag.startswith(DASH_NS_COMPAT):
         global DASH_NS
@@ -281,11 +397,24 @@ def ParseMpd(url, xml):
 
     mpd = DashMPD(url, mpd_tree)
 
-    if not (mpd.type is None or mpd.type == 'static'):
-        raise Exception('Only static MPDs are supported')
+    if not (mpd.type is None or mpd.type == 'static' or allow_dynamic and mpd.type == 'dynamic'):
+        raise Exception('Only static MPDs are supported (use --record for dynamic MPDs)')
 
     return mpd
 
+def FormatDuration(seconds):
+    return 'PT%.3fS' % seconds
+
+def AddContentProtection(xml):
+    for p in xml.findall(DASH_NS+'Period'):
+        for s in p.findall(DASH_NS+'AdaptationSet'):
+            cp = ElementTree.Element(DASH_NS+'ContentProtection', schemeIdUri='urn:uuid:5E629AF5-38DA-4063-8977-97FFBD9902D4')
+            cp.tail = s.tail
+            cids = ElementTree.SubElement(cp, MARLIN_MAS_NS+'MarlinContentIds')
+            cid = ElementTree.SubElement(cids, MARLIN_MAS_NS+'MarlinContentId')
+            cid.text = 'urn:marlin:kid:'+Options.kid.hex()
+            s.insert(0, cp)
+
 def MakeNewDir(dir, is_warning=False):
     if path.exists(dir):
         if is_warning:
@@ -314,76 +443,297 @@ def ComputeUrl(base_url, url):
         return urllib.parse.urljoin(base_url, url)
 
 class Cloner:
-    def __init__(self, root_dir):
+    def __init__(self, root_dir, fetcher):
         self.root_dir = root_dir
-        self.track_ids = []
-        self.init_filename = None
+        self.fetcher = fetcher
+        self.encryptors = {}
 
-    def CloneSegment(self, url, path_out, is_init):
+    def TargetFilename(self, path_out):
         while path_out.startswith('/'):
             path_out = path_out[1:]
-        target_dir = path.join(self.root_dir, path_out)
+        return path.join(self.root_dir, path_out)
+
+    def CloneSegment(self, url, path_out, is_init, representation_key):
+        # clone a single segment and wait for it to complete
+        return self.SubmitSegment(url, path_out, is_init, representation_key).result()
+
+    def SubmitSegment(self, url, path_out, is_init, representation_key):
+        # the segments of a representation are encrypted with the encryptor setup from its init segment
         if Options.verbose:
             print('Cloning', url, 'to', path_out)
 
-        #os.makedirs(target_dir)
-        try:
-            os.makedirs(path.dirname(target_dir))
-        except OSError:
-            if path.exists(target_dir):
-                pass
-        except:
-            raise
-
-        data = OpenURL(url)
-        outfile_name = path.join(self.root_dir, path_out)
-        use_temp_file = False
+        outfile_name = self.TargetFilename(path_out)
+        process = None
+        use_journal = True
         if Options.encrypt:
-            use_temp_file = True
-            outfile_name_final = outfile_name
-            outfile_name += '.tmp'
-        outfile = open(outfile_name, 'wb')
+            if is_init:
+                # the clear init segment is always needed to setup the encryptor
+                encryptor = CencEncryptor(Options.kid, Options.key)
+                self.encryptors[representation_key] = encryptor
+                process = encryptor.ProcessInitSegment
+                use_journal = False
+            else:
+                process = self.encryptors[representation_key].ProcessMediaSegment
+        return self.fetcher.Submit(url, outfile_name, process, use_journal=use_journal)
+
+    def CloneSegments(self, segments, representation_key):
+        # clone (url, path_out) segments concurrently, stopping at the first one that can't be fetched
+        pending = collections.deque()
+        window = 2*self.fetcher.parallel
+        failed = False
+        for (url, path_out) in segments:
+            if len(pending) >= window:
+                if not self.WaitForSegment(pending.popleft()):
+                    failed = True
+                    break
+            pending.append(self.SubmitSegment(url, path_out, False, representation_key))
+        for future in pending:
+            if not self.WaitForSegment(future):
+                failed = True
+        return not failed
+
+    def WaitForSegment(self, future):
         try:
-            shutil.copyfileobj(data, outfile)
-            outfile.close()
-
-            if Options.encrypt:
-                if is_init:
-                    self.track_ids = GetTrackIds(outfile_name)
-                    self.init_filename = outfile_name
-
-                #shutil.copyfile(outfile_name, outfile_name_final)
-                args = ["--method", "MPEG-CENC"]
-                for t in self.track_ids:
-                    args.append("--property")
-                    args.append(str(t)+":KID:"+Options.kid.encode('hex'))
-                for t in self.track_ids:
-                    args.append("--key")
-                    args.append(str(t)+":"+Options.key.encode('hex')+':random')
-                args += [outfile_name, outfile_name_final]
-
-                if not is_init:
-                    args += ["--fragments-info", self.init_filename]
+            future.result()
+            return True
+        except (FetchError, IOError) as e:
+            if Options.verbose:
+                print('Segment fetch failed:', e)
+            return False
+
+def CloneRepresentations(mpd, cloner):
+    for (period_index, period) in enumerate(mpd.periods):
+        for (adaptation_set_index, adaptation_set) in enumerate(period.adaptation_sets):
+            for representation in adaptation_set.representations:
+                key = (period_index, adaptation_set_index, representation.id)
+                # compute the base URL
+                base_url = representation.AttributeLookup('base_urls')[0]
+                if Options.verbose:
+                    print('Base URL = '+base_url)
 
+                # process the init segment
                 if Options.verbose:
-                    print('mp4encrypt '+(' '.join(args)))
-                Bento4Command("mp4encrypt", *args)
-        finally:
-            if use_temp_file and not is_init:
-                os.unlink(outfile_name)
+                    print('### Processing Initialization Segment')
+                url = ComputeUrl(base_url, representation.init_segment_url)
+                cloner.CloneSegment(url, representation.init_segment_url, True, key)
 
-    def Cleanup(self):
-        if (self.init_filename):
-            os.unlink(self.init_filename)
+                # process all segment URLs (the first failure moves to the next representation)
+                if Options.verbose:
+                    print('### Processing Media Segments for AdaptationSet', representation.id)
+                segments = ((ComputeUrl(base_url, seg_url), seg_url) for seg_url in representation.GenerateSegmentUrls())
+                complete = cloner.CloneSegments(segments, key)
+                if not complete and representation.HasKnownSegmentCount():
+                    print('WARNING: some segments of representation', representation.id, 'could not be cloned')
+
+class LiveRecorder:
+    """Records a dynamic MPD.
+
+    The MPD is polled at its minimumUpdatePeriod, the segments that appear in
+    its SegmentTimelines are cloned as they become available, and a local MPD
+    listing all the recorded segments is updated after each poll. When the
+    recording ends, the local MPD is converted to a static MPD.
+    """
+    def __init__(self, mpd_url, output_dir, fetcher, cloner, poll_interval=None, duration=None):
+        self.mpd_url       = mpd_url
+        self.mpd_filename  = path.join(output_dir, path.basename(urllib.parse.urlparse(mpd_url).path))
+        self.fetcher       = fetcher
+        self.cloner        = cloner
+        self.poll_interval = poll_interval
+        self.duration      = duration
+        self.xml           = None
+        self.initialized   = set()
+        self.submitted     = {}
+        self.recorded      = {}
+        self.pending       = []
+        self.timelines     = {}
+        self.timescales    = {}
+
+    def Record(self, mpd):
+        start_time = time.time()
+        try:
+            while True:
+                self.ProcessMpd(mpd)
+                self.CollectSegments(wait=False)
+                self.WriteMpd(final=False)
+                if mpd.type != 'dynamic':
+                    break
+                if self.duration is not None and time.time()-start_time >= self.duration:
+                    break
+
+                poll_interval = self.poll_interval
+                if poll_interval is None:
+                    poll_interval = float(ParseDuration(mpd.xml.get('minimumUpdatePeriod')) or DEFAULT_POLL_INTERVAL)
+                time.sleep(poll_interval)
 
-def main():
-    # determine the platform binary name
-    platform = sys.platform
-    if platform.startswith('linux'):
-        platform = 'linux-x86'
-    elif platform.startswith('darwin'):
-        platform = 'macosx'
+                if Options.verbose:
+                    print('Reloading MPD from', self.mpd_url)
+                try:
+                    mpd_xml = self.fetcher.Fetch(self.mpd_url).data.decode('utf-8')
+                except FetchError as e:
+                    print('WARNING: failed to reload MPD:', e)
+                    continue
+                mpd = ParseMpd(self.mpd_url, mpd_xml.replace('nitialisation', 'nitialization'), allow_dynamic=True)
+        except KeyboardInterrupt:
+            print('Recording interrupted')
+
+        self.CollectSegments(wait=True)
+        self.WriteMpd(final=True)
+
+    def ProcessMpd(self, mpd):
+        if self.xml is None:
+            self.xml = copy.deepcopy(mpd.xml)
+
+        for (period_index, period) in enumerate(mpd.periods):
+            period_key = period.xml.get('id') or str(period_index)
+            if self.FindElement(self.xml, 'Period', period_key) is None:
+                # new period: insert it after the last one
+                position = max([index+1 for (index, child) in enumerate(self.xml) if child.tag == DASH_NS+'Period'] or [len(self.xml)])
+                self.xml.insert(position, copy.deepcopy(period.xml))
+
+            for (adaptation_set_index, adaptation_set) in enumerate(period.adaptation_sets):
+                adaptation_set_key = adaptation_set.xml.get('id') or str(adaptation_set_index)
+                for representation in adaptation_set.representations:
+                    self.ProcessRepresentation(representation, (period_key, adaptation_set_key, representation.id))
+
+    def ProcessRepresentation(self, representation, key):
+        if representation.segment_base_type != 'SegmentTemplate' or representation.SegmentBaseLookup('segment_timeline') is None:
+            raise Exception('Only dynamic MPDs with a SegmentTimeline can be recorded')
+
+        # remember which SegmentTemplate element holds the timeline of this representation
+        if 'segment_timeline' in representation.segment_base.__dict__:
+            owner = key
+        elif 'segment_timeline' in representation.parent.segment_base.__dict__:
+            owner = (key[0], key[1], None)
+        else:
+            owner = (key[0], None, None)
+        self.timelines.setdefault(owner, set()).add(key)
+        self.timescales[owner] = int(representation.SegmentBaseLookup('timescale') or 1)
+
+        base_url = representation.AttributeLookup('base_urls')[0]
+        if key not in self.initialized:
+            self.cloner.CloneSegment(ComputeUrl(base_url, representation.init_segment_url), representation.init_segment_url, True, key)
+            self.initialized.add(key)
+
+        # only the segments that were not seen in a previous version of the MPD are new
+        submitted = self.submitted.setdefault(key, set())
+        for (segment_time, segment_duration, number, url) in representation.GenerateTimelineSegments():
+            if segment_time in submitted:
+                continue
+            submitted.add(segment_time)
+            future = self.cloner.SubmitSegment(ComputeUrl(base_url, url), url, False, key)
+            self.pending.append((key, segment_time, segment_duration, number, future))
+
+    def CollectSegments(self, wait):
+        pending = []
+        for (key, segment_time, segment_duration, number, future) in self.pending:
+            if not wait and not future.done():
+                pending.append((key, segment_time, segment_duration, number, future))
+                continue
+            # failed segments stay in the timeline, so that the segment numbers of the following ones don't shift
+            try:
+                future.result()
+            except (FetchError, IOError) as e:
+                print('WARNING: failed to record segment:', e)
+            self.recorded.setdefault(key, {})[segment_time] = (segment_duration, number)
+        self.pending = pending
+
+    def FindElement(self, parent, tag, key):
+        for (index, child) in enumerate(parent.findall(DASH_NS+tag)):
+            if (child.get('id') or str(index)) == key:
+                return child
+        return None
 
+    def FindSegmentTemplate(self, xml, owner):
+        node = self.FindElement(xml, 'Period', owner[0])
+        if node is not None and owner[1] is not None:
+            node = self.FindElement(node, 'AdaptationSet', owner[1])
+            if node is not None and owner[2] is not None:
+                node = next((r for r in node.findall(DASH_NS+'Representation') if r.get('id') == owner[2]), None)
+        if node is None:
+            return None
+        return node.find(DASH_NS+'SegmentTemplate')
+
+    def WriteMpd(self, final):
+        xml = copy.deepcopy(self.xml)
+
+        # the timeline of each SegmentTemplate lists the segments recorded for all its representations
+        period_durations = {}
+        for (owner, keys) in self.timelines.items():
+            template = self.FindSegmentTemplate(xml, owner)
+            if template is None:
+                continue
+            times = None
+            for key in keys:
+                recorded = set(self.recorded.get(key, {}))
+                times = recorded if times is None else times & recorded
+            recorded = self.recorded.get(next(iter(keys)), {})
+            segments = [(segment_time,)+recorded[segment_time] for segment_time in sorted(times)]
+
+            # with $Number$ URLs, the timeline must not skip a number: it stops before a segment that is
+            # still being fetched, or that was never seen because the live window moved past it
+            if '$Number' in (template.get('media') or ''):
+                for index in range(1, len(segments)):
+                    if segments[index][2] != segments[index-1][2]+1:
+                        if final:
+                            print('WARNING: segment number %d was not recorded, the following segments are not listed in the MPD' %
+                                  (segments[index-1][2]+1))
+                        segments = segments[:index]
+                        break
+
+            timeline = template.find(DASH_NS+'SegmentTimeline')
+            for child in list(timeline):
+                timeline.remove(child)
+            timeline.text = None
+            entry = None
+            for (index, (segment_time, segment_duration, _)) in enumerate(segments):
+                if index and segments[index-1][0]+segments[index-1][1] == segment_time and segments[index-1][1] == segment_duration:
+                    entry.set('r', str(int(entry.get('r', '0'))+1))
+                    continue
+                entry = ElementTree.SubElement(timeline, DASH_NS+'S', t=str(segment_time), d=str(segment_duration))
+            if not segments:
+                continue
+            template.set('startNumber', str(segments[0][2]))
+
+            if final:
+                # start the presentation at the first recorded segment
+                template.set('presentationTimeOffset', str(segments[0][0]))
+                end_time = segments[-1][0]+segments[-1][1]
+                duration = Fraction(end_time-segments[0][0], self.timescales[owner])
+                period_durations[owner[0]] = max(period_durations.get(owner[0], 0), duration)
+
+        if final:
+            self.MakeStatic(xml, period_durations)
+        else:
+            # the local MPD keeps all the recorded segments
+            xml.attrib.pop('timeShiftBufferDepth', None)
+
+        if Options.encrypt:
+            AddContentProtection(xml)
+        output = io.BytesIO()
+        ElementTree.ElementTree(xml).write(output, encoding='UTF-8', xml_declaration=True)
+        WriteFileAtomically(self.mpd_filename, output.getvalue())
+
+    def MakeStatic(self, xml, period_durations):
+        xml.set('type', 'static')
+        for attribute in ['minimumUpdatePeriod', 'timeShiftBufferDepth', 'suggestedPresentationDelay',
+                          'availabilityStartTime', 'availabilityEndTime', 'publishTime']:
+            xml.attrib.pop(attribute, None)
+        for utc_timing in xml.findall(DASH_NS+'UTCTiming'):
+            xml.remove(utc_timing)
+
+        # keep the periods with recorded segments, one after the other
+        start = Fraction(0)
+        for (index, period) in enumerate(xml.findall(DASH_NS+'Period')):
+            duration = period_durations.get(period.get('id') or str(index))
+            if duration is None:
+                xml.remove(period)
+                continue
+            period.set('start', FormatDuration(start))
+            period.set('duration', FormatDuration(duration))
+            start += duration
+        xml.set('mediaPresentationDuration', FormatDuration(start))
+
+def main():
     # parse options
     parser = OptionParser(usage="%prog [options] <file-or-http-url> <output-dir>\n")
     parser.add_option('', '--quiet', dest="verbose",
@@ -391,10 +741,35 @@ def main():
                       help="Be quiet")
     parser.add_option('', "--encrypt", metavar='<KID:KEY>',
                       dest='encrypt', default=None,
-                      help="Encrypt the media, with KID and KEY specified in Hex (32 characters each)")
+                      help="Encrypt the media, with KID and KEY specified in Hex (32 characters each) (requires the 'cryptography' Python module)")
     parser.add_option('', "--exec-dir", metavar="<exec_dir>",
-                      dest="exec_dir", default=path.join(SCRIPT_PATH, 'bin', platform),
-                      help="Directory where the Bento4 executables are located")
+                      dest="exec_dir", default=None,
+                      help="Ignored, kept for compatibility (the media is encrypted in-process)")
+    parser.add_option('', "--parallel", metavar='<n>', type='int',
+                      dest='parallel', default=4,
+                      help="Number of segments to download concurrently (default: 4)")
+    parser.add_option('', "--retries", metavar='<n>', type='int',
+                      dest='retries', default=3,
+                      help="Number of times a failed download is retried, with exponential backoff (default: 3)")
+    parser.add_option('', "--max-in-flight", metavar='<megabytes>', type='int',
+                      dest='max_in_flight', default=64,
+                      help="Maximum amount of downloaded data held in memory at any time (default: 64)")
+    parser.add_option('', "--resume", action='store_true',
+                      dest='resume', default=False,
+                      help="Resume an interrupted clone in the same output directory: segments that are already complete and intact (according to the clone journal) are not downloaded again")
+    parser.add_option('', "--revalidate", action='store_true',
+                      dest='revalidate', default=False,
+                      help="With --resume, check that complete segments haven't changed on the server, with conditional (If-None-Match/If-Modified-Since) requests")
+
+    parser.add_option('', "--record", action='store_true',
+                      dest='record', default=False,
+                      help="Record a live (dynamic) MPD: new segments are cloned as they appear, until the MPD becomes static or the recording duration is reached, and the local MPD is then converted to a static MPD")
+    parser.add_option('', "--record-duration", metavar='<seconds>', type='float',
+                      dest='record_duration', default=None,
+                      help="With --record, stop recording after <seconds> (default: record until interrupted or until the MPD becomes static)")
+    parser.add_option('', "--poll-interval", metavar='<seconds>', type='float',
+                      dest='poll_interval', default=None,
+                      help="With --record, interval between MPD reloads (default: the MPD minimumUpdatePeriod)")
 
     global Options
     (Options, args) = parser.parse_args()
@@ -408,11 +783,15 @@ def main():
     if Options.encrypt:
         if len(Options.encrypt) != 65:
             raise Exception('Invalid argument for --encrypt option')
+        CheckEncryptionBackend()
         Options.kid = bytes.fromhex(Options.encrypt[:32])
         Options.key = bytes.fromhex(Options.encrypt[33:])
 
     # create the output dir
-    MakeNewDir(output_dir, True)
+    if Options.resume and path.exists(output_dir):
+        if Options.verbose: print("Resuming clone in", output_dir)
+    else:
+        MakeNewDir(output_dir, True)
 
     # load and parse the MPD
     if Options.verbose: print("Loading MPD from", mpd_url)
@@ -424,50 +803,28 @@ def main():
 
     if Options.verbose: print("Parsing MPD")
     mpd_xml = mpd_xml.replace('nitialisation', 'nitialization')
-    mpd = ParseMpd(mpd_url, mpd_xml)
+    mpd = ParseMpd(mpd_url, mpd_xml, allow_dynamic=Options.record)
 
     ElementTree.register_namespace('', DASH_NS_URN)
     ElementTree.register_namespace('mas', MARLIN_MAS_NS_URN)
 
-    cloner = Cloner(output_dir)
-    for period in mpd.periods:
-        for adaptation_set in period.adaptation_sets:
-            for representation in adaptation_set.representations:
-                # compute the base URL
-                base_url = representation.AttributeLookup('base_urls')[0]
-                if Options.verbose:
-                    print('Base URL = '+base_url)
-
-                # process the init segment
-                if Options.verbose:
-                    print('### Processing Initialization Segment')
-                url = ComputeUrl(base_url, representation.init_segment_url)
-                cloner.CloneSegment(url, representation.init_segment_url, True)
-
-                # process all segment URLs
-                if Options.verbose:
-                    print('### Processing Media Segments for AdaptationSet', representation.id)
-                for seg_url in representation.GenerateSegmentUrls():
-                    url = ComputeUrl(base_url, seg_url)
-                    try:
-                        cloner.CloneSegment(url, seg_url, False)
-                    except (urllib.error.HTTPError, urllib.error.URLError, IOError):
-                        # move to the next representation
-                        break
-
-                # cleanup the init segment
-                cloner.Cleanup()
+    journal = Journal(path.join(output_dir, JOURNAL_FILENAME), Options.resume)
+    fetcher = Fetcher(parallel=Options.parallel, retries=Options.retries,
+                      max_in_flight_bytes=Options.max_in_flight*1024*1024, verbose=Options.verbose,
+                      journal=journal, revalidate=Options.revalidate)
+    cloner = Cloner(output_dir, fetcher)
+    try:
+        if mpd.type == 'dynamic':
+            recorder = LiveRecorder(mpd_url, output_dir, fetcher, cloner, Options.poll_interval, Options.record_duration)
+            recorder.Record(mpd)
+            return
+        CloneRepresentations(mpd, cloner)
+    finally:
+        fetcher.Close()
 
     # modify the MPD if needed
     if Options.encrypt:
-        for p in mpd.xml.findall(DASH_NS+'Period'):
-            for s in p.findall(DASH_NS+'AdaptationSet'):
-                cp = ElementTree.Element(DASH_NS+'ContentProtection', schemeIdUri='urn:uuid:5E629AF5-38DA-4063-8977-97FFBD9902D4')
-                cp.tail = s.tail
-                cids = ElementTree.SubElement(cp, MARLIN_MAS_NS+'MarlinContentIds')
-                cid = ElementTree.SubElement(cids, MARLIN_MAS_NS+'MarlinContentId')
-                cid.text = 'urn:marlin:kid:'+Options.kid.encode('hex')
-                s.insert(0, cp)
+        AddContentProtection(mpd.xml)
 
     # write the MPD
     xml_tree = ElementTree.ElementTree(mpd.xml)
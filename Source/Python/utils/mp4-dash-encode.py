@@ -2,13 +2,16 @@
 
 from optparse import OptionParser
 from subprocess import check_output, CalledProcessError
-from pipes import quote
 import sys
 import os
 import os.path as path
 import json
 import math
-from mp4utils import MakeNewDir, PrintErrorAndExit
+import time
+import shlex
+import importlib
+from concurrent.futures import ThreadPoolExecutor
+from mp4utils import MakeNewDir, PrintErrorAndExit, FileCache
 
 # setup main options
 VERSION = "1.0.0"
@@ -20,6 +23,9 @@ TempFiles = []
 RESOLUTION_ROUNDING_H = 16
 RESOLUTION_ROUNDING_V = 2
 
+PROBE_CACHE_VERSION = 1
+GOP_PROBE_DURATION  = 60
+
 def scale_resolution(pixels, aspect_ratio):
     x = RESOLUTION_ROUNDING_H*((int(math.ceil(math.sqrt(pixels*aspect_ratio)))+RESOLUTION_ROUNDING_H-1) // RESOLUTION_ROUNDING_H)
     y = RESOLUTION_ROUNDING_V*((int(math.ceil(x/aspect_ratio))+RESOLUTION_ROUNDING_V-1) // RESOLUTION_ROUNDING_V)
@@ -45,34 +51,78 @@ def compute_bitrates_and_resolutions(options):
 
     return (bitrates, resolutions)
 
+def format_command(cmd):
+    return ' '.join([shlex.quote(arg) for arg in cmd])
+
 def run_command(options, cmd):
     if options.debug:
-        print('COMMAND: ', cmd)
+        print('COMMAND: ', format_command(cmd))
     try:
-        return check_output(cmd, shell=True)
+        return check_output(cmd)
     except CalledProcessError as e:
         message = "binary tool failed with error %d" % e.returncode
         if options.verbose:
-            message += " - " + str(cmd)
+            message += " - " + format_command(cmd)
         raise Exception(message)
+    except OSError as e:
+        raise Exception('unable to run %s: %s' % (cmd[0], e))
+
+def get_default_probe_cache_dir():
+    cache_home = os.environ.get('XDG_CACHE_HOME') or path.join(path.expanduser('~'), '.cache')
+    return path.join(cache_home, 'bento4', 'probe')
+
+class ProbeCache:
+    """
+    ffprobe results, keyed by the identity of the probed file, so that a file
+    is only probed again when it changes.
+    """
+    def __init__(self, cache_dir):
+        self.files = FileCache(cache_dir, 'json')
+
+    def load(self, filename):
+        try:
+            entry = json.loads(self.files.load(filename) or b'{}')
+        except ValueError:
+            return {}
+        if entry.get('version') != PROBE_CACHE_VERSION:
+            return {}
+        return entry
+
+    def store(self, filename, entry):
+        entry['version'] = PROBE_CACHE_VERSION
+        self.files.store(filename, json.dumps(entry).encode('utf-8'))
 
 class MediaSource:
-    def __init__(self, options, filename):
+    def __init__(self, options, filename, cache=None):
+        self.options = options
+        self.filename = filename
+        self.cache = cache
         self.width = 0
         self.height = 0
         self.frame_rate = 0
+        self.video_stream = None
+        self.gop = None
 
-        if not options.debug:
-            quiet = '-v quiet '
+        entry = cache.load(filename) if cache else {}
+        if 'probe' in entry:
+            self.probe = entry['probe']
+            self.gop = entry.get('gop')
         else:
-            quiet = ''
-
-        command = 'ffprobe -of json -loglevel quiet -show_format -show_streams ' + quiet + quote(filename)
-        json_probe = run_command(options, command)
-        self.json_info = json.loads(json_probe, strict=False)
+            command = ['ffprobe', '-of', 'json', '-loglevel', 'quiet', '-show_format', '-show_streams']
+            if not options.debug:
+                command += ['-v', 'quiet']
+            json_probe = run_command(options, command+[filename])
+            self.probe = json.loads(json_probe, strict=False)
+            if cache:
+                cache.store(filename, {'probe': self.probe})
+        self.json_info = self.probe
 
-        for stream in self.json_info['streams']:
+        self.format = self.probe.get('format', {})
+        self.streams = self.probe.get('streams', [])
+        self.duration = float(self.format.get('duration', 0))
+        for stream in self.streams:
             if stream['codec_type'] == 'video':
+                self.video_stream = stream
                 self.width = stream['width']
                 self.height = stream['height']
                 frame_rate = stream['avg_frame_rate']
@@ -88,9 +138,276 @@ class MediaSource:
                     self.frame_rate = float(frame_rate)
                 break
 
+    def get_stream_duration(self, stream):
+        if 'duration' in stream:
+            return float(stream['duration'])
+        return self.duration
+
+    def get_gop_info(self):
+        # keyframe structure of the first GOP_PROBE_DURATION seconds of the video,
+        # probed from the packet flags (no decoding) the first time it is needed
+        if self.gop is not None or self.video_stream is None:
+            return self.gop
+        command = ['ffprobe', '-of', 'json', '-loglevel', 'quiet', '-select_streams', 'v:0',
+                   '-read_intervals', '%%+%d' % GOP_PROBE_DURATION, '-show_entries', 'packet=pts_time,flags', self.filename]
+        packets = json.loads(run_command(self.options, command), strict=False).get('packets', [])
+        keyframe_times = []
+        gop_sizes = []
+        for packet in packets:
+            if 'K' in packet.get('flags', ''):
+                keyframe_times.append(float(packet['pts_time']) if packet.get('pts_time', 'N/A') != 'N/A' else None)
+                gop_sizes.append(0)
+            if gop_sizes:
+                gop_sizes[-1] += 1
+        self.gop = {
+            'probed_duration': GOP_PROBE_DURATION,
+            'keyframe_times':  keyframe_times,
+            'gop_sizes':       gop_sizes
+        }
+        if gop_sizes:
+            self.gop['min_gop_size'] = min(gop_sizes)
+            self.gop['max_gop_size'] = max(gop_sizes)
+            self.gop['average_gop_size'] = float(sum(gop_sizes))/len(gop_sizes)
+        if self.cache:
+            self.cache.store(self.filename, {'probe': self.probe, 'gop': self.gop})
+        return self.gop
+
     def __repr__(self):
         return 'Video: resolution='+str(self.width)+'x'+str(self.height)
 
+def compute_concurrency(options, rung_count):
+    # returns (number of concurrent rungs, encoder threads per rung)
+    cpu_count = os.cpu_count() or 1
+    if options.encoder_threads:
+        jobs = max(1, cpu_count // options.encoder_threads)
+        threads = options.encoder_threads
+    else:
+        jobs = cpu_count
+        threads = 0
+    if options.jobs:
+        jobs = options.jobs
+    jobs = max(1, min(jobs, rung_count))
+    if not threads:
+        # share the cores between the rungs that run concurrently
+        threads = max(1, cpu_count // jobs)
+    return (jobs, threads)
+
+def build_output_options(options, bitrate, threads):
+    # audio and video encoder options for one bitrate
+    output_opts = ['-strict', 'experimental', '-codec:a', options.audio_codec, '-ac', '2', '-ab', '%dk' % options.audio_bitrate,
+                   '-preset', 'slow', '-map_metadata', '-1', '-codec:v', options.video_codec]
+    if options.video_codec == 'libx264':
+        output_opts += ['-profile:v', 'baseline']
+    if options.package:
+        # fragmented output, ready for the packager
+        output_opts += ['-movflags', 'frag_keyframe+empty_moov']
+
+    #x264_opts = "-x264opts keyint=%d:min-keyint=%d:scenecut=0:rc-lookahead=%d" % (options.segment_size, options.segment_size, options.segment_size)
+    #video_opts = "-g %d" % (options.segment_size)
+    video_opts = ['-force_key_frames', 'expr:eq(mod(n,%d),0)' % (options.segment_size)]
+    video_opts += ['-bufsize', '%dk' % bitrate, '-maxrate', '%dk' % int(bitrate*1.5)]
+    if options.video_codec == 'libx264':
+        x264_opts = 'rc-lookahead=%d' % (options.segment_size)
+        if options.package:
+            # only the forced keyframes start fragments, so they stay aligned across bitrates
+            x264_opts += ':scenecut=0'
+        video_opts += ['-x264opts', x264_opts]
+    elif options.video_codec == 'libx265':
+        video_opts += ['-x265-params', 'no-open-gop=1:keyint=%d:no-scenecut=1:profile=main' % (options.segment_size)]
+    if threads:
+        video_opts += ['-threads', str(threads)]
+    if options.encoder_params:
+        video_opts += shlex.split(options.encoder_params)
+    return output_opts+video_opts
+
+def build_global_options(options):
+    global_opts = []
+    if not options.debug:
+        global_opts += ['-v', 'quiet']
+    if options.force_output:
+        global_opts.append('-y')
+    return global_opts
+
+def build_text_overlay_filter(options, bitrate, resolution):
+    return 'drawtext=fontfile='+options.text_overlay_font+': text='+str(int(bitrate))+'kbps '+str(resolution[0])+'*'+str(resolution[1])+': fontsize=50:  x=(w)/8: y=h-(2*lh): fontcolor=white:'
+
+def build_encode_command(options, source_filename, bitrate, resolution, threads, output_filename):
+    cmd = ['ffmpeg', '-i', source_filename] + build_output_options(options, bitrate, threads)
+    if options.text_overlay:
+        cmd += ['-vf', build_text_overlay_filter(options, bitrate, resolution)]
+    if options.select_streams:
+        specifiers = options.select_streams.split(',')
+        for specifier in specifiers:
+            cmd += ['-map', '0:'+specifier]
+    else:
+        cmd += ['-map', '0']
+    cmd += build_global_options(options)
+    return cmd+['-s', str(resolution[0])+'x'+str(resolution[1]), '-f', 'mp4', output_filename]
+
+def build_single_decode_command(options, source_filename, bitrates, resolutions, threads, output_filenames):
+    # one decode of the source video, split and scaled for each bitrate
+    graph = '[0:v:0]split=%d%s' % (len(bitrates), ''.join(['[v%d]' % i for i in range(len(bitrates))]))
+    for i in range(len(bitrates)):
+        graph += ';[v%d]scale=%d:%d' % (i, resolutions[i][0], resolutions[i][1])
+        if options.text_overlay:
+            graph += ','+build_text_overlay_filter(options, bitrates[i], resolutions[i])
+        graph += '[o%d]' % i
+
+    cmd = ['ffmpeg', '-i', source_filename] + build_global_options(options) + ['-filter_complex', graph]
+    for i in range(len(bitrates)):
+        cmd += ['-map', '[o%d]' % i, '-map', '0:a?']
+        cmd += build_output_options(options, bitrates[i], threads)
+        cmd += ['-f', 'mp4', output_filenames[i]]
+    return cmd
+
+def get_rung_filenames(options, bitrate):
+    # (encoder output, final fragmented output)
+    output_filename = path.join(options.output_dir, 'video_%05d.mp4' % int(bitrate))
+    if options.package:
+        # the encoder writes the fragmented output directly
+        return (output_filename, output_filename)
+    return (output_filename+'_', output_filename)
+
+def fragment_rung(options, temp_filename, output_filename):
+    if temp_filename == output_filename:
+        return 0.0
+    start = time.time()
+    run_command(options, ['mp4fragment', temp_filename, output_filename])
+    if not options.keep_files:
+        os.unlink(temp_filename)
+    TempFiles.remove(temp_filename)
+    return time.time()-start
+
+def encode_rung(options, source_filename, bitrate, resolution, threads):
+    # encode one rung of the ladder, then fragment it right away
+    (temp_filename, output_filename) = get_rung_filenames(options, bitrate)
+    timing = {
+        'bitrate':    int(bitrate),
+        'resolution': '%dx%d' % (resolution[0], resolution[1]),
+        'output':     output_filename,
+        'threads':    threads
+    }
+    start = time.time()
+    timing['start'] = start
+
+    if options.verbose:
+        print('ENCODING bitrate: %d, resolution: %dx%d' % (int(bitrate), resolution[0], resolution[1]))
+    if temp_filename != output_filename:
+        TempFiles.append(temp_filename)
+    run_command(options, build_encode_command(options, source_filename, bitrate, resolution, threads, temp_filename))
+    timing['encode_time'] = time.time()-start
+
+    timing['fragment_time'] = fragment_rung(options, temp_filename, output_filename)
+    timing['total_time'] = time.time()-start
+
+    if options.verbose:
+        print('DONE bitrate: %d in %.1fs (encode %.1fs, fragment %.1fs)' % (int(bitrate), timing['total_time'], timing['encode_time'], timing['fragment_time']))
+    return timing
+
+def package_ladder(options, report):
+    # run the packager in-process on the fragmented outputs
+    output_filenames = [timing['output'] for timing in sorted(report['rungs'], key=lambda timing: timing['bitrate'])]
+    args = ['--output-dir', options.package_dir or path.join(options.output_dir, 'output'), '--exec-dir', '-']
+    if options.force_output:
+        args.append('--force')
+    if options.verbose:
+        args.append('--verbose')
+    if options.debug:
+        args.append('--debug')
+    if options.hls:
+        args.append('--hls')
+    if options.packager_params:
+        args += shlex.split(options.packager_params)
+
+    if options.verbose:
+        print('PACKAGING', len(output_filenames), 'bitrate(s)')
+    start = time.time()
+    mp4dash = importlib.import_module('mp4-dash')
+    try:
+        mp4dash.main(args+output_filenames)
+    finally:
+        for f in mp4dash.TempFiles:
+            if path.exists(f):
+                os.unlink(f)
+        del mp4dash.TempFiles[:]
+    report['package_time'] = time.time()-start
+
+def write_timing_report(options, report, start):
+    report['wall_time'] = time.time()-start
+    report['rungs'].sort(key=lambda timing: timing['bitrate'])
+    for timing in report['rungs']:
+        timing['start'] -= start
+    report_filename = options.timing_report or path.join(options.output_dir, 'encode-timing.json')
+    with open(report_filename, 'w') as report_file:
+        json.dump(report, report_file, indent=4)
+
+def encode_ladder_single_decode(options, source_filename, bitrates, resolutions):
+    # all the encoders run in the same ffmpeg process
+    (jobs, _) = compute_concurrency(options, len(bitrates))
+    threads = options.encoder_threads or max(1, (os.cpu_count() or 1) // len(bitrates))
+    if options.verbose:
+        print('Encoding %d rung(s) from a single decode, %d encoder thread(s) each' % (len(bitrates), threads))
+
+    start = time.time()
+    filenames = [get_rung_filenames(options, bitrate) for bitrate in bitrates]
+    temp_filenames = [temp_filename for (temp_filename, _) in filenames]
+    TempFiles.extend([temp_filename for (temp_filename, output_filename) in filenames if temp_filename != output_filename])
+    run_command(options, build_single_decode_command(options, source_filename, bitrates, resolutions, threads, temp_filenames))
+    encode_time = time.time()-start
+
+    # fragment all the rungs concurrently
+    timings = []
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        futures = [executor.submit(fragment_rung, options, temp_filename, output_filename) for (temp_filename, output_filename) in filenames]
+        for i in range(len(bitrates)):
+            fragment_time = futures[i].result()
+            timings.append({
+                'bitrate':       int(bitrates[i]),
+                'resolution':    '%dx%d' % (resolutions[i][0], resolutions[i][1]),
+                'output':        filenames[i][1],
+                'threads':       threads,
+                'start':         start,
+                'encode_time':   encode_time,
+                'fragment_time': fragment_time,
+                'total_time':    encode_time+fragment_time
+            })
+
+    report = {'mode': 'single-decode', 'jobs': jobs, 'threads': threads, 'rungs': timings}
+    if options.package:
+        package_ladder(options, report)
+    write_timing_report(options, report, start)
+
+def encode_ladder(options, source_filename, bitrates, resolutions):
+    (jobs, threads) = compute_concurrency(options, len(bitrates))
+    if options.verbose:
+        print('Encoding %d rung(s), %d at a time, %d encoder thread(s) each' % (len(bitrates), jobs, threads))
+
+    start = time.time()
+    timings = []
+    errors = []
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        # the highest bitrates are the slowest, start them first
+        order = sorted(range(len(bitrates)), key=lambda i: -bitrates[i])
+        futures = [(i, executor.submit(encode_rung, options, source_filename, bitrates[i], resolutions[i], threads)) for i in order]
+        for (i, future) in futures:
+            if future.cancelled():
+                continue
+            try:
+                timings.append(future.result())
+            except Exception as e:
+                # don't start the rungs that are still pending
+                for (_, other) in futures:
+                    other.cancel()
+                errors.append('bitrate %d: %s' % (int(bitrates[i]), e))
+
+    report = {'mode': 'parallel', 'jobs': jobs, 'threads': threads, 'rungs': timings}
+    if options.package and not errors:
+        package_ladder(options, report)
+    write_timing_report(options, report, start)
+
+    if errors:
+        raise Exception('encoding failed for ' + ', '.join(errors))
+
 def main():
     # parse options
     global Options
@@ -130,6 +447,26 @@ def main():
                       help="Extra encoder parameters")
     parser.add_option('-f', '--force', dest="force_output", action="store_true",
                       help="Overwrite output files if they already exist", default=False)
+    parser.add_option('-j', '--jobs', dest='jobs', type='int', default=0,
+                      help="Number of bitrates to encode concurrently (default: auto, based on the number of CPUs and --encoder-threads)")
+    parser.add_option('', '--encoder-threads', dest='encoder_threads', type='int', default=0,
+                      help="Number of threads used by each encoder (default: the CPUs are shared between the concurrent encoders)")
+    parser.add_option('', '--single-decode', dest='single_decode', action='store_true', default=False,
+                      help="Decode the source only once, and encode all the bitrates from a single ffmpeg split/scale filter graph")
+    parser.add_option('', '--package', dest='package', action='store_true', default=False,
+                      help="Package the encoded bitrates with mp4-dash in the same run (the encoder writes fragmented MP4 directly, without intermediate files)")
+    parser.add_option('', '--package-dir', dest='package_dir', metavar='<package-dir>',
+                      help="Output directory for the packaged presentation (default: 'output' in the output directory)")
+    parser.add_option('', '--hls', dest='hls', action='store_true', default=False,
+                      help="When packaging, also output HLS playlists")
+    parser.add_option('', '--packager-params', dest='packager_params',
+                      help="Extra mp4-dash parameters, used when packaging")
+    parser.add_option('', '--probe-cache', dest='probe_cache', metavar='<cache-dir>',
+                      help="Directory where the source probe results are cached (default: "+get_default_probe_cache_dir()+")")
+    parser.add_option('', '--no-probe-cache', dest='no_probe_cache', action='store_true', default=False,
+                      help="Always probe the source, without using the probe cache")
+    parser.add_option('', '--timing-report', dest='timing_report', metavar='<filename>',
+                      help="Write the per-bitrate timing report to <filename> (default: encode-timing.json in the output directory)")
     (options, args) = parser.parse_args()
     Options = options
     if len(args) == 0:
@@ -144,13 +481,22 @@ def main():
     if options.min_bitrate > options.max_bitrate:
         raise Exception('ERROR: max bitrate must be >= min bitrate')
 
+    if (options.hls or options.packager_params or options.package_dir) and not options.package:
+        raise Exception('ERROR: --hls, --packager-params and --package-dir require --package')
+
+    if options.single_decode and options.select_streams:
+        raise Exception('ERROR: --select-streams cannot be used with --single-decode')
+
     if options.output_dir:
         MakeNewDir(dir=options.output_dir, exit_if_exists = not (options.force_output), severity='ERROR')
 
     if options.verbose:
         print('Encoding', options.bitrates, 'bitrates, min bitrate =', options.min_bitrate, 'max bitrate =', options.max_bitrate)
 
-    media_source = MediaSource(options, args[0])
+    probe_cache = None
+    if not options.no_probe_cache:
+        probe_cache = ProbeCache(options.probe_cache or get_default_probe_cache_dir())
+    media_source = MediaSource(options, args[0], probe_cache)
     if not options.resolution:
         options.resolution = [media_source.width, media_source.height]
     if options.verbose:
@@ -164,53 +510,20 @@ def main():
 
     (bitrates, resolutions) = compute_bitrates_and_resolutions(options)
 
-    for i in range(options.bitrates):
-        output_filename = path.join(options.output_dir, 'video_%05d.mp4' % int(bitrates[i]))
-        temp_filename = output_filename+'_'
-        base_cmd  = 'ffmpeg -i %s -strict experimental -codec:a %s -ac 2 -ab %dk -preset slow -map_metadata -1 -codec:v %s' % (quote(args[0]), options.audio_codec, options.audio_bitrate, options.video_codec)
-        if options.video_codec == 'libx264':
-            base_cmd += ' -profile:v baseline'
-        if options.text_overlay:
-            if not options.text_overlay_font:
-                font_file = "/Library/Fonts/Courier New.ttf"
-                if path.exists(font_file):
-                    options.text_overlay_font = font_file
-                else:
-                    raise Exception('ERROR: no default font file, please use the --text-overlay-font option')
-            if not path.exists(options.text_overlay_font):
-                raise Exception('ERROR: font file "'+options.text_overlay_font+'" does not exist')
-            base_cmd += ' -vf "drawtext=fontfile='+options.text_overlay_font+': text='+str(int(bitrates[i]))+'kbps '+str(resolutions[i][0])+'*'+str(resolutions[i][1])+': fontsize=50:  x=(w)/8: y=h-(2*lh): fontcolor=white:"'
-        if options.select_streams:
-            specifiers = options.select_streams.split(',')
-            for specifier in specifiers:
-                base_cmd += ' -map 0:'+specifier
-        else:
-            base_cmd += ' -map 0'
-        if not options.debug:
-            base_cmd += ' -v quiet'
-        if options.force_output:
-            base_cmd += ' -y'
-
-        #x264_opts = "-x264opts keyint=%d:min-keyint=%d:scenecut=0:rc-lookahead=%d" % (options.segment_size, options.segment_size, options.segment_size)
-        #video_opts = "-g %d" % (options.segment_size)
-        video_opts = "-force_key_frames 'expr:eq(mod(n,%d),0)'" % (options.segment_size)
-        video_opts += " -bufsize %dk -maxrate %dk" % (bitrates[i], int(bitrates[i]*1.5))
-        if options.video_codec == 'libx264':
-            video_opts += " -x264opts rc-lookahead=%d" % (options.segment_size)
-        elif options.video_codec == 'libx265':
-            video_opts += ' -x265-params "no-open-gop=1:keyint=%d:no-scenecut=1:profile=main"' % (options.segment_size)
-        if options.encoder_params:
-            video_opts += ' ' + options.encoder_params
-        cmd = base_cmd+' '+video_opts+' -s '+str(resolutions[i][0])+'x'+str(resolutions[i][1])+' -f mp4 '+temp_filename
-        if options.verbose:
-            print('ENCODING bitrate: %d, resolution: %dx%d' % (int(bitrates[i]), resolutions[i][0], resolutions[i][1]))
-        run_command(options, cmd)
-
-        cmd = 'mp4fragment "%s" "%s"' % (temp_filename, output_filename)
-        run_command(options, cmd)
+    if options.text_overlay:
+        if not options.text_overlay_font:
+            font_file = "/Library/Fonts/Courier New.ttf"
+            if path.exists(font_file):
+                options.text_overlay_font = font_file
+            else:
+                raise Exception('ERROR: no default font file, please use the --text-overlay-font option')
+        if not path.exists(options.text_overlay_font):
+            raise Exception('ERROR: font file "'+options.text_overlay_font+'" does not exist')
 
-        if not options.keep_files:
-            os.unlink(temp_filename)
+    if options.single_decode:
+        encode_ladder_single_decode(options, args[0], bitrates, resolutions)
+    else:
+        encode_ladder(options, args[0], bitrates, resolutions)
 
 ###########################
 if __name__ == '__main__':
@@ -224,4 +537,5 @@ if __name__ == '__main__':
             PrintErrorAndExit('ERROR: %s\n' % str(err))
     finally:
         for f in TempFiles:
-            os.unlink(f)
+            if path.exists(f):
+                os.unlink(f)
@@ -29,7 +29,10 @@ import math
 import operator
 import struct
 from functools import reduce
-from subtitles import SubtitlesFile
+from subtitles import SubtitlesFile, WebvttSegmenter
+from mp4index import WriteTrackSegmentIndex
+from sinkutils import MakeOutputSink, ListFiles, S3_MIN_PART_SIZE
+from jobutils import JobManifest, GetFileIdentity, MakeFingerprint, ListFilesModifiedSince
 from mp4utils import (
     MakePsshBox,
     MakePsshBoxV1,
@@ -75,6 +78,7 @@ MPD_NS                      = 'urn:mpeg:dash:schema:mpd:2011'
 SPLIT_INIT_SEGMENT_NAME     = 'init.mp4'
 NOSPLIT_INIT_FILE_PATTERN   = 'init-%s.mp4'
 ONDEMAND_MEDIA_FILE_PATTERN = '%s-%s.mp4'
+SEGMENT_INDEX_FILE_PATTERN  = 'index-%s.idx'
 
 PADDED_SEGMENT_PATTERN      = 'seg-%05llu.m4s'
 PADDED_SEGMENT_URL_PATTERN  = 'seg-%05d.m4s'
@@ -88,6 +92,9 @@ SEGMENT_URL_TEMPLATE        = NOPAD_SEGMENT_URL_TEMPLATE
 
 MEDIA_FILE_PATTERN          = '%s-%02d.mp4'
 
+WEBVTT_SEGMENT_PATTERN      = 'seg-%d.vtt'
+WEBVTT_SEGMENT_URL_TEMPLATE = 'seg-$Number$.vtt'
+
 MARLIN_SCHEME_ID_URI        = 'urn:uuid:5E629AF5-38DA-4063-8977-97FFBD9902D4'
 MARLIN_MAS_NAMESPACE        = 'urn:marlin:mas:1-0:services:schemas:mpd'
 MARLIN_PSSH_SYSTEM_ID       = '69f908af481646ea910ccd5dcccb0a3a'
@@ -194,6 +201,23 @@ def AddSegmentList(options, container, subdir, track, use_byte_range=False):
         i += 1
 
 
+#############################################
+def AddSegmentTimeline(segment_template, segment_scaled_durations):
+    segment_timeline = xml.SubElement(segment_template, 'SegmentTimeline')
+    repeat_count = 0
+    for i in range(len(segment_scaled_durations)):
+        duration = segment_scaled_durations[i]
+        if i + 1 < len(segment_scaled_durations) and duration == segment_scaled_durations[i + 1]:
+            repeat_count += 1
+        else:
+            args = [segment_timeline, 'S']
+            kwargs = {'d': str(duration)}
+            if repeat_count:
+                kwargs['r'] = str(repeat_count)
+
+            xml.SubElement(*args, **kwargs)
+            repeat_count = 0
+
 #############################################
 def AddSegmentTemplate(options, container, init_segment_url, media_url_template_prefix, track, stream_name):
     if options.use_segment_list:
@@ -214,20 +238,7 @@ def AddSegmentTemplate(options, container, init_segment_url, media_url_template_
                   'startNumber': '1'} # (keep the @startNumber, even if not needed, because some clients like Silverlight want it)
 
         segment_template = xml.SubElement(*args, **kwargs)
-        segment_timeline = xml.SubElement(segment_template, 'SegmentTimeline')
-        repeat_count = 0
-        for i in range(len(track.segment_scaled_durations)):
-            duration = track.segment_scaled_durations[i]
-            if i + 1 < len(track.segment_scaled_durations) and duration == track.segment_scaled_durations[i + 1]:
-                repeat_count += 1
-            else:
-                args = [segment_timeline, 'S']
-                kwargs = {'d': str(duration)}
-                if repeat_count:
-                    kwargs['r'] = str(repeat_count)
-
-                xml.SubElement(*args, **kwargs)
-                repeat_count = 0
+        AddSegmentTimeline(segment_template, track.segment_scaled_durations)
     else:
         xml.SubElement(container,
                        'SegmentTemplate',
@@ -638,8 +649,17 @@ def OutputDash(options, set_attributes, audio_sets, video_sets, subtitles_sets,
                                             'Representation',
                                             id='subtitles/'+subtitles_file.language,
                                             bandwidth=str(bandwidth))
-            base_url = xml.SubElement(representation, 'BaseURL')
-            base_url.text = 'subtitles/'+subtitles_file.language+'/'+subtitles_file.media_name
+            if subtitles_file.segment_track:
+                # segments aligned with the timeline of the reference track
+                segment_template = xml.SubElement(representation,
+                                                  'SegmentTemplate',
+                                                  timescale=str(subtitles_file.segment_track.timescale),
+                                                  media='subtitles/'+subtitles_file.language+'/'+WEBVTT_SEGMENT_URL_TEMPLATE,
+                                                  startNumber='1')
+                AddSegmentTimeline(segment_template, subtitles_file.segment_track.segment_scaled_durations)
+            else:
+                base_url = xml.SubElement(representation, 'BaseURL')
+                base_url.text = 'subtitles/'+subtitles_file.language+'/'+subtitles_file.media_name
 
     # save the MPD
     if options.mpd_filename:
@@ -743,8 +763,9 @@ def OutputHlsTrack(options, track, all_tracks, media_subdir, media_playlist_name
     media_playlist_file.write('#EXT-X-ENDLIST\n')
 
 #############################################
-def OutputHlsWebvttPlaylist(options, media_subdir, media_playlist_name, media_file_name, total_duration):
-    # output a playlist with a single segment that covers the entire WebVTT file
+def OutputHlsWebvttPlaylist(options, media_subdir, media_playlist_name, media_file_name, total_duration, segment_durations=None):
+    # output a playlist with a single segment that covers the entire WebVTT file,
+    # or with one entry per segment if the file has been split
     output_dir = path.join(options.output_dir, media_subdir)
     os.makedirs(output_dir, exist_ok = True)
     playlist_file = open(path.join(output_dir, media_playlist_name), 'w', newline='\r\n')
@@ -754,10 +775,18 @@ def OutputHlsWebvttPlaylist(options, media_subdir, media_playlist_name, media_fi
     playlist_file.write('#EXT-X-VERSION:6\n')
     playlist_file.write('#EXT-X-INDEPENDENT-SEGMENTS\n')
     playlist_file.write('#EXT-X-PLAYLIST-TYPE:VOD\n')
-    playlist_file.write('#EXT-X-TARGETDURATION:{}\n'.format(total_duration))
-    playlist_file.write('#EXTINF:{},\n'.format(total_duration))
-    playlist_file.write(media_file_name)
-    playlist_file.write('\n')
+    if segment_durations:
+        playlist_file.write('#EXT-X-TARGETDURATION:{}\n'.format(int(math.ceil(max(segment_durations)))))
+        playlist_file.write('#EXT-X-MEDIA-SEQUENCE:0\n')
+        for i in range(len(segment_durations)):
+            playlist_file.write('#EXTINF:{:f},\n'.format(segment_durations[i]))
+            playlist_file.write(WEBVTT_SEGMENT_PATTERN % (i+1))
+            playlist_file.write('\n')
+    else:
+        playlist_file.write('#EXT-X-TARGETDURATION:{}\n'.format(total_duration))
+        playlist_file.write('#EXTINF:{},\n'.format(total_duration))
+        playlist_file.write(media_file_name)
+        playlist_file.write('\n')
     playlist_file.write('#EXT-X-ENDLIST\n')
 
 #############################################
@@ -1037,17 +1066,18 @@ def OutputHls(options, set_attributes, audio_sets, video_sets, subtitles_sets, s
         for subtitles_file in subtitles_files:
             media_subdir = 'subtitles/{}'.format(subtitles_file.language)
             media_playlist_name = options.hls_media_playlist_name
-            default = audio_track.hls_default and not default_selected
+            default = subtitles_file.hls_default and not default_selected
             if default:
                 default_selected = True
             master_playlist_file.write('#EXT-X-MEDIA:TYPE=SUBTITLES,GROUP-ID="subtitles",NAME="{}",AUTOSELECT={},DEFAULT={},LANGUAGE="{}",URI="{}/{}"\n'.format(
-                                       language_name,
+                                       subtitles_file.language_name,
                                        'YES' if subtitles_file.hls_autoselect else 'NO',
                                        'YES' if default else 'NO',
                                        subtitles_file.language,
                                        media_subdir,
                                        media_playlist_name))
-            OutputHlsWebvttPlaylist(options, media_subdir, media_playlist_name, subtitles_file.media_name, presentation_duration)
+            segment_durations = subtitles_file.segment_track.segment_durations if subtitles_file.segment_track else None
+            OutputHlsWebvttPlaylist(options, media_subdir, media_playlist_name, subtitles_file.media_name, presentation_duration, segment_durations)
 
 #############################################
 def OutputSmooth(options, audio_tracks, video_tracks):
@@ -1203,6 +1233,12 @@ def OutputSmooth(options, audio_tracks, video_tracks):
                            name='timeScale',
                            value=str(audio_track.timescale),
                            valueType='data')
+        if options.segment_index:
+            xml.SubElement(audio_entry,
+                           'param',
+                           name='segmentIndex',
+                           value=audio_track.segment_index_name,
+                           valueType='data')
 
     for video_track in video_tracks:
         video_entry = xml.SubElement(server_manifest_switch,
@@ -1220,6 +1256,12 @@ def OutputSmooth(options, audio_tracks, video_tracks):
                            name='timeScale',
                            value=str(video_track.timescale),
                            valueType='data')
+        if options.segment_index:
+            xml.SubElement(video_entry,
+                           'param',
+                           name='segmentIndex',
+                           value=video_track.segment_index_name,
+                           valueType='data')
 
     # save the Manifest
     if options.smooth_server_manifest_filename != '':
@@ -1246,6 +1288,10 @@ def OutputHippo(options, audio_tracks, video_tracks):
         server_manifest += '        ],\n'
         server_manifest += '        "file": "' + track.parent.media_name + '"\n'
         server_manifest += '      },\n'
+        if options.segment_index:
+            server_manifest += '      "segmentIndex": {\n'
+            server_manifest += '        "file": "' + track.segment_index_name + '"\n'
+            server_manifest += '      },\n'
         server_manifest += '      "initSegment": {\n'
         server_manifest += '        "file": "' + track.init_segment_name + '"\n'
         server_manifest += '      }\n'
@@ -1257,6 +1303,20 @@ def OutputHippo(options, audio_tracks, video_tracks):
     if options.hippo_server_manifest_filename != '':
         open(path.join(options.output_dir, options.hippo_server_manifest_filename), 'w').write(server_manifest)
 
+#############################################
+def OutputSegmentIndexes(options, tracks):
+    for track in tracks:
+        index_filename = path.join(options.output_dir, track.segment_index_name)
+        task = MakeMediaTask(options, 'index:'+track.segment_index_name, track.parent.media_source.filename, track.id)
+        if not task:
+            continue
+        if options.verbose:
+            print('Writing segment index', track.segment_index_name)
+        ReleaseFiles(options, index_filename)
+        WriteTrackSegmentIndex(index_filename, track)
+        PublishFiles(options, index_filename)
+        RecordMediaTask(options, task, [index_filename])
+
 #############################################
 def SelectTracks(options, media_sources):
     # parse the media files
@@ -1488,6 +1548,7 @@ def KeySpecToKeyInfo(options, key_spec):
     key_info['key'] = key_hex
     key_info['kid'] = kid_hex
     key_info['iv']  = iv_hex or 'random'
+    key_info['random_iv'] = not iv_hex
     if options.hls and not iv_hex:
         # for HLS, we need to know the IV
         import random
@@ -1548,7 +1609,7 @@ def EncryptSources(options, media_sources):
 
         # check if we have already encrypted this file
         if media_file in encrypted_files:
-            media_source.filename = encrypted_files[media_file].name
+            media_source.filename = encrypted_files[media_file]
             continue
 
         if not media_source.mp4_info['movie']['fragments']:
@@ -1568,12 +1629,26 @@ def EncryptSources(options, media_sources):
         # pick a default key
         default_kid = options.key_infos[0]['kid']
 
+        # the IVs that are generated for HLS are not part of the fingerprint, they are
+        # recorded with the task instead, so that the HLS playlists match the encrypted file
+        fingerprint = MakeFingerprint('encrypt',
+                                      GetFileIdentity(media_file),
+                                      [(track_id, key_info['kid'], key_info['key'], 'random' if key_info['random_iv'] else key_info['iv'])
+                                       for (track_id, key_info) in sorted(media_source.key_infos.items())],
+                                      [(key_info['kid'], key_info['key']) for key_info in options.key_infos],
+                                      [options.encryption_cenc_scheme, options.encryption_args, options.smooth, options.playready,
+                                       options.eme_signaling, options.marlin_add_pssh, options.playready_add_pssh, options.playready_version,
+                                       options.playready_header, options.widevine_header, options.primetime_metadata])
+        encrypted_filename = MakePreparedFile(options, 'encrypt', fingerprint, 'Encrypted[' + GetMappedFileName(media_file) + ']')
+        encrypted_files[media_file] = encrypted_filename
+        media_source.filename = encrypted_filename
+        if options.job.IsDone('encrypt:'+fingerprint, fingerprint):
+            options.job.Keep('encrypt:'+fingerprint)
+            for (track_id, iv) in options.job.GetData('encrypt:'+fingerprint).items():
+                media_source.key_infos[int(track_id)]['iv'] = iv
+            continue
+
         print('Encrypting track IDs ' + str(sorted(media_source.key_infos.keys()) ) +' in ' + GetMappedFileName(media_file))
-        encrypted_file = tempfile.NamedTemporaryFile(dir=options.output_dir, delete=False)
-        encrypted_files[media_file] = encrypted_file
-        TempFiles.append(encrypted_file.name)
-        encrypted_file.close() # necessary on Windows
-        MapFileName(encrypted_file.name, path.basename(encrypted_file.name) + ' = Encrypted[' + GetMappedFileName(media_file) + ']')
         args = ['--method', MpegCencSchemeMap[options.encryption_cenc_scheme]]
 
         if options.encryption_args:
@@ -1644,8 +1719,22 @@ def EncryptSources(options, media_sources):
             pssh_file.close() # necessary on Windows
             args += ['--pssh', PRIMETIME_PSSH_SYSTEM_ID+':'+pssh_file.name]
 
-        Mp4Encrypt(options, media_file, encrypted_file.name, *args)
-        media_source.filename = encrypted_file.name
+        Mp4Encrypt(options, media_file, encrypted_filename, *args)
+        options.job.Record('encrypt:'+fingerprint, fingerprint, options.job_dir, [encrypted_filename],
+                           data=dict([(str(track_id), key_info['iv']) for (track_id, key_info) in media_source.key_infos.items() if key_info['random_iv']]))
+
+def MakePreparedFile(options, kind, fingerprint, description):
+    # the prepared (extracted or encrypted) versions of the sources are temporary files,
+    # unless they are kept in the job directory for later runs, named by their fingerprint
+    if options.job_dir:
+        filename = options.job.GetWorkFilename(kind+'-'+fingerprint+'.mp4')
+    else:
+        temp_file = tempfile.NamedTemporaryFile(dir=options.output_dir, delete=False)
+        TempFiles.append(temp_file.name)
+        temp_file.close() # necessary on Windows
+        filename = temp_file.name
+    MapFileName(filename, path.basename(filename) + ' = ' + description)
+    return filename
 
 #############################################
 def ComputeWidevinePssh(header_spec, encryption_scheme, kid):
@@ -1669,6 +1758,80 @@ def ComputeWidevinePssh(header_spec, encryption_scheme, kid):
     # Wrap the header in a PSSH box
     return MakePsshBox(bytes.fromhex(WIDEVINE_PSSH_SYSTEM_ID), header)
 
+#############################################
+def OutputSubtitlesFiles(options, subtitles_files):
+    if not subtitles_files:
+        return
+    MakeNewDir(path.join(options.output_dir, 'subtitles'))
+    for subtitles_file in subtitles_files:
+        out_dir = path.join(options.output_dir, 'subtitles', subtitles_file.language)
+        segment_durations = subtitles_file.segment_track.segment_durations if subtitles_file.segment_track else None
+        task = MakeMediaTask(options, 'subtitles:'+subtitles_file.language, subtitles_file.media_source.filename,
+                             subtitles_file.media_name, segment_durations)
+        if not task:
+            continue
+        print('Processing and Copying subtitles file', GetMappedFileName(subtitles_file.media_source.filename))
+        MakeNewDir(out_dir)
+        ReleaseFiles(options, out_dir)
+        if subtitles_file.segment_track:
+            segmenter = WebvttSegmenter(subtitles_file.media_source.filename, segment_durations)
+            filenames = [path.join(out_dir, name) for name in segmenter.segment(out_dir, WEBVTT_SEGMENT_PATTERN)]
+        else:
+            media_filename = path.join(out_dir, subtitles_file.media_name)
+            shutil.copyfile(subtitles_file.media_source.filename, media_filename)
+            filenames = [media_filename]
+        PublishFiles(options, out_dir)
+        RecordMediaTask(options, task, filenames)
+
+#############################################
+def PublishFiles(options, filename, keep=False):
+    # publish a file, or all the files of a directory, of the output directory
+    if path.isdir(filename):
+        filenames = [path.join(filename, name) for name in ListFiles(filename)]
+    else:
+        filenames = [filename]
+    for filename in filenames:
+        options.sink.PutFile(path.relpath(filename, options.output_dir).replace(os.sep, '/'), filename, keep)
+
+def MakeMediaTask(options, name, source_filename, *parameters):
+    # return the (name, fingerprint) of a task that produces media files from a source, or None
+    # if the task does not need to be done again, since neither its source nor its parameters changed
+    fingerprint = MakeFingerprint(GetFileIdentity(source_filename), parameters, options.dedup_store)
+    if options.job.IsDone(name, fingerprint):
+        if options.verbose:
+            print('Keeping the unchanged output of', name)
+        options.job.Keep(name)
+        return None
+    return (name, fingerprint)
+
+def RecordMediaTask(options, task, filenames):
+    # the digests of the published files are already known with a content-addressed store
+    (name, fingerprint) = task
+    options.job.Record(name, fingerprint, options.output_dir, filenames, digests=getattr(options.sink, 'digests', None))
+
+def ReleaseFiles(options, filename):
+    # with a content-addressed store, the files of a previous output may be links to
+    # blobs of the store, that writing them in place would modify: remove them first
+    if not options.dedup_store or not path.exists(filename):
+        return
+    if path.isdir(filename):
+        for name in ListFiles(filename):
+            os.unlink(path.join(filename, name))
+    else:
+        os.unlink(filename)
+
+def PublishOutput(options):
+    # the media files are published as soon as they are produced: once they are all
+    # stored, publish the manifests (and any other file that is not published yet)
+    options.sink.Flush()
+    if options.sink.staging_dir:
+        temp_files = set([path.realpath(filename) for filename in TempFiles])
+        for name in ListFiles(options.output_dir):
+            filename = path.join(options.output_dir, name)
+            if not options.sink.IsPublished(name) and path.realpath(filename) not in temp_files:
+                options.sink.PutFile(name, filename)
+    options.sink.Close()
+
 #############################################
 FileNameMap = {}
 def MapFileName(from_name, to_name):
@@ -1680,7 +1843,7 @@ def GetMappedFileName(filename):
 
 #############################################
 Options = None
-def main():
+def main(args=None):
     # determine the platform binary name
     host_platform = ''
     if platform.system() == 'Linux':
@@ -1742,6 +1905,8 @@ def main():
                       help="Always output an @lang attribute for audio tracks even when the language is undefined"),
     parser.add_option('', "--subtitles", dest="subtitles", action="store_true", default=False,
                       help="Enable Subtitles")
+    parser.add_option('', "--segment-webvtt", dest="segment_webvtt", action="store_true", default=False,
+                      help="Split WebVTT subtitles files into segments aligned with the video segments (or the audio segments if there is no video), instead of publishing them as a single file")
     parser.add_option('', "--attributes", dest="attributes", action="append", metavar='<attributes-definition>', default=[],
                       help="Specify the attributes of a set of tracks. This option may be used multiple times, once per attribute set.")
     parser.add_option('', "--smooth", dest="smooth", default=False, action="store_true",
@@ -1766,6 +1931,8 @@ def main():
                       help="Produce an output compatible with the Hippo Media Server")
     parser.add_option('', '--hippo-server-manifest-name', dest="hippo_server_manifest_filename",
                       help="Hippo Media Server Manifest file name", metavar="<filename>", default='stream.msm')
+    parser.add_option('', "--segment-index", dest="segment_index", default=False, action="store_true",
+                      help="Write a binary segment index file for each track, that maps segment times to byte ranges in the media file (not available with the default split output)")
     parser.add_option('', "--use-compat-namespace", dest="use_compat_namespace", action="store_true", default=False,
                       help="Use the original DASH MPD namespace as it was specified in the first published specification")
     parser.add_option('', "--use-legacy-audio-channel-config-uri", dest="use_legacy_audio_channel_config_uri", action="store_true", default=False,
@@ -1820,9 +1987,28 @@ def main():
                       help="Add Clear Key signaling to the MPD (requires an encrypted input, or the --encryption-key option))")
     parser.add_option('', "--clearkey-license-uri", dest="clearkey_license_uri",
                       help="Specify the license/key URI to use for Clear Key (only valid with --clearkey option)")
+    parser.add_option('', "--output-sink", metavar="<url>", dest="output_sink", default=None,
+                      help="Upload the output to an S3-compatible object store instead of writing it to the output directory. " +
+                           "<url> is s3://<bucket>/<prefix> (with the endpoint set by the AWS_ENDPOINT_URL environment variable, if not AWS) " +
+                           "or http(s)://<host>/<bucket>/<prefix>. Credentials are read from AWS_ACCESS_KEY_ID, AWS_SECRET_ACCESS_KEY and AWS_SESSION_TOKEN, and the region from AWS_REGION. " +
+                           "Files are uploaded as soon as they are produced, and the manifests last")
+    parser.add_option('', "--upload-jobs", metavar="<n>", dest="upload_jobs", type="int", default=8,
+                      help="Maximum number of concurrent uploads, with --output-sink (default: 8)")
+    parser.add_option('', "--upload-part-size", metavar="<megabytes>", dest="upload_part_size", type="int", default=8,
+                      help="Files larger than this are uploaded in parts of this size, with --output-sink (default: 8)")
+    parser.add_option('', "--dedup-store", metavar="<dir>", dest="dedup_store", default=None,
+                      help="Store the media files (init segments, segments, media files, subtitles and segment indexes) in a content-addressed store in this directory, " +
+                           "where identical files are stored once, and hard link them (or symbolically link them, across file systems) from the output directory. " +
+                           "The store may be shared by several titles and runs")
+    parser.add_option('', "--job-dir", metavar="<dir>", dest="job_dir", default=None,
+                      help="Keep the state of the packaging job in this directory (a job manifest, the prepared sources and the analysis cache), " +
+                           "and only redo, when packaging again to the same output directory, the work whose inputs or options changed " +
+                           "(the manifests are always generated again). Implies --force")
     parser.add_option('', "--exec-dir", metavar="<exec_dir>", dest="exec_dir", default=default_exec_dir,
                       help="Directory where the Bento4 executables are located (use '-' to look for executable in the current PATH)")
-    (options, args) = parser.parse_args()
+    parser.add_option('', "--analysis-cache-dir", metavar="<dir>", dest="analysis_cache_dir", default=None,
+                      help="Cache the analysis of the input files in this directory, so that unchanged files are not analyzed again")
+    (options, args) = parser.parse_args(args)
     if not args:
         parser.print_help()
         sys.exit(1)
@@ -1894,6 +2080,22 @@ def main():
     if options.on_demand and options.use_segment_list:
         raise Exception('segment lists cannot be used with the on-demand profile')
 
+    if options.output_sink and options.upload_part_size*1024*1024 < S3_MIN_PART_SIZE:
+        raise Exception('ERROR: --upload-part-size must be at least %d' % (S3_MIN_PART_SIZE//(1024*1024)))
+
+    if options.dedup_store and options.output_sink:
+        raise Exception('ERROR: --dedup-store cannot be used with --output-sink')
+
+    if options.job_dir:
+        if options.output_sink:
+            raise Exception('ERROR: --job-dir cannot be used with --output-sink')
+        options.force_output = True
+        if not options.analysis_cache_dir:
+            options.analysis_cache_dir = path.join(options.job_dir, 'analysis')
+
+    if options.segment_index and options.split:
+        raise Exception('ERROR: --segment-index requires an output with media files (--no-split, --smooth, --hippo or the on-demand profile)')
+
     if options.smooth:
         if ISOFF_LIVE_PROFILE not in options.profiles:
             raise Exception('--smooth requires the live profile')
@@ -1952,35 +2154,51 @@ def main():
         except:
             raise Exception('Invalid syntax for --attributes option')
 
-    # create the output directory
-    severity = 'ERROR'
-    if options.no_media: severity = 'WARNING'
-    if options.force_output: severity = None
-    MakeNewDir(dir=options.output_dir, exit_if_exists = not (options.no_media or options.force_output), severity=severity)
+    # create the output directory, or the staging directory of the output sink
+    options.sink = MakeOutputSink(options.output_sink,
+                                  options.output_dir,
+                                  store_dir = options.dedup_store,
+                                  jobs      = options.upload_jobs,
+                                  part_size = options.upload_part_size*1024*1024,
+                                  verbose   = options.verbose)
+    if options.sink.staging_dir:
+        options.output_dir = options.sink.staging_dir
+    else:
+        severity = 'ERROR'
+        if options.no_media: severity = 'WARNING'
+        if options.force_output: severity = None
+        MakeNewDir(dir=options.output_dir, exit_if_exists = not (options.no_media or options.force_output), severity=severity)
+
+    # load the state of the previous run of the job, if any
+    options.job = JobManifest(options.job_dir)
 
     # parse media sources syntax
     media_sources = [MediaSource(options, source) for source in args]
+    for media_source in media_sources:
+        options.job.AddInput(media_source.filename)
 
     # for on-demand, we need to first extract tracks into individual media files
     if options.on_demand:
         (audio_sets, video_sets, subtitles_sets, mp4_files) = SelectTracks(options, media_sources)
         media_sources = [x for x in media_sources if x.format == "webvtt"] # Keep subtitles
         for track in sum(list(audio_sets.values()) + list(video_sets.values()), []):
-            print('Extracting track', track.id, 'from', GetMappedFileName(track.parent.media_source.filename))
-            track_file = tempfile.NamedTemporaryFile(dir=options.output_dir, delete=False)
-            TempFiles.append(track_file.name)
-            track_file.close() # necessary on Windows
-            MapFileName(track_file.name, path.basename(track_file.name) + ' = Extracted[track '+str(track.id) + ' from '+GetMappedFileName(track.parent.media_source.filename)+']')
-
-            Mp4Fragment(options,
-                        track.parent.media_source.filename,
-                        track_file.name,
-                        track = str(track.id),
-                        index = True,
-                        copy_udta = True,
-                        quiet = True)
-
-            media_source = MediaSource(options, track_file.name)
+            fingerprint = MakeFingerprint('fragment', GetFileIdentity(track.parent.media_source.filename), track.id)
+            track_filename = MakePreparedFile(options, 'fragment', fingerprint,
+                                              'Extracted[track '+str(track.id) + ' from '+GetMappedFileName(track.parent.media_source.filename)+']')
+            if options.job.IsDone('fragment:'+fingerprint, fingerprint):
+                options.job.Keep('fragment:'+fingerprint)
+            else:
+                print('Extracting track', track.id, 'from', GetMappedFileName(track.parent.media_source.filename))
+                Mp4Fragment(options,
+                            track.parent.media_source.filename,
+                            track_filename,
+                            track = str(track.id),
+                            index = True,
+                            copy_udta = True,
+                            quiet = True)
+                options.job.Record('fragment:'+fingerprint, fingerprint, options.job_dir, [track_filename])
+
+            media_source = MediaSource(options, track_filename)
             media_source.spec = track.parent.media_source.spec
             media_sources.append(media_source)
 
@@ -2090,6 +2308,8 @@ def main():
                     track.parent.media_name = ONDEMAND_MEDIA_FILE_PATTERN % (options.media_prefix, track.representation_id)
                 else:
                     track.init_segment_name = NOSPLIT_INIT_FILE_PATTERN % (track.representation_id)
+                if not options.split:
+                    track.segment_index_name = SEGMENT_INDEX_FILE_PATTERN % (track.representation_id)
 
                 track.stream_id = adaptation_set_name[0]
                 if adaptation_set_name[0] == 'audio':
@@ -2105,6 +2325,13 @@ def main():
                 if atom.type == 'moov' and not hasattr(track, 'moov_atom'):
                     track.moov_atom = atom
 
+    # WebVTT subtitles are split along the segments of the first video (or audio) track
+    if options.segment_webvtt:
+        reference_tracks = video_tracks or audio_tracks
+        for subtitles_file in subtitles_files:
+            if subtitles_file.format == 'webvtt' and reference_tracks:
+                subtitles_file.segment_track = reference_tracks[0]
+
     # compute some values if not set
     if options.min_buffer_time == 0.0:
         if video_tracks:
@@ -2143,7 +2370,13 @@ def main():
                 for adaptation_set_name, tracks in list(adaptation_sets.items()):
                     for track in tracks:
                         out_dir = path.join(options.output_dir, track.representation_id)
+                        task = MakeMediaTask(options, 'split:'+track.representation_id, track.parent.media_source.filename,
+                                             track.id, track.init_segment_name, SEGMENT_PATTERN)
+                        if not task:
+                            continue
                         MakeNewDir(out_dir, recursive=True)
+                        ReleaseFiles(options, out_dir)
+                        stamp = options.job.MakeStamp() if options.job_dir else None
                         print('Splitting media file ('+adaptation_set_name[0]+')', GetMappedFileName(track.parent.media_source.filename))
                         Mp4Split(options,
                                  track.parent.media_source.filename,
@@ -2152,31 +2385,49 @@ def main():
                                  start_number           = '1',
                                  init_segment           = path.join(out_dir, track.init_segment_name),
                                  media_segment          = path.join(out_dir, SEGMENT_PATTERN))
+                        # the I-frame playlists are computed from the video segments
+                        PublishFiles(options, out_dir, keep=options.hls and track.type == 'video')
+                        if options.job_dir:
+                            RecordMediaTask(options, task, ListFilesModifiedSince(out_dir, stamp))
 
         else:
             for mp4_file in list(mp4_files.values()):
-                print('Processing and Copying media file', GetMappedFileName(mp4_file.media_source.filename))
                 media_filename = path.join(options.output_dir, mp4_file.media_name)
+                task = MakeMediaTask(options, 'copy:'+mp4_file.media_name, mp4_file.media_source.filename)
+                if not task:
+                    continue
+                print('Processing and Copying media file', GetMappedFileName(mp4_file.media_source.filename))
                 if not options.force_output and path.exists(media_filename):
                     PrintErrorAndExit('ERROR: file ' + media_filename + ' already exists')
 
+                ReleaseFiles(options, media_filename)
                 shutil.copyfile(mp4_file.media_source.filename, media_filename)
+                PublishFiles(options, media_filename, keep=options.hls)
+                RecordMediaTask(options, task, [media_filename])
             if options.smooth or options.hippo:
                 for track in audio_tracks+video_tracks+subtitles_tracks:
+                    init_segment_filename = path.join(options.output_dir, track.init_segment_name)
+                    task = MakeMediaTask(options, 'init:'+track.init_segment_name, track.parent.media_source.filename, track.id)
+                    if not task:
+                        continue
+                    ReleaseFiles(options, init_segment_filename)
                     Mp4Split(options,
                              track.parent.media_source.filename,
                              track_id     = str(track.id),
                              init_only    = True,
-                             init_segment = path.join(options.output_dir, track.init_segment_name))
+                             init_segment = init_segment_filename)
+                    PublishFiles(options, init_segment_filename)
+                    RecordMediaTask(options, task, [init_segment_filename])
 
-        if subtitles_files:
-            MakeNewDir(path.join(options.output_dir, 'subtitles'))
-            for subtitles_file in subtitles_files:
-                print('Processing and Copying subtitles file', GetMappedFileName(subtitles_file.media_source.filename))
-                out_dir = path.join(options.output_dir, 'subtitles', subtitles_file.language)
-                MakeNewDir(out_dir)
-                media_filename = path.join(out_dir, subtitles_file.media_name)
-                shutil.copyfile(subtitles_file.media_source.filename, media_filename)
+        OutputSubtitlesFiles(options, subtitles_files)
+
+    # output the segment indexes
+    if options.segment_index:
+        OutputSegmentIndexes(options, audio_tracks+video_tracks+subtitles_tracks)
+
+    # the manifests are always generated again, and are the files written from now on
+    if options.job_dir:
+        stamp = options.job.MakeStamp()
 
     # output the DASH MPD
     OutputDash(options, set_attributes, audio_sets, video_sets, subtitles_sets, subtitles_files)
@@ -2193,6 +2444,21 @@ def main():
     if options.hippo:
         OutputHippo(options, audio_tracks, video_tracks)
 
+    # publish the manifests, once the media is published
+    PublishOutput(options)
+
+    # save the state of the job, and remove the outputs of the previous run that were not produced again
+    if options.job_dir:
+        job_dir = path.realpath(options.job_dir)
+        manifest_filenames = [filename for filename in ListFilesModifiedSince(options.output_dir, stamp)
+                              if path.commonpath([path.realpath(filename), job_dir]) != job_dir]
+        options.job.Record('manifests', None, options.output_dir, manifest_filenames)
+        if options.no_media:
+            options.job.KeepAll()
+        options.job.Save()
+
+    return (options, audio_tracks+video_tracks+subtitles_tracks, subtitles_files)
+
 ###########################
 if sys.version_info < (3,7,0):
     sys.stderr.write("ERROR: This tool must be run with Python 3.7 or above\n")
@@ -2209,4 +2475,7 @@ if __name__ == '__main__':
             PrintErrorAndExit('ERROR: {}\n'.format(str(err)))
     finally:
         for f in TempFiles:
-            os.unlink(f)
+            if path.exists(f):
+                os.unlink(f)
+        if Options and getattr(Options, 'sink', None):
+            Options.sink.Abort()
@@ -0,0 +1,460 @@
+#!/usr/bin/env python3
+
+__author__    = 'Gilles Boccon-Gibod (bok@bok.net)'
+__copyright__ = 'Copyright 2011-2020 Axiomatic Systems, LLC.'
+
+### Imports
+import sys
+import os
+import os.path as path
+import posixpath
+import hashlib
+from optparse import OptionParser
+import urllib.parse
+from fetchutils import Fetcher, FetchError, Journal, CoalesceRanges
+from mp4utils import WriteFileAtomically
+from mp4cenc import CencEncryptor, CheckEncryptionBackend
+
+# constants
+JOURNAL_FILENAME     = '.mp4-hls-clone-journal'
+MASTER_PLAYLIST_TAGS = ('#EXT-X-STREAM-INF:', '#EXT-X-I-FRAME-STREAM-INF:', '#EXT-X-MEDIA:')
+KEY_TAGS             = ('#EXT-X-KEY:', '#EXT-X-SESSION-KEY:')
+
+def ParseAttributeList(text):
+    # list of [name, value] pairs, with the values as they appear (quoted strings keep their quotes)
+    attributes = []
+    position = 0
+    while position < len(text):
+        equal = text.find('=', position)
+        if equal < 0:
+            break
+        name = text[position:equal].strip()
+        position = equal+1
+        if text.startswith('"', position):
+            end = text.find('"', position+1)
+            if end < 0:
+                raise Exception('Invalid attribute list: '+text)
+            end += 1
+        else:
+            end = text.find(',', position)
+            if end < 0:
+                end = len(text)
+        attributes.append([name, text[position:end]])
+        position = end+1
+    return attributes
+
+def FormatAttributeList(attributes):
+    return ','.join([name+'='+value for (name, value) in attributes])
+
+def GetAttribute(attributes, name):
+    for (attribute_name, value) in attributes:
+        if attribute_name == name:
+            return value.strip('"')
+    return None
+
+def SetAttribute(attributes, name, value):
+    for attribute in attributes:
+        if attribute[0] == name:
+            attribute[1] = '"'+value+'"'
+            return
+    attributes.append([name, '"'+value+'"'])
+
+def ParseByteRange(text, previous_end):
+    # <length>[@<offset>], where a missing offset continues the previous range of the same resource
+    (length, _, offset) = text.strip('"').partition('@')
+    if offset:
+        offset = int(offset)
+    elif previous_end is not None:
+        offset = previous_end
+    else:
+        raise Exception('Byte range without an offset: '+text)
+    return (offset, int(length))
+
+def FormatByteRange(byte_range):
+    return '%d@%d' % (byte_range[1], byte_range[0])
+
+def ResolveUrl(base_url, url):
+    if urllib.parse.urlsplit(url).scheme:
+        return url
+    return urllib.parse.urljoin(base_url, url)
+
+class MediaReference:
+    """A media segment or an initialization section (EXT-X-MAP) referenced by a playlist"""
+    def __init__(self, url, byte_range, init=None, is_init=False):
+        self.url         = url
+        self.byte_range  = byte_range
+        self.init        = init
+        self.is_init     = is_init
+        self.local_range = byte_range
+
+class Playlist:
+    """A master or media playlist, kept as a list of items that can be written
+    back with the URIs rewritten.
+
+    Items are tuples: ('line', text), ('variant', url), ('tag', tag, attributes, url, is_iframe),
+    ('key', tag, attributes), ('map', reference, attributes) or ('segment', reference).
+    """
+    def __init__(self, url, text):
+        self.url        = url
+        self.items      = []
+        self.references = []
+        self.children   = []
+        self.encrypted  = False
+
+        lines = [line.strip() for line in text.splitlines()]
+        if not lines or not lines[0].startswith('#EXTM3U'):
+            raise Exception('Not an HLS playlist: '+url)
+        self.is_master = any([line.startswith(MASTER_PLAYLIST_TAGS) for line in lines])
+        if self.is_master:
+            self.ParseMaster(lines)
+        else:
+            self.ParseMedia(lines)
+
+    def ParseKey(self, line):
+        (tag, _, attributes) = line.partition(':')
+        attributes = ParseAttributeList(attributes)
+        if GetAttribute(attributes, 'METHOD') not in (None, 'NONE'):
+            self.encrypted = True
+        # keys are not cloned, the clone keeps using the original key server
+        uri = GetAttribute(attributes, 'URI')
+        if uri is not None:
+            SetAttribute(attributes, 'URI', ResolveUrl(self.url, uri))
+        self.items.append(('key', tag, attributes))
+
+    def ParseMaster(self, lines):
+        for line in lines:
+            if line.startswith(('#EXT-X-MEDIA:', '#EXT-X-I-FRAME-STREAM-INF:')):
+                (tag, _, attributes) = line.partition(':')
+                attributes = ParseAttributeList(attributes)
+                uri = GetAttribute(attributes, 'URI')
+                if uri is None:
+                    self.items.append(('line', line))
+                    continue
+                url = ResolveUrl(self.url, uri)
+                is_iframe = (tag == '#EXT-X-I-FRAME-STREAM-INF')
+                self.items.append(('tag', tag, attributes, url, is_iframe))
+                self.children.append((url, is_iframe))
+            elif line.startswith(KEY_TAGS):
+                self.ParseKey(line)
+            elif line.startswith('#') or not line:
+                self.items.append(('line', line))
+            else:
+                url = ResolveUrl(self.url, line)
+                self.items.append(('variant', url))
+                self.children.append((url, False))
+
+    def ParseMedia(self, lines):
+        previous_end = {}
+        byte_range = None
+        init = None
+        for line in lines:
+            if line.startswith('#EXT-X-BYTERANGE:'):
+                byte_range = line[len('#EXT-X-BYTERANGE:'):]
+            elif line.startswith('#EXT-X-MAP:'):
+                attributes = ParseAttributeList(line[len('#EXT-X-MAP:'):])
+                url = ResolveUrl(self.url, GetAttribute(attributes, 'URI'))
+                map_range = GetAttribute(attributes, 'BYTERANGE')
+                if map_range is not None:
+                    map_range = ParseByteRange(map_range, None)
+                init = MediaReference(url, map_range, is_init=True)
+                self.items.append(('map', init, attributes))
+                self.references.append(init)
+            elif line.startswith(KEY_TAGS):
+                self.ParseKey(line)
+            elif line.startswith('#') or not line:
+                self.items.append(('line', line))
+            else:
+                url = ResolveUrl(self.url, line)
+                if byte_range is not None:
+                    byte_range = ParseByteRange(byte_range, previous_end.get(url))
+                    previous_end[url] = byte_range[0]+byte_range[1]
+                reference = MediaReference(url, byte_range, init)
+                self.items.append(('segment', reference))
+                self.references.append(reference)
+                byte_range = None
+
+class FilePlan:
+    """How a remote file is cloned: as a whole, or as the coalesced byte ranges
+    that the playlists reference"""
+    def __init__(self, url, local_path):
+        self.url        = url
+        self.local_path = local_path
+        self.references = []
+        self.whole      = False
+
+    def Add(self, reference):
+        self.references.append(reference)
+        if reference.byte_range is None:
+            self.whole = True
+
+    def HasInit(self):
+        return any([reference.is_init for reference in self.references])
+
+    def GetSpans(self):
+        if self.whole:
+            return None
+        return CoalesceRanges([reference.byte_range for reference in self.references])
+
+    def MapRanges(self, spans):
+        # the local file is the concatenation of the spans
+        if spans is None:
+            return
+        span_offsets = []
+        local_offset = 0
+        for (offset, size) in spans:
+            span_offsets.append((offset, size, local_offset))
+            local_offset += size
+        for reference in self.references:
+            (offset, size) = reference.byte_range
+            for (span_offset, span_size, local_offset) in span_offsets:
+                if span_offset <= offset < span_offset+span_size:
+                    reference.local_range = (local_offset+offset-span_offset, size)
+                    break
+
+class HlsCloner:
+    def __init__(self, url, output_dir, fetcher, encryption=None):
+        self.url        = url
+        self.base_url   = urllib.parse.urljoin(url, '.')
+        self.output_dir = output_dir
+        self.fetcher    = fetcher
+        self.encryption = encryption
+        self.playlists  = []
+        self.files      = {}
+        self.encryptors = {}
+        self.failures   = 0
+
+    def LocalPath(self, url):
+        # path of the local copy of url, relative to the output directory
+        parsed_url = urllib.parse.urlsplit(url)
+        if url.startswith(self.base_url):
+            local_path = parsed_url.path[len(urllib.parse.urlsplit(self.base_url).path):]
+        else:
+            local_path = 'external/'+(parsed_url.netloc or 'local')+'/'+parsed_url.path
+        local_path = urllib.parse.unquote(local_path)
+        if parsed_url.query:
+            # URLs that only differ by their query must not collide
+            (root, extension) = posixpath.splitext(local_path)
+            local_path = root+'-'+hashlib.sha1(parsed_url.query.encode('utf-8')).hexdigest()[:8]+extension
+        return '/'.join([part for part in local_path.split('/') if part not in ('', '.', '..')])
+
+    def LoadPlaylist(self, url, is_iframe=False):
+        if Options.verbose:
+            print('Loading playlist', url)
+        playlist = Playlist(url, self.fetcher.Fetch(url).data.decode('utf-8'))
+        playlist.local_path = self.LocalPath(url)
+        playlist.is_iframe = is_iframe
+        if playlist.encrypted and self.encryption:
+            raise Exception('Playlists with encrypted segments cannot be encrypted again')
+        self.playlists.append(playlist)
+
+        loaded = set([p.url for p in self.playlists])
+        for (child_url, child_is_iframe) in playlist.children:
+            if child_is_iframe and self.encryption:
+                # the I-frame byte ranges would not match the encrypted segments
+                print('WARNING: skipping I-frame playlist', child_url)
+                continue
+            if child_url not in loaded:
+                self.LoadPlaylist(child_url, child_is_iframe)
+                loaded.add(child_url)
+        return playlist
+
+    def PlanFiles(self):
+        for playlist in self.playlists:
+            for reference in playlist.references:
+                plan = self.files.get(reference.url)
+                if plan is None:
+                    plan = self.files[reference.url] = FilePlan(reference.url, self.LocalPath(reference.url))
+                plan.Add(reference)
+
+    def Clone(self):
+        self.LoadPlaylist(self.url)
+        self.PlanFiles()
+
+        # files with initialization sections go first, the encryptors are setup from them
+        plans = sorted(self.files.values(), key=lambda plan: not plan.HasInit())
+        init_plans = [plan for plan in plans if plan.HasInit()]
+        self.CloneFiles(init_plans)
+        self.CloneFiles(plans[len(init_plans):])
+
+        for playlist in self.playlists:
+            self.WritePlaylist(playlist)
+
+    def CloneFiles(self, plans):
+        futures = []
+        for plan in plans:
+            spans = plan.GetSpans()
+            if self.encryption:
+                process = lambda data, plan=plan, spans=spans: self.EncryptFile(plan, spans, data)
+                # the local byte ranges are only known after the data is encrypted
+                use_journal = plan.whole and not plan.HasInit()
+            else:
+                plan.MapRanges(spans)
+                process = None
+                use_journal = True
+            if Options.verbose:
+                print('Cloning', plan.url, 'to', plan.local_path)
+            filename = path.join(self.output_dir, *plan.local_path.split('/'))
+            futures.append((plan, self.fetcher.Submit(plan.url, filename, process, use_journal=use_journal, spans=spans)))
+
+        for (plan, future) in futures:
+            try:
+                future.result()
+            except (FetchError, IOError) as e:
+                print('ERROR: failed to clone', plan.url, '(%s)' % e)
+                self.failures += 1
+
+    def EncryptFile(self, plan, spans, data):
+        if plan.whole:
+            if len(set([reference.is_init for reference in plan.references])) > 1 or any([reference.byte_range for reference in plan.references]):
+                raise Exception('Cannot encrypt '+plan.url+': it is referenced both as a whole and by byte ranges')
+            return self.EncryptPiece(plan.references[0], data)
+
+        # group the references by byte range
+        pieces = {}
+        for reference in plan.references:
+            pieces.setdefault(reference.byte_range, []).append(reference)
+
+        # encrypt the pieces, initialization sections first, and lay them out one after the other
+        ranges = sorted(pieces)
+        end = 0
+        for byte_range in ranges:
+            if byte_range[0] < end:
+                raise Exception('Cannot encrypt '+plan.url+': its byte ranges overlap')
+            end = byte_range[0]+byte_range[1]
+        encrypted = {}
+        for byte_range in sorted(ranges, key=lambda byte_range: not pieces[byte_range][0].is_init):
+            encrypted[byte_range] = self.EncryptPiece(pieces[byte_range][0], self.ExtractRange(spans, data, byte_range))
+        local_offset = 0
+        for byte_range in ranges:
+            for reference in pieces[byte_range]:
+                reference.local_range = (local_offset, len(encrypted[byte_range]))
+            local_offset += len(encrypted[byte_range])
+        return [encrypted[byte_range] for byte_range in ranges]
+
+    def ExtractRange(self, spans, data, byte_range):
+        local_offset = 0
+        for (span_offset, span_size) in spans:
+            if span_offset <= byte_range[0] < span_offset+span_size:
+                start = local_offset+byte_range[0]-span_offset
+                return data[start:start+byte_range[1]]
+            local_offset += span_size
+        raise Exception('byte range not found')
+
+    def EncryptPiece(self, reference, data):
+        if reference.is_init:
+            encryptor = CencEncryptor(self.encryption[0], self.encryption[1])
+            self.encryptors[(reference.url, reference.byte_range)] = encryptor
+            return encryptor.ProcessInitSegment(data)
+        if reference.init is None:
+            raise Exception('Only fragmented MP4 playlists (with EXT-X-MAP) can be encrypted')
+        encryptor = self.encryptors.get((reference.init.url, reference.init.byte_range))
+        if encryptor is None:
+            raise Exception('No initialization section for '+reference.url)
+        return encryptor.ProcessMediaSegment(data)
+
+    def LocalUri(self, playlist, url):
+        return posixpath.relpath(self.LocalPath(url), posixpath.dirname(playlist.local_path) or '.')
+
+    def WritePlaylist(self, playlist):
+        lines = []
+        key_written = False
+        for item in playlist.items:
+            if item[0] == 'line':
+                lines.append(item[1])
+            elif item[0] == 'variant':
+                lines.append(self.LocalUri(playlist, item[1]))
+            elif item[0] == 'tag':
+                (_, tag, attributes, url, is_iframe) = item
+                if is_iframe and self.encryption:
+                    continue
+                SetAttribute(attributes, 'URI', self.LocalUri(playlist, url))
+                lines.append(tag+':'+FormatAttributeList(attributes))
+            elif item[0] == 'key':
+                lines.append(item[1]+':'+FormatAttributeList(item[2]))
+            elif item[0] == 'map':
+                (_, reference, attributes) = item
+                if self.encryption and not key_written:
+                    lines.append('#EXT-X-KEY:METHOD=SAMPLE-AES-CTR,URI="urn:marlin:kid:'+self.encryption[0].hex()+'"')
+                    key_written = True
+                SetAttribute(attributes, 'URI', self.LocalUri(playlist, reference.url))
+                if reference.local_range is not None:
+                    SetAttribute(attributes, 'BYTERANGE', FormatByteRange(reference.local_range))
+                lines.append('#EXT-X-MAP:'+FormatAttributeList(attributes))
+            elif item[0] == 'segment':
+                reference = item[1]
+                if reference.local_range is not None:
+                    lines.append('#EXT-X-BYTERANGE:'+FormatByteRange(reference.local_range))
+                lines.append(self.LocalUri(playlist, reference.url))
+
+        filename = path.join(self.output_dir, *playlist.local_path.split('/'))
+        WriteFileAtomically(filename, ('\n'.join(lines)+'\n').encode('utf-8'))
+
+def main():
+    # parse options
+    parser = OptionParser(usage="%prog [options] <file-or-http-url> <output-dir>\n")
+    parser.add_option('', '--quiet', dest="verbose",
+                      action='store_false', default=True,
+                      help="Be quiet")
+    parser.add_option('', "--encrypt", metavar='<KID:KEY>',
+                      dest='encrypt', default=None,
+                      help="Encrypt the media (fragmented MP4 only), with KID and KEY specified in Hex (32 characters each) (requires the 'cryptography' Python module)")
+    parser.add_option('', "--parallel", metavar='<n>', type='int',
+                      dest='parallel', default=4,
+                      help="Number of files to download concurrently (default: 4)")
+    parser.add_option('', "--retries", metavar='<n>', type='int',
+                      dest='retries', default=3,
+                      help="Number of times a failed download is retried, with exponential backoff (default: 3)")
+    parser.add_option('', "--max-in-flight", metavar='<megabytes>', type='int',
+                      dest='max_in_flight', default=64,
+                      help="Maximum amount of downloaded data held in memory at any time (default: 64)")
+    parser.add_option('', "--resume", action='store_true',
+                      dest='resume', default=False,
+                      help="Resume an interrupted clone in the same output directory: files that are already complete and intact (according to the clone journal) are not downloaded again")
+    parser.add_option('', "--revalidate", action='store_true',
+                      dest='revalidate', default=False,
+                      help="With --resume, check that complete files haven't changed on the server, with conditional (If-None-Match/If-Modified-Since) requests")
+
+    global Options
+    (Options, args) = parser.parse_args()
+    if len(args) != 2:
+        parser.print_help()
+        sys.exit(1)
+
+    # process arguments
+    playlist_url = args[0]
+    output_dir = args[1]
+    encryption = None
+    if Options.encrypt:
+        if len(Options.encrypt) != 65:
+            raise Exception('Invalid argument for --encrypt option')
+        CheckEncryptionBackend()
+        encryption = (bytes.fromhex(Options.encrypt[:32]), bytes.fromhex(Options.encrypt[33:]))
+    if not urllib.parse.urlsplit(playlist_url).scheme:
+        playlist_url = 'file://'+path.abspath(playlist_url)
+
+    # create the output dir
+    if path.exists(output_dir):
+        if Options.resume:
+            if Options.verbose: print("Resuming clone in", output_dir)
+        else:
+            print('WARNING: directory "'+output_dir+'" already exists')
+    else:
+        os.makedirs(output_dir)
+
+    journal = Journal(path.join(output_dir, JOURNAL_FILENAME), Options.resume)
+    fetcher = Fetcher(parallel=Options.parallel, retries=Options.retries,
+                      max_in_flight_bytes=Options.max_in_flight*1024*1024, verbose=Options.verbose,
+                      journal=journal, revalidate=Options.revalidate)
+    cloner = HlsCloner(playlist_url, output_dir, fetcher, encryption)
+    try:
+        cloner.Clone()
+    finally:
+        fetcher.Close()
+
+    if cloner.failures:
+        print('ERROR: %d file(s) could not be cloned' % cloner.failures)
+        sys.exit(1)
+
+###########################
+if __name__ == '__main__':
+    main()
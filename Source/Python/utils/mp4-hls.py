@@ -17,9 +17,13 @@ from optparse import OptionParser
 import shutil
 import platform
 import sys
+import os
 import os.path as path
 import json
-from subtitles import SubtitlesFile
+import math
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_EXCEPTION
+from subtitles import SubtitlesFile, WebvttSegmenter
 from mp4utils import Base64Encode,\
                      Mp4File,\
                      Mp42Hls,\
@@ -35,18 +39,38 @@ SDK_REVISION = '639'
 SCRIPT_PATH = path.abspath(path.dirname(__file__))
 sys.path += [SCRIPT_PATH]
 
+MPEG2_TS_PCR_OFFSET    = 10000 # default PTS offset of mp42hls, in 90kHz units
+WEBVTT_SEGMENT_PATTERN = 'segment-%d.vtt'
+
 #############################################
-def CreateSubtitlesPlaylist(playlist_filename, webvtt_filename, duration):
+def CreateSubtitlesPlaylist(playlist_filename, webvtt_filename, duration, segment_durations=None):
     playlist = open(playlist_filename, 'w', newline='\r\n')
     playlist.write('#EXTM3U\n')
-    playlist.write('#EXT-X-TARGETDURATION:%d\n' % (duration))
+    if segment_durations:
+        playlist.write('#EXT-X-TARGETDURATION:%d\n' % (int(math.ceil(max(segment_durations)))))
+    else:
+        playlist.write('#EXT-X-TARGETDURATION:%d\n' % (duration))
     playlist.write('#EXT-X-VERSION:3\n')
     playlist.write('#EXT-X-MEDIA-SEQUENCE:0\n')
     playlist.write('#EXT-X-PLAYLIST-TYPE:VOD\n')
-    playlist.write('#EXTINF:%d,\n' % (duration))
-    playlist.write(webvtt_filename+'\n')
+    if segment_durations:
+        for i in range(len(segment_durations)):
+            playlist.write('#EXTINF:%f,\n' % (segment_durations[i]))
+            playlist.write(WEBVTT_SEGMENT_PATTERN % (i)+'\n')
+    else:
+        playlist.write('#EXTINF:%d,\n' % (duration))
+        playlist.write(webvtt_filename+'\n')
     playlist.write('#EXT-X-ENDLIST\n')
 
+#############################################
+def ReadPlaylistSegmentDurations(playlist_filename):
+    segment_durations = []
+    with open(playlist_filename, 'r') as playlist:
+        for line in playlist:
+            if line.startswith('#EXTINF:'):
+                segment_durations.append(float(line[8:].split(',')[0]))
+    return segment_durations
+
 
 #############################################
 def ComputeCodecName(codec_family):
@@ -88,31 +112,50 @@ def ComputeFairplayKeyLine(params):
     # start with a '!' to specify we want to skip the IV (since it is not needed on the key line for Fairplay)
     return '!URI="'+params['uri']+'",KEYFORMAT="com.apple.streamingkeydelivery",KEYFORMATVERSIONS="1"'
 
+#############################################
+def RunJobs(options, jobs):
+    # run a list of (function, args) jobs, options.jobs at a time, and return their results in
+    # the order of the list. The first failure cancels the jobs that haven't started yet, and is
+    # raised once the running jobs have completed.
+    if options.jobs <= 1 or len(jobs) <= 1:
+        return [function(*args) for (function, args) in jobs]
+
+    with ThreadPoolExecutor(max_workers=min(options.jobs, len(jobs))) as executor:
+        futures = [executor.submit(function, *args) for (function, args) in jobs]
+        wait(futures, return_when=FIRST_EXCEPTION)
+        for future in futures:
+            if future.done() and not future.cancelled() and future.exception() is not None:
+                for other in futures:
+                    other.cancel()
+                raise future.exception()
+        return [future.result() for future in futures]
+
 #############################################
 def AnalyzeSources(options, media_sources):
-    # parse the media files
+    # find the media files to parse
     mp4_files = {}
     for media_source in media_sources:
         if media_source.format != 'mp4': continue
 
         media_file = media_source.filename
 
-        # check if we have already parsed this file
-        if media_file in mp4_files:
-            media_source.mp4_file = mp4_files[media_file]
-            continue
+        # check if we have already seen this file
+        if media_file in mp4_files: continue
 
-        # parse the file
         if not path.exists(media_file):
             PrintErrorAndExit('ERROR: media file ' + media_file + ' does not exist')
 
-        # get the file info
         print('Parsing media file', media_file)
-        mp4_file = Mp4File(Options, media_source)
-        media_source.mp4_file = mp4_file
+        mp4_files[media_file] = media_source
 
-        # remember we have parsed this file
-        mp4_files[media_file] = mp4_file
+    # parse the files (each file is parsed only once, even if it is used by more than one source).
+    # mp42hls computes its own segments and stats, so the files are only analyzed from their
+    # mp4info info, without dumping them.
+    parsed_files = RunJobs(options, [(partial(Mp4File, lazy=True), (Options, media_source)) for media_source in mp4_files.values()])
+    mp4_files = dict(zip(mp4_files.keys(), parsed_files))
+    for media_source in media_sources:
+        if media_source.format == 'mp4':
+            media_source.mp4_file = mp4_files[media_source.filename]
 
     # analyze the media sources
     for media_source in media_sources:
@@ -287,8 +330,9 @@ def OutputHls(options, media_sources):
     if video_has_muxed_audio and not audio_only and len(audio_tracks) == 1 and len(list(audio_tracks.values())[0]) == 1:
         audio_tracks = {}
 
-    # process main media sources
-    total_duration = 0
+    # prepare the main media sources
+    # (the sources are all processed at the end, in parallel, and in the order in which they are prepared)
+    jobs = []
     main_media = []
     for media_source in mp4_sources:
         if not audio_only and not media_source.spec.get('+audio_fallback') and not media_source.has_video:
@@ -315,19 +359,12 @@ def OutputHls(options, media_sources):
         if media_source.spec.get('+audio_fallback') == 'yes':
             media_info['video_track_id'] = 0
 
-        # process the source
         out_dir = path.join(options.output_dir, media_info['dir'])
         MakeNewDir(out_dir)
-        ProcessSource(options, media_info, out_dir)
-
-        # update the duration
-        duration_s = int(media_info['info']['stats']['duration'])
-        if duration_s > total_duration:
-            total_duration = duration_s
-
         main_media.append(media_info)
+        jobs.append((ProcessSource, (options, media_info, out_dir)))
 
-    # process audio tracks
+    # prepare the audio tracks
     if len(audio_tracks):
         MakeNewDir(path.join(options.output_dir, 'audio'))
     if options.audio_format == 'ts':
@@ -351,10 +388,19 @@ def OutputHls(options, media_sources):
             if options.audio_format == 'packed':
                 audio_track.media_info['file_extension'] = ComputeCodecName(audio_track.codec_family)
 
-            # process the source
             out_dir = path.join(options.output_dir, 'audio', group_id, audio_track.language)
             MakeNewDir(out_dir)
-            ProcessSource(options, audio_track.media_info, out_dir)
+            jobs.append((ProcessSource, (options, audio_track.media_info, out_dir)))
+
+    # process the sources
+    RunJobs(options, jobs)
+
+    # compute the total duration
+    total_duration = 0
+    for media_info in main_media:
+        duration_s = int(media_info['info']['stats']['duration'])
+        if duration_s > total_duration:
+            total_duration = duration_s
 
     # start the master playlist
     master_playlist = open(path.join(options.output_dir, options.master_playlist_name), 'w', newline='\r\n')
@@ -380,14 +426,24 @@ def OutputHls(options, media_sources):
         master_playlist.write('\n')
         master_playlist.write('# Subtitles\n')
         MakeNewDir(path.join(options.output_dir, 'subtitles'))
+        # WebVTT files can be split along the segments of the main media
+        segment_durations = None
+        if options.segment_webvtt and main_media:
+            segment_durations = ReadPlaylistSegmentDurations(path.join(options.output_dir, main_media[0]['dir'], options.media_playlist_name))
         for subtitles_file in subtitles_files:
             out_dir = path.join(options.output_dir, 'subtitles', subtitles_file.language)
             MakeNewDir(out_dir)
-            media_filename = path.join(out_dir, subtitles_file.media_name)
-            shutil.copyfile(subtitles_file.media_source.filename, media_filename)
+            if segment_durations and subtitles_file.format == 'webvtt':
+                segmenter = WebvttSegmenter(subtitles_file.media_source.filename, segment_durations, mpegts=MPEG2_TS_PCR_OFFSET)
+                segmenter.segment(out_dir, WEBVTT_SEGMENT_PATTERN, start_number=0)
+                playlist_segment_durations = segment_durations
+            else:
+                media_filename = path.join(out_dir, subtitles_file.media_name)
+                shutil.copyfile(subtitles_file.media_source.filename, media_filename)
+                playlist_segment_durations = None
             relative_url = 'subtitles/'+subtitles_file.language+'/subtitles.m3u8'
             playlist_filename = path.join(out_dir, 'subtitles.m3u8')
-            CreateSubtitlesPlaylist(playlist_filename, subtitles_file.media_name, total_duration)
+            CreateSubtitlesPlaylist(playlist_filename, subtitles_file.media_name, total_duration, playlist_segment_durations)
 
             master_playlist.write('#EXT-X-MEDIA:TYPE=SUBTITLES,GROUP-ID="subtitles",NAME="%s",LANGUAGE="%s",URI="%s"\n' % (subtitles_file.language_name, subtitles_file.language, relative_url))
 
@@ -570,6 +626,10 @@ def main():
                       help="Directory where the Bento4 executables are located")
     parser.add_option('', "--base-url", metavar="<base_url>", dest="base_url", default="",
                       help="The base URL for the Media Playlists and TS files listed in the playlists. This is the prefix for the files.")
+    parser.add_option('', "--segment-webvtt", dest="segment_webvtt", action="store_true", default=False,
+                      help="Split WebVTT subtitles files into segments aligned with the segments of the main media, instead of publishing them as a single file")
+    parser.add_option('-j', '--jobs', dest="jobs", type="int", default=os.cpu_count() or 1, metavar="<n>",
+                      help="Number of media files analyzed, and of renditions processed, concurrently (default: the number of CPUs)")
     (options, args) = parser.parse_args()
     if len(args) == 0:
         parser.print_help()
@@ -0,0 +1,320 @@
+#! /usr/bin/env python3
+
+__author__    = 'Gilles Boccon-Gibod (bok@bok.net)'
+__copyright__ = 'Copyright 2011-2020 Axiomatic Systems, LLC.'
+
+###
+# Just-in-time DASH/HLS origin for fragmented MP4 sources.
+# The sources are analyzed once, at startup, and the MPD and HLS playlists
+# are generated by mp4-dash.py without media. Media segments are then served
+# directly from the sources, as byte ranges sent with sendfile, and the init
+# segments are generated by mp4split the first time they are requested, and
+# kept in an LRU cache.
+#
+# usage: mp4-origin.py [origin-options] -- [mp4-dash-options] <media-file> [<media-file> ...]
+
+from optparse import OptionParser
+import collections
+import asyncio
+import tempfile
+import importlib
+import re
+import sys
+import os.path as path
+
+SCRIPT_PATH = path.abspath(path.dirname(__file__))
+sys.path += [SCRIPT_PATH]
+
+from mp4utils import Mp4Split, MediaContentTypes, PrintErrorAndExit
+mp4dash = importlib.import_module('mp4-dash')
+
+VERSION = "1.0.0"
+
+SEGMENT_NAME_REGEXP = re.compile(r'^seg-(\d+)\.m4s$')
+BYTE_RANGE_REGEXP   = re.compile(r'^bytes=(\d*)-(\d*)$')
+MAX_REQUEST_HEADERS = 100
+
+REASONS = {
+    200: 'OK',
+    206: 'Partial Content',
+    400: 'Bad Request',
+    404: 'Not Found',
+    405: 'Method Not Allowed',
+    416: 'Range Not Satisfiable',
+    500: 'Internal Server Error'
+}
+
+#############################################
+class LruCache:
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self.entries = collections.OrderedDict()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, key):
+        value = self.entries.get(key)
+        if value is not None:
+            self.entries.move_to_end(key)
+        return value
+
+    def put(self, key, value):
+        self.entries[key] = value
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+class OriginTrack:
+    """
+    The segment table of a track: (offset, size) of the moof and mdat atoms of
+    each of its segments in the source file.
+    """
+    def __init__(self, track):
+        self.track_id = track.id
+        self.filename = track.parent.media_source.filename
+        self.init_segment_name = track.init_segment_name
+        self.segments = track.get_segment_byte_ranges()
+
+class Origin:
+    def __init__(self, options, dash_args):
+        self.options = options
+        self.manifest_dir = tempfile.TemporaryDirectory(prefix='mp4-origin-')
+        self.init_segments = LruCache(options.init_cache_size)
+        self.pending_init_segments = {}
+        self.stats = collections.Counter()
+
+        # analyze the sources and generate the manifests
+        dash_args = dash_args + ['--no-media', '--force', '--output-dir', self.manifest_dir.name]
+        if options.analysis_cache_dir:
+            dash_args += ['--analysis-cache-dir', options.analysis_cache_dir]
+        (self.dash_options, tracks, subtitles_files) = mp4dash.main(dash_args)
+        if not self.dash_options.split or self.dash_options.on_demand:
+            raise Exception('ERROR: only the default (split) layout can be served, --no-split, --smooth, --hippo and the on-demand profile are not supported')
+        if self.dash_options.encryption_key or any(track.parent.media_source.spec.get('+key') for track in tracks):
+            raise Exception('ERROR: encryption is not supported, the sources must be encrypted beforehand')
+        mp4dash.OutputSubtitlesFiles(self.dash_options, subtitles_files)
+
+        self.tracks = dict([(track.representation_id, OriginTrack(track)) for track in tracks])
+
+    def close(self):
+        self.manifest_dir.cleanup()
+
+    def make_init_segment(self, track):
+        with tempfile.TemporaryDirectory(dir=self.manifest_dir.name) as temp_dir:
+            init_segment_filename = path.join(temp_dir, track.init_segment_name)
+            Mp4Split(self.dash_options,
+                     track.filename,
+                     track_id     = str(track.track_id),
+                     init_only    = True,
+                     init_segment = init_segment_filename)
+            with open(init_segment_filename, 'rb') as f:
+                return f.read()
+
+    async def get_init_segment(self, representation_id):
+        init_segment = self.init_segments.get(representation_id)
+        if init_segment is not None:
+            self.stats['init_cache_hits'] += 1
+            return init_segment
+
+        # concurrent requests for the same init segment wait for the same generation
+        pending = self.pending_init_segments.get(representation_id)
+        if pending is None:
+            self.stats['init_segments_generated'] += 1
+            loop = asyncio.get_running_loop()
+            pending = loop.run_in_executor(None, self.make_init_segment, self.tracks[representation_id])
+            self.pending_init_segments[representation_id] = pending
+            try:
+                init_segment = await pending
+                self.init_segments.put(representation_id, init_segment)
+            finally:
+                del self.pending_init_segments[representation_id]
+            return init_segment
+        return await asyncio.shield(pending)
+
+    async def resolve(self, url_path):
+        """
+        Returns (content type, data) for generated content, (content type,
+        (filename, offset, size)) for content served from a file, or None.
+        """
+        url_path = url_path.lstrip('/')
+        if '..' in url_path.split('/'):
+            return None
+        content_type = MediaContentTypes.get(path.splitext(url_path)[1], 'application/octet-stream')
+
+        # media and init segments
+        (representation_id, _, name) = url_path.rpartition('/')
+        track = self.tracks.get(representation_id)
+        if track:
+            if name == track.init_segment_name:
+                return (content_type, await self.get_init_segment(representation_id))
+            match = SEGMENT_NAME_REGEXP.match(name)
+            if match:
+                number = int(match.group(1))
+                if 1 <= number <= len(track.segments):
+                    self.stats['segments'] += 1
+                    (offset, size) = track.segments[number-1]
+                    return (content_type, (track.filename, offset, size))
+            return None
+
+        # manifests and subtitles
+        filename = path.join(self.manifest_dir.name, *url_path.split('/'))
+        if url_path and path.isfile(filename):
+            self.stats['manifests'] += 1
+            return (content_type, (filename, 0, path.getsize(filename)))
+        return None
+
+#############################################
+def ParseByteRange(header, size):
+    # returns (start, end) for a satisfiable range, None otherwise
+    match = BYTE_RANGE_REGEXP.match(header.strip())
+    if not match or (not match.group(1) and not match.group(2)):
+        return None
+    if match.group(1):
+        start = int(match.group(1))
+        end = int(match.group(2)) if match.group(2) else size-1
+    else:
+        start = max(0, size-int(match.group(2)))
+        end = size-1
+    end = min(end, size-1)
+    if start > end:
+        return None
+    return (start, end)
+
+async def SendResponse(writer, status, headers, body=b'', keep_alive=True):
+    lines = ['HTTP/1.1 %d %s' % (status, REASONS[status])]
+    headers = dict(headers)
+    headers.setdefault('Content-Length', str(len(body)))
+    headers['Connection'] = 'keep-alive' if keep_alive else 'close'
+    headers['Access-Control-Allow-Origin'] = '*'
+    for (name, value) in headers.items():
+        lines.append(name+': '+value)
+    writer.write(('\r\n'.join(lines)+'\r\n\r\n').encode('latin-1'))
+    if body:
+        writer.write(body)
+    await writer.drain()
+
+async def HandleRequest(origin, writer, method, url_path, headers, keep_alive):
+    if method not in ['GET', 'HEAD']:
+        await SendResponse(writer, 405, {'Allow': 'GET, HEAD'}, keep_alive=keep_alive)
+        return
+    resource = await origin.resolve(url_path.split('?', 1)[0])
+    if resource is None:
+        await SendResponse(writer, 404, {}, keep_alive=keep_alive)
+        return
+
+    (content_type, content) = resource
+    if isinstance(content, bytes):
+        (filename, offset, size) = (None, 0, len(content))
+    else:
+        (filename, offset, size) = content
+
+    # byte ranges
+    status = 200
+    response_headers = {'Content-Type': content_type, 'Accept-Ranges': 'bytes'}
+    if 'range' in headers:
+        byte_range = ParseByteRange(headers['range'], size)
+        if byte_range is None:
+            await SendResponse(writer, 416, {'Content-Range': 'bytes */%d' % size}, keep_alive=keep_alive)
+            return
+        (start, end) = byte_range
+        status = 206
+        response_headers['Content-Range'] = 'bytes %d-%d/%d' % (start, end, size)
+        offset += start
+        size = end-start+1
+    response_headers['Content-Length'] = str(size)
+
+    if method == 'HEAD':
+        await SendResponse(writer, status, response_headers, keep_alive=keep_alive)
+    elif filename is None:
+        await SendResponse(writer, status, response_headers, content[offset:offset+size], keep_alive=keep_alive)
+    else:
+        with open(filename, 'rb') as f:
+            await SendResponse(writer, status, response_headers, keep_alive=keep_alive)
+            await asyncio.get_running_loop().sendfile(writer.transport, f, offset, size)
+
+async def HandleConnection(origin, reader, writer):
+    try:
+        while True:
+            request_line = await reader.readline()
+            if not request_line:
+                break
+            try:
+                (method, url_path, version) = request_line.decode('latin-1').split()
+            except ValueError:
+                await SendResponse(writer, 400, {}, keep_alive=False)
+                break
+
+            headers = {}
+            while True:
+                line = await reader.readline()
+                if line in [b'\r\n', b'\n', b'']:
+                    break
+                if len(headers) >= MAX_REQUEST_HEADERS:
+                    break
+                (name, _, value) = line.decode('latin-1').partition(':')
+                headers[name.strip().lower()] = value.strip()
+
+            connection = headers.get('connection', '').lower()
+            keep_alive = (version == 'HTTP/1.1' and connection != 'close') or connection == 'keep-alive'
+            try:
+                await HandleRequest(origin, writer, method, url_path, headers, keep_alive)
+            except (ConnectionError, asyncio.IncompleteReadError):
+                raise
+            except Exception as e:
+                if origin.options.verbose:
+                    print('ERROR:', url_path, e)
+                await SendResponse(writer, 500, {}, keep_alive=False)
+                break
+            if origin.options.verbose:
+                print(method, url_path)
+            if not keep_alive:
+                break
+    except (ConnectionError, asyncio.IncompleteReadError):
+        pass
+    finally:
+        writer.close()
+
+async def StartServer(origin, host, port):
+    return await asyncio.start_server(lambda reader, writer: HandleConnection(origin, reader, writer), host, port)
+
+async def Serve(origin, host, port):
+    server = await StartServer(origin, host, port)
+    for socket in server.sockets:
+        print('Serving on http://%s:%d/' % socket.getsockname()[:2])
+    async with server:
+        await server.serve_forever()
+
+#############################################
+def main():
+    parser = OptionParser(usage="%prog [options] -- [mp4-dash options] <media-file> [<media-file> ...]",
+                          description="Serve DASH and HLS presentations of fragmented MP4 files, packaged just-in-time. The options after -- are the mp4-dash.py packaging options and media files. Version " + VERSION)
+    parser.add_option('-v', '--verbose', dest="verbose", action='store_true', default=False,
+                      help="Be verbose")
+    parser.add_option('', '--host', dest="host", metavar="<host>", default='127.0.0.1',
+                      help="Address to listen on (default: 127.0.0.1)")
+    parser.add_option('-p', '--port', dest="port", type="int", metavar="<port>", default=8000,
+                      help="Port to listen on (default: 8000)")
+    parser.add_option('', '--init-cache-size', dest="init_cache_size", type="int", metavar="<n>", default=256,
+                      help="Maximum number of init segments kept in memory (default: 256)")
+    parser.add_option('', '--analysis-cache-dir', dest="analysis_cache_dir", metavar="<dir>", default=None,
+                      help="Cache the analysis of the sources in this directory, so that restarting the origin doesn't analyze unchanged sources again")
+    (options, args) = parser.parse_args()
+    if len(args) == 0:
+        parser.print_help()
+        sys.exit(1)
+
+    origin = Origin(options, args)
+    try:
+        asyncio.run(Serve(origin, options.host, options.port))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        origin.close()
+
+###########################
+if __name__ == '__main__':
+    try:
+        main()
+    except Exception as err:
+        PrintErrorAndExit('ERROR: %s\n' % str(err))
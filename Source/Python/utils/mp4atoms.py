@@ -0,0 +1,304 @@
+__author__    = 'Gilles Boccon-Gibod (bok@bok.net)'
+__copyright__ = 'Copyright 2011-2020 Axiomatic Systems, LLC.'
+
+###
+# Binary MP4 atom parsing and serialization helpers.
+# These work directly on bytes, without running the Bento4 command line
+# tools, for the cases where only a few atoms need to be read or patched.
+
+import struct
+
+CONTAINER_ATOMS = {'moov', 'trak', 'mdia', 'minf', 'stbl', 'mvex', 'moof', 'traf', 'dinf', 'edts', 'mfra', 'sinf', 'schi'}
+
+# tfhd flags
+TFHD_BASE_DATA_OFFSET_PRESENT         = 0x000001
+TFHD_SAMPLE_DESCRIPTION_INDEX_PRESENT = 0x000002
+TFHD_DEFAULT_SAMPLE_DURATION_PRESENT  = 0x000008
+TFHD_DEFAULT_SAMPLE_SIZE_PRESENT      = 0x000010
+TFHD_DEFAULT_SAMPLE_FLAGS_PRESENT     = 0x000020
+TFHD_DURATION_IS_EMPTY                = 0x010000
+TFHD_DEFAULT_BASE_IS_MOOF             = 0x020000
+
+# trun flags
+TRUN_DATA_OFFSET_PRESENT                     = 0x000001
+TRUN_FIRST_SAMPLE_FLAGS_PRESENT              = 0x000004
+TRUN_SAMPLE_DURATION_PRESENT                 = 0x000100
+TRUN_SAMPLE_SIZE_PRESENT                     = 0x000200
+TRUN_SAMPLE_FLAGS_PRESENT                    = 0x000400
+TRUN_SAMPLE_COMPOSITION_TIME_OFFSET_PRESENT  = 0x000800
+
+# sample flags
+SAMPLE_FLAG_IS_NON_SYNC = 0x00010000
+
+# struct formats of the tfra traf/trun/sample numbers, by size in bytes
+TFRA_NUMBER_FORMATS = {1: 'B', 2: 'H', 3: '3s', 4: 'I'}
+
+class Atom:
+    """An atom, with either a raw payload or a list of child atoms.
+
+    For atoms parsed from a buffer, position is the offset of the atom in
+    that buffer and size is the size of the atom as it was parsed.
+    """
+    def __init__(self, type, payload=b'', children=None, position=0, size=None):
+        self.type     = type
+        self.payload  = payload
+        self.children = children
+        self.position = position
+        self.size     = size
+
+    def FindChild(self, path):
+        atom = self
+        for type in path.split('/'):
+            if atom.children is None:
+                return None
+            atom = next((child for child in atom.children if child.type == type), None)
+            if atom is None:
+                return None
+        return atom
+
+    def FindChildren(self, type):
+        return [child for child in self.children or [] if child.type == type]
+
+    def Serialize(self):
+        if self.children is not None:
+            payload = b''.join([child.Serialize() for child in self.children])
+        else:
+            payload = self.payload
+        return MakeAtom(self.type, payload)
+
+    def GetSize(self):
+        if self.children is not None:
+            payload_size = sum([child.GetSize() for child in self.children])
+        else:
+            payload_size = len(self.payload)
+        return AtomHeaderSize(payload_size) + payload_size
+
+def AtomHeaderSize(payload_size):
+    return 8 if payload_size+8 <= 0xFFFFFFFF else 16
+
+def MakeAtom(type, payload):
+    if AtomHeaderSize(len(payload)) == 8:
+        return struct.pack('>I4s', len(payload)+8, type.encode('latin-1')) + payload
+    else:
+        return struct.pack('>I4sQ', 1, type.encode('latin-1'), len(payload)+16) + payload
+
+def MakeFullAtom(type, version, flags, payload):
+    return MakeAtom(type, struct.pack('>I', (version << 24) | flags) + payload)
+
+def ParseFullAtomHeader(payload):
+    (version_and_flags,) = struct.unpack_from('>I', payload, 0)
+    return (version_and_flags >> 24, version_and_flags & 0xFFFFFF)
+
+def ReadAtomHeader(data, position, end):
+    """Return (type, header_size, size) for the atom at position"""
+    if position+8 > end:
+        raise ValueError('truncated atom header at %d' % position)
+    (size, type) = struct.unpack_from('>I4s', data, position)
+    header_size = 8
+    if size == 1:
+        if position+16 > end:
+            raise ValueError('truncated atom header at %d' % position)
+        (size,) = struct.unpack_from('>Q', data, position+8)
+        header_size = 16
+    elif size == 0:
+        size = end-position
+    if size < header_size or position+size > end:
+        raise ValueError('invalid atom size at %d' % position)
+    return (type.decode('latin-1'), header_size, size)
+
+def ParseAtoms(data, start=0, end=None, containers=CONTAINER_ATOMS):
+    """Parse the atoms in data[start:end], recursing into container atoms"""
+    if end is None:
+        end = len(data)
+    atoms = []
+    position = start
+    while position < end:
+        (type, header_size, size) = ReadAtomHeader(data, position, end)
+        if type in containers:
+            children = ParseAtoms(data, position+header_size, position+size, containers)
+            atom = Atom(type, children=children, position=position, size=size)
+        else:
+            atom = Atom(type, bytes(data[position+header_size:position+size]), position=position, size=size)
+        atoms.append(atom)
+        position += size
+    return atoms
+
+def ScanAtoms(file, start=0, end=None):
+    """Yield (type, position, header_size, size) for the atoms of a file,
+    reading only the atom headers"""
+    if end is None:
+        file.seek(0, 2)
+        end = file.tell()
+    position = start
+    while position < end:
+        file.seek(position)
+        header = file.read(min(16, end-position))
+        (type, header_size, size) = ReadAtomHeader(header, 0, end-position)
+        yield (type, position, header_size, size)
+        position += size
+
+def FindAtom(atoms, path):
+    (type, _, rest) = path.partition('/')
+    for atom in atoms:
+        if atom.type == type:
+            return atom.FindChild(rest) if rest else atom
+    return None
+
+class TrackFragmentHeader:
+    def __init__(self, payload):
+        (self.version, self.flags) = ParseFullAtomHeader(payload)
+        (self.track_id,) = struct.unpack_from('>I', payload, 4)
+        offset = 8
+        self.base_data_offset = None
+        self.sample_description_index = None
+        self.default_sample_duration = None
+        self.default_sample_size = None
+        self.default_sample_flags = None
+        if self.flags & TFHD_BASE_DATA_OFFSET_PRESENT:
+            (self.base_data_offset,) = struct.unpack_from('>Q', payload, offset)
+            offset += 8
+        if self.flags & TFHD_SAMPLE_DESCRIPTION_INDEX_PRESENT:
+            (self.sample_description_index,) = struct.unpack_from('>I', payload, offset)
+            offset += 4
+        if self.flags & TFHD_DEFAULT_SAMPLE_DURATION_PRESENT:
+            (self.default_sample_duration,) = struct.unpack_from('>I', payload, offset)
+            offset += 4
+        if self.flags & TFHD_DEFAULT_SAMPLE_SIZE_PRESENT:
+            (self.default_sample_size,) = struct.unpack_from('>I', payload, offset)
+            offset += 4
+        if self.flags & TFHD_DEFAULT_SAMPLE_FLAGS_PRESENT:
+            (self.default_sample_flags,) = struct.unpack_from('>I', payload, offset)
+            offset += 4
+
+    def Serialize(self):
+        payload = struct.pack('>II', (self.version << 24) | self.flags, self.track_id)
+        if self.flags & TFHD_BASE_DATA_OFFSET_PRESENT:
+            payload += struct.pack('>Q', self.base_data_offset)
+        for (flag, value) in [(TFHD_SAMPLE_DESCRIPTION_INDEX_PRESENT, self.sample_description_index),
+                              (TFHD_DEFAULT_SAMPLE_DURATION_PRESENT,  self.default_sample_duration),
+                              (TFHD_DEFAULT_SAMPLE_SIZE_PRESENT,      self.default_sample_size),
+                              (TFHD_DEFAULT_SAMPLE_FLAGS_PRESENT,     self.default_sample_flags)]:
+            if self.flags & flag:
+                payload += struct.pack('>I', value)
+        return payload
+
+class TrackRun:
+    def __init__(self, payload):
+        (self.version, self.flags) = ParseFullAtomHeader(payload)
+        (sample_count,) = struct.unpack_from('>I', payload, 4)
+        offset = 8
+        self.data_offset = None
+        self.first_sample_flags = None
+        if self.flags & TRUN_DATA_OFFSET_PRESENT:
+            (self.data_offset,) = struct.unpack_from('>i', payload, offset)
+            offset += 4
+        if self.flags & TRUN_FIRST_SAMPLE_FLAGS_PRESENT:
+            (self.first_sample_flags,) = struct.unpack_from('>I', payload, offset)
+            offset += 4
+
+        fields = [(TRUN_SAMPLE_DURATION_PRESENT, 'I'),
+                  (TRUN_SAMPLE_SIZE_PRESENT, 'I'),
+                  (TRUN_SAMPLE_FLAGS_PRESENT, 'I'),
+                  (TRUN_SAMPLE_COMPOSITION_TIME_OFFSET_PRESENT, 'i' if self.version else 'I')]
+        entry_format = '>'+''.join([code for (flag, code) in fields if self.flags & flag])
+        entry_size = struct.calcsize(entry_format)
+        columns = list(zip(*struct.iter_unpack(entry_format, payload[offset:offset+sample_count*entry_size]))) if entry_size else []
+        if entry_size and len(columns[0]) != sample_count:
+            raise ValueError('truncated trun atom')
+        column = 0
+        self.sample_durations = self.sample_sizes = self.sample_flags = self.sample_composition_time_offsets = None
+        for (flag, _), name in zip(fields, ['sample_durations', 'sample_sizes', 'sample_flags', 'sample_composition_time_offsets']):
+            if self.flags & flag:
+                setattr(self, name, list(columns[column]))
+                column += 1
+        self.sample_count = sample_count
+
+    def Serialize(self):
+        payload = struct.pack('>II', (self.version << 24) | self.flags, self.sample_count)
+        if self.flags & TRUN_DATA_OFFSET_PRESENT:
+            payload += struct.pack('>i', self.data_offset)
+        if self.flags & TRUN_FIRST_SAMPLE_FLAGS_PRESENT:
+            payload += struct.pack('>I', self.first_sample_flags)
+        columns = [values for values in [self.sample_durations, self.sample_sizes, self.sample_flags, self.sample_composition_time_offsets] if values is not None]
+        if columns:
+            entry_format = 'I' * (len(columns)-1)
+            entry_format += 'i' if self.version and self.sample_composition_time_offsets is not None else 'I'
+            payload += b''.join([struct.pack('>'+entry_format, *entry) for entry in zip(*columns)])
+        return payload
+
+class TrackExtends:
+    def __init__(self, payload):
+        (self.track_id,
+         self.default_sample_description_index,
+         self.default_sample_duration,
+         self.default_sample_size,
+         self.default_sample_flags) = struct.unpack_from('>IIIII', payload, 4)
+
+class SegmentIndex:
+    def __init__(self, payload):
+        (self.version, self.flags) = ParseFullAtomHeader(payload)
+        if self.version == 0:
+            (self.reference_id, self.timescale, self.earliest_presentation_time, self.first_offset) = struct.unpack_from('>IIII', payload, 4)
+            offset = 20
+        else:
+            (self.reference_id, self.timescale, self.earliest_presentation_time, self.first_offset) = struct.unpack_from('>IIQQ', payload, 4)
+            offset = 28
+        (reference_count,) = struct.unpack_from('>2xH', payload, offset)
+        offset += 4
+        if offset+12*reference_count > len(payload):
+            raise ValueError('truncated sidx atom')
+
+        # each reference is (reference_type, referenced_size, subsegment_duration, starts_with_sap, sap_type, sap_delta_time)
+        self.references = []
+        for (type_and_size, subsegment_duration, sap) in struct.iter_unpack('>III', payload[offset:offset+12*reference_count]):
+            self.references.append((type_and_size >> 31, type_and_size & 0x7FFFFFFF, subsegment_duration,
+                                    sap >> 31, (sap >> 28) & 0x7, sap & 0x0FFFFFFF))
+
+class TrackFragmentRandomAccess:
+    def __init__(self, payload):
+        (self.version, self.flags) = ParseFullAtomHeader(payload)
+        (self.track_id, lengths, entry_count) = struct.unpack_from('>III', payload, 4)
+        offset = 16
+        number_sizes = [((lengths >> shift) & 0x3)+1 for shift in [4, 2, 0]]
+        entry_format = '>' + ('QQ' if self.version else 'II') + ''.join([TFRA_NUMBER_FORMATS[size] for size in number_sizes])
+        entry_size = struct.calcsize(entry_format)
+        if offset+entry_size*entry_count > len(payload):
+            raise ValueError('truncated tfra atom')
+
+        # each entry is (time, moof_offset, traf_number, trun_number, sample_number)
+        self.entries = []
+        for entry in struct.iter_unpack(entry_format, payload[offset:offset+entry_size*entry_count]):
+            self.entries.append(tuple([int.from_bytes(value, 'big') if isinstance(value, bytes) else value for value in entry]))
+
+def GetTrackId(trak):
+    tkhd = trak.FindChild('tkhd')
+    (version, _) = ParseFullAtomHeader(tkhd.payload)
+    return struct.unpack_from('>I', tkhd.payload, 20 if version else 12)[0]
+
+def GetTrackIds(data):
+    """Return the IDs of the tracks of an MP4 file or init segment"""
+    moov = FindAtom(ParseAtoms(data, containers={'moov', 'trak'}), 'moov')
+    if moov is None:
+        raise ValueError('no moov atom found')
+    return [GetTrackId(trak) for trak in moov.FindChildren('trak')]
+
+#############################################
+# Module Exports
+#############################################
+__all__ = [
+    'Atom',
+    'MakeAtom',
+    'MakeFullAtom',
+    'ParseFullAtomHeader',
+    'ReadAtomHeader',
+    'ParseAtoms',
+    'ScanAtoms',
+    'FindAtom',
+    'TrackFragmentHeader',
+    'TrackRun',
+    'TrackExtends',
+    'SegmentIndex',
+    'TrackFragmentRandomAccess',
+    'GetTrackId',
+    'GetTrackIds'
+]
@@ -0,0 +1,395 @@
+__author__    = 'Gilles Boccon-Gibod (bok@bok.net)'
+__copyright__ = 'Copyright 2011-2020 Axiomatic Systems, LLC.'
+
+###
+# In-process MPEG Common Encryption ('cenc' scheme, AES-CTR) of fragmented
+# MP4 init and media segments.
+# The output layout follows what mp4encrypt --method MPEG-CENC produces:
+# 16-byte IVs, 'senc'/'saiz'/'saio' atoms appended to each 'traf', and, for
+# AVC/HEVC video, subsample encryption of whole blocks of the VCL NAL units.
+
+import os
+import struct
+import aes
+from mp4atoms import *
+from mp4atoms import TFHD_DEFAULT_BASE_IS_MOOF
+
+CENC_NAL_UNIT_ENCRYPTION_MIN_SIZE = 112
+CENC_IV_SIZE = 16
+
+AVC_SAMPLE_FORMATS  = {'avc1', 'avc2', 'avc3', 'avc4', 'dvav', 'dva1'}
+HEVC_SAMPLE_FORMATS = {'hev1', 'hvc1', 'dvhe', 'dvh1'}
+
+VISUAL_SAMPLE_ENTRY_SIZE = 78
+AUDIO_SAMPLE_ENTRY_SIZE  = 28
+
+class CencTrack:
+    def __init__(self, track_id, nal_type, nalu_length_size):
+        self.track_id         = track_id
+        self.nal_type         = nal_type
+        self.nalu_length_size = nalu_length_size
+        self.trex             = None
+
+    def GetSubSampleMap(self, sample):
+        # same layout as the Bento4 'advanced' subsample mapper
+        clear_sizes = []
+        encrypted_sizes = []
+        def AppendEntry(clear_size, encrypted_size):
+            if clear_sizes and encrypted_sizes[-1] == 0:
+                clear_size += clear_sizes.pop()
+                encrypted_sizes.pop()
+            while clear_size > 0xFFFF:
+                clear_sizes.append(0xFFFF)
+                encrypted_sizes.append(0)
+                clear_size -= 0xFFFF
+            clear_sizes.append(clear_size)
+            encrypted_sizes.append(encrypted_size)
+
+        length_size = self.nalu_length_size
+        position = 0
+        end = len(sample)
+        while end-position > 1+length_size:
+            nalu_size = length_size+int.from_bytes(sample[position:position+length_size], 'big')
+            if position+nalu_size > end:
+                raise ValueError('invalid NAL unit size')
+            nalu_header = sample[position+length_size]
+            if nalu_size < CENC_NAL_UNIT_ENCRYPTION_MIN_SIZE:
+                skip = True
+            elif self.nal_type == 'avc':
+                skip = (nalu_header & 0x1F) not in (1, 2, 3, 4, 5)
+            else:
+                skip = ((nalu_header >> 1) & 0x3F) >= 32
+            if skip:
+                AppendEntry(nalu_size, 0)
+            else:
+                encrypted_size = nalu_size-(CENC_NAL_UNIT_ENCRYPTION_MIN_SIZE-16)
+                encrypted_size -= encrypted_size % 16
+                AppendEntry(nalu_size-encrypted_size, encrypted_size)
+            position += nalu_size
+        if position < end:
+            AppendEntry(end-position, 0)
+
+        return (clear_sizes, encrypted_sizes)
+
+def CheckEncryptionBackend():
+    # the pure python AES fallback is orders of magnitude too slow to encrypt media
+    if aes.Cipher is None:
+        raise Exception("ERROR: encrypting requires the 'cryptography' Python module (pip install cryptography)")
+
+class CencEncryptor:
+    """Encrypts the segments of one fragmented MP4 stream with a single KID/key.
+
+    ProcessInitSegment must be called first. After that, media segments may be
+    processed concurrently, from any thread.
+    """
+    def __init__(self, kid, key, track_ids=None, iv=None):
+        if len(kid) != 16 or len(key) != 16:
+            raise ValueError('KID and key must be 16 bytes')
+        if iv is not None and len(iv) not in (8, 16):
+            raise ValueError('IV must be 8 or 16 bytes')
+        self.kid       = kid
+        self.iv        = iv
+        self.cipher    = aes.ecb(key)
+        self.track_ids = track_ids
+        self.tracks    = {}
+
+    def ProcessInitSegment(self, data):
+        atoms = ParseAtoms(data)
+        moov = FindAtom(atoms, 'moov')
+        if moov is None:
+            raise ValueError('no moov atom found in init segment')
+
+        for trak in moov.FindChildren('trak'):
+            track_id = GetTrackId(trak)
+            if self.track_ids is not None and track_id not in self.track_ids:
+                continue
+            hdlr = trak.FindChild('mdia/hdlr')
+            stsd = trak.FindChild('mdia/minf/stbl/stsd')
+            if hdlr is None or stsd is None:
+                continue
+            handler_type = hdlr.payload[8:12].decode('latin-1')
+            if handler_type not in ('vide', 'soun'):
+                continue
+            (stsd.payload, track) = self.ProcessSampleDescriptions(track_id, handler_type, stsd.payload)
+            self.tracks[track_id] = track
+
+        mvex = moov.FindChild('mvex')
+        if mvex is not None:
+            for trex_atom in mvex.FindChildren('trex'):
+                trex = TrackExtends(trex_atom.payload)
+                if trex.track_id in self.tracks:
+                    self.tracks[trex.track_id].trex = trex
+
+        # signal the 'iso6' brand (needed for the 'senc' atom)
+        ftyp = FindAtom(atoms, 'ftyp')
+        if ftyp is not None:
+            compatible_brands = [ftyp.payload[i:i+4] for i in range(8, len(ftyp.payload), 4)]
+            if b'iso6' not in compatible_brands:
+                ftyp.payload += b'iso6'
+
+        return b''.join([atom.Serialize() for atom in atoms])
+
+    def ProcessSampleDescriptions(self, track_id, handler_type, payload):
+        (entry_count,) = struct.unpack_from('>I', payload, 4)
+        entries = []
+        nal_type = None
+        nalu_length_size = None
+        position = 8
+        for _ in range(entry_count):
+            (format, header_size, size) = ReadAtomHeader(payload, position, len(payload))
+            body = payload[position+header_size:position+size]
+            position += size
+            if format in ('encv', 'enca'):
+                raise ValueError('track %d is already encrypted' % track_id)
+
+            if handler_type == 'vide':
+                if format in AVC_SAMPLE_FORMATS:
+                    nal_type = 'avc'
+                    config = FindAtom(ParseAtoms(body, VISUAL_SAMPLE_ENTRY_SIZE, containers={}), 'avcC')
+                    if config is not None:
+                        nalu_length_size = (config.payload[4] & 3)+1
+                elif format in HEVC_SAMPLE_FORMATS:
+                    nal_type = 'hevc'
+                    config = FindAtom(ParseAtoms(body, VISUAL_SAMPLE_ENTRY_SIZE, containers={}), 'hvcC')
+                    if config is not None:
+                        nalu_length_size = (config.payload[21] & 3)+1
+                else:
+                    raise ValueError('unsupported video format for encryption: '+format)
+                if nalu_length_size is None:
+                    raise ValueError('no decoder configuration found for track %d' % track_id)
+                encrypted_format = 'encv'
+            else:
+                encrypted_format = 'enca'
+
+            sinf = MakeAtom('sinf',
+                            MakeAtom('frma', format.encode('latin-1')) +
+                            MakeFullAtom('schm', 0, 0, b'cenc'+struct.pack('>I', 0x10000)) +
+                            MakeAtom('schi', MakeFullAtom('tenc', 0, 0, struct.pack('>BBBB', 0, 0, 1, CENC_IV_SIZE)+self.kid)))
+            entries.append(MakeAtom(encrypted_format, body+sinf))
+
+        return (payload[:8]+b''.join(entries)+payload[position:], CencTrack(track_id, nal_type, nalu_length_size))
+
+    def ProcessMediaSegment(self, data):
+        data = bytearray(data)
+        atoms = ParseAtoms(data, containers={'moof', 'traf'})
+
+        # encrypt the samples in place and rebuild the 'moof' atoms
+        # (like with mp4encrypt, each track starts with a new IV in each segment)
+        ivs = {}
+        output_position = 0
+        moof_deltas = []
+        for atom in atoms:
+            if atom.type == 'moof':
+                size = self.ProcessFragment(data, atom, output_position, ivs)
+                moof_deltas.append((atom.position, size-atom.size))
+                output_position += size
+            else:
+                output_position += atom.size
+
+        # segment indexes must account for the moof size changes
+        output = []
+        for atom in atoms:
+            if atom.type == 'moof':
+                output.append(atom.Serialize())
+            elif atom.type == 'sidx':
+                output.append(MakeAtom('sidx', UpdateSegmentIndex(atom, moof_deltas)))
+            elif atom.type == 'mfra':
+                output.append(UpdateRandomAccessIndex(bytes(data[atom.position:atom.position+atom.size]), moof_deltas))
+            else:
+                output.append(bytes(data[atom.position:atom.position+atom.size]))
+        return b''.join(output)
+
+    def ProcessFragment(self, data, moof, output_position, ivs):
+        # returns the size of the updated moof atom
+        trafs = []
+        data_end = moof.position
+        for traf in moof.FindChildren('traf'):
+            tfhd = TrackFragmentHeader(traf.FindChild('tfhd').payload)
+            if tfhd.base_data_offset is not None:
+                base = tfhd.base_data_offset
+            elif tfhd.flags & TFHD_DEFAULT_BASE_IS_MOOF or not trafs:
+                base = moof.position
+            else:
+                base = data_end
+            track = self.tracks.get(tfhd.track_id)
+            truns = [(atom, TrackRun(atom.payload)) for atom in traf.FindChildren('trun')]
+            data_end = self.ProcessTrackFragment(data, traf, tfhd, truns, track, base, ivs)
+            trafs.append((traf, tfhd, truns, track))
+
+        new_size = moof.GetSize()
+        delta = new_size-moof.size
+        output_moof_position = output_position
+
+        # fix the data offsets and the auxiliary information offsets
+        offset = 8
+        for child in moof.children:
+            if child.type == 'traf':
+                (traf, tfhd, truns, track) = next(entry for entry in trafs if entry[0] is child)
+                if tfhd.base_data_offset is not None:
+                    tfhd.base_data_offset += output_moof_position+new_size-(moof.position+moof.size)
+                    traf.FindChild('tfhd').payload = tfhd.Serialize()
+                else:
+                    for (trun_atom, trun) in truns:
+                        if trun.data_offset is not None:
+                            trun.data_offset += delta
+                            trun_atom.payload = trun.Serialize()
+                if track is not None:
+                    senc_offset = offset+8
+                    for traf_child in traf.children:
+                        if traf_child.type == 'senc':
+                            break
+                        senc_offset += traf_child.GetSize()
+                    senc_offset += 12+4
+                    saio = traf.FindChild('saio')
+                    if tfhd.base_data_offset is not None:
+                        # absolute offsets: use a version 1 saio (the atom size is the same)
+                        saio.payload = struct.pack('>IIQ', 1 << 24, 1, output_moof_position+senc_offset)
+                    else:
+                        saio.payload = struct.pack('>III', 0, 1, senc_offset)
+            offset += child.GetSize()
+
+        return new_size
+
+    def ProcessTrackFragment(self, data, traf, tfhd, truns, track, base, ivs):
+        # encrypts the samples of a track fragment, and returns the end of its sample data
+        trex = track.trex if track is not None else None
+        data_end = base
+        sample_infos = []
+        for (_, trun) in truns:
+            position = base+trun.data_offset if trun.data_offset is not None else data_end
+            if trun.sample_sizes is not None:
+                sizes = trun.sample_sizes
+            elif tfhd.default_sample_size is not None:
+                sizes = [tfhd.default_sample_size]*trun.sample_count
+            elif trex is not None:
+                sizes = [trex.default_sample_size]*trun.sample_count
+            else:
+                raise ValueError('no sample size for track %d' % tfhd.track_id)
+            if track is not None:
+                for size in sizes:
+                    if position+size > len(data):
+                        raise ValueError('sample data out of range')
+                    sample_infos.append(self.EncryptSample(data, position, size, track, ivs))
+                    position += size
+            else:
+                position += sum(sizes)
+            data_end = position
+
+        if track is None:
+            return data_end
+        if traf.FindChild('senc') is not None or traf.FindChild('saiz') is not None:
+            raise ValueError('track %d is already encrypted' % tfhd.track_id)
+
+        use_subsamples = track.nalu_length_size is not None
+        if use_subsamples:
+            saiz = struct.pack('>BI', 0, len(sample_infos)) + bytes([len(info) for info in sample_infos])
+        else:
+            saiz = struct.pack('>BI', CENC_IV_SIZE, len(sample_infos))
+        if tfhd.base_data_offset is not None:
+            saio = struct.pack('>IIQ', 1 << 24, 1, 0)
+        else:
+            saio = struct.pack('>III', 0, 1, 0)
+        traf.children += [
+            Atom('saiz', struct.pack('>I', 0)+saiz),
+            Atom('saio', saio),
+            Atom('senc', struct.pack('>II', 2 if use_subsamples else 0, len(sample_infos))+b''.join(sample_infos))
+        ]
+        return data_end
+
+    def EncryptSample(self, data, position, size, track, ivs):
+        # the 64-bit counter part of the IV advances by the number of encrypted blocks
+        iv = ivs.get(track.track_id)
+        if iv is None:
+            if self.iv is None:
+                iv = os.urandom(8)+bytes(8)
+            else:
+                iv = (self.iv+bytes(8))[:16]
+        sample = data[position:position+size]
+        if track.nalu_length_size is None:
+            data[position:position+size] = self.cipher.ctr(iv, sample)
+            ivs[track.track_id] = NextIv(iv, size)
+            return iv
+
+        (clear_sizes, encrypted_sizes) = track.GetSubSampleMap(sample)
+        ranges = []
+        offset = position
+        for (clear_size, encrypted_size) in zip(clear_sizes, encrypted_sizes):
+            offset += clear_size
+            if encrypted_size:
+                ranges.append((offset, encrypted_size))
+            offset += encrypted_size
+        if ranges:
+            encrypted = self.cipher.ctr(iv, b''.join([data[start:start+length] for (start, length) in ranges]))
+            cursor = 0
+            for (start, length) in ranges:
+                data[start:start+length] = encrypted[cursor:cursor+length]
+                cursor += length
+        ivs[track.track_id] = NextIv(iv, sum(encrypted_sizes))
+
+        return iv+struct.pack('>H', len(clear_sizes))+b''.join([struct.pack('>HI', clear_size, encrypted_size)
+                                                               for (clear_size, encrypted_size) in zip(clear_sizes, encrypted_sizes)])
+
+def NextIv(iv, encrypted_size):
+    counter = (int.from_bytes(iv[8:16], 'big')+(encrypted_size+15)//16) & 0xFFFFFFFFFFFFFFFF
+    return iv[0:8]+counter.to_bytes(8, 'big')
+
+def UpdateSegmentIndex(sidx, moof_deltas):
+    # grow each reference by the size change of the moof atoms it contains
+    payload = bytearray(sidx.payload)
+    (version, _) = ParseFullAtomHeader(payload)
+    if version == 0:
+        (first_offset,) = struct.unpack_from('>I', payload, 16)
+        offset = 20
+    else:
+        (first_offset,) = struct.unpack_from('>Q', payload, 20)
+        offset = 28
+    (reference_count,) = struct.unpack_from('>H', payload, offset+2)
+    offset += 4
+
+    def Growth(start, end):
+        return sum([delta for (position, delta) in moof_deltas if start <= position < end])
+
+    anchor = sidx.position+sidx.size
+    growth = Growth(anchor, anchor+first_offset)
+    if growth:
+        if version == 0:
+            struct.pack_into('>I', payload, 16, first_offset+growth)
+        else:
+            struct.pack_into('>Q', payload, 20, first_offset+growth)
+    start = anchor+first_offset
+    for _ in range(reference_count):
+        (reference,) = struct.unpack_from('>I', payload, offset)
+        referenced_size = reference & 0x7FFFFFFF
+        growth = Growth(start, start+referenced_size)
+        struct.pack_into('>I', payload, offset, (reference & 0x80000000) | (referenced_size+growth))
+        start += referenced_size
+        offset += 12
+
+    return bytes(payload)
+
+def UpdateRandomAccessIndex(mfra_data, moof_deltas):
+    # shift the moof offsets by the size change of the moof atoms that precede them
+    mfra = ParseAtoms(mfra_data)[0]
+    for tfra in mfra.FindChildren('tfra'):
+        payload = bytearray(tfra.payload)
+        (version, _) = ParseFullAtomHeader(payload)
+        (length_sizes, entry_count) = struct.unpack_from('>II', payload, 8)
+        field_size = 8 if version else 4
+        field_format = '>Q' if version else '>I'
+        entry_size = 2*field_size+((length_sizes >> 4) & 3)+((length_sizes >> 2) & 3)+(length_sizes & 3)+3
+        offset = 16
+        for _ in range(entry_count):
+            (moof_offset,) = struct.unpack_from(field_format, payload, offset+field_size)
+            shift = sum([delta for (position, delta) in moof_deltas if position < moof_offset])
+            struct.pack_into(field_format, payload, offset+field_size, moof_offset+shift)
+            offset += entry_size
+        tfra.payload = bytes(payload)
+    return mfra.Serialize()
+
+#############################################
+# Module Exports
+#############################################
+__all__ = [
+    'CheckEncryptionBackend',
+    'CencEncryptor'
+]
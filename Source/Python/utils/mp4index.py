@@ -0,0 +1,151 @@
+__author__    = 'Gilles Boccon-Gibod (bok@bok.net)'
+__copyright__ = 'Copyright 2011-2020 Axiomatic Systems, LLC.'
+
+###
+# Segment index sidecar files.
+# A segment index is a fixed-width binary table of the segments of one track
+# of a fragmented MP4 file, sorted by time, that an origin server can map in
+# memory and binary-search to find the byte range of the segment at a given
+# time, without parsing the MP4 file. All the values are little-endian.
+#
+# header (32 bytes):
+#   magic           4 bytes ('B4SX')
+#   version         u16
+#   record size     u16
+#   track id        u32
+#   timescale       u32
+#   record count    u64
+#   reserved        u64
+#
+# records (32 bytes each):
+#   start time      u64 (decode time of the first sample, in the track timescale)
+#   byte offset     u64 (of the moof atom, in the media file)
+#   byte length     u64 (of the moof atom and the atoms that follow it, up to and including the mdat atom)
+#   duration        u32 (in the track timescale)
+#   flags           u32 (SEGMENT_INDEX_FLAG_SYNC if the first sample of the segment is a sync sample)
+
+import collections
+import struct
+import mmap
+
+SEGMENT_INDEX_MAGIC         = b'B4SX'
+SEGMENT_INDEX_VERSION       = 1
+SEGMENT_INDEX_HEADER_FORMAT = '<4sHHIIQ8x'
+SEGMENT_INDEX_RECORD_FORMAT = '<QQQII'
+SEGMENT_INDEX_HEADER_SIZE   = struct.calcsize(SEGMENT_INDEX_HEADER_FORMAT)
+SEGMENT_INDEX_RECORD_SIZE   = struct.calcsize(SEGMENT_INDEX_RECORD_FORMAT)
+SEGMENT_INDEX_FLAG_SYNC     = 0x00000001
+
+SegmentIndexRecord = collections.namedtuple('SegmentIndexRecord', ['start_time', 'duration', 'offset', 'size', 'is_sync'])
+
+def MakeSegmentIndex(track_id, timescale, records):
+    """Serialize a segment index, from a list of SegmentIndexRecord sorted by start time"""
+    data = [struct.pack(SEGMENT_INDEX_HEADER_FORMAT,
+                        SEGMENT_INDEX_MAGIC,
+                        SEGMENT_INDEX_VERSION,
+                        SEGMENT_INDEX_RECORD_SIZE,
+                        track_id,
+                        timescale,
+                        len(records))]
+    for record in records:
+        data.append(struct.pack(SEGMENT_INDEX_RECORD_FORMAT,
+                                record.start_time,
+                                record.offset,
+                                record.size,
+                                record.duration,
+                                SEGMENT_INDEX_FLAG_SYNC if record.is_sync else 0))
+    return b''.join(data)
+
+def GetTrackSegmentIndexRecords(track):
+    """Return the SegmentIndexRecord list of a loaded Mp4Track"""
+    return [SegmentIndexRecord(start_time, duration, offset, size, is_sync)
+            for (start_time, duration, (offset, size), is_sync) in zip(track.segment_start_times,
+                                                                     track.segment_scaled_durations,
+                                                                     track.get_segment_byte_ranges(),
+                                                                     track.segment_sync_flags)]
+
+def WriteTrackSegmentIndex(filename, track):
+    with open(filename, 'wb') as f:
+        f.write(MakeSegmentIndex(track.id, track.timescale, GetTrackSegmentIndexRecords(track)))
+
+class SegmentIndexFile:
+    """
+    A memory-mapped segment index. Records are only decoded when accessed, so
+    opening an index and looking up a time is O(log n) regardless of its size.
+    """
+    def __init__(self, filename):
+        with open(filename, 'rb') as f:
+            self.data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            if len(self.data) < SEGMENT_INDEX_HEADER_SIZE:
+                raise ValueError('truncated segment index header')
+            (magic, version, record_size, self.track_id, self.timescale, self.record_count) = \
+                struct.unpack_from(SEGMENT_INDEX_HEADER_FORMAT, self.data, 0)
+            if magic != SEGMENT_INDEX_MAGIC:
+                raise ValueError('not a segment index')
+            if version != SEGMENT_INDEX_VERSION:
+                raise ValueError('unsupported segment index version %d' % version)
+            # later versions may only append fields to the records
+            if record_size < SEGMENT_INDEX_RECORD_SIZE:
+                raise ValueError('invalid segment index record size %d' % record_size)
+            if SEGMENT_INDEX_HEADER_SIZE+self.record_count*record_size > len(self.data):
+                raise ValueError('truncated segment index')
+            self.record_size = record_size
+        except ValueError:
+            self.close()
+            raise
+
+    def close(self):
+        self.data.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __len__(self):
+        return self.record_count
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += self.record_count
+        if index < 0 or index >= self.record_count:
+            raise IndexError('segment index out of range')
+        (start_time, offset, size, duration, flags) = struct.unpack_from(SEGMENT_INDEX_RECORD_FORMAT, self.data,
+                                                                         SEGMENT_INDEX_HEADER_SIZE+index*self.record_size)
+        return SegmentIndexRecord(start_time, duration, offset, size, (flags & SEGMENT_INDEX_FLAG_SYNC) != 0)
+
+    def get_start_time(self, index):
+        return struct.unpack_from('<Q', self.data, SEGMENT_INDEX_HEADER_SIZE+index*self.record_size)[0]
+
+    def find(self, time):
+        """
+        Return the index of the segment that contains a time (in the track
+        timescale), or None if the time is outside of the track.
+        """
+        low = 0
+        high = self.record_count
+        while low < high:
+            middle = (low+high)//2
+            if self.get_start_time(middle) <= time:
+                low = middle+1
+            else:
+                high = middle
+        if low == 0:
+            return None
+        record = self[low-1]
+        if time >= record.start_time+record.duration:
+            return None
+        return low-1
+
+#############################################
+# Module Exports
+#############################################
+__all__ = [
+    'SegmentIndexRecord',
+    'MakeSegmentIndex',
+    'GetTrackSegmentIndexRecords',
+    'WriteTrackSegmentIndex',
+    'SegmentIndexFile'
+]
@@ -0,0 +1,447 @@
+#! /usr/bin/env python3
+
+__author__    = 'Gilles Boccon-Gibod (bok@bok.net)'
+__copyright__ = 'Copyright 2011-2020 Axiomatic Systems, LLC.'
+
+###
+# Synthetic fragmented MP4 generator.
+# Writes valid fragmented MP4 files (H.264 video and AAC audio tracks with
+# dummy sample payloads), with a configurable number of tracks, timescales,
+# fragment durations, sample sizes and sync sample pattern, without any
+# source media or external tool. The files are meant for stress testing and
+# benchmarking the parsers and packagers on realistic structures.
+
+from optparse import OptionParser
+import sys
+import struct
+import heapq
+import random
+
+from mp4atoms import MakeAtom, MakeFullAtom, TFHD_DEFAULT_BASE_IS_MOOF, TFHD_DEFAULT_SAMPLE_DURATION_PRESENT, \
+                     TFHD_DEFAULT_SAMPLE_SIZE_PRESENT, TFHD_DEFAULT_SAMPLE_FLAGS_PRESENT, TRUN_DATA_OFFSET_PRESENT, \
+                     TRUN_FIRST_SAMPLE_FLAGS_PRESENT, TRUN_SAMPLE_SIZE_PRESENT, TRUN_SAMPLE_FLAGS_PRESENT
+
+SYNC_SAMPLE_FLAGS     = 0x02000000 # depends on no other sample
+NON_SYNC_SAMPLE_FLAGS = 0x01010000 # depends on other samples, not a sync sample
+
+MOVIE_TIMESCALE        = 1000
+MAX_FRAGMENT_COUNT     = 100000
+AAC_SAMPLING_FREQUENCIES = [96000, 88200, 64000, 48000, 44100, 32000, 24000, 22050, 16000, 12000, 11025, 8000, 7350]
+
+#############################################
+class BitWriter:
+    def __init__(self):
+        self.bits = []
+
+    def Write(self, value, bit_count):
+        self.bits += [(value >> (bit_count-1-i)) & 1 for i in range(bit_count)]
+
+    def WriteUnsignedGolomb(self, value):
+        value += 1
+        bit_count = value.bit_length()
+        self.Write(0, bit_count-1)
+        self.Write(value, bit_count)
+
+    def WriteSignedGolomb(self, value):
+        self.WriteUnsignedGolomb(2*value-1 if value > 0 else -2*value)
+
+    def GetRbsp(self):
+        # rbsp_stop_one_bit, then pad to a byte boundary
+        bits = self.bits+[1]
+        bits += [0]*(-len(bits) % 8)
+        return bytes([int(''.join([str(bit) for bit in bits[i:i+8]]), 2) for i in range(0, len(bits), 8)])
+
+def EscapeNalUnit(payload):
+    # insert emulation prevention bytes
+    escaped = bytearray()
+    zeros = 0
+    for byte in payload:
+        if zeros >= 2 and byte <= 3:
+            escaped.append(3)
+            zeros = 0
+        escaped.append(byte)
+        zeros = zeros+1 if byte == 0 else 0
+    return bytes(escaped)
+
+def MakeAvcParameterSets(width, height, profile=66, level=31):
+    # baseline profile SPS and PPS, with cropping for sizes that are not multiples of 16
+    sps = BitWriter()
+    sps.Write(profile, 8)
+    sps.Write(0xC0, 8) # constraint_set0_flag, constraint_set1_flag
+    sps.Write(level, 8)
+    sps.WriteUnsignedGolomb(0) # seq_parameter_set_id
+    sps.WriteUnsignedGolomb(0) # log2_max_frame_num_minus4
+    sps.WriteUnsignedGolomb(2) # pic_order_cnt_type
+    sps.WriteUnsignedGolomb(1) # max_num_ref_frames
+    sps.Write(0, 1)            # gaps_in_frame_num_value_allowed_flag
+    sps.WriteUnsignedGolomb((width+15)//16-1)
+    sps.WriteUnsignedGolomb((height+15)//16-1)
+    sps.Write(1, 1)            # frame_mbs_only_flag
+    sps.Write(1, 1)            # direct_8x8_inference_flag
+    crop_right  = ((width+15)//16*16-width)//2
+    crop_bottom = ((height+15)//16*16-height)//2
+    if crop_right or crop_bottom:
+        sps.Write(1, 1)
+        for crop in [0, crop_right, 0, crop_bottom]:
+            sps.WriteUnsignedGolomb(crop)
+    else:
+        sps.Write(0, 1)
+    sps.Write(0, 1)            # vui_parameters_present_flag
+
+    pps = BitWriter()
+    pps.WriteUnsignedGolomb(0) # pic_parameter_set_id
+    pps.WriteUnsignedGolomb(0) # seq_parameter_set_id
+    pps.Write(0, 1)            # entropy_coding_mode_flag
+    pps.Write(0, 1)            # bottom_field_pic_order_in_frame_present_flag
+    pps.WriteUnsignedGolomb(0) # num_slice_groups_minus1
+    pps.WriteUnsignedGolomb(0) # num_ref_idx_l0_default_active_minus1
+    pps.WriteUnsignedGolomb(0) # num_ref_idx_l1_default_active_minus1
+    pps.Write(0, 1)            # weighted_pred_flag
+    pps.Write(0, 2)            # weighted_bipred_idc
+    pps.WriteSignedGolomb(0)   # pic_init_qp_minus26
+    pps.WriteSignedGolomb(0)   # pic_init_qs_minus26
+    pps.WriteSignedGolomb(0)   # chroma_qp_index_offset
+    pps.Write(1, 1)            # deblocking_filter_control_present_flag
+    pps.Write(0, 1)            # constrained_intra_pred_flag
+    pps.Write(0, 1)            # redundant_pic_cnt_present_flag
+
+    return (bytes([0x67])+EscapeNalUnit(sps.GetRbsp()), bytes([0x68])+EscapeNalUnit(pps.GetRbsp()))
+
+#############################################
+def ParseSampleSizeDistribution(spec):
+    """
+    Return a function (rng, sample_index) -> sample size for a distribution
+    spec: 'constant:<size>', 'uniform:<min>:<max>' or 'normal:<mean>:<stddev>'
+    """
+    fields = spec.split(':')
+    try:
+        values = [int(field) for field in fields[1:]]
+    except ValueError:
+        raise Exception('invalid sample size distribution "'+spec+'"')
+    if fields[0] == 'constant' and len(values) == 1:
+        size = values[0]
+        return lambda rng, index: size
+    elif fields[0] == 'uniform' and len(values) == 2:
+        return lambda rng, index: rng.randint(values[0], values[1])
+    elif fields[0] == 'normal' and len(values) == 2:
+        return lambda rng, index: int(rng.gauss(values[0], values[1]))
+    raise Exception('invalid sample size distribution "'+spec+'"')
+
+class TrackSpec:
+    """
+    Description of a synthetic track. sample_size is either a distribution
+    spec (see ParseSampleSizeDistribution) or a function (rng, sample_index)
+    -> size. A sample is a sync sample when its index is a multiple of
+    sync_interval (by default, the first sample of each fragment of a video
+    track, and all the samples of an audio track).
+    """
+    def __init__(self, type='video', timescale=None, sample_duration=None, fragment_duration=2.0, samples_per_fragment=None,
+                 sample_size=None, sync_interval=None, width=1280, height=720, frame_rate=30, sample_rate=48000, channels=2,
+                 language='und'):
+        if type not in ['video', 'audio']:
+            raise Exception('unsupported track type "'+type+'"')
+        self.type        = type
+        self.width       = width
+        self.height      = height
+        self.sample_rate = sample_rate
+        self.channels    = channels
+        self.language    = language
+        if type == 'video':
+            self.timescale       = timescale or 90000
+            self.sample_duration = sample_duration or int(round(self.timescale/float(frame_rate)))
+            sample_size          = sample_size or 'uniform:2000:20000'
+        else:
+            if sample_rate not in AAC_SAMPLING_FREQUENCIES:
+                raise Exception('unsupported audio sample rate %d' % sample_rate)
+            self.timescale       = timescale or sample_rate
+            self.sample_duration = sample_duration or 1024*self.timescale//sample_rate
+            sample_size          = sample_size or 'uniform:300:400'
+        self.sample_size = ParseSampleSizeDistribution(sample_size) if isinstance(sample_size, str) else sample_size
+        self.samples_per_fragment = samples_per_fragment or max(1, int(round(fragment_duration*self.timescale/self.sample_duration)))
+        if sync_interval is None:
+            sync_interval = self.samples_per_fragment if type == 'video' else 1
+        self.sync_interval = sync_interval
+        self.constant_sample_size = self.sample_size(random.Random(0), 0) if isinstance(sample_size, str) and sample_size.startswith('constant:') else None
+        self.track_id = 0
+
+    def IsSync(self, sample_index):
+        return sample_index % self.sync_interval == 0
+
+#############################################
+def MakeMovieHeader(duration, next_track_id):
+    return MakeFullAtom('mvhd', 0, 0, struct.pack('>IIII', 0, 0, MOVIE_TIMESCALE, 0) +
+                        struct.pack('>IH10x', 0x00010000, 0x0100) +
+                        struct.pack('>9I', 0x00010000, 0, 0, 0, 0x00010000, 0, 0, 0, 0x40000000) +
+                        bytes(24) + struct.pack('>I', next_track_id))
+
+def MakeLanguage(language):
+    language = (language+'und')[:3] if len(language) != 3 else language
+    return ((ord(language[0])-0x60) << 10) | ((ord(language[1])-0x60) << 5) | (ord(language[2])-0x60)
+
+def MakeSampleEntry(track):
+    if track.type == 'video':
+        (sps, pps) = MakeAvcParameterSets(track.width, track.height)
+        avcc = MakeAtom('avcC', struct.pack('>BBBBBB', 1, sps[1], sps[2], sps[3], 0xFF, 0xE1) +
+                        struct.pack('>H', len(sps)) + sps + struct.pack('>BH', 1, len(pps)) + pps)
+        compressor_name = b'\x0cBento4 synth'.ljust(32, b'\x00')
+        return MakeAtom('avc1', bytes(6) + struct.pack('>H', 1) + bytes(16) +
+                        struct.pack('>HHIIIH', track.width, track.height, 0x00480000, 0x00480000, 0, 1) +
+                        compressor_name + struct.pack('>Hh', 0x0018, -1) + avcc)
+    else:
+        frequency_index = AAC_SAMPLING_FREQUENCIES.index(track.sample_rate)
+        audio_specific_config = struct.pack('>H', (2 << 11) | (frequency_index << 7) | (track.channels << 3))
+        decoder_specific_info = MakeDescriptor(0x05, audio_specific_config)
+        decoder_config = MakeDescriptor(0x04, struct.pack('>BBBHII', 0x40, 0x15, 0, 0, 128000, 128000) + decoder_specific_info)
+        es_descriptor = MakeDescriptor(0x03, struct.pack('>HB', track.track_id, 0) + decoder_config + MakeDescriptor(0x06, b'\x02'))
+        return MakeAtom('mp4a', bytes(6) + struct.pack('>H', 1) + bytes(8) +
+                        struct.pack('>HHHHI', track.channels, 16, 0, 0, track.sample_rate << 16) +
+                        MakeFullAtom('esds', 0, 0, es_descriptor))
+
+def MakeDescriptor(tag, payload):
+    # sizes are always coded on 4 bytes
+    return bytes([tag, 0x80 | (len(payload) >> 21) & 0x7F, 0x80 | (len(payload) >> 14) & 0x7F, 0x80 | (len(payload) >> 7) & 0x7F, len(payload) & 0x7F]) + payload
+
+def MakeTrack(track):
+    if track.type == 'video':
+        tkhd_size = struct.pack('>II', track.width << 16, track.height << 16)
+        volume = 0
+        handler = b'vide'
+        media_header = MakeFullAtom('vmhd', 0, 1, bytes(8))
+    else:
+        tkhd_size = struct.pack('>II', 0, 0)
+        volume = 0x0100
+        handler = b'soun'
+        media_header = MakeFullAtom('smhd', 0, 0, bytes(4))
+    tkhd = MakeFullAtom('tkhd', 0, 7, struct.pack('>IIIII', 0, 0, track.track_id, 0, 0) + bytes(8) +
+                        struct.pack('>hhH2x', 0, 0, volume) +
+                        struct.pack('>9I', 0x00010000, 0, 0, 0, 0x00010000, 0, 0, 0, 0x40000000) + tkhd_size)
+    mdhd = MakeFullAtom('mdhd', 0, 0, struct.pack('>IIIIHH', 0, 0, track.timescale, 0, MakeLanguage(track.language), 0))
+    hdlr = MakeFullAtom('hdlr', 0, 0, struct.pack('>I4s12x', 0, handler) + b'Bento4 synth\x00')
+    dinf = MakeAtom('dinf', MakeFullAtom('dref', 0, 0, struct.pack('>I', 1) + MakeFullAtom('url ', 0, 1, b'')))
+    stbl = MakeAtom('stbl', MakeFullAtom('stsd', 0, 0, struct.pack('>I', 1) + MakeSampleEntry(track)) +
+                            MakeFullAtom('stts', 0, 0, struct.pack('>I', 0)) +
+                            MakeFullAtom('stsc', 0, 0, struct.pack('>I', 0)) +
+                            MakeFullAtom('stsz', 0, 0, struct.pack('>II', 0, 0)) +
+                            MakeFullAtom('stco', 0, 0, struct.pack('>I', 0)))
+    minf = MakeAtom('minf', media_header + dinf + stbl)
+    return MakeAtom('trak', tkhd + MakeAtom('mdia', mdhd + hdlr + minf))
+
+def MakeInitSegment(tracks, duration):
+    ftyp = MakeAtom('ftyp', b'isom' + struct.pack('>I', 1) + b'isomiso6dashavc1mp41')
+    mvex = MakeAtom('mvex', MakeFullAtom('mehd', 1, 0, struct.pack('>Q', int(duration*MOVIE_TIMESCALE))) +
+                    b''.join([MakeFullAtom('trex', 0, 0, struct.pack('>IIIII', track.track_id, 1, track.sample_duration, 0, 0)) for track in tracks]))
+    moov = MakeAtom('moov', MakeMovieHeader(duration, len(tracks)+1) + b''.join([MakeTrack(track) for track in tracks]) + mvex)
+    return ftyp + moov
+
+#############################################
+class FragmentWriter:
+    def __init__(self, track, rng):
+        self.track          = track
+        self.rng            = rng
+        self.sample_index   = 0
+        self.decode_time    = 0
+        self.zeros          = bytes(65536)
+
+    def MakeSamplePayload(self, size, sync):
+        if self.track.type == 'video':
+            # a single NAL unit, length prefixed: an IDR slice for sync samples, a non-IDR slice otherwise
+            size = max(size, 6)
+            return struct.pack('>IB', size-4, 0x65 if sync else 0x41) + self.MakeFiller(size-5)
+        return self.MakeFiller(max(size, 1))
+
+    def MakeFiller(self, size):
+        if size > len(self.zeros):
+            self.zeros = bytes(size)
+        return self.zeros[:size]
+
+    def MakeFragment(self, sequence_number, sample_count):
+        # returns (moof, mdat, decode_time, first sync sample number or None)
+        track = self.track
+        sizes = []
+        syncs = []
+        payloads = []
+        for i in range(sample_count):
+            sync = track.IsSync(self.sample_index+i)
+            size = track.constant_sample_size if track.constant_sample_size is not None else track.sample_size(self.rng, self.sample_index+i)
+            payload = self.MakeSamplePayload(size, sync)
+            payloads.append(payload)
+            sizes.append(len(payload))
+            syncs.append(sync)
+
+        # use the tfhd defaults, and only the trun fields that are needed
+        all_sync = all(syncs)
+        default_flags = SYNC_SAMPLE_FLAGS if all_sync else NON_SYNC_SAMPLE_FLAGS
+        tfhd_flags = TFHD_DEFAULT_BASE_IS_MOOF | TFHD_DEFAULT_SAMPLE_DURATION_PRESENT | TFHD_DEFAULT_SAMPLE_FLAGS_PRESENT
+        tfhd_payload = struct.pack('>II', track.track_id, track.sample_duration)
+        constant_size = len(set(sizes)) == 1
+        if constant_size:
+            tfhd_flags |= TFHD_DEFAULT_SAMPLE_SIZE_PRESENT
+            tfhd_payload += struct.pack('>I', sizes[0])
+        tfhd_payload += struct.pack('>I', default_flags)
+        tfhd = MakeFullAtom('tfhd', 0, tfhd_flags, tfhd_payload)
+        tfdt = MakeFullAtom('tfdt', 1, 0, struct.pack('>Q', self.decode_time))
+
+        trun_flags = TRUN_DATA_OFFSET_PRESENT
+        first_sample_flags = b''
+        if not all_sync and syncs[0] and not any(syncs[1:]):
+            trun_flags |= TRUN_FIRST_SAMPLE_FLAGS_PRESENT
+            first_sample_flags = struct.pack('>I', SYNC_SAMPLE_FLAGS)
+        columns = []
+        if not constant_size:
+            trun_flags |= TRUN_SAMPLE_SIZE_PRESENT
+            columns.append(sizes)
+        if not all_sync and not (trun_flags & TRUN_FIRST_SAMPLE_FLAGS_PRESENT) and any(syncs):
+            trun_flags |= TRUN_SAMPLE_FLAGS_PRESENT
+            columns.append([SYNC_SAMPLE_FLAGS if sync else NON_SYNC_SAMPLE_FLAGS for sync in syncs])
+        entries = struct.pack('>%dI' % (sample_count*len(columns)), *[value for entry in zip(*columns) for value in entry]) if columns else b''
+        trun_size = 8+4+8+len(first_sample_flags)+len(entries)
+        mfhd = MakeFullAtom('mfhd', 0, 0, struct.pack('>I', sequence_number))
+        traf_size = 8+len(tfhd)+len(tfdt)+trun_size
+        moof_size = 8+len(mfhd)+traf_size
+        trun = MakeFullAtom('trun', 1, trun_flags, struct.pack('>Ii', sample_count, moof_size+8) + first_sample_flags + entries)
+        moof = MakeAtom('moof', mfhd + MakeAtom('traf', tfhd + tfdt + trun))
+
+        mdat = MakeAtom('mdat', b''.join(payloads))
+        decode_time = self.decode_time
+        sync_number = next((i+1 for i in range(sample_count) if syncs[i]), None)
+        self.sample_index += sample_count
+        self.decode_time += sample_count*track.sample_duration
+        return (moof, mdat, decode_time, sync_number)
+
+def MakeRandomAccessIndex(tracks, entries):
+    # one tfra per track, with 64-bit times and offsets and 32-bit numbers
+    tfras = b''
+    for track in tracks:
+        track_entries = entries[track.track_id]
+        tfras += MakeFullAtom('tfra', 1, 0, struct.pack('>III', track.track_id, 0x3F, len(track_entries)) +
+                              b''.join([struct.pack('>QQIII', time, offset, 1, 1, sample_number) for (time, offset, sample_number) in track_entries]))
+    size = 8+len(tfras)+16
+    return MakeAtom('mfra', tfras + MakeFullAtom('mfro', 0, 0, struct.pack('>I', size)))
+
+def WriteSyntheticMp4(filename, tracks, fragment_count=None, duration=None, mfra=True, seed=0):
+    """
+    Write a fragmented MP4 file with the given tracks (TrackSpec objects).
+    The length is either a number of fragments per track, or a duration in
+    seconds. Returns a dict with the number of fragments and samples written.
+    """
+    if fragment_count is None and duration is None:
+        raise Exception('a fragment count or a duration is required')
+    for (index, track) in enumerate(tracks):
+        track.track_id = index+1
+
+    # the number of samples of each track
+    sample_totals = []
+    for track in tracks:
+        if duration is not None:
+            sample_totals.append(int(round(duration*track.timescale/track.sample_duration)))
+        else:
+            sample_totals.append(fragment_count*track.samples_per_fragment)
+        if (sample_totals[-1]+track.samples_per_fragment-1)//track.samples_per_fragment > MAX_FRAGMENT_COUNT:
+            raise Exception('too many fragments (max %d per track)' % MAX_FRAGMENT_COUNT)
+    total_duration = max([float(sample_totals[i]*tracks[i].sample_duration)/tracks[i].timescale for i in range(len(tracks))])
+
+    rng = random.Random(seed)
+    writers = [FragmentWriter(track, rng) for track in tracks]
+    random_access_entries = dict([(track.track_id, []) for track in tracks])
+    stats = {'fragments': 0, 'samples': 0}
+    with open(filename, 'wb') as output:
+        output.write(MakeInitSegment(tracks, total_duration))
+
+        # interleave the fragments of all the tracks by start time
+        queue = [(0.0, index) for index in range(len(tracks)) if sample_totals[index]]
+        heapq.heapify(queue)
+        sequence_number = 1
+        while queue:
+            (_, index) = heapq.heappop(queue)
+            (track, writer) = (tracks[index], writers[index])
+            sample_count = min(track.samples_per_fragment, sample_totals[index]-writer.sample_index)
+            offset = output.tell()
+            (moof, mdat, decode_time, sync_number) = writer.MakeFragment(sequence_number, sample_count)
+            output.write(moof)
+            output.write(mdat)
+            if sync_number is not None:
+                random_access_entries[track.track_id].append((decode_time+(sync_number-1)*track.sample_duration, offset, sync_number))
+            sequence_number += 1
+            stats['fragments'] += 1
+            stats['samples'] += sample_count
+            if writer.sample_index < sample_totals[index]:
+                heapq.heappush(queue, (float(writer.decode_time)/track.timescale, index))
+
+        if mfra:
+            output.write(MakeRandomAccessIndex(tracks, random_access_entries))
+    return stats
+
+#############################################
+def main():
+    parser = OptionParser(usage="%prog [options] <output-filename>",
+                          description="Write a synthetic fragmented MP4 file, with dummy sample payloads")
+    parser.add_option('', '--video', dest='video', type='int', default=1,
+                      help="Number of video tracks (default: 1)")
+    parser.add_option('', '--audio', dest='audio', type='int', default=1,
+                      help="Number of audio tracks (default: 1)")
+    parser.add_option('', '--fragments', dest='fragments', type='int',
+                      help="Number of fragments per track (max %d)" % MAX_FRAGMENT_COUNT)
+    parser.add_option('', '--duration', dest='duration', type='float',
+                      help="Duration in seconds (default: 60, if --fragments is not used)")
+    parser.add_option('', '--fragment-duration', dest='fragment_duration', type='float', default=2.0,
+                      help="Fragment duration in seconds (default: 2)")
+    parser.add_option('', '--samples-per-fragment', dest='samples_per_fragment', type='int',
+                      help="Number of samples per fragment (overrides --fragment-duration)")
+    parser.add_option('', '--video-timescale', dest='video_timescale', type='int', default=90000,
+                      help="Timescale of the video tracks (default: 90000)")
+    parser.add_option('', '--frame-rate', dest='frame_rate', type='float', default=30,
+                      help="Video frame rate (default: 30)")
+    parser.add_option('', '--resolution', dest='resolution', default='1280x720',
+                      help="Video resolution (default: 1280x720)")
+    parser.add_option('', '--video-sample-size', dest='video_sample_size', default='uniform:2000:20000',
+                      help="Video sample size distribution: constant:<size>, uniform:<min>:<max> or normal:<mean>:<stddev> (default: uniform:2000:20000)")
+    parser.add_option('', '--sync-interval', dest='sync_interval', type='int',
+                      help="Number of video samples between sync samples (default: one sync sample at the start of each fragment)")
+    parser.add_option('', '--sample-rate', dest='sample_rate', type='int', default=48000,
+                      help="Audio sample rate, also used as the audio timescale (default: 48000)")
+    parser.add_option('', '--audio-sample-size', dest='audio_sample_size', default='uniform:300:400',
+                      help="Audio sample size distribution (default: uniform:300:400)")
+    parser.add_option('', '--no-mfra', dest='mfra', action='store_false', default=True,
+                      help="Don't write an mfra index")
+    parser.add_option('', '--seed', dest='seed', type='int', default=0,
+                      help="Seed of the sample size generator (default: 0)")
+    (options, args) = parser.parse_args()
+    if len(args) != 1:
+        parser.print_help()
+        sys.exit(1)
+
+    (width, height) = [int(x) for x in options.resolution.split('x')]
+    tracks = []
+    for i in range(options.video):
+        tracks.append(TrackSpec('video', timescale=options.video_timescale, frame_rate=options.frame_rate, width=width, height=height,
+                                fragment_duration=options.fragment_duration, samples_per_fragment=options.samples_per_fragment,
+                                sample_size=options.video_sample_size, sync_interval=options.sync_interval))
+    for i in range(options.audio):
+        tracks.append(TrackSpec('audio', sample_rate=options.sample_rate, fragment_duration=options.fragment_duration,
+                                samples_per_fragment=options.samples_per_fragment, sample_size=options.audio_sample_size))
+    if not tracks:
+        raise Exception('at least one track is needed')
+    duration = options.duration
+    if options.fragments is None and duration is None:
+        duration = 60
+    stats = WriteSyntheticMp4(args[0], tracks, fragment_count=options.fragments, duration=duration, mfra=options.mfra, seed=options.seed)
+    print('%d fragments, %d samples' % (stats['fragments'], stats['samples']))
+
+###########################
+if __name__ == '__main__':
+    try:
+        main()
+    except Exception as err:
+        sys.stderr.write('ERROR: %s\n' % str(err))
+        sys.exit(1)
+
+#############################################
+# Module Exports
+#############################################
+__all__ = [
+    'TrackSpec',
+    'ParseSampleSizeDistribution',
+    'MakeAvcParameterSets',
+    'MakeInitSegment',
+    'WriteSyntheticMp4'
+]
@@ -13,9 +13,11 @@ import io
 import struct
 import operator
 import hashlib
+import threading
 import fractions
 import xml.sax.saxutils as saxutils
 import base64
+from mp4atoms import SAMPLE_FLAG_IS_NON_SYNC
 
 LanguageCodeMap = {
     'aar': 'aa', 'abk': 'ab', 'afr': 'af', 'aka': 'ak', 'alb': 'sq', 'amh': 'am', 'ara': 'ar', 'arg': 'an',
@@ -46,6 +48,20 @@ LanguageCodeMap = {
     'yor': 'yo', 'zha': 'za', 'zho': 'zh', 'zul': 'zu', '```': 'und'
 }
 
+# content types of the files produced by the packagers, by extension
+MediaContentTypes = {
+    '.mpd':  'application/dash+xml',
+    '.m3u8': 'application/vnd.apple.mpegurl',
+    '.mp4':  'video/mp4',
+    '.m4s':  'video/iso.segment',
+    '.vtt':  'text/vtt',
+    '.ttml': 'application/ttml+xml',
+    '.xml':  'application/xml',
+    '.json': 'application/json',
+    '.ism':  'application/vnd.ms-sstr+xml',
+    '.ismc': 'application/vnd.ms-sstr+xml'
+}
+
 LanguageNames = {
     "aa": "Qafara",
     "ab": "Аҧсуа",
@@ -296,11 +312,55 @@ def Bento4Command(options, name, *args, **kwargs):
         raise Exception('executable "'+name+'" not found, ensure that it is in your path or in the directory '+options.exec_dir)
 
 
+class FileCache:
+    """
+    Data computed from files, keyed by the identity of the file (path, size,
+    modification time and inode) and by a list of JSON-serializable values
+    (the parameters of the computation), so that the data is only computed
+    again when the file changes.
+    """
+    def __init__(self, cache_dir, suffix):
+        self.cache_dir = cache_dir
+        self.suffix    = suffix
+
+    def get_filename(self, filename, key):
+        stat = os.stat(filename)
+        identity = [path.realpath(filename), stat.st_size, stat.st_mtime_ns, stat.st_ino]+list(key)
+        digest = hashlib.sha1(json.dumps(identity).encode('utf-8')).hexdigest()
+        return path.join(self.cache_dir, digest+'.'+self.suffix)
+
+    def load(self, filename, key=()):
+        try:
+            with open(self.get_filename(filename, key), 'rb') as f:
+                return f.read()
+        except (IOError, OSError):
+            return None
+
+    def store(self, filename, data, key=()):
+        try:
+            WriteFileAtomically(self.get_filename(filename, key), data)
+        except (IOError, OSError):
+            # the cache is only an optimization
+            pass
+
+def AnalyzeFile(options, name, filename, *args, **kwargs):
+    # run an analysis tool, through the analysis cache if there is one
+    cache_dir = getattr(options, 'analysis_cache_dir', None)
+    if not cache_dir:
+        return Bento4Command(options, name, filename, *args, **kwargs)
+    cache = FileCache(cache_dir, name)
+    key = [name, list(args), sorted(kwargs.items())]
+    output = cache.load(filename, key)
+    if output is None:
+        output = Bento4Command(options, name, filename, *args, **kwargs)
+        cache.store(filename, output, key)
+    return output
+
 def Mp4Info(options, filename, *args, **kwargs):
-    return Bento4Command(options, 'mp4info', filename, *args, **kwargs)
+    return AnalyzeFile(options, 'mp4info', filename, *args, **kwargs)
 
 def Mp4Dump(options, filename, *args, **kwargs):
-    return Bento4Command(options, 'mp4dump', filename, *args, **kwargs)
+    return AnalyzeFile(options, 'mp4dump', filename, *args, **kwargs)
 
 def Mp4Split(options, filename, *args, **kwargs):
     return Bento4Command(options, 'mp4split', filename, *args, **kwargs)
@@ -363,29 +423,20 @@ def FindChild(top, path):
     return top
 
 class Mp4Track:
+    # attributes computed from the atoms of the file rather than from its mp4info info
+    # (for the tracks of a lazy Mp4File, accessing one of them loads the file)
+    SEGMENT_INFO_ATTRIBUTES = ['default_sample_duration', 'default_sample_flags', 'timescale', 'moofs', 'sample_counts',
+                               'segment_sizes', 'segment_start_times', 'segment_sync_flags', 'segment_durations', 'segment_scaled_durations', 'segment_bitrates', 'total_sample_count',
+                               'total_duration', 'total_scaled_duration', 'media_size', 'average_segment_duration',
+                               'average_segment_bitrate', 'max_segment_bitrate', 'bandwidth', 'key_info',
+                               'frame_rate', 'frame_rate_ratio']
+
     def __init__(self, parent, info):
         self.parent                   = parent
         self.info                     = info
-        self.default_sample_duration  = 0
-        self.timescale                = 0
-        self.moofs                    = []
-        self.sample_counts            = []
-        self.segment_sizes            = []
-        self.segment_durations        = []
-        self.segment_scaled_durations = []
-        self.segment_bitrates         = []
-        self.total_sample_count       = 0
-        self.total_duration           = 0
-        self.total_scaled_duration    = 0
-        self.media_size               = 0
-        self.average_segment_duration = 0
-        self.average_segment_bitrate  = 0
-        self.max_segment_bitrate      = 0
-        self.bandwidth                = 0
         self.language                 = ''
         self.language_name            = ''
         self.order_index              = 0
-        self.key_info                 = {}
         self.id = info['id']
         if info['type'] == 'Audio':
             self.type = 'audio'
@@ -470,6 +521,48 @@ class Mp4Track:
         self.language = info['language']
         self.language_name = LanguageNames.get(LanguageCodeMap.get(self.language, 'und'), '')
 
+    def __getattr__(self, name):
+        # only called for attributes that are not set yet
+        parent = self.__dict__.get('parent')
+        if name in Mp4Track.SEGMENT_INFO_ATTRIBUTES and parent is not None and not parent.loaded:
+            parent.load()
+            return getattr(self, name)
+        raise AttributeError("'Mp4Track' object has no attribute '"+name+"'")
+
+    def init_segment_info(self):
+        self.default_sample_duration  = 0
+        self.default_sample_flags     = 0
+        self.timescale                = 0
+        self.moofs                    = []
+        self.sample_counts            = []
+        self.segment_sizes            = []
+        self.segment_start_times      = []
+        self.segment_sync_flags       = []
+        self.segment_durations        = []
+        self.segment_scaled_durations = []
+        self.segment_bitrates         = []
+        self.total_sample_count       = 0
+        self.total_duration           = 0
+        self.total_scaled_duration    = 0
+        self.media_size               = 0
+        self.average_segment_duration = 0
+        self.average_segment_bitrate  = 0
+        self.max_segment_bitrate      = 0
+        self.bandwidth                = 0
+        self.key_info                 = {}
+
+    def get_segment_byte_ranges(self):
+        # (offset, size) of each segment in the file: its moof atom and the atoms that follow it,
+        # up to and including the first mdat (not a trailing mfra, for example)
+        byte_ranges = []
+        for segment_index in self.moofs:
+            atoms = self.parent.segments[segment_index]
+            atom_types = [atom.type for atom in atoms]
+            if 'mdat' in atom_types:
+                atoms = atoms[:atom_types.index('mdat')+1]
+            byte_ranges.append((atoms[0].position, reduce(operator.add, [atom.size for atom in atoms], 0)))
+        return byte_ranges
+
     def update(self, options):
         # compute the total number of samples
         self.total_sample_count = reduce(operator.add, self.sample_counts, 0)
@@ -530,11 +623,21 @@ class Mp4Track:
         return 'File '+str(self.parent.file_list_index)+'#'+str(self.id)
 
 class Mp4File:
-    def __init__(self, options, media_source):
+    # attributes computed when the file is loaded
+    SEGMENT_INFO_ATTRIBUTES = ['atoms', 'segments', 'init_segment', 'tree']
+
+    def __init__(self, options, media_source, lazy=False):
+        """
+        With lazy=True, the tracks are only built from the mp4info info of the media source,
+        and the atoms of the file are only walked and dumped when a segment-level attribute
+        of the file or of one of its tracks is first accessed.
+        """
         self.media_source    = media_source
+        self.options         = options
         self.info            = media_source.mp4_info
         self.tracks          = {}
         self.file_list_index = 0 # used to keep a sequence number just amongst all sources
+        self.loaded          = False
 
         filename = media_source.filename
         if options.debug:
@@ -543,6 +646,29 @@ class Mp4File:
         # by default, the media name is the basename of the source file
         self.media_name = path.basename(filename)
 
+        for track in self.info['tracks']:
+            self.tracks[track['id']] = Mp4Track(self, track)
+
+        if not lazy:
+            self.load()
+
+    def __getattr__(self, name):
+        # only called for attributes that are not set yet
+        if name in Mp4File.SEGMENT_INFO_ATTRIBUTES and not self.__dict__.get('loaded', True):
+            self.load()
+            return getattr(self, name)
+        raise AttributeError("'Mp4File' object has no attribute '"+name+"'")
+
+    def load(self):
+        if self.loaded:
+            return
+        self.loaded = True
+        options  = self.options
+        filename = self.media_source.filename
+
+        for track in self.tracks.values():
+            track.init_segment_info()
+
         # walk the atom structure
         self.atoms = WalkAtoms(filename)
         self.segments = []
@@ -558,9 +684,6 @@ class Mp4File:
         if options.debug:
             print('  found', len(self.segments), 'segments')
 
-        for track in self.info['tracks']:
-            self.tracks[track['id']] = Mp4Track(self, track)
-
         # get a complete file dump
         json_dump = Mp4Dump(options, filename, format='json', verbosity='1')
         self.tree = json.loads(json_dump, strict=False, object_pairs_hook=collections.OrderedDict)
@@ -577,6 +700,7 @@ class Mp4File:
                         for c2 in c1['children']:
                             if c2['name'] == 'trex':
                                 self.tracks[c2['track id']].default_sample_duration = c2['default sample duration']
+                                self.tracks[c2['track id']].default_sample_flags = c2['default sample flags']
                     elif c1['name'] == 'trak':
                         track_id = 0
                         for c2 in c1['children']:
@@ -605,7 +729,25 @@ class Mp4File:
                 track.moofs.append(segment_index)
                 segment_duration = 0
                 default_sample_duration = tfhd.get('default sample duration', track.default_sample_duration)
-                for trun in FilterChildren(trafs[0], 'trun'):
+
+                # start time (in the track timescale) and sync flag of the first sample of the segment
+                tfdt = FilterChildren(trafs[0], 'tfdt')
+                if tfdt:
+                    track.segment_start_times.append(tfdt[0]['base media decode time'])
+                elif track.segment_start_times:
+                    track.segment_start_times.append(track.segment_start_times[-1]+track.segment_scaled_durations[-1])
+                else:
+                    track.segment_start_times.append(0)
+                first_sample_flags = tfhd.get('default sample flags', track.default_sample_flags)
+                truns = FilterChildren(trafs[0], 'trun')
+                if truns:
+                    if 'first sample flags' in truns[0]:
+                        first_sample_flags = truns[0]['first sample flags']
+                    elif truns[0]['entries'] and 'f' in truns[0]['entries'][0]:
+                        first_sample_flags = truns[0]['entries'][0]['f']
+                track.segment_sync_flags.append((int(first_sample_flags) & SAMPLE_FLAG_IS_NON_SYNC) == 0)
+
+                for trun in truns:
                     track.sample_counts.append(trun['sample count'])
                     for entry in trun['entries']:
                         sample_duration = int(entry.get('d', default_sample_duration))
@@ -758,6 +900,29 @@ def MakeNewDir(dir, exit_if_exists=False, severity=None, recursive=False):
     else:
         os.mkdir(dir)
 
+def MakeTempFilename(filename):
+    return '%s.%d-%d.tmp' % (filename, os.getpid(), threading.get_ident())
+
+def WriteFileAtomically(filename, data, make_dirs=None):
+    # data is bytes, or a list of bytes that are written one after the other
+    dir = path.dirname(filename)
+    if make_dirs is not None:
+        make_dirs(dir)
+    elif dir:
+        os.makedirs(dir, exist_ok=True)
+    temp_filename = MakeTempFilename(filename)
+    try:
+        with open(temp_filename, 'wb') as f:
+            for chunk in (data if isinstance(data, list) else [data]):
+                f.write(chunk)
+        os.replace(temp_filename, filename)
+    except:
+        try:
+            os.unlink(temp_filename)
+        except OSError:
+            pass
+        raise
+
 def MakePsshBox(system_id, payload):
     pssh_size = 12+16+4+len(payload)
     return struct.pack('>I', pssh_size)+b'pssh'+struct.pack('>I',0)+system_id+struct.pack('>I', len(payload))+payload
@@ -1051,37 +1216,40 @@ def ComputeMarlinPssh(options):
     return struct.pack('>I4sI4sII', 24, b'marl', 16, b'mkid', 0, 0)
 
 def DerivePlayReadyKey(seed, kid, swap=True):
+    return DerivePlayReadyKeys(seed, [kid], swap)[0]
+
+def DerivePlayReadyKeys(seed, kids, swap=True):
     if len(seed) < 30:
         raise Exception('seed must be  >= 30 bytes')
-    if len(kid) != 16:
-        raise Exception('kid must be 16 bytes')
-
-    if swap:
-        kid = kid[3:4]+kid[2:3]+kid[1:2]+kid[0:1]+kid[5:6]+kid[4:5]+kid[7:8]+kid[6:7]+kid[8:]
-
     seed = seed[:30]
 
-    sha = hashlib.sha256()
-    sha.update(seed)
-    sha.update(kid)
-    sha_A = sha.digest()
+    # all three hashes start with the seed, so hash it only once
+    seed_sha = hashlib.sha256()
+    seed_sha.update(seed)
+
+    keys = []
+    for kid in kids:
+        if len(kid) != 16:
+            raise Exception('kid must be 16 bytes')
 
-    sha = hashlib.sha256()
-    sha.update(seed)
-    sha.update(kid)
-    sha.update(seed)
-    sha_B = sha.digest()
+        if swap:
+            kid = kid[3:4]+kid[2:3]+kid[1:2]+kid[0:1]+kid[5:6]+kid[4:5]+kid[7:8]+kid[6:7]+kid[8:]
 
-    sha = hashlib.sha256()
-    sha.update(seed)
-    sha.update(kid)
-    sha.update(seed)
-    sha.update(kid)
-    sha_C = sha.digest()
+        # A = SHA256(seed|kid), B = SHA256(seed|kid|seed), C = SHA256(seed|kid|seed|kid)
+        sha = seed_sha.copy()
+        sha.update(kid)
+        sha_A = sha.digest()
+        sha.update(seed)
+        sha_B = sha.digest()
+        sha.update(kid)
+        sha_C = sha.digest()
 
-    content_key = bytes([sha_A[i] ^ sha_A[i+16] ^ sha_B[i] ^ sha_B[i+16] ^ sha_C[i] ^ sha_C[i+16] for i in range(16)])
+        content_key = (int.from_bytes(sha_A[:16], 'big') ^ int.from_bytes(sha_A[16:], 'big') ^
+                       int.from_bytes(sha_B[:16], 'big') ^ int.from_bytes(sha_B[16:], 'big') ^
+                       int.from_bytes(sha_C[:16], 'big') ^ int.from_bytes(sha_C[16:], 'big'))
+        keys.append(content_key.to_bytes(16, 'big'))
 
-    return content_key
+    return keys
 
 def ComputePlayReadyChecksum(kid, key):
     import aes
@@ -1321,6 +1489,8 @@ __all__ = [
     'MediaSource',
     'ComputeBandwidth',
     'MakeNewDir',
+    'WriteFileAtomically',
+    'FileCache',
     'MakePsshBox',
     'MakePsshBoxV1',
     'GetEncryptionKey',
@@ -1330,6 +1500,7 @@ __all__ = [
     'ComputeDolbyDigitalPlusSmoothStreamingInfo',
     'ComputeMarlinPssh',
     'DerivePlayReadyKey',
+    'DerivePlayReadyKeys',
     'ComputePlayReadyHeader',
     'ComputePrimetimeMetaData',
     'ComputeWidevineHeader'
@@ -1,28 +1,78 @@
 #! /usr/bin/env python3
 
 import sys
-from mp4utils import DerivePlayReadyKey, Base64Decode
+from optparse import OptionParser
+from mp4utils import DerivePlayReadyKeys, Base64Decode
+
+def ParseKid(kid_hex):
+    kid_hex = kid_hex.replace(' ', '')
+    kid_hex = kid_hex.replace('-', '')
+    return bytes.fromhex(kid_hex)
+
+def ReadKids(kids_file):
+    for line in kids_file:
+        line = line.strip()
+        if line and not line.startswith('#'):
+            yield line
+
+def DeriveKeysChunk(args):
+    (seed, kids, swap) = args
+    return DerivePlayReadyKeys(seed, kids, swap)
+
+def DeriveKeys(seed, kids, swap, jobs, chunk_size):
+    # yields the derived keys in the same order as the kids
+    if jobs <= 1:
+        for start in range(0, len(kids), chunk_size):
+            yield from DerivePlayReadyKeys(seed, kids[start:start+chunk_size], swap)
+        return
+
+    from multiprocessing import Pool
+    chunks = [(seed, kids[start:start+chunk_size], swap) for start in range(0, len(kids), chunk_size)]
+    with Pool(jobs) as pool:
+        for keys in pool.imap(DeriveKeysChunk, chunks):
+            yield from keys
 
 ###########################
-if __name__ == '__main__':
-    if len(sys.argv) != 3 and len(sys.argv) != 4:
-        sys.stderr.write('ERROR: invalid arguments\n')
-        sys.stderr.write('Usage: pr-derive-key.py [--no-swap] <seed-base64> <kid-hex>\n')
+def main():
+    parser = OptionParser(usage="%prog [options] <seed-base64> [<kid-hex>]",
+                          description="Derive PlayReady content keys from a key seed. "+
+                                      "With a single KID, the key is printed. With --kids, one KID is read per line "+
+                                      "and a '<kid-hex> <key-hex>' line is printed for each.")
+    parser.add_option('', '--no-swap', dest="swap", action="store_false", default=True,
+                      help="Do not swap the byte order of the first 8 bytes of the KIDs (GUID form)")
+    parser.add_option('', '--kids', dest="kids", metavar="<filename>",
+                      help="Read the KIDs, in hex, one per line, from <filename> (use - for stdin)")
+    parser.add_option('-j', '--jobs', dest="jobs", type="int", default=1, metavar="<n>",
+                      help="Number of processes to use with --kids (default: 1)")
+    parser.add_option('', '--chunk-size', dest="chunk_size", type="int", default=10000, metavar="<n>",
+                      help="Number of KIDs handled per batch with --kids (default: 10000)")
+    (options, args) = parser.parse_args()
+
+    if options.kids is None and len(args) != 2 or options.kids is not None and len(args) != 1:
+        parser.print_help()
         sys.exit(1)
 
-    swap = True
-    if (len(sys.argv) == 4):
-        if sys.argv[1] == '--no-swap':
-            swap = False
-        else:
-            raise Exception('unknown command line option "'+sys.argv[2]+'"')
+    seed_bin = Base64Decode(args[0])
 
-    (seed_base64, kid_hex) = sys.argv[-2:]
-    kid_hex = kid_hex.replace(' ', '')
-    kid_hex = kid_hex.replace('-', '')
+    if options.kids is None:
+        dkey = DerivePlayReadyKeys(seed_bin, [ParseKid(args[1])], options.swap)[0]
+        print(dkey.hex())
+        return
 
-    seed_bin = Base64Decode(seed_base64)
-    kid_bin = bytes.fromhex(kid_hex)
+    if options.kids == '-':
+        kids_hex = list(ReadKids(sys.stdin))
+    else:
+        with open(options.kids) as kids_file:
+            kids_hex = list(ReadKids(kids_file))
+    kids = [ParseKid(kid_hex) for kid_hex in kids_hex]
 
-    dkey = DerivePlayReadyKey(seed_bin, kid_bin, swap)
-    print(dkey.hex())
+    out = sys.stdout
+    for (kid, dkey) in zip(kids, DeriveKeys(seed_bin, kids, options.swap, options.jobs, max(options.chunk_size, 1))):
+        out.write(kid.hex()+' '+dkey.hex()+'\n')
+
+if __name__ == '__main__':
+    try:
+        main()
+    except Exception as err:
+        sys.stderr.write('ERROR: %s\n' % err)
+        sys.exit(1)
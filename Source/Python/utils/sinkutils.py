@@ -0,0 +1,509 @@
+__author__    = 'Gilles Boccon-Gibod (bok@bok.net)'
+__copyright__ = 'Copyright 2011-2020 Axiomatic Systems, LLC.'
+
+###
+# Output sinks.
+# The packagers produce their output in a local directory, and publish each
+# file to a sink as soon as it is complete. The local sink leaves the files
+# where they are. The S3 sink uploads them to an S3-compatible object store
+# while packaging goes on, from a bounded pool of threads, with multipart
+# uploads for large files, and removes the local copies once they are stored.
+# The content-addressed sink keeps the files in the output directory, as
+# links to the files of a store where each distinct content is stored once.
+
+import os
+import os.path as path
+import time
+import hmac
+import shutil
+import hashlib
+import datetime
+import tempfile
+import threading
+import collections
+import http.client
+import urllib.parse
+import xml.etree.ElementTree as xml
+import xml.sax.saxutils as saxutils
+from concurrent.futures import ThreadPoolExecutor
+from fetchutils import ConnectionPool, HTTP_RETRY_STATUSES
+from mp4utils import MediaContentTypes
+
+S3_DEFAULT_REGION     = 'us-east-1'
+S3_MIN_PART_SIZE      = 5*1024*1024
+S3_DEFAULT_PART_SIZE  = 8*1024*1024
+S3_SIGNATURE_SERVICE  = 's3'
+URI_UNRESERVED_CHARS  = '-_.~'
+READ_CHUNK_SIZE       = 1024*1024
+
+class UploadError(Exception):
+    def __init__(self, url, message, status=None):
+        super().__init__(url+': '+message)
+        self.url = url
+        self.status = status
+
+def GetContentType(name):
+    return MediaContentTypes.get(path.splitext(name)[1], 'application/octet-stream')
+
+def ListFiles(root_dir):
+    """Return the paths of the files under root_dir, relative to it, with '/' separators"""
+    names = []
+    for (dirpath, _, filenames) in os.walk(root_dir):
+        for filename in filenames:
+            names.append(path.relpath(path.join(dirpath, filename), root_dir).replace(os.sep, '/'))
+    return sorted(names)
+
+#############################################
+class OutputSink:
+    """
+    Destination of the packaged files.
+    PutFile publishes a complete file of the output directory, under a name
+    relative to that directory. Unless keep is True, the sink may remove the
+    local file once it is published. Flush waits until all the files put so
+    far are published, and raises the first error, if any.
+    """
+    # local directory where the output is produced, when it is not the destination
+    staging_dir = None
+
+    def PutFile(self, name, filename, keep=False):
+        pass
+
+    def IsPublished(self, name):
+        return False
+
+    def Flush(self):
+        pass
+
+    def Close(self):
+        pass
+
+    def Abort(self):
+        pass
+
+class LocalSink(OutputSink):
+    """The output directory is the destination: the files are already in place"""
+    def __init__(self, output_dir):
+        self.output_dir = output_dir
+
+#############################################
+def HashFile(filename):
+    digest = hashlib.sha256()
+    with open(filename, 'rb') as f:
+        while True:
+            chunk = f.read(READ_CHUNK_SIZE)
+            if not chunk:
+                break
+            digest.update(chunk)
+    return digest.hexdigest()
+
+class ContentAddressedStore:
+    """
+    A directory of read-only files (blobs) named by the SHA-256 digest of their
+    content, as <store_dir>/<first 2 digits>/<digest>, so that each distinct
+    content is stored once. Add moves a file to the store, and replaces it by a
+    hard link to its blob (or a symbolic link, if the store is on another file
+    system). Several processes may share a store: blobs are created atomically.
+    """
+    def __init__(self, store_dir):
+        self.store_dir = store_dir
+        self.stats     = collections.Counter()
+
+    def GetBlobPath(self, digest):
+        return path.join(self.store_dir, digest[:2], digest)
+
+    def Add(self, filename):
+        """Store a file, link it to its blob, and return its digest"""
+        digest = HashFile(filename)
+        blob = self.GetBlobPath(digest)
+        self.stats['files'] += 1
+        if path.exists(blob):
+            if not path.samefile(blob, filename):
+                self.stats['duplicates'] += 1
+                self.stats['bytes_saved'] += path.getsize(filename)
+        else:
+            os.makedirs(path.dirname(blob), exist_ok=True)
+            temp_blob = '%s.%d.%d.tmp' % (blob, os.getpid(), threading.get_ident())
+            try:
+                os.link(filename, temp_blob)
+            except OSError:
+                shutil.copyfile(filename, temp_blob)
+            os.chmod(temp_blob, 0o444)
+            os.replace(temp_blob, blob)
+            self.stats['blobs'] += 1
+        self.Link(blob, filename)
+        return digest
+
+    def Link(self, blob, filename):
+        if path.samefile(blob, filename):
+            return
+        temp_link = filename+'.link.tmp'
+        try:
+            os.link(blob, temp_link)
+        except OSError:
+            os.symlink(path.abspath(blob), temp_link)
+        os.replace(temp_link, filename)
+
+class ContentAddressedSink(LocalSink):
+    """
+    The output directory is the destination, and each published file is
+    replaced by a link to its blob in a content-addressed store. The digests
+    of the published files are kept, by name, in the digests dictionary.
+    """
+    def __init__(self, output_dir, store_dir, verbose=False):
+        super().__init__(output_dir)
+        self.store   = ContentAddressedStore(store_dir)
+        self.digests = {}
+        self.verbose = verbose
+
+    def PutFile(self, name, filename, keep=False):
+        self.digests[name] = self.store.Add(filename)
+
+    def IsPublished(self, name):
+        return name in self.digests
+
+    def Close(self):
+        if self.verbose:
+            print('Stored %d files (%d new, %d duplicates, %d bytes saved)' % (self.store.stats['files'],
+                                                                               self.store.stats['blobs'],
+                                                                               self.store.stats['duplicates'],
+                                                                               self.store.stats['bytes_saved']))
+
+#############################################
+class S3Credentials:
+    def __init__(self, access_key_id, secret_access_key, session_token=None):
+        self.access_key_id     = access_key_id
+        self.secret_access_key = secret_access_key
+        self.session_token     = session_token
+
+    @staticmethod
+    def FromEnvironment():
+        if 'AWS_ACCESS_KEY_ID' not in os.environ or 'AWS_SECRET_ACCESS_KEY' not in os.environ:
+            return None
+        return S3Credentials(os.environ['AWS_ACCESS_KEY_ID'],
+                             os.environ['AWS_SECRET_ACCESS_KEY'],
+                             os.environ.get('AWS_SESSION_TOKEN'))
+
+def UriEncode(value, safe=''):
+    return urllib.parse.quote(value, safe=safe+URI_UNRESERVED_CHARS)
+
+def MakeCanonicalQueryString(query):
+    return '&'.join(sorted([UriEncode(name)+'='+UriEncode(value) for (name, value) in query.items()]))
+
+def SignS3Request(method, uri, query_string, headers, payload_hash, credentials, region, now=None):
+    """
+    Add the AWS Signature Version 4 headers to a request. uri must already be
+    URI-encoded, and all the headers, including Host, are signed.
+    """
+    if now is None:
+        now = datetime.datetime.now(datetime.timezone.utc)
+    amz_date = now.strftime('%Y%m%dT%H%M%SZ')
+    date = amz_date[:8]
+    headers['x-amz-date'] = amz_date
+    headers['x-amz-content-sha256'] = payload_hash
+    if credentials.session_token:
+        headers['x-amz-security-token'] = credentials.session_token
+
+    signed_headers = sorted([(name.lower(), ' '.join(str(value).split())) for (name, value) in headers.items()])
+    signed_header_names = ';'.join([name for (name, _) in signed_headers])
+    canonical_request = '\n'.join([method,
+                                   uri,
+                                   query_string,
+                                   ''.join([name+':'+value+'\n' for (name, value) in signed_headers]),
+                                   signed_header_names,
+                                   payload_hash])
+    scope = '/'.join([date, region, S3_SIGNATURE_SERVICE, 'aws4_request'])
+    string_to_sign = '\n'.join(['AWS4-HMAC-SHA256',
+                                amz_date,
+                                scope,
+                                hashlib.sha256(canonical_request.encode('utf-8')).hexdigest()])
+    key = ('AWS4'+credentials.secret_access_key).encode('utf-8')
+    for scope_part in [date, region, S3_SIGNATURE_SERVICE, 'aws4_request']:
+        key = hmac.new(key, scope_part.encode('utf-8'), hashlib.sha256).digest()
+    signature = hmac.new(key, string_to_sign.encode('utf-8'), hashlib.sha256).hexdigest()
+    headers['Authorization'] = 'AWS4-HMAC-SHA256 Credential=%s/%s, SignedHeaders=%s, Signature=%s' % (
+        credentials.access_key_id, scope, signed_header_names, signature)
+
+def FindXmlText(data, name):
+    # S3-compatible servers do not all use the S3 namespace
+    for element in xml.fromstring(data).iter():
+        if element.tag == name or element.tag.endswith('}'+name):
+            return element.text
+    return None
+
+class MultipartUpload:
+    def __init__(self, name, filename, size, part_size, keep):
+        self.name       = name
+        self.filename   = filename
+        self.part_count = (size+part_size-1)//part_size
+        self.keep       = keep
+        self.upload_id  = None
+        self.etags      = [None]*self.part_count
+        self.remaining  = self.part_count
+        self.completed  = False
+        self.lock       = threading.Lock()
+
+class S3Sink(OutputSink):
+    """
+    Uploads the files to an S3-compatible object store.
+    The URL is either s3://<bucket>/<prefix>, for which the endpoint is taken
+    from the AWS_ENDPOINT_URL environment variable, or is the regional AWS
+    endpoint, or http(s)://<host>/<bucket>/<prefix> for a path-style
+    endpoint. Requests are signed when credentials are available.
+    Files up to part_size bytes are uploaded with a single request, larger
+    ones with a multipart upload, whose parts are uploaded concurrently
+    (S3 requires parts of at least S3_MIN_PART_SIZE bytes, except the last).
+    """
+    def __init__(self, url, jobs=8, part_size=S3_DEFAULT_PART_SIZE, credentials=None, region=None,
+                 retries=3, backoff=0.5, timeout=60, verbose=False):
+        self.url         = url
+        self.part_size   = part_size
+        self.credentials = credentials if credentials is not None else S3Credentials.FromEnvironment()
+        self.region      = region or os.environ.get('AWS_REGION') or os.environ.get('AWS_DEFAULT_REGION') or S3_DEFAULT_REGION
+        self.retries     = retries
+        self.backoff     = backoff
+        self.verbose     = verbose
+
+        parsed_url = urllib.parse.urlsplit(url)
+        if parsed_url.scheme == 's3':
+            (bucket, key_prefix) = (parsed_url.netloc, parsed_url.path)
+            endpoint = urllib.parse.urlsplit(os.environ.get('AWS_ENDPOINT_URL') or 'https://s3.'+self.region+'.amazonaws.com')
+            (self.scheme, self.netloc) = (endpoint.scheme, endpoint.netloc)
+            self.bucket_path = endpoint.path.rstrip('/')+'/'+bucket
+        elif parsed_url.scheme in ('http', 'https'):
+            (bucket, _, key_prefix) = parsed_url.path.lstrip('/').partition('/')
+            (self.scheme, self.netloc) = (parsed_url.scheme, parsed_url.netloc)
+            self.bucket_path = '/'+bucket
+        else:
+            raise UploadError(url, 'unsupported URL scheme')
+        if not bucket:
+            raise UploadError(url, 'no bucket name')
+        self.key_prefix = key_prefix.strip('/')
+
+        self.staging_dir = tempfile.mkdtemp(prefix='mp4-sink-')
+        self.pool        = ConnectionPool(timeout)
+        self.executor    = ThreadPoolExecutor(max_workers=max(jobs, 1))
+        self.condition   = threading.Condition()
+        self.in_flight   = 0
+        self.error       = None
+        self.closed      = False
+        self.published   = set()
+        self.uploads     = []
+        self.stats       = collections.Counter()
+
+    def GetKey(self, name):
+        return self.key_prefix+'/'+name if self.key_prefix else name
+
+    def GetUrl(self, name):
+        return self.scheme+'://'+self.netloc+self.bucket_path+'/'+self.GetKey(name)
+
+    def Submit(self, function, *args):
+        with self.condition:
+            self.in_flight += 1
+        self.executor.submit(self.Run, function, args)
+
+    def Run(self, function, args):
+        try:
+            # once something failed, the remaining uploads are skipped
+            if self.error is None:
+                function(*args)
+        except Exception as e:
+            with self.condition:
+                if self.error is None:
+                    self.error = e
+        finally:
+            with self.condition:
+                self.in_flight -= 1
+                self.condition.notify_all()
+
+    def CheckError(self):
+        if self.error is not None:
+            raise self.error
+
+    def PutFile(self, name, filename, keep=False):
+        self.CheckError()
+        if name in self.published:
+            return
+        self.published.add(name)
+        size = path.getsize(filename)
+        if size > self.part_size:
+            self.Submit(self.StartMultipartUpload, MultipartUpload(name, filename, size, self.part_size, keep))
+        else:
+            self.Submit(self.PutObject, name, filename, keep)
+
+    def IsPublished(self, name):
+        return name in self.published
+
+    def PutObject(self, name, filename, keep):
+        with open(filename, 'rb') as f:
+            data = f.read()
+        self.Request('PUT', name, body=data, headers={'Content-Type': GetContentType(name)})
+        self.OnFilePublished(name, filename, len(data), keep)
+
+    def StartMultipartUpload(self, upload):
+        (_, data) = self.Request('POST', upload.name, {'uploads': ''}, headers={'Content-Type': GetContentType(upload.name)})
+        upload.upload_id = FindXmlText(data, 'UploadId')
+        if not upload.upload_id:
+            raise UploadError(self.GetUrl(upload.name), 'no upload ID in the response')
+        with self.condition:
+            self.uploads.append(upload)
+        for part_number in range(1, upload.part_count+1):
+            self.Submit(self.PutPart, upload, part_number)
+
+    def PutPart(self, upload, part_number):
+        with open(upload.filename, 'rb') as f:
+            f.seek((part_number-1)*self.part_size)
+            data = f.read(self.part_size)
+        (response, _) = self.Request('PUT', upload.name, {'partNumber': str(part_number), 'uploadId': upload.upload_id}, body=data)
+        etag = response.getheader('ETag')
+        if not etag:
+            raise UploadError(self.GetUrl(upload.name), 'no ETag for part %d' % part_number)
+        with self.condition:
+            self.stats['parts'] += 1
+        with upload.lock:
+            upload.etags[part_number-1] = etag
+            upload.remaining -= 1
+            complete = (upload.remaining == 0)
+        # the last part to be uploaded completes the upload
+        if complete:
+            self.CompleteMultipartUpload(upload)
+
+    def CompleteMultipartUpload(self, upload):
+        body = '<CompleteMultipartUpload>'
+        for (part_index, etag) in enumerate(upload.etags):
+            body += '<Part><PartNumber>%d</PartNumber><ETag>%s</ETag></Part>' % (part_index+1, saxutils.escape(etag))
+        body += '</CompleteMultipartUpload>'
+        (_, data) = self.Request('POST', upload.name, {'uploadId': upload.upload_id}, body=body.encode('utf-8'),
+                                 headers={'Content-Type': 'application/xml'})
+        # the request may succeed and the upload still fail, with an error in the body
+        if FindXmlText(data, 'Code') is not None:
+            raise UploadError(self.GetUrl(upload.name), 'multipart upload failed: '+FindXmlText(data, 'Code'))
+        upload.completed = True
+        self.OnFilePublished(upload.name, upload.filename, path.getsize(upload.filename), upload.keep)
+
+    def AbortMultipartUpload(self, upload):
+        try:
+            self.RequestOnce('DELETE', upload.name, {'uploadId': upload.upload_id}, b'', {})
+        except (UploadError, OSError, http.client.HTTPException):
+            # the bucket lifecycle rules are the last resort for parts that could not be deleted
+            pass
+
+    def OnFilePublished(self, name, filename, size, keep):
+        if self.verbose:
+            print('Uploaded', self.GetUrl(name))
+        with self.condition:
+            self.stats['objects'] += 1
+            self.stats['bytes'] += size
+        if not keep:
+            os.unlink(filename)
+
+    def Request(self, method, name, query=None, body=b'', headers=None):
+        attempt = 0
+        while True:
+            try:
+                return self.RequestOnce(method, name, query or {}, body, headers or {})
+            except UploadError as e:
+                if e.status is not None and e.status not in HTTP_RETRY_STATUSES:
+                    raise
+                error = e
+            except (OSError, http.client.HTTPException) as e:
+                error = UploadError(self.GetUrl(name), str(e) or e.__class__.__name__)
+
+            if attempt >= self.retries:
+                raise error
+            delay = self.backoff * (2 ** attempt)
+            attempt += 1
+            if self.verbose:
+                print('WARNING: %s, retrying in %.1fs' % (error, delay))
+            time.sleep(delay)
+
+    def RequestOnce(self, method, name, query, body, headers):
+        uri = self.bucket_path+'/'+UriEncode(self.GetKey(name), safe='/')
+        query_string = MakeCanonicalQueryString(query)
+        headers = dict(headers)
+        headers['Host'] = self.netloc
+        headers['Content-Length'] = str(len(body))
+        if self.credentials is not None:
+            SignS3Request(method, uri, query_string, headers, hashlib.sha256(body).hexdigest(), self.credentials, self.region)
+        target = uri+'?'+query_string if query_string else uri
+
+        (connection, _) = self.pool.Acquire(self.scheme, self.netloc)
+        try:
+            connection.request(method, target, body, headers)
+            response = connection.getresponse()
+            data = response.read()
+        except:
+            connection.close()
+            raise
+        if response.will_close:
+            connection.close()
+        else:
+            self.pool.Release(self.scheme, self.netloc, connection)
+
+        if response.status < 200 or response.status >= 300:
+            raise UploadError(self.GetUrl(name), 'HTTP error %d' % response.status, response.status)
+        return (response, data)
+
+    def Flush(self):
+        with self.condition:
+            while self.in_flight:
+                self.condition.wait()
+        self.CheckError()
+
+    def Close(self):
+        if self.closed:
+            return
+        try:
+            self.Flush()
+        except:
+            self.Abort()
+            raise
+        self.Shutdown()
+
+    def Abort(self):
+        if self.closed:
+            return
+        with self.condition:
+            if self.error is None:
+                self.error = UploadError(self.url, 'aborted')
+            while self.in_flight:
+                self.condition.wait()
+        for upload in self.uploads:
+            if not upload.completed:
+                self.AbortMultipartUpload(upload)
+        self.Shutdown()
+
+    def Shutdown(self):
+        self.closed = True
+        self.executor.shutdown(wait=True)
+        self.pool.Close()
+        shutil.rmtree(self.staging_dir, ignore_errors=True)
+
+def MakeOutputSink(url, output_dir, store_dir=None, **kwargs):
+    """
+    Return the sink for an output URL, or the local sink of output_dir if url
+    is None, which links the files to a content-addressed store if store_dir
+    is not None.
+    """
+    if url is None:
+        if store_dir is not None:
+            return ContentAddressedSink(output_dir, store_dir, verbose=kwargs.get('verbose', False))
+        return LocalSink(output_dir)
+    return S3Sink(url, **kwargs)
+
+#############################################
+# Module Exports
+#############################################
+__all__ = [
+    'S3_MIN_PART_SIZE',
+    'UploadError',
+    'ListFiles',
+    'OutputSink',
+    'LocalSink',
+    'HashFile',
+    'ContentAddressedStore',
+    'ContentAddressedSink',
+    'S3Credentials',
+    'SignS3Request',
+    'S3Sink',
+    'MakeOutputSink'
+]
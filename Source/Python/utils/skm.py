@@ -6,109 +6,150 @@ import urllib.request, urllib.parse, urllib.error
 
 KEKID_CONSTANT_1 = b"KEKID_1"
 
+KEY_WRAP_IV = bytes.fromhex('A6A6A6A6A6A6A6A6')
+
 def WrapKey(key, kek):
     if len(key) > 16:
         # assume hex
         key = bytes.fromhex(key)
-    if len(kek) > 16:
-        # assume hex
-        kek = bytes.fromhex(kek)
-
-    if (len(key)% 8) or (len(kek) % 8):
-        raise Exception('key and kek must be a multiple of 64 bits')
-
-    # create a cipher with kek
-    cipher = aes.rijndael(kek)
-
-    # Inputs:      Plaintext, n 64-bit values {P1, P2, ..., Pn}, and
-    # Key, K (the KEK).
-    # Outputs:     Ciphertext, (n+1) 64-bit values {C0, C1, ..., Cn}.
-    n = len(key) // 8
-    if n < 1:
-        raise Exception('key too short')
-
-    # 1) Initialize variables.
-    #
-    #    Set A = IV, an initial value (see 2.2.3)
-    #      For i = 1 to n
-    #      R[i] = P[i]
-    A = bytes.fromhex('A6A6A6A6A6A6A6A6')
-    R = [key[i*8:(i+1)*8] for i in range(n)]
-
-    # 2) Calculate intermediate values.
-    #
-    #    For j = 0 to 5
-    #      For i=1 to n
-    #        B = AES(K, A | R[i])
-    #        A = MSB(64, B) ^ t where t = (n*j)+i
-    #        R[i] = LSB(64, B)
-    for j in range(6):
-        for i in range(n):
-            B = cipher.encrypt(A+R[i])
-            A = B[0:7] + bytes([B[7] ^ ((n*j)+i+1)])
-            R[i] = B[8:16]
-
-    # 3) Output the results.
-    #
-    #    Set C[0] = A
-    #    For i = 1 to n
-    #      C[i] = R[i]
-    return b''.join([A]+R)
+    return WrapKeys([key], kek)[0]
 
 def UnwrapKey(key, kek):
     if len(key) > 32:
         # assume hex
         key = bytes.fromhex(key)
+    return UnwrapKeys([key], kek)[0]
+
+def GroupKeysBySize(keys, min_blocks, error_message):
+    # group the key indexes by number of 64-bit blocks, so that all the keys
+    # of a group can be processed in lock-step
+    groups = {}
+    for (index, key) in enumerate(keys):
+        if len(key) % 8:
+            raise Exception('key and kek must be a multiple of 64 bits')
+        n = len(key) // 8
+        if n < min_blocks:
+            raise Exception(error_message)
+        groups.setdefault(n, []).append(index)
+    return groups
+
+def WrapKeys(keys, kek):
+    """RFC 3394 key wrap of a list of binary keys with the same kek.
+
+    The kek schedule is expanded once, and each of the 6*n wrapping steps
+    runs one multi-block AES-ECB operation over all the keys of the batch.
+    Returns the list of wrapped keys, in the same order as the input.
+    """
     if len(kek) > 16:
         # assume hex
         kek = bytes.fromhex(kek)
+    if len(kek) % 8:
+        raise Exception('key and kek must be a multiple of 64 bits')
 
-    if (len(key)% 8) or (len(kek) % 8):
+    # create a cipher with kek
+    cipher = aes.ecb(kek)
+
+    wrapped_keys = [None] * len(keys)
+    for (n, indexes) in GroupKeysBySize(keys, 1, 'key too short').items():
+        # Inputs:      Plaintext, n 64-bit values {P1, P2, ..., Pn}, and
+        # Key, K (the KEK).
+        # Outputs:     Ciphertext, (n+1) 64-bit values {C0, C1, ..., Cn}.
+
+        # 1) Initialize variables.
+        #
+        #    Set A = IV, an initial value (see 2.2.3)
+        #      For i = 1 to n
+        #      R[i] = P[i]
+        A = [KEY_WRAP_IV] * len(indexes)
+        R = [[keys[k][i*8:(i+1)*8] for k in indexes] for i in range(n)]
+
+        # 2) Calculate intermediate values.
+        #
+        #    For j = 0 to 5
+        #      For i=1 to n
+        #        B = AES(K, A | R[i])
+        #        A = MSB(64, B) ^ t where t = (n*j)+i
+        #        R[i] = LSB(64, B)
+        for j in range(6):
+            for i in range(n):
+                t = (n*j)+i+1
+                Ri = R[i]
+                B = cipher.encrypt(b''.join([a+r for (a, r) in zip(A, Ri)]))
+                for k in range(len(indexes)):
+                    A[k] = (int.from_bytes(B[k*16:k*16+8], 'big') ^ t).to_bytes(8, 'big')
+                    Ri[k] = B[k*16+8:k*16+16]
+
+        # 3) Output the results.
+        #
+        #    Set C[0] = A
+        #    For i = 1 to n
+        #      C[i] = R[i]
+        for (k, index) in enumerate(indexes):
+            wrapped_keys[index] = b''.join([A[k]]+[R[i][k] for i in range(n)])
+
+    return wrapped_keys
+
+def UnwrapKeys(wrapped_keys, kek):
+    """RFC 3394 key unwrap of a list of binary wrapped keys with the same kek.
+
+    This is the batch counterpart of WrapKeys. An exception is raised if any
+    of the keys fails the integrity check.
+    """
+    if len(kek) > 16:
+        # assume hex
+        kek = bytes.fromhex(kek)
+    if len(kek) % 8:
         raise Exception('key and kek must be a multiple of 64 bits')
 
     # create a de-cipher with kek
-    decipher = aes.rijndael(kek)
-
-    # Inputs:  Ciphertext, (n+1) 64-bit values {C0, C1, ..., Cn}, and
-    # Key, K (the KEK).
-    # Outputs: Plaintext, n 64-bit values {P0, P1, K, Pn}.
-    n = len(key) // 8 - 1
-    if n < 1:
-        raise Exception('wrapped key too short')
-
-    # 1) Initialize variables.
-    #
-    #    Set A = C[0]
-    #    For i = 1 to n
-    #      R[i] = C[i]
-    A = key[0:8]
-    R = [key[(i+1)*8:(i+2)*8] for i in range(n)]
-
-    # 2) Compute intermediate values.
-    #
-    #    For j = 5 to 0
-    #     For i = n to 1
-    #       B = AES-1(K, (A ^ t) | R[i]) where t = n*j+i
-    #       A = MSB(64, B)
-    #       R[i] = LSB(64, B)
-    for j in range(5, -1, -1):
-        for i in range(n-1, -1, -1):
-            B = decipher.decrypt(A[0:7] + bytes([A[7]^((n*j)+i+1)])) + R[i:i+1]
-            A = B[0:8]
-            R[i] = B[8:16]
-
-    # 3) Output results.
-    #
-    #    If A is an appropriate initial value (see 2.2.3),
-    #    Then
-    #      For i = 1 to n
-    #        P[i] = R[i]
-    #    Else
-    #      Return an error
-    for i in range(8):
-        if A[i] != 0xA6:
-            raise Exception('invalid/corrupted wrapped key or wrong kek')
-    return b''.join(R)
+    decipher = aes.ecb(kek)
+
+    keys = [None] * len(wrapped_keys)
+    for (n_plus_one, indexes) in GroupKeysBySize(wrapped_keys, 2, 'wrapped key too short').items():
+        # Inputs:  Ciphertext, (n+1) 64-bit values {C0, C1, ..., Cn}, and
+        # Key, K (the KEK).
+        # Outputs: Plaintext, n 64-bit values {P0, P1, K, Pn}.
+        n = n_plus_one - 1
+
+        # 1) Initialize variables.
+        #
+        #    Set A = C[0]
+        #    For i = 1 to n
+        #      R[i] = C[i]
+        A = [int.from_bytes(wrapped_keys[k][0:8], 'big') for k in indexes]
+        R = [[wrapped_keys[k][(i+1)*8:(i+2)*8] for k in indexes] for i in range(n)]
+
+        # 2) Compute intermediate values.
+        #
+        #    For j = 5 to 0
+        #     For i = n to 1
+        #       B = AES-1(K, (A ^ t) | R[i]) where t = n*j+i
+        #       A = MSB(64, B)
+        #       R[i] = LSB(64, B)
+        for j in range(5, -1, -1):
+            for i in range(n-1, -1, -1):
+                t = (n*j)+i+1
+                Ri = R[i]
+                B = decipher.decrypt(b''.join([(a ^ t).to_bytes(8, 'big')+r for (a, r) in zip(A, Ri)]))
+                for k in range(len(indexes)):
+                    A[k] = int.from_bytes(B[k*16:k*16+8], 'big')
+                    Ri[k] = B[k*16+8:k*16+16]
+
+        # 3) Output results.
+        #
+        #    If A is an appropriate initial value (see 2.2.3),
+        #    Then
+        #      For i = 1 to n
+        #        P[i] = R[i]
+        #    Else
+        #      Return an error
+        iv = int.from_bytes(KEY_WRAP_IV, 'big')
+        for (k, index) in enumerate(indexes):
+            if A[k] != iv:
+                raise Exception('invalid/corrupted wrapped key or wrong kek')
+            keys[index] = b''.join([R[i][k] for i in range(n)])
+
+    return keys
 
 def ComputeKekId(kek):
     if len(kek) > 16:
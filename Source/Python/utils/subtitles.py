@@ -3,23 +3,28 @@ __copyright__ = 'Copyright 2011-2020 Axiomatic Systems, LLC.'
 
 import xml.etree.ElementTree as ET
 import os.path as path
+import re
 from mp4utils import LanguageCodeMap, LanguageNames, BooleanFromString
 
 TTML_XML_NAMESPACE = 'http://www.w3.org/ns/ttml'
 XML_NAMESPACE      = 'http://www.w3.org/XML/1998/namespace'
 
+WEBVTT_TIMESTAMP_PATTERN  = re.compile(r'^(?:(\d+):)?([0-5]\d):([0-5]\d)\.(\d{3})$')
+WEBVTT_TIMESTAMP_MAP_TAG  = 'X-TIMESTAMP-MAP='
+
 class SubtitlesFile:
     def __init__(self, options, media_source):
         self.media_source    = media_source
         self.format          = None
+        self.xml_tree        = None
+        self._size           = None
+        self.segment_track   = None # track whose segments the file is split along, if any
 
         filename = media_source.filename
         self.media_name = path.basename(filename)
         if options.debug:
             print('Processing Subtitles file', filename)
 
-        self.size = path.getsize(filename)
-
         self.language = media_source.spec.get('+language')
         self.language_name = 'Unknown'
         if not self.language:
@@ -47,12 +52,30 @@ class SubtitlesFile:
         self.hls_group = media_source.spec.get('+hls_group')
         self.hls_group_match = media_source.spec.get('+hls_group_match', '*').split('&')
 
+    @property
+    def size(self):
+        if self._size is None:
+            self._size = path.getsize(self.media_source.filename)
+        return self._size
+
+    def get_xml_tree(self):
+        # full parse of the document, only done when the content is needed
+        if self.xml_tree is None:
+            self.xml_tree = ET.parse(self.media_source.filename)
+        return self.xml_tree
+
     def parse_ttml(self, options):
         self.format    = 'ttml'
         self.mime_type = 'application/ttml+xml'
 
-        xml_tree= ET.parse(self.media_source.filename)
-        xml_root = xml_tree.getroot()
+        # only the root element is needed here, documents with embedded images can be very large
+        xml_root = None
+        with open(self.media_source.filename, 'rb') as ttml_file:
+            for (_, element) in ET.iterparse(ttml_file, events=('start',)):
+                xml_root = element
+                break
+        if xml_root is None:
+            raise Exception('ERROR: no root element found in '+self.media_source.filename)
 
         if xml_root.tag != '{'+TTML_XML_NAMESPACE+'}tt':
             if options.debug:
@@ -70,7 +93,121 @@ class SubtitlesFile:
         self.format    = 'webvtt'
         self.mime_type = 'text/vtt'
 
+def parse_webvtt_timestamp(timestamp):
+    # returns a time in milliseconds
+    match = WEBVTT_TIMESTAMP_PATTERN.match(timestamp)
+    if not match:
+        raise Exception('ERROR: invalid WebVTT timestamp "'+timestamp+'"')
+    (hours, minutes, seconds, milliseconds) = match.groups()
+    return ((int(hours or 0)*60+int(minutes))*60+int(seconds))*1000+int(milliseconds)
+
+def format_webvtt_timestamp(time):
+    return '%02d:%02d:%02d.%03d' % (time//3600000, (time//60000)%60, (time//1000)%60, time%1000)
+
+def read_webvtt_blocks(webvtt_file):
+    # yields the blocks of lines separated by blank lines, one at a time
+    block = []
+    for line in webvtt_file:
+        line = line.rstrip('\r\n')
+        if line.strip():
+            block.append(line)
+        elif block:
+            yield block
+            block = []
+    if block:
+        yield block
+
+class WebvttCue:
+    def __init__(self, block):
+        self.lines = block
+        timing_line = block[0] if '-->' in block[0] else block[1]
+        (start, rest) = timing_line.split('-->', 1)
+        self.start = parse_webvtt_timestamp(start.strip())
+        self.end   = parse_webvtt_timestamp(rest.split()[0])
+
+class WebvttSegmenter:
+    """
+    Splits a WebVTT file into segments aligned with a segment timeline (the
+    segment durations of a video track). The cues are streamed: only the
+    cues of the current segment are kept in memory. A cue that spans a
+    segment boundary is repeated in each segment it overlaps.
+    """
+    def __init__(self, filename, segment_durations, mpegts=0):
+        self.filename = filename
+        self.mpegts   = mpegts
+
+        # the boundaries are computed from the cumulative durations, so that rounding errors don't add up
+        self.boundaries = []
+        total = 0.0
+        for duration in segment_durations:
+            total += duration
+            self.boundaries.append(int(round(total*1000)))
+
+    def make_header(self, blocks):
+        # the file header, with the X-TIMESTAMP-MAP needed by HLS clients
+        header = [line for line in blocks[0] if not line.startswith(WEBVTT_TIMESTAMP_MAP_TAG)] if blocks else ['WEBVTT']
+        if not header or not header[0].startswith('WEBVTT'):
+            raise Exception('ERROR: '+self.filename+' is not a WebVTT file')
+        header.insert(1, '%sMPEGTS:%d,LOCAL:%s' % (WEBVTT_TIMESTAMP_MAP_TAG, self.mpegts, format_webvtt_timestamp(0)))
+        return '\n\n'.join(['\n'.join(block) for block in [header]+blocks[1:]])+'\n'
+
+    def start_segment(self, header):
+        if self.segment_file is not None:
+            self.segment_file.close()
+            # only keep the cues that extend into the new segment
+            segment_start = self.boundaries[len(self.segment_names)-1]
+            self.active = [cue for cue in self.active if cue.end > segment_start]
+        segment_name = self.segment_pattern % (self.start_number+len(self.segment_names))
+        self.segment_names.append(segment_name)
+        self.segment_file = open(path.join(self.output_dir, segment_name), 'w', encoding='utf-8')
+        self.segment_file.write(header)
+        for cue in self.active:
+            self.segment_file.write('\n'+'\n'.join(cue.lines)+'\n')
+
+    def segment(self, output_dir, segment_pattern, start_number=1):
+        # returns the list of segment file names
+        if not self.boundaries:
+            raise Exception('ERROR: no segment timeline to split '+self.filename)
+        self.output_dir      = output_dir
+        self.segment_pattern = segment_pattern
+        self.start_number    = start_number
+        self.segment_names   = []
+        self.segment_file    = None
+        self.active          = []
+        header = None
+        header_blocks = []
+        try:
+            with open(self.filename, 'r', encoding='utf-8-sig') as webvtt_file:
+                for block in read_webvtt_blocks(webvtt_file):
+                    if block[0].startswith('NOTE'):
+                        continue
+                    if not ('-->' in block[0] or (len(block) > 1 and '-->' in block[1])):
+                        if header is not None:
+                            raise Exception('ERROR: unexpected block after the first cue in '+self.filename)
+                        header_blocks.append(block)
+                        continue
+                    if header is None:
+                        header = self.make_header(header_blocks)
+                    cue = WebvttCue(block)
+
+                    # move on to the segment that contains the start of the cue
+                    while len(self.segment_names) < len(self.boundaries) and (self.segment_file is None or cue.start >= self.boundaries[len(self.segment_names)-1]):
+                        self.start_segment(header)
+                    self.segment_file.write('\n'+'\n'.join(cue.lines)+'\n')
+                    self.active.append(cue)
+
+            # output the remaining segments, with the cues that are still active
+            if header is None:
+                header = self.make_header(header_blocks)
+            while len(self.segment_names) < len(self.boundaries):
+                self.start_segment(header)
+        finally:
+            if self.segment_file is not None:
+                self.segment_file.close()
+                self.segment_file = None
+        return self.segment_names
+
 #############################################
 # Module Exports
 #############################################
-__all__ = ['SubtitlesFile']
+__all__ = ['SubtitlesFile', 'WebvttSegmenter']
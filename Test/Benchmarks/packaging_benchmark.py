@@ -0,0 +1,425 @@
+#! /usr/bin/env python3
+
+###
+# Performance benchmarks for the packaging hot paths (media analysis, track
+# selection, splitting, encryption, the DASH/HLS/Smooth/Hippo writers, the
+# bandwidth computation, AES and key wrapping, and the mp4-dash-clone segment
+# enumeration), on large synthetic inputs generated with mp4synth.
+#
+# Each benchmark runs in a fresh process, and records the wall time, the peak
+# python memory (tracemalloc, measured in a separate run since tracing slows
+# everything down), the max RSS of the process and of its child processes, and
+# the number of child processes. The results are written as JSON and compared
+# against a checked-in baseline: any metric above the baseline plus the
+# tolerance is a regression, and makes the exit code 1.
+#
+# The baseline is machine dependent: regenerate it with --update-baseline
+# when the reference machine changes.
+
+import os.path as path
+BENTO4_HOME = path.abspath(path.join(path.dirname(__file__), '..', '..'))
+
+import sys
+sys.path += [path.join(BENTO4_HOME, 'Source', 'Python', 'utils')]
+
+import os
+import io
+import json
+import time
+import random
+import shutil
+import platform
+import tempfile
+import importlib
+import subprocess
+import contextlib
+import tracemalloc
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from optparse import OptionParser, Values
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+DEFAULT_BASELINE   = path.join(path.dirname(path.abspath(__file__)), 'packaging_baseline.json')
+BASELINE_VERSION   = 1
+TIME_SLACK         = 0.05         # seconds, absorbs the noise on short benchmarks
+MEMORY_SLACK       = 4*1024*1024  # bytes
+KEK                = bytes(range(16))
+ENCRYPTION_KEY     = '000102030405060708090a0b0c0d0e0f:00112233445566778899aabbccddeeff'
+
+#############################################
+class CountingPopen(subprocess.Popen):
+    count = 0
+
+    def __init__(self, *args, **kwargs):
+        CountingPopen.count += 1
+        super().__init__(*args, **kwargs)
+
+class Measurement:
+    """
+    Accumulates the metrics of the measured sections of a benchmark. A section
+    is measured with 'with measurement:', and can be entered several times
+    (for example once per call of a wrapped function).
+    """
+    def __init__(self, trace_memory):
+        self.trace_memory     = trace_memory
+        self.wall_time        = 0.0
+        self.python_peak      = 0
+        self.subprocess_count = 0
+        self.items            = None
+        self.depth            = 0
+
+    def __enter__(self):
+        self.depth += 1
+        if self.depth == 1:
+            if self.trace_memory:
+                tracemalloc.reset_peak()
+                self.traced_start = tracemalloc.get_traced_memory()[0]
+            self.subprocess_start = CountingPopen.count
+            self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *args):
+        self.depth -= 1
+        if self.depth == 0:
+            self.wall_time += time.perf_counter()-self.start
+            self.subprocess_count += CountingPopen.count-self.subprocess_start
+            if self.trace_memory:
+                self.python_peak = max(self.python_peak, tracemalloc.get_traced_memory()[1]-self.traced_start)
+
+def MeasureCalls(measurement, module, name):
+    function = getattr(module, name)
+    def wrapper(*args, **kwargs):
+        with measurement:
+            return function(*args, **kwargs)
+    setattr(module, name, wrapper)
+
+def GetMaxRss(who):
+    if resource is None:
+        return None
+    max_rss = resource.getrusage(who).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return max_rss if platform.system() == 'Darwin' else max_rss*1024
+
+#############################################
+# Inputs
+#############################################
+def GenerateInputs(work_dir, scale):
+    import mp4synth
+    inputs = {'scale': scale}
+    inputs['long'] = path.join(work_dir, 'long.mp4')
+    tracks = [mp4synth.TrackSpec('video', sample_size='uniform:200:2000'), mp4synth.TrackSpec('audio', sample_size='uniform:20:40')]
+    mp4synth.WriteSyntheticMp4(inputs['long'], tracks, duration=600*scale)
+    return inputs
+
+def MakeTimelineMpd(representation_count, segment_count, seed=0):
+    rng = random.Random(seed)
+    durations = [rng.randint(1900, 2100) for _ in range(segment_count)]
+    timeline = ''.join(['<S d="%d"/>' % duration for duration in durations])
+    representations = ''.join(['<Representation id="video-%d" bandwidth="%d"/>' % (i, 500000*(i+1)) for i in range(representation_count)])
+    return ('<?xml version="1.0"?>'
+            '<MPD xmlns="urn:mpeg:dash:schema:mpd:2011" type="static" mediaPresentationDuration="PT%.3fS">' % (sum(durations)/1000.0) +
+            '<Period><AdaptationSet mimeType="video/mp4">'
+            '<SegmentTemplate timescale="1000" initialization="$RepresentationID$/init.mp4" media="$RepresentationID$/seg-$Time$.m4s">'
+            '<SegmentTimeline>'+timeline+'</SegmentTimeline></SegmentTemplate>'+representations+
+            '</AdaptationSet></Period></MPD>')
+
+#############################################
+# Benchmarks
+#############################################
+def RunDash(inputs, work_dir, measurement, functions, extra_args=[]):
+    # run mp4-dash, measuring only the calls to the given functions
+    mp4dash = importlib.import_module('mp4-dash')
+    for function in functions:
+        MeasureCalls(measurement, mp4dash, function)
+    output_dir = path.join(work_dir, 'output')
+    mp4dash.main(['--exec-dir', '-', '--force', '-o', output_dir]+extra_args+[inputs['long']])
+
+def BenchmarkMediaAnalysis(inputs, work_dir, measurement):
+    RunDash(inputs, work_dir, measurement, ['MediaSource', 'Mp4File'])
+
+def BenchmarkSelectTracks(inputs, work_dir, measurement):
+    RunDash(inputs, work_dir, measurement, ['SelectTracks'])
+
+def BenchmarkSplit(inputs, work_dir, measurement):
+    RunDash(inputs, work_dir, measurement, ['Mp4Split'])
+
+def BenchmarkEncryptSources(inputs, work_dir, measurement):
+    RunDash(inputs, work_dir, measurement, ['EncryptSources'], ['--encryption-key', ENCRYPTION_KEY])
+
+def BenchmarkOutputDash(inputs, work_dir, measurement):
+    RunDash(inputs, work_dir, measurement, ['OutputDash'])
+
+def BenchmarkOutputHls(inputs, work_dir, measurement):
+    RunDash(inputs, work_dir, measurement, ['OutputHls'], ['--hls'])
+
+def BenchmarkOutputSmooth(inputs, work_dir, measurement):
+    RunDash(inputs, work_dir, measurement, ['OutputSmooth'], ['--smooth'])
+
+def BenchmarkOutputHippo(inputs, work_dir, measurement):
+    RunDash(inputs, work_dir, measurement, ['OutputHippo'], ['--hippo'])
+
+def BenchmarkComputeBandwidth(inputs, work_dir, measurement):
+    from mp4utils import ComputeBandwidth
+    rng = random.Random(0)
+    segment_count = 2000*inputs['scale']
+    sizes = [rng.randint(100000, 1000000) for _ in range(segment_count)]
+    durations = [2.0]*segment_count
+    with measurement:
+        for buffer_time in [1.0, 10.0]:
+            ComputeBandwidth(buffer_time, sizes, durations)
+    measurement.items = 2*segment_count
+
+def GetCryptoScale():
+    # the pure python AES fallback is orders of magnitude slower than the native backend
+    import aes
+    return 256 if aes.Cipher is not None else 1
+
+def BenchmarkAesEcb(inputs, work_dir, measurement):
+    import aes
+    data = bytes(64*1024*GetCryptoScale()*inputs['scale'])
+    cipher = aes.ecb(KEK)
+    with measurement:
+        cipher.decrypt(cipher.encrypt(data))
+    measurement.items = 2*len(data)
+
+def BenchmarkAesCtr(inputs, work_dir, measurement):
+    import aes
+    data = bytes(64*1024*GetCryptoScale()*inputs['scale'])
+    cipher = aes.ecb(KEK)
+    iv = bytes(8)+(0xFFFFFFFFFFFFFFFF-1000).to_bytes(8, 'big')
+    with measurement:
+        # a fresh IV per 16KB chunk, like the samples of a fragment, then one that wraps
+        for offset in range(0, len(data), 16384):
+            cipher.ctr(bytes(16), data[offset:offset+16384])
+        cipher.ctr(iv, data[:16384])
+    measurement.items = len(data)+16384
+
+def BenchmarkKeyWrapSingle(inputs, work_dir, measurement):
+    import skm
+    keys = [os.urandom(16) for _ in range(500*GetCryptoScale()*inputs['scale'])]
+    with measurement:
+        wrapped = [skm.WrapKey(key, KEK) for key in keys]
+        unwrapped = [skm.UnwrapKey(wrapped_key, KEK) for wrapped_key in wrapped]
+    if unwrapped != keys:
+        raise Exception('ERROR: key wrap round trip failed')
+    measurement.items = 2*len(keys)
+
+def BenchmarkKeyWrapBatch(inputs, work_dir, measurement):
+    import skm
+    keys = [os.urandom(16) for _ in range(500*GetCryptoScale()*inputs['scale'])]
+    with measurement:
+        wrapped = skm.WrapKeys(keys, KEK)
+        unwrapped = skm.UnwrapKeys(wrapped, KEK)
+    if unwrapped != keys or wrapped[:10] != [skm.WrapKey(key, KEK) for key in keys[:10]]:
+        raise Exception('ERROR: batch and single key results differ')
+    measurement.items = 2*len(keys)
+
+def BenchmarkDashCloneEnumeration(inputs, work_dir, measurement):
+    mp4dashclone = importlib.import_module('mp4-dash-clone')
+    mp4dashclone.Options = Values({'verbose': False})
+    mpd_xml = MakeTimelineMpd(8, 10000*inputs['scale'])
+    with measurement:
+        mpd = mp4dashclone.ParseMpd('http://example.com/stream.mpd', mpd_xml)
+        url_count = 0
+        for period in mpd.periods:
+            for adaptation_set in period.adaptation_sets:
+                for representation in adaptation_set.representations:
+                    for url in representation.GenerateSegmentUrls():
+                        url_count += 1
+    measurement.items = url_count
+
+BENCHMARKS = [
+    ('media-analysis',         BenchmarkMediaAnalysis),
+    ('select-tracks',          BenchmarkSelectTracks),
+    ('split',                  BenchmarkSplit),
+    ('encrypt-sources',        BenchmarkEncryptSources),
+    ('output-dash',            BenchmarkOutputDash),
+    ('output-hls',             BenchmarkOutputHls),
+    ('output-smooth',          BenchmarkOutputSmooth),
+    ('output-hippo',           BenchmarkOutputHippo),
+    ('compute-bandwidth',      BenchmarkComputeBandwidth),
+    ('aes-ecb',                BenchmarkAesEcb),
+    ('aes-ctr',                BenchmarkAesCtr),
+    ('keywrap-single',         BenchmarkKeyWrapSingle),
+    ('keywrap-batch',          BenchmarkKeyWrapBatch),
+    ('dash-clone-enumeration', BenchmarkDashCloneEnumeration)
+]
+
+# the input sizes of these benchmarks depend on the AES backend
+CRYPTO_BENCHMARKS = ['aes-ecb', 'aes-ctr', 'keywrap-single', 'keywrap-batch']
+
+#############################################
+# Runner
+#############################################
+def RunBenchmark(name, inputs, trace_memory):
+    # runs in a fresh worker process
+    benchmark = dict(BENCHMARKS)[name]
+    subprocess.Popen = CountingPopen
+    if trace_memory:
+        tracemalloc.start()
+    measurement = Measurement(trace_memory)
+    work_dir = tempfile.mkdtemp(prefix='bento4-benchmark-')
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            benchmark(inputs, work_dir, measurement)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    return {
+        'wall_time':        measurement.wall_time,
+        'python_peak':      measurement.python_peak,
+        'max_rss':          GetMaxRss(resource.RUSAGE_SELF) if resource else None,
+        'max_child_rss':    GetMaxRss(resource.RUSAGE_CHILDREN) if resource else None,
+        'subprocess_count': measurement.subprocess_count,
+        'items':            measurement.items
+    }
+
+def RunInWorker(name, inputs, trace_memory):
+    context = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+        return executor.submit(RunBenchmark, name, inputs, trace_memory).result()
+
+def RunBenchmarks(names, inputs, repeat):
+    results = {}
+    for name in names:
+        # keep the fastest of the timed runs, then add the peak python memory from a traced run
+        runs = [RunInWorker(name, inputs, False) for _ in range(repeat)]
+        result = min(runs, key=lambda run: run['wall_time'])
+        result['python_peak'] = RunInWorker(name, inputs, True)['python_peak']
+        results[name] = result
+        PrintResult(name, result)
+    return results
+
+def PrintResult(name, result):
+    line = '%-24s %9.3f s  %8.1f MB peak  %8.1f MB rss  %4d subprocesses' % (
+           name, result['wall_time'], result['python_peak']/1048576.0, (result['max_rss'] or 0)/1048576.0, result['subprocess_count'])
+    if result['items'] and result['wall_time']:
+        line += '  %12.0f items/s' % (result['items']/result['wall_time'])
+    print(line)
+
+def GetEnvironment(scale):
+    import aes
+    return {
+        'python':      platform.python_version(),
+        'platform':    platform.platform(),
+        'aes_backend': 'cryptography' if aes.Cipher is not None else 'pure python',
+        'scale':       scale
+    }
+
+def CompareResults(results, baseline, time_tolerance, memory_tolerance):
+    """
+    Compare results with a baseline, and return a list of regressions.
+    """
+    regressions = []
+    for (name, result) in sorted(results.items()):
+        reference = baseline.get(name)
+        if reference is None:
+            continue
+        checks = [('wall_time',        time_tolerance,   TIME_SLACK),
+                  ('python_peak',      memory_tolerance, MEMORY_SLACK),
+                  ('max_rss',          memory_tolerance, MEMORY_SLACK),
+                  ('max_child_rss',    memory_tolerance, MEMORY_SLACK),
+                  ('subprocess_count', 0,                0)]
+        for (metric, tolerance, slack) in checks:
+            (value, reference_value) = (result.get(metric), reference.get(metric))
+            if value is None or reference_value is None:
+                continue
+            limit = reference_value*(1.0+tolerance)+slack
+            if value > limit:
+                regressions.append('%s: %s is %s, baseline %s (limit %s)' % (name, metric, FormatMetric(metric, value),
+                                   FormatMetric(metric, reference_value), FormatMetric(metric, limit)))
+    return regressions
+
+def FormatMetric(metric, value):
+    if metric == 'wall_time':
+        return '%.3f s' % value
+    elif metric == 'subprocess_count':
+        return '%d' % value
+    return '%.1f MB' % (value/1048576.0)
+
+def main():
+    parser = OptionParser(usage="%prog [options] [<benchmark-name> ...]",
+                          description="Run the packaging benchmarks and compare the results with a baseline")
+    parser.add_option('', '--list', dest='list', action='store_true', default=False,
+                      help="List the benchmarks")
+    parser.add_option('', '--scale', dest='scale', type='int', default=1,
+                      help="Input size multiplier (default: 1)")
+    parser.add_option('', '--repeat', dest='repeat', type='int', default=3,
+                      help="Number of timed runs of each benchmark, the fastest one is kept (default: 3)")
+    parser.add_option('', '--output', dest='output', metavar='<filename>',
+                      help="Write the results to <filename> in JSON")
+    parser.add_option('', '--baseline', dest='baseline', metavar='<filename>', default=DEFAULT_BASELINE,
+                      help="Baseline results (default: %default)")
+    parser.add_option('', '--update-baseline', dest='update_baseline', action='store_true', default=False,
+                      help="Write the results to the baseline file instead of comparing them")
+    parser.add_option('', '--no-compare', dest='compare', action='store_false', default=True,
+                      help="Don't compare the results with the baseline")
+    parser.add_option('', '--time-tolerance', dest='time_tolerance', type='float', default=0.5,
+                      help="Relative wall time increase allowed before failing (default: 0.5)")
+    parser.add_option('', '--memory-tolerance', dest='memory_tolerance', type='float', default=0.25,
+                      help="Relative memory increase allowed before failing (default: 0.25)")
+    (options, args) = parser.parse_args()
+
+    all_names = [name for (name, _) in BENCHMARKS]
+    if options.list:
+        print('\n'.join(all_names))
+        return 0
+    for name in args:
+        if name not in all_names:
+            raise Exception('ERROR: unknown benchmark "'+name+'"')
+    names = [name for name in all_names if not args or name in args]
+
+    work_dir = tempfile.mkdtemp(prefix='bento4-benchmark-inputs-')
+    try:
+        inputs = GenerateInputs(work_dir, options.scale)
+        results = RunBenchmarks(names, inputs, options.repeat)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    report = {'version': BASELINE_VERSION, 'environment': GetEnvironment(options.scale), 'results': results}
+
+    if options.output:
+        with open(options.output, 'w') as output:
+            json.dump(report, output, indent=4, sort_keys=True)
+
+    if options.update_baseline:
+        if path.exists(options.baseline):
+            with open(options.baseline) as baseline_file:
+                baseline = json.load(baseline_file)
+            if baseline.get('environment', {}).get('scale') == options.scale:
+                # keep the entries of the benchmarks that were not run
+                baseline['results'].update(results)
+                report['results'] = baseline['results']
+        with open(options.baseline, 'w') as baseline_file:
+            json.dump(report, baseline_file, indent=4, sort_keys=True)
+        print('baseline written to', options.baseline)
+        return 0
+
+    if not options.compare or not path.exists(options.baseline):
+        return 0
+    with open(options.baseline) as baseline_file:
+        baseline = json.load(baseline_file)
+    if baseline.get('version') != BASELINE_VERSION or baseline['environment'].get('scale') != options.scale:
+        raise Exception('ERROR: the baseline is not compatible with these results (version or scale mismatch)')
+    if baseline['environment'].get('python') != report['environment']['python']:
+        sys.stderr.write('WARNING: the baseline was recorded with python %s\n' % baseline['environment'].get('python'))
+    if baseline['environment'].get('aes_backend') != report['environment']['aes_backend']:
+        sys.stderr.write('WARNING: the baseline was recorded with another AES backend, the crypto benchmarks are not compared\n')
+        results = dict([(name, result) for (name, result) in results.items() if name not in CRYPTO_BENCHMARKS])
+    regressions = CompareResults(results, baseline['results'], options.time_tolerance, options.memory_tolerance)
+    if regressions:
+        print('PERFORMANCE REGRESSIONS:')
+        for regression in regressions:
+            print('    '+regression)
+        return 1
+    print('no regressions')
+    return 0
+
+if __name__ == '__main__':
+    try:
+        sys.exit(main())
+    except Exception as err:
+        sys.stderr.write(str(err)+'\n')
+        sys.exit(2)
@@ -0,0 +1,75 @@
+import threading
+import functools
+import http.server
+import pytest
+
+class RequestCountingHandler(http.server.SimpleHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def setup(self):
+        super().setup()
+        self.server.stats['connections'] += 1
+
+    def do_GET(self):
+        with self.server.lock:
+            self.server.stats['requests'] += 1
+            self.server.paths.append(self.path)
+            failures = self.server.failures.get(self.path, 0)
+            if failures:
+                self.server.failures[self.path] = failures-1
+            generator = self.server.generators.get(self.path)
+            byte_range = self.headers.get('Range')
+            if byte_range:
+                self.server.ranges.append((self.path, byte_range))
+        if failures:
+            self.send_error(503)
+            return
+        if generator:
+            body = generator().encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+            return
+        if byte_range:
+            self.send_byte_range(byte_range)
+            return
+        super().do_GET()
+
+    def send_byte_range(self, byte_range):
+        (first, last) = byte_range[len('bytes='):].split('-')
+        try:
+            with open(self.translate_path(self.path), 'rb') as f:
+                data = f.read()
+        except OSError:
+            self.send_error(404)
+            return
+        body = data[int(first):int(last)+1]
+        self.send_response(206)
+        self.send_header('Content-Range', 'bytes %s-%d/%d' % (first, int(first)+len(body)-1, len(data)))
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+@pytest.fixture
+def http_server(tmp_path):
+    root = tmp_path / "www"
+    root.mkdir()
+    handler = functools.partial(RequestCountingHandler, directory=str(root))
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), handler)
+    server.stats = {'connections': 0, 'requests': 0}
+    server.failures = {}
+    server.generators = {}
+    server.paths = []
+    server.ranges = []
+    server.lock = threading.Lock()
+    server.root = root
+    server.base_url = 'http://127.0.0.1:%d/' % server.server_address[1]
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
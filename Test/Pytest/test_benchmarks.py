@@ -0,0 +1,55 @@
+import os
+import subprocess
+import tracemalloc
+import importlib.util
+
+BENTO4_HOME = os.environ['BENTO4_HOME']
+spec = importlib.util.spec_from_file_location("packaging_benchmark", os.path.join(BENTO4_HOME, "Test/Benchmarks/packaging_benchmark.py"))
+benchmark = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(benchmark)
+
+BASELINE = {
+    'fast':  {'wall_time': 0.01, 'python_peak': 1000, 'max_rss': 20000000, 'max_child_rss': 0, 'subprocess_count': 2},
+    'slow':  {'wall_time': 10.0, 'python_peak': 100000000, 'max_rss': 200000000, 'max_child_rss': 0, 'subprocess_count': 0}
+}
+
+def test_compare_results():
+    # within the tolerance, or within the absolute slack for short runs
+    results = {
+        'fast':  {'wall_time': 0.05, 'python_peak': 2000000, 'max_rss': 20000000, 'max_child_rss': 0, 'subprocess_count': 2},
+        'slow':  {'wall_time': 14.0, 'python_peak': 120000000, 'max_rss': 200000000, 'max_child_rss': 0, 'subprocess_count': 0},
+        'other': {'wall_time': 1.0, 'python_peak': 0, 'max_rss': None, 'max_child_rss': None, 'subprocess_count': 0}
+    }
+    assert benchmark.CompareResults(results, BASELINE, 0.5, 0.25) == []
+
+    results['slow']['wall_time'] = 16.0
+    results['fast']['subprocess_count'] = 3
+    regressions = benchmark.CompareResults(results, BASELINE, 0.5, 0.25)
+    assert len(regressions) == 2
+    assert regressions[0].startswith('fast: subprocess_count is 3')
+    assert regressions[1].startswith('slow: wall_time is 16.000 s')
+
+def test_measurement(monkeypatch):
+    monkeypatch.setattr(subprocess, 'Popen', benchmark.CountingPopen)
+    measurement = benchmark.Measurement(trace_memory=True)
+    tracemalloc.start()
+    try:
+        with measurement:
+            with measurement:
+                subprocess.check_output(['true'])
+            data = bytearray(1000000)
+        subprocess.check_output(['true'])
+        with measurement:
+            subprocess.check_output(['true'])
+    finally:
+        tracemalloc.stop()
+    assert measurement.subprocess_count == 2
+    assert measurement.python_peak >= len(data)
+    assert measurement.wall_time > 0
+
+def test_run_benchmark(monkeypatch):
+    monkeypatch.setattr(subprocess, 'Popen', subprocess.Popen)
+    result = benchmark.RunBenchmark('dash-clone-enumeration', {'scale': 1}, False)
+    assert result['items'] == 8*10000
+    assert result['subprocess_count'] == 0
+    assert result['wall_time'] > 0
@@ -0,0 +1,134 @@
+import os
+import sys
+import struct
+import pytest
+
+BENTO4_HOME = os.environ['BENTO4_HOME']
+sys.path.insert(0, os.path.join(BENTO4_HOME, 'Source', 'Python'))
+
+# the bindings need the Bento4C shared library (cmake -DBUILD_BENTO4C=ON)
+try:
+    import bento4.core as core
+    import bento4.streams as streams
+    import bento4.inspectors as inspectors
+    import bento4.errors as errors
+except ImportError as e:
+    pytest.skip(str(e), allow_module_level=True)
+
+VIDEO_FILE = os.path.join(BENTO4_HOME, 'Test', 'Data', 'video-h264-001.mp4')
+AUDIO_FILE = os.path.join(BENTO4_HOME, 'Test', 'Data', 'audio-aac-001.mp4')
+
+def test_atom_type_name():
+    assert core.atom_name(core.atom_type('caca')) == 'caca'
+    assert core.atom_type('mp42') == core.File.FILE_BRAND_MP42
+
+def test_file_and_tracks():
+    file = core.File(VIDEO_FILE)
+    major_brand, _, compatible_brands = file.type
+    assert core.atom_name(major_brand) == 'isom'
+    assert core.File.FILE_BRAND_ISOM in compatible_brands
+    assert not file.moov_is_before_mdat
+
+    movie = file.movie
+    assert movie.duration == (3623, 1000)
+    assert list(movie.tracks) == [1, 2]
+    video, audio = movie.tracks[1], movie.tracks[2]
+    assert movie.track_by_type(core.Track.TYPE_AUDIO) is audio
+    assert (video.type, video.handler_type) == (core.Track.TYPE_VIDEO, core.Track.HANDLER_TYPE_VIDE)
+    assert (audio.type, audio.handler_type) == (core.Track.TYPE_AUDIO, core.Track.HANDLER_TYPE_SOUN)
+    assert video.media_duration == (108000, 30000)
+    assert (video.sample_count, audio.sample_count) == (54, 78)
+    assert video.language == 'eng'
+
+def test_sample_descriptions():
+    video = core.File(VIDEO_FILE).movie.tracks[1]
+    descriptions = video.sample_descriptions
+    assert len(descriptions) == 1
+    avc = descriptions[0]
+    assert isinstance(avc, core.AvcSampleDescription)
+    assert avc.type == core.SampleDescription.TYPE_AVC
+    assert core.atom_name(avc.format) == 'avc1'
+    assert (avc.width, avc.height, avc.nalu_length_size) == (160, 120, 4)
+    assert core.avc_profile_name(avc.profile) == 'Main'
+    assert avc.sequence_parameters[0][1] == avc.profile
+
+    audio = core.File(AUDIO_FILE).movie.tracks[1].sample_description(0)
+    assert isinstance(audio, core.MpegAudioSampleDescription)
+    assert (audio.sample_rate, audio.channel_count) == (44100, 2)
+    assert audio.mpeg4_audio_object_type == 2
+    assert core.mpeg_audio_object_type_name(audio.mpeg4_audio_object_type) == 'AAC Low Complexity'
+    assert audio.decoder_info == bytes([0x12, 0x10])
+
+def test_sample_data():
+    with open(VIDEO_FILE, 'rb') as f:
+        contents = f.read()
+    video = core.File(VIDEO_FILE).movie.tracks[1]
+    samples = list(video.sample_iterator())
+    assert len(samples) == video.sample_count
+    assert samples[0].is_sync
+    for sample in samples:
+        data = sample.data
+        assert isinstance(data, memoryview)
+        assert len(data) == sample.size
+        assert data == contents[sample.offset:sample.offset+sample.size]
+        # the payload is a sequence of length prefixed NAL units
+        position = 0
+        while position < len(data):
+            position += 4+struct.unpack('>I', data[position:position+4])[0]
+        assert position == len(data)
+
+    # the data of a sample outlives the sample, the track and the file
+    sample = core.File(VIDEO_FILE).movie.tracks[1].sample(1)
+    data = sample.data
+    offset = sample.offset
+    del sample
+    assert data == contents[offset:offset+len(data)]
+
+def test_sample_index():
+    audio = core.File(VIDEO_FILE).movie.tracks[2]
+    index = audio.sample_index_for_timestamp_ms(1000)
+    sample = audio.sample(index)
+    assert sample.dts <= 22050 < sample.dts+sample.duration
+    with pytest.raises(errors.Bento4Error):
+        audio.sample(audio.sample_count)
+
+def test_memory_stream():
+    stream = streams.MemoryByteStream()
+    stream.write(b'hello, world')
+    assert stream.size == 12
+    stream.seek(7)
+    assert stream.read(100) == b'world'
+    with pytest.raises(errors.EndOfStreamError):
+        stream.read_exactly(1)
+    assert bytes(stream.data) == b'hello, world'
+
+    buffer = streams.DataBuffer(b'abcd')
+    buffer.data[0] = ord('x')
+    assert bytes(buffer) == b'xbcd'
+
+def test_file_from_memory_stream():
+    with open(AUDIO_FILE, 'rb') as f:
+        contents = f.read()
+    file = core.File(stream=streams.MemoryByteStream(contents))
+    track = file.movie.tracks[1]
+    sample = track.read_sample(10)
+    assert sample.data == contents[sample.offset:sample.offset+sample.size]
+
+def test_inspectors():
+    file = core.File(AUDIO_FILE)
+    inspector = inspectors.XmlInspector()
+    file.inspect(inspector)
+    moov = inspector.root.find('atom[@name="moov"]')
+    assert moov is not None
+    assert moov.get('extra').startswith('size=8+')
+    mvhd = moov.find('atom[@name="mvhd"]')
+    fields = dict((field.get('name'), field.get('value')) for field in mvhd.findall('field'))
+    assert fields['timescale'] == '44100'
+
+    stream = streams.MemoryByteStream()
+    file.inspect(inspectors.PrintInspector(stream))
+    assert bytes(stream.data).decode('utf-8').startswith('[moov] size=8+')
+
+def test_missing_file(tmp_path):
+    with pytest.raises(errors.Bento4Error):
+        core.File(str(tmp_path / 'missing.mp4'))
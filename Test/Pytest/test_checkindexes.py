@@ -0,0 +1,93 @@
+from unittest.mock import patch
+import sys
+import os
+import json
+import shutil
+import struct
+import subprocess
+import importlib
+from mp4atoms import ParseAtoms, FindAtom, SegmentIndex, TrackFragmentRandomAccess
+checkindexes = importlib.import_module("check-indexes")
+
+BENTO4_HOME = os.environ['BENTO4_HOME']
+VIDEO_H264_001_MP4 = os.path.join(BENTO4_HOME, "Test/Data/video-h264-001.mp4")
+AUDIO_AAC_001_MP4 = os.path.join(BENTO4_HOME, "Test/Data/audio-aac-001.mp4")
+
+def make_indexed_file(input_file, output_file):
+    subprocess.check_call(['mp4fragment', '--index', '--fragment-duration', '1000', input_file, output_file])
+    return output_file
+
+def run_checkindexes(extra_args):
+    with patch.object(sys, 'argv', ['check-indexes'] + extra_args):
+        return checkindexes.main()
+
+def patch_file(filename, offset, data):
+    with open(filename, 'r+b') as f:
+        f.seek(offset)
+        f.write(data)
+
+def test_parse_indexes(tmp_path):
+    filename = make_indexed_file(AUDIO_AAC_001_MP4, str(tmp_path / 'audio.mp4'))
+    with open(filename, 'rb') as f:
+        atoms = ParseAtoms(f.read())
+    moofs = [atom.position for atom in atoms if atom.type == 'moof']
+    sidx_atom = FindAtom(atoms, 'sidx')
+    sidx = SegmentIndex(sidx_atom.payload)
+    assert len(sidx.references) == len(moofs) > 1
+    assert sidx_atom.position+sidx_atom.size+sidx.first_offset == moofs[0]
+    assert all([reference[0] == 0 and reference[3] == 1 for reference in sidx.references])
+    tfra = TrackFragmentRandomAccess(FindAtom(atoms, 'mfra/tfra').payload)
+    assert [entry[1] for entry in tfra.entries] == moofs
+    assert [entry[2:] for entry in tfra.entries] == [(1, 1, 1)]*len(moofs)
+
+def test_verify_valid_files(tmp_path):
+    make_indexed_file(VIDEO_H264_001_MP4, str(tmp_path / 'video.mp4'))
+    make_indexed_file(AUDIO_AAC_001_MP4, str(tmp_path / 'audio.m4a'))
+    (tmp_path / 'notes.txt').write_text('not an MP4 file')
+    report_filename = str(tmp_path / 'report.json')
+    assert run_checkindexes(['-q', '--jobs', '2', '--report', report_filename, str(tmp_path)]) == checkindexes.EXIT_OK
+    with open(report_filename) as f:
+        report = json.load(f)
+    assert report['summary'] == {'files': 2, 'ok': 2, 'invalid': 0, 'error': 0, 'exit_code': 0}
+    audio = [result for result in report['files'] if result['filename'].endswith('audio.m4a')][0]
+    assert audio['sidx_reference_count'] == audio['moof_count'] == audio['tfra_entry_count'] > 1
+
+def test_verify_invalid_files(tmp_path):
+    filename = make_indexed_file(AUDIO_AAC_001_MP4, str(tmp_path / 'audio.mp4'))
+    with open(filename, 'rb') as f:
+        atoms = ParseAtoms(f.read())
+    sidx_atom = FindAtom(atoms, 'sidx')
+    tfra_atom = FindAtom(atoms, 'mfra/tfra')
+
+    # shift the first sidx reference, and point the second tfra entry to the wrong moof
+    sidx_bad = str(tmp_path / 'sidx.mp4')
+    shutil.copyfile(filename, sidx_bad)
+    sidx = SegmentIndex(sidx_atom.payload)
+    if sidx.version == 0:
+        patch_file(sidx_bad, sidx_atom.position+8+16, struct.pack('>I', sidx.first_offset+8))
+    else:
+        patch_file(sidx_bad, sidx_atom.position+8+20, struct.pack('>Q', sidx.first_offset+8))
+    result = checkindexes.VerifyFile(sidx_bad)
+    assert result['status'] == 'invalid'
+    assert 'does not point to a moof atom' in result['errors'][0]
+
+    tfra_bad = str(tmp_path / 'tfra.mp4')
+    shutil.copyfile(filename, tfra_bad)
+    tfra = TrackFragmentRandomAccess(tfra_atom.payload)
+    entry_size = 8+8+3 if tfra.version else 4+4+3
+    moof_offset_position = tfra_atom.position+8+16+entry_size+(8 if tfra.version else 4)
+    patch_file(tfra_bad, moof_offset_position, struct.pack('>Q' if tfra.version else '>I', tfra.entries[0][1]+1))
+    result = checkindexes.VerifyFile(tfra_bad)
+    assert result['status'] == 'invalid'
+    assert result['errors'] == ['tfra track 1 entry 1: offset %d does not point to a moof atom' % (tfra.entries[0][1]+1)]
+
+    truncated = str(tmp_path / 'truncated.mp4')
+    with open(filename, 'rb') as f:
+        data = f.read()
+    with open(truncated, 'wb') as f:
+        f.write(data[:-10])
+    assert checkindexes.VerifyFile(truncated)['status'] == 'error'
+
+    assert run_checkindexes(['-q', sidx_bad, filename]) == checkindexes.EXIT_INVALID
+    assert run_checkindexes(['-q', truncated, sidx_bad]) == checkindexes.EXIT_ERROR
+    assert run_checkindexes(['-q', '--require-index', VIDEO_H264_001_MP4]) == checkindexes.EXIT_INVALID
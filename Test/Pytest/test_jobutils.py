@@ -0,0 +1,144 @@
+from unittest.mock import patch
+import sys
+import os
+import re
+import json
+import importlib
+import mp4synth
+import mp4utils
+from sinkutils import ListFiles, HashFile
+from jobutils import JobManifest, MakeFingerprint
+mp4dash = importlib.import_module("mp4-dash")
+
+ENCRYPTION_KEY = "000102030405060708090a0b0c0d0e0f:00112233445566778899aabbccddeeff"
+
+def make_source(tmp_path):
+    filename = str(tmp_path / "source.mp4")
+    mp4synth.WriteSyntheticMp4(filename, [mp4synth.TrackSpec('video'), mp4synth.TrackSpec('audio')], fragment_count=5)
+    return filename
+
+def run_mp4dash(args, input_files):
+    # return the names of the Bento4 tools that were run
+    commands = []
+    bento4_command = mp4utils.Bento4Command
+    def record_command(options, name, *args, **kwargs):
+        commands.append(name)
+        return bento4_command(options, name, *args, **kwargs)
+    with patch.object(mp4utils, 'Bento4Command', record_command), patch.object(sys, 'argv', ["mp4dash"] + args + input_files):
+        mp4dash.main()
+    return commands
+
+def read_files(root_dir):
+    files = {}
+    for name in ListFiles(root_dir):
+        with open(os.path.join(root_dir, name), 'rb') as f:
+            files[name] = f.read()
+    return files
+
+def get_mtimes(root_dir):
+    return dict([(name, os.stat(os.path.join(root_dir, name)).st_mtime_ns) for name in ListFiles(root_dir)])
+
+def test_manifest_only_changes(tmp_path):
+    source = make_source(tmp_path)
+    job_dir = str(tmp_path / "job")
+    output_dir = str(tmp_path / "output")
+    commands = run_mp4dash(['--hls', '--job-dir', job_dir, '-o', output_dir], [source])
+    assert commands.count('mp4split') == 2
+    media_mtimes = dict([(name, mtime) for (name, mtime) in get_mtimes(output_dir).items() if name.endswith('.mp4') or name.endswith('.m4s')])
+
+    # only the manifests are generated again, and the renamed master playlist is removed
+    args = ['--hls', '--hls-master-playlist-name', 'main.m3u8', '--attributes', 'video:role=main']
+    commands = run_mp4dash(args + ['--job-dir', job_dir, '-o', output_dir], [source])
+    assert not set(commands) & set(['mp4split', 'mp4info', 'mp4dump'])
+    reference_dir = str(tmp_path / "reference")
+    run_mp4dash(args + ['-o', reference_dir], [source])
+    assert read_files(output_dir) == read_files(reference_dir)
+    for (name, mtime) in media_mtimes.items():
+        assert get_mtimes(output_dir)[name] == mtime
+
+    # the job manifest records the outputs with their digests
+    with open(os.path.join(job_dir, 'job.json')) as f:
+        manifest = json.load(f)
+    assert manifest['inputs'][0][0] == os.path.realpath(source)
+    outputs = manifest['tasks']['split:video/avc1']['outputs']
+    assert sorted(outputs) == ['video/avc1/init.mp4'] + ['video/avc1/seg-%d.m4s' % i for i in range(1, 6)]
+    assert [output['digest'] for output in outputs.values()] == [HashFile(os.path.join(output_dir, name)) for name in outputs]
+    assert 'main.m3u8' in manifest['tasks']['manifests']['outputs']
+
+def test_changed_outputs_and_inputs(tmp_path):
+    source = make_source(tmp_path)
+    job_dir = str(tmp_path / "job")
+    output_dir = str(tmp_path / "output")
+    run_mp4dash(['--job-dir', job_dir, '-o', output_dir], [source])
+    expected = read_files(output_dir)
+
+    # a modified output is produced again, by its task only
+    with open(os.path.join(output_dir, 'audio', 'und', 'mp4a.40.2', 'seg-2.m4s'), 'wb') as f:
+        f.write(b'modified')
+    commands = run_mp4dash(['--job-dir', job_dir, '-o', output_dir], [source])
+    assert commands.count('mp4split') == 1
+    assert read_files(output_dir) == expected
+
+    # a changed input is analyzed and split again, and the outputs that are not produced anymore are removed
+    mp4synth.WriteSyntheticMp4(source, [mp4synth.TrackSpec('video'), mp4synth.TrackSpec('audio')], fragment_count=3)
+    commands = run_mp4dash(['--job-dir', job_dir, '-o', output_dir], [source])
+    assert commands.count('mp4split') == 2 and 'mp4info' in commands
+    assert 'seg-4.m4s' not in os.listdir(os.path.join(output_dir, 'video', 'avc1'))
+
+def test_encrypted_sources(tmp_path):
+    source = make_source(tmp_path)
+    job_dir = str(tmp_path / "job")
+    output_dir = str(tmp_path / "output")
+    run_mp4dash(['--hls', '--encryption-cenc-scheme', 'cbcs', '--encryption-key', ENCRYPTION_KEY, '--job-dir', job_dir, '-o', output_dir], [source])
+    with open(os.path.join(output_dir, '720p.m3u8')) as f:
+        iv = re.search('IV=(0x[0-9a-f]+)', f.read()).group(1)
+
+    # the encrypted source is kept in the job directory, with the IV that was generated for it
+    commands = run_mp4dash(['--hls', '--encryption-cenc-scheme', 'cbcs', '--encryption-key', ENCRYPTION_KEY, '--job-dir', job_dir, '-o', output_dir,
+                            '--hls-master-playlist-name', 'main.m3u8'], [source])
+    assert not set(commands) & set(['mp4encrypt', 'mp4split'])
+    with open(os.path.join(output_dir, '720p.m3u8')) as f:
+        assert re.search('IV=(0x[0-9a-f]+)', f.read()).group(1) == iv
+    assert not os.path.exists(os.path.join(output_dir, 'master.m3u8'))
+
+    # a different key encrypts the source again, and removes the previous encrypted source
+    previous_files = ListFiles(job_dir)
+    commands = run_mp4dash(['--hls', '--encryption-cenc-scheme', 'cbcs', '--encryption-key', ENCRYPTION_KEY[:-1]+'0', '--job-dir', job_dir, '-o', output_dir], [source])
+    assert commands.count('mp4encrypt') == 1 and commands.count('mp4split') == 2
+    assert len([name for name in ListFiles(job_dir) if name.startswith('encrypt-')]) == 1
+    assert set(ListFiles(job_dir)) != set(previous_files)
+
+def test_adding_smooth(tmp_path):
+    source = make_source(tmp_path)
+    job_dir = str(tmp_path / "job")
+    output_dir = str(tmp_path / "output")
+    run_mp4dash(['--hippo', '--job-dir', job_dir, '-o', output_dir], [source])
+    commands = run_mp4dash(['--hippo', '--smooth', '--job-dir', job_dir, '-o', output_dir], [source])
+    assert not set(commands) & set(['mp4split', 'mp4info', 'mp4dump'])
+    reference_dir = str(tmp_path / "reference")
+    run_mp4dash(['--hippo', '--smooth', '-o', reference_dir], [source])
+    assert read_files(output_dir) == read_files(reference_dir)
+
+def test_job_manifest(tmp_path):
+    output = tmp_path / "output.bin"
+    output.write_bytes(b'data')
+    job = JobManifest(str(tmp_path / "job"))
+    assert not job.IsDone('task', 'fingerprint')
+    job.Record('task', 'fingerprint', str(tmp_path), [str(output)], data={'a': 1})
+    job.Save()
+
+    job = JobManifest(str(tmp_path / "job"))
+    assert job.IsDone('task', 'fingerprint')
+    assert not job.IsDone('task', 'other')
+    assert job.GetData('task') == {'a': 1}
+    output.write_bytes(b'other')
+    assert not job.IsDone('task', 'fingerprint')
+
+    # the outputs that are not produced again are removed
+    job.Save()
+    assert not output.exists()
+
+    # without a job directory, nothing is ever done
+    job = JobManifest(None)
+    job.Record('task', MakeFingerprint(1, 2), str(tmp_path), [])
+    assert not job.IsDone('task', MakeFingerprint(1, 2))
@@ -0,0 +1,90 @@
+import os
+import glob
+import subprocess
+import pytest
+from concurrent.futures import ThreadPoolExecutor
+from unittest.mock import patch
+import aes
+from mp4atoms import ParseAtoms, FindAtom, GetTrackIds
+from mp4cenc import CencEncryptor, CheckEncryptionBackend
+
+BENTO4_HOME = os.environ['BENTO4_HOME']
+VIDEO_H264_001_MP4 = os.path.join(BENTO4_HOME, "Test/Data/video-h264-001.mp4")
+AUDIO_AAC_001_MP4 = os.path.join(BENTO4_HOME, "Test/Data/audio-aac-001.mp4")
+
+KID = bytes.fromhex('000102030405060708090a0b0c0d0e0f')
+KEY = bytes.fromhex('00112233445566778899aabbccddeeff')
+IV  = bytes.fromhex('0102030405060708')
+
+def split_fragmented(input_file, output_dir):
+    fragmented = os.path.join(output_dir, 'fragmented.mp4')
+    subprocess.check_call(['mp4fragment', '--fragment-duration', '1000', input_file, fragmented])
+    init = os.path.join(output_dir, 'init.mp4')
+    subprocess.check_call(['mp4split', '--init-segment', init,
+                           '--media-segment', os.path.join(output_dir, 'seg-%llu-%llu.m4s'),
+                           '--pattern-parameters', 'IN', fragmented])
+    return (init, sorted(glob.glob(os.path.join(output_dir, 'seg-*.m4s'))))
+
+def mp4encrypt(input_file, output_file, track_ids, fragments_info=None):
+    args = ['mp4encrypt', '--method', 'MPEG-CENC']
+    for track_id in track_ids:
+        args += ['--property', '%d:KID:%s' % (track_id, KID.hex()),
+                 '--key', '%d:%s:%s' % (track_id, KEY.hex(), IV.hex())]
+    if fragments_info:
+        args += ['--fragments-info', fragments_info]
+    subprocess.check_call(args+[input_file, output_file])
+    with open(output_file, 'rb') as f:
+        return f.read()
+
+def read_file(filename):
+    with open(filename, 'rb') as f:
+        return f.read()
+
+@pytest.mark.parametrize('input_file', [VIDEO_H264_001_MP4, AUDIO_AAC_001_MP4])
+def test_cenc_matches_mp4encrypt(tmp_path, input_file):
+    (init, segments) = split_fragmented(input_file, str(tmp_path))
+    assert len(segments) > 1
+    track_ids = GetTrackIds(read_file(init))
+
+    encryptor = CencEncryptor(KID, KEY, iv=IV)
+    encrypted_init = encryptor.ProcessInitSegment(read_file(init))
+    assert encrypted_init == mp4encrypt(init, str(tmp_path / 'init.enc.mp4'), track_ids)
+
+    # segments are processed out of order, the IVs restart with each segment
+    for segment in reversed(segments):
+        expected = mp4encrypt(segment, segment+'.enc', track_ids, init)
+        assert encryptor.ProcessMediaSegment(read_file(segment)) == expected
+
+def test_cenc_random_iv(tmp_path):
+    (init, segments) = split_fragmented(VIDEO_H264_001_MP4, str(tmp_path))
+    encryptor = CencEncryptor(KID, KEY)
+    encryptor.ProcessInitSegment(read_file(init))
+    clear = read_file(segments[0])
+    encrypted = encryptor.ProcessMediaSegment(clear)
+    traf = FindAtom(ParseAtoms(encrypted), 'moof/traf')
+    assert traf.FindChild('senc') is not None
+    assert traf.FindChild('saiz') is not None
+    assert traf.FindChild('saio') is not None
+    assert len(encrypted) > len(clear)
+
+def test_cenc_concurrent_segments(tmp_path):
+    (init, segments) = split_fragmented(VIDEO_H264_001_MP4, str(tmp_path))
+    encryptor = CencEncryptor(KID, KEY, iv=IV)
+    encryptor.ProcessInitSegment(read_file(init))
+    expected = [encryptor.ProcessMediaSegment(read_file(segment)) for segment in segments]
+    with ThreadPoolExecutor(4) as executor:
+        assert list(executor.map(lambda segment: encryptor.ProcessMediaSegment(read_file(segment)), segments*4)) == expected*4
+
+def test_check_encryption_backend():
+    with patch.object(aes, 'Cipher', None):
+        with pytest.raises(Exception, match='cryptography'):
+            CheckEncryptionBackend()
+
+def test_cenc_invalid_key():
+    with pytest.raises(ValueError):
+        CencEncryptor(KID, KEY[:8])
+
+def test_get_track_ids():
+    assert GetTrackIds(read_file(VIDEO_H264_001_MP4)) == [1, 2]
+    with pytest.raises(ValueError):
+        GetTrackIds(b'\x00\x00\x00\x08free')
@@ -1,6 +1,8 @@
 from unittest.mock import patch
 import sys
 import os
+import shutil
+import subprocess
 import importlib
 mp4dash = importlib.import_module("mp4-dash")
 
@@ -118,3 +120,28 @@ def test_mp4dash_020():
         "--playready"],
         "020",
         [VIDEO_H264_002_MP4])
+
+def test_mp4dash_021(tmp_path):
+    # WebVTT subtitles split along the segments of the audio (there is no video)
+    webvtt = tmp_path / "subtitles.vtt"
+    webvtt.write_text('WEBVTT\n\n' + ''.join(['%d\n00:00:%02d.000 --> 00:00:%02d.500\nCue %d\n\n' % (i, i, i+1, i) for i in range(20)]))
+    output_dir = os.path.join(TEST_OUTPUT_ROOT, "021")
+    shutil.rmtree(output_dir, ignore_errors=True)
+    fragmented = str(tmp_path / "fragmented.mp4")
+    subprocess.check_call(["mp4fragment", "--fragment-duration", "2000", AUDIO_AAC_001_MP4, fragmented])
+    run_mp4dash(["--hls", "--segment-webvtt"], "021", [fragmented, "[+format=webvtt,+language=fr]"+str(webvtt)])
+
+    audio_dir = os.path.join(output_dir, "audio", "und", "mp4a.40.2")
+    audio_segments = [name for name in os.listdir(audio_dir) if name.endswith('.m4s')]
+    subtitles_dir = os.path.join(output_dir, "subtitles", "fr")
+    subtitles_segments = [name for name in os.listdir(subtitles_dir) if name.endswith('.vtt')]
+    assert len(subtitles_segments) == len(audio_segments) > 1
+    with open(os.path.join(subtitles_dir, "seg-1.vtt")) as f:
+        assert f.read().startswith('WEBVTT\nX-TIMESTAMP-MAP=MPEGTS:0,LOCAL:00:00:00.000\n')
+    with open(os.path.join(subtitles_dir, "media.m3u8")) as f:
+        playlist = f.read()
+    assert playlist.count('#EXTINF:') == len(audio_segments)
+    assert 'seg-%d.vtt' % len(audio_segments) in playlist
+    with open(os.path.join(output_dir, "stream.mpd")) as f:
+        mpd = f.read()
+    assert 'media="subtitles/fr/seg-$Number$.vtt"' in mpd
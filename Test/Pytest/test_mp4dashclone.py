@@ -0,0 +1,325 @@
+from unittest.mock import patch
+import sys
+import os
+import subprocess
+import importlib
+import pytest
+import fetchutils
+import mp4synth
+from mp4cenc import CencEncryptor
+mp4dashclone = importlib.import_module("mp4-dash-clone")
+
+BENTO4_HOME = os.environ['BENTO4_HOME']
+VIDEO_H264_001_MP4 = os.path.join(BENTO4_HOME, "Test/Data/video-h264-001.mp4")
+SEGMENT_SIZE = 1024
+
+KID = '000102030405060708090a0b0c0d0e0f'
+KEY = '00112233445566778899aabbccddeeff'
+IV  = '0102030405060708'
+
+MPD_TEMPLATE = """<?xml version="1.0" encoding="utf-8"?>
+<MPD xmlns="urn:mpeg:dash:schema:mpd:2011" type="static" mediaPresentationDuration="PT{duration}S" profiles="urn:mpeg:dash:profile:isoff-live:2011" minBufferTime="PT2S">
+  <Period>
+    <AdaptationSet mimeType="video/mp4" segmentAlignment="true">
+      <SegmentTemplate timescale="1000" duration="2000" initialization="$RepresentationID$/init.mp4" media="$RepresentationID$/seg-$Number$.m4s" startNumber="1"{timeline}
+      <Representation id="video" bandwidth="500000" codecs="avc1.42c01e" width="320" height="240"/>
+    </AdaptationSet>
+  </Period>
+</MPD>
+"""
+
+def make_dash_source(root, use_timeline):
+    # split a test file into an init segment and fixed-size media segments
+    with open(VIDEO_H264_001_MP4, 'rb') as f:
+        data = f.read()
+    chunks = [data[i:i+SEGMENT_SIZE] for i in range(0, len(data), SEGMENT_SIZE)]
+    os.makedirs(os.path.join(root, 'video'))
+    files = {}
+    for (index, chunk) in enumerate(chunks):
+        name = 'video/init.mp4' if index == 0 else 'video/seg-%d.m4s' % index
+        with open(os.path.join(root, name), 'wb') as f:
+            f.write(chunk)
+        files[name] = chunk
+    segment_count = len(chunks)-1
+    if use_timeline:
+        timeline = '>\n        <SegmentTimeline><S t="0" d="2000" r="%d"/></SegmentTimeline>\n      </SegmentTemplate>' % (segment_count-1)
+    else:
+        timeline = '/>'
+    with open(os.path.join(root, 'stream.mpd'), 'w') as f:
+        f.write(MPD_TEMPLATE.format(duration=2*segment_count, timeline=timeline))
+    return files
+
+def run_mp4dashclone(extra_args, url, output_dir):
+    args = ["mp4dashclone", "--quiet"] + extra_args + [url, str(output_dir)]
+    with patch.object(sys, 'argv', args):
+        mp4dashclone.main()
+
+def check_clone(output_dir, files, mpd_name='stream.mpd'):
+    for (name, data) in files.items():
+        with open(os.path.join(output_dir, name), 'rb') as f:
+            assert f.read() == data
+    assert os.path.exists(os.path.join(output_dir, mpd_name))
+    leftovers = [name for (_, _, names) in os.walk(output_dir) for name in names if name.endswith('.tmp')]
+    assert leftovers == []
+
+@pytest.mark.parametrize("use_timeline", [False, True])
+def test_clone_http(http_server, tmp_path, use_timeline):
+    files = make_dash_source(str(http_server.root), use_timeline)
+    output_dir = tmp_path / "clone"
+    run_mp4dashclone(["--parallel", "4"], http_server.base_url+'stream.mpd', output_dir)
+    check_clone(output_dir, files)
+    # connections are kept alive and reused across segments
+    assert http_server.stats['connections'] < len(files)
+    assert http_server.stats['requests'] >= len(files)
+
+def test_clone_file(tmp_path):
+    source_dir = tmp_path / "source"
+    source_dir.mkdir()
+    files = make_dash_source(str(source_dir), True)
+    output_dir = tmp_path / "clone"
+    run_mp4dashclone(["--parallel", "2"], 'file://'+str(source_dir / 'stream.mpd'), output_dir)
+    check_clone(output_dir, files)
+
+def test_fetcher_retry(http_server, tmp_path):
+    (http_server.root / 'a.bin').write_bytes(b'hello')
+    http_server.failures['/a.bin'] = 2
+    with fetchutils.Fetcher(parallel=2, retries=3, backoff=0.01) as fetcher:
+        result = fetcher.Submit(http_server.base_url+'a.bin', str(tmp_path / 'out' / 'a.bin')).result()
+    assert result.status == 200
+    assert (tmp_path / 'out' / 'a.bin').read_bytes() == b'hello'
+
+def test_fetcher_not_found(http_server, tmp_path):
+    with fetchutils.Fetcher(retries=3, backoff=0.01) as fetcher:
+        with pytest.raises(fetchutils.FetchError) as error:
+            fetcher.Fetch(http_server.base_url+'missing.bin')
+    assert error.value.status == 404
+    assert http_server.stats['requests'] == 1
+
+def test_clone_resume(http_server, tmp_path):
+    files = make_dash_source(str(http_server.root), True)
+    output_dir = tmp_path / "clone"
+    run_mp4dashclone([], http_server.base_url+'stream.mpd', output_dir)
+
+    # simulate an interrupted clone: missing and truncated segments
+    os.unlink(str(output_dir / 'video' / 'seg-3.m4s'))
+    os.unlink(str(output_dir / 'video' / 'seg-7.m4s'))
+    with open(str(output_dir / 'video' / 'seg-5.m4s'), 'r+b') as f:
+        f.truncate(100)
+
+    http_server.stats['requests'] = 0
+    run_mp4dashclone(["--resume"], http_server.base_url+'stream.mpd', output_dir)
+    check_clone(output_dir, files)
+    # only the MPD and the 3 incomplete segments are requested
+    assert http_server.stats['requests'] == 1+3
+
+    # revalidation sends a conditional request for each segment
+    http_server.stats['requests'] = 0
+    run_mp4dashclone(["--resume", "--revalidate"], http_server.base_url+'stream.mpd', output_dir)
+    check_clone(output_dir, files)
+    assert http_server.stats['requests'] == 1+len(files)
+
+def test_clone_resume_template_number(http_server, tmp_path):
+    files = make_dash_source(str(http_server.root), False)
+    output_dir = tmp_path / "clone"
+    run_mp4dashclone([], http_server.base_url+'stream.mpd', output_dir)
+    os.unlink(str(output_dir / 'video' / 'seg-10.m4s'))
+
+    http_server.stats['requests'] = 0
+    del http_server.paths[:]
+    run_mp4dashclone(["--resume", "--parallel", "1"], http_server.base_url+'stream.mpd', output_dir)
+    check_clone(output_dir, files)
+    # only the MPD and the missing segment are requested, the segment count is known from the MPD duration
+    assert http_server.stats['requests'] == 1+1
+    assert http_server.paths == ['/stream.mpd', '/video/seg-10.m4s']
+
+def test_clone_http_no_extra_requests(http_server, tmp_path):
+    # with a known duration, no request is made past the last segment
+    files = make_dash_source(str(http_server.root), False)
+    run_mp4dashclone([], http_server.base_url+'stream.mpd', tmp_path / "clone")
+    assert http_server.stats['requests'] == len(files)+1
+
+def test_url_template():
+    template = mp4dashclone.CompileUrlTemplate('$RepresentationID$/$Bandwidth$/seg-$Number%05d$-$Time$-100%-$$.m4s')
+    assert template.Format('video', '500000', 1234, 7) == 'video/500000/seg-00007-1234-100%-$.m4s'
+    assert mp4dashclone.ProcessUrlTemplate('seg-$Number$.m4s', None, None, None, '3') == 'seg-3.m4s'
+    assert mp4dashclone.ProcessUrlTemplate('$RepresentationID$/seg-$Number$.m4s', None, None, None, 3) == '$RepresentationID$/seg-3.m4s'
+    assert mp4dashclone.ProcessUrlTemplate('$RepresentationID$/init.mp4', 'audio', None, None, None) == 'audio/init.mp4'
+
+def test_parse_duration():
+    assert mp4dashclone.ParseDuration('PT1H2M3.5S') == 3723.5
+    assert mp4dashclone.ParseDuration('P1DT0.02S') == mp4dashclone.Fraction('86400.02')
+    with pytest.raises(Exception):
+        mp4dashclone.ParseDuration('1H')
+
+ENUMERATION_MPD = """<?xml version="1.0" encoding="utf-8"?>
+<MPD xmlns="urn:mpeg:dash:schema:mpd:2011" type="static" mediaPresentationDuration="{duration}">
+  <Period id="1" duration="PT20.02S">
+    <AdaptationSet>
+      <SegmentTemplate timescale="1000" duration="2000" media="$RepresentationID$/$Number%03d$.m4s" startNumber="5" initialization="$RepresentationID$/init.mp4"/>
+      <Representation id="a" bandwidth="1000"/>
+    </AdaptationSet>
+  </Period>
+  <Period id="2">
+    <AdaptationSet>
+      <SegmentTemplate timescale="90000" duration="180000" media="$RepresentationID$/$Time$.m4s" startNumber="0" initialization="$RepresentationID$/init.mp4"/>
+      <Representation id="b" bandwidth="1000"/>
+    </AdaptationSet>
+    <AdaptationSet>
+      <SegmentTemplate timescale="10" media="$RepresentationID$/$Number$-$Time$.m4s" presentationTimeOffset="100" initialization="$RepresentationID$/init.mp4">
+        <SegmentTimeline><S t="100" d="20" r="1"/><S d="10" r="-1"/><S t="160" d="30" r="-1"/></SegmentTimeline>
+      </SegmentTemplate>
+      <Representation id="c" bandwidth="1000"/>
+    </AdaptationSet>
+  </Period>
+</MPD>
+"""
+
+def get_segment_urls(mpd, period, adaptation_set):
+    return list(mpd.periods[period].adaptation_sets[adaptation_set].representations[0].GenerateSegmentUrls())
+
+def test_segment_enumeration():
+    mpd = mp4dashclone.DashMPD('http://example.com/stream.mpd',
+                               mp4dashclone.ElementTree.XML(ENUMERATION_MPD.format(duration='PT30.02S')))
+    assert get_segment_urls(mpd, 0, 0) == ['a/%03d.m4s' % number for number in range(5, 16)]
+    assert get_segment_urls(mpd, 1, 0) == ['b/%d.m4s' % (i*180000) for i in range(5)]
+    assert get_segment_urls(mpd, 1, 1) == ['c/1-100.m4s', 'c/2-120.m4s', 'c/3-140.m4s', 'c/4-150.m4s',
+                                           'c/5-160.m4s', 'c/6-190.m4s']
+
+def test_segment_enumeration_large():
+    # one million segments of 2 seconds
+    mpd = mp4dashclone.DashMPD('http://example.com/stream.mpd',
+                               mp4dashclone.ElementTree.XML(ENUMERATION_MPD.format(duration='PT2000020.02S')))
+    urls = get_segment_urls(mpd, 1, 0)
+    assert len(urls) == 1000000
+    assert urls[-1] == 'b/%d.m4s' % (999999*180000)
+
+LIVE_MPD_TEMPLATE = """<?xml version="1.0" encoding="utf-8"?>
+<MPD xmlns="urn:mpeg:dash:schema:mpd:2011" type="{type}" availabilityStartTime="2020-01-01T00:00:00Z" minimumUpdatePeriod="PT0.05S" timeShiftBufferDepth="PT8S" profiles="urn:mpeg:dash:profile:isoff-live:2011" minBufferTime="PT2S">
+  <Period id="p0" start="PT0S">
+    <AdaptationSet mimeType="video/mp4" segmentAlignment="true">
+      <SegmentTemplate timescale="1000" initialization="$RepresentationID$/init.mp4" media="$RepresentationID$/seg-$Number$.m4s" startNumber="{start_number}">
+        <SegmentTimeline><S t="{start_time}" d="2000" r="3"/></SegmentTimeline>
+      </SegmentTemplate>
+      <Representation id="video" bandwidth="500000" codecs="avc1.42c01e" width="320" height="240"/>
+    </AdaptationSet>
+  </Period>
+</MPD>
+"""
+
+def make_live_source(http_server):
+    # a live stand-in: the 4 segment window advances by one segment each time the MPD
+    # is loaded, starting at segment 3, and the stream ends after 6 loads
+    polls = []
+    def live_mpd():
+        polls.append(None)
+        first = len(polls)+1
+        return LIVE_MPD_TEMPLATE.format(type='dynamic' if len(polls) < 6 else 'static',
+                                        start_number=first+1, start_time=first*2000)
+    http_server.generators['/live.mpd'] = live_mpd
+    return polls
+
+def load_mpd(filename):
+    with open(filename, 'rb') as f:
+        return mp4dashclone.DashMPD('file://'+filename, mp4dashclone.ElementTree.XML(f.read()))
+
+def test_record_live(http_server, tmp_path):
+    files = make_dash_source(str(http_server.root), True)
+    polls = make_live_source(http_server)
+
+    output_dir = tmp_path / "record"
+    run_mp4dashclone(["--record"], http_server.base_url+'live.mpd', output_dir)
+    assert len(polls) == 6
+
+    # each segment is fetched once
+    segment_paths = [p for p in http_server.paths if p.endswith('.m4s')]
+    assert sorted(segment_paths) == sorted(set(segment_paths))
+    recorded = ['video/seg-%d.m4s' % number for number in range(3, 12)]
+    check_clone(output_dir, dict([(name, files[name]) for name in ['video/init.mp4']+recorded]), 'live.mpd')
+
+    # the local MPD is a static MPD with all the recorded segments
+    mpd = load_mpd(str(output_dir / 'live.mpd'))
+    assert mpd.type == 'static'
+    assert mpd.xml.get('mediaPresentationDuration') == 'PT18.000S'
+    assert mpd.xml.get('timeShiftBufferDepth') is None
+    representation = mpd.periods[0].adaptation_sets[0].representations[0]
+    assert list(representation.GenerateSegmentUrls()) == recorded
+    assert representation.SegmentBaseLookup('presentationTimeOffset') == '4000'
+
+def test_record_live_failed_segment(http_server, tmp_path):
+    files = make_dash_source(str(http_server.root), True)
+    make_live_source(http_server)
+    http_server.failures['/video/seg-6.m4s'] = 100
+
+    # the failed segment stays in the timeline, the numbers of the following segments are unchanged
+    output_dir = tmp_path / "record"
+    run_mp4dashclone(["--record", "--retries", "0"], http_server.base_url+'live.mpd', output_dir)
+    recorded = ['video/seg-%d.m4s' % number for number in range(3, 12)]
+    check_clone(output_dir, dict([(name, files[name]) for name in recorded if name != 'video/seg-6.m4s']), 'live.mpd')
+    assert not (output_dir / 'video' / 'seg-6.m4s').exists()
+    representation = load_mpd(str(output_dir / 'live.mpd')).periods[0].adaptation_sets[0].representations[0]
+    assert list(representation.GenerateSegmentUrls()) == recorded
+    assert [segment[0] for segment in representation.GenerateTimelineSegments()] == [number*2000 for number in range(2, 11)]
+
+LIVE_TWO_TRACKS_MPD_TEMPLATE = """<?xml version="1.0" encoding="utf-8"?>
+<MPD xmlns="urn:mpeg:dash:schema:mpd:2011" type="{type}" availabilityStartTime="2020-01-01T00:00:00Z" minimumUpdatePeriod="PT0.05S" profiles="urn:mpeg:dash:profile:isoff-live:2011" minBufferTime="PT2S">
+  <Period id="p0" start="PT0S">
+    <AdaptationSet mimeType="video/mp4">
+      <SegmentTemplate timescale="1000" initialization="$RepresentationID$/init.mp4" media="$RepresentationID$/seg-$Number$.m4s" startNumber="{start_number}">
+        <SegmentTimeline><S t="{start_time}" d="2000" r="1"/></SegmentTimeline>
+      </SegmentTemplate>
+      <Representation id="video" bandwidth="500000" codecs="avc1.42c01e" width="1280" height="720"/>
+    </AdaptationSet>
+    <AdaptationSet mimeType="audio/mp4">
+      <SegmentTemplate timescale="1000" initialization="$RepresentationID$/init.mp4" media="$RepresentationID$/seg-$Number$.m4s" startNumber="{start_number}">
+        <SegmentTimeline><S t="{start_time}" d="2000" r="1"/></SegmentTimeline>
+      </SegmentTemplate>
+      <Representation id="audio" bandwidth="128000" codecs="mp4a.40.2"/>
+    </AdaptationSet>
+  </Period>
+</MPD>
+"""
+
+def mp4encrypt(input_file, output_file, fragments_info=None):
+    args = ['mp4encrypt', '--method', 'MPEG-CENC', '--property', '1:KID:'+KID, '--key', '1:%s:%s' % (KEY, IV)]
+    if fragments_info:
+        args += ['--fragments-info', fragments_info]
+    subprocess.check_call(args+[input_file, output_file])
+    with open(output_file, 'rb') as f:
+        return f.read()
+
+def test_record_live_encrypt(http_server, tmp_path):
+    pytest.importorskip('cryptography')
+    root = str(http_server.root)
+    for track_type in ['video', 'audio']:
+        source = os.path.join(root, track_type+'.mp4')
+        mp4synth.WriteSyntheticMp4(source, [mp4synth.TrackSpec(track_type)], fragment_count=6)
+        os.makedirs(os.path.join(root, track_type))
+        subprocess.check_call(['mp4split', '--pattern-parameters', 'N', '--init-segment', os.path.join(root, track_type, 'init.mp4'),
+                               '--media-segment', os.path.join(root, track_type, 'seg-%llu.m4s'), source])
+
+    # a 2 segment window that advances by one segment each time the MPD is loaded, the stream ends after 5 loads
+    polls = []
+    def live_mpd():
+        polls.append(None)
+        return LIVE_TWO_TRACKS_MPD_TEMPLATE.format(type='dynamic' if len(polls) < 5 else 'static',
+                                                   start_number=len(polls), start_time=(len(polls)-1)*2000)
+    http_server.generators['/live.mpd'] = live_mpd
+
+    # each representation is encrypted with its own track configuration, whatever the poll its segments appear in
+    output_dir = tmp_path / "record"
+    with patch.object(mp4dashclone, 'CencEncryptor', lambda kid, key: CencEncryptor(kid, key, iv=bytes.fromhex(IV))):
+        run_mp4dashclone(["--record", "--encrypt", KID+':'+KEY], http_server.base_url+'live.mpd', output_dir)
+    assert len(polls) == 5
+    for track_type in ['video', 'audio']:
+        init = os.path.join(root, track_type, 'init.mp4')
+        names = ['init.mp4']+['seg-%d.m4s' % number for number in range(1, 7)]
+        for name in names:
+            source = os.path.join(root, track_type, name)
+            expected = mp4encrypt(source, str(tmp_path / 'expected.mp4'), None if name == 'init.mp4' else init)
+            with open(str(output_dir / track_type / name), 'rb') as f:
+                assert f.read() == expected, track_type+'/'+name
+
+def test_dynamic_mpd_needs_record(http_server, tmp_path):
+    http_server.generators['/live.mpd'] = lambda: LIVE_MPD_TEMPLATE.format(type='dynamic', start_number=1, start_time=0)
+    with pytest.raises(Exception):
+        run_mp4dashclone([], http_server.base_url+'live.mpd', tmp_path / "clone")
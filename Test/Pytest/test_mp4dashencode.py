@@ -0,0 +1,188 @@
+from unittest.mock import patch
+import os
+import json
+import time
+import threading
+import importlib
+import shutil
+import subprocess
+from optparse import Values
+mp4dashencode = importlib.import_module("mp4-dash-encode")
+
+BENTO4_HOME = os.environ['BENTO4_HOME']
+VIDEO_H264_001_MP4 = os.path.join(BENTO4_HOME, "Test/Data/video-h264-001.mp4")
+
+def make_options(output_dir, **kwargs):
+    options = Values(dict(verbose=False, debug=False, keep_files=False, output_dir=str(output_dir),
+                          bitrates=4, min_bitrate=500.0, max_bitrate=2000.0, resolution=[1280, 720],
+                          audio_codec='aac', video_codec='libx264', audio_bitrate=128, select_streams=None,
+                          segment_size=72, text_overlay=False, text_overlay_font=None, encoder_params=None,
+                          force_output=True, jobs=0, encoder_threads=0, timing_report=None, single_decode=False,
+                          package=False, package_dir=None, hls=False, packager_params=None))
+    for (name, value) in kwargs.items():
+        setattr(options, name, value)
+    return options
+
+def test_compute_concurrency(tmp_path):
+    with patch.object(os, 'cpu_count', return_value=64):
+        assert mp4dashencode.compute_concurrency(make_options(tmp_path), 5) == (5, 12)
+        assert mp4dashencode.compute_concurrency(make_options(tmp_path, encoder_threads=16), 8) == (4, 16)
+        assert mp4dashencode.compute_concurrency(make_options(tmp_path, jobs=2), 8) == (2, 32)
+    with patch.object(os, 'cpu_count', return_value=None):
+        assert mp4dashencode.compute_concurrency(make_options(tmp_path), 3) == (1, 1)
+
+def test_build_encode_command(tmp_path):
+    command = mp4dashencode.build_encode_command(make_options(tmp_path, encoder_params='-tune film'), 'my source.mov', 1000, (640, 360), 8, 'out.mp4_')
+    assert command[:3] == ['ffmpeg', '-i', 'my source.mov']
+    assert command[command.index('-force_key_frames')+1] == 'expr:eq(mod(n,72),0)'
+    assert command[command.index('-threads')+1] == '8'
+    assert command[command.index('-tune')+1] == 'film'
+    assert command[-5:] == ['-s', '640x360', '-f', 'mp4', 'out.mp4_']
+
+def test_encode_ladder(tmp_path):
+    # the rungs run concurrently, and each one is fragmented as soon as it is encoded
+    running = []
+    max_running = [0]
+    lock = threading.Lock()
+    commands = []
+    def run_command(options, cmd):
+        with lock:
+            commands.append(cmd[0])
+            running.append(cmd)
+            max_running[0] = max(max_running[0], len(running))
+        time.sleep(0.05)
+        with open(cmd[-1], 'wb') as f:
+            f.write(b'data')
+        with lock:
+            running.remove(cmd)
+
+    options = make_options(tmp_path, jobs=4)
+    (bitrates, resolutions) = mp4dashencode.compute_bitrates_and_resolutions(options)
+    with patch.object(mp4dashencode, 'run_command', run_command):
+        mp4dashencode.encode_ladder(options, 'source.mp4', bitrates, resolutions)
+
+    assert max_running[0] == 4
+    assert sorted(commands) == ['ffmpeg']*4 + ['mp4fragment']*4
+    with open(str(tmp_path / 'encode-timing.json')) as f:
+        report = json.load(f)
+    assert report['jobs'] == 4
+    assert [rung['bitrate'] for rung in report['rungs']] == [int(bitrate) for bitrate in bitrates]
+    for rung in report['rungs']:
+        assert rung['encode_time'] > 0 and rung['fragment_time'] > 0
+        assert os.path.exists(rung['output'])
+        assert not os.path.exists(rung['output']+'_')
+
+def test_build_single_decode_command(tmp_path):
+    options = make_options(tmp_path)
+    (bitrates, resolutions) = mp4dashencode.compute_bitrates_and_resolutions(options)
+    outputs = ['out-%d.mp4_' % i for i in range(len(bitrates))]
+    command = mp4dashencode.build_single_decode_command(options, 'my source.mov', bitrates, resolutions, 4, outputs)
+    assert command[:7] == ['ffmpeg', '-i', 'my source.mov', '-v', 'quiet', '-y', '-filter_complex']
+    graph = command[7]
+    assert graph.startswith('[0:v:0]split=4[v0][v1][v2][v3];')
+    assert command.count('-i') == 1
+    text = ' '.join(command[8:])
+    for (i, resolution) in enumerate(resolutions):
+        assert '[v%d]scale=%d:%d[o%d]' % (i, resolution[0], resolution[1], i) in graph
+        assert '-map [o%d] -map 0:a?' % i in text
+        assert ' -bufsize %dk ' % bitrates[i] in text
+        assert ' -f mp4 '+outputs[i] in text
+    # every output gets the same keyframe forcing, so the segments stay aligned
+    assert text.count('-force_key_frames expr:eq(mod(n,72),0)') == len(bitrates)
+    assert text.count(' -threads 4 ') == len(bitrates)
+
+def test_encode_ladder_single_decode(tmp_path):
+    commands = []
+    def run_command(options, cmd):
+        commands.append(cmd)
+        if cmd[0] == 'ffmpeg':
+            outputs = [cmd[i+1] for i in range(len(cmd)-1) if cmd[i] == 'mp4']
+        else:
+            outputs = [cmd[-1]]
+        for output in outputs:
+            with open(output, 'wb') as f:
+                f.write(b'data')
+
+    options = make_options(tmp_path, single_decode=True)
+    (bitrates, resolutions) = mp4dashencode.compute_bitrates_and_resolutions(options)
+    with patch.object(mp4dashencode, 'run_command', run_command):
+        mp4dashencode.encode_ladder_single_decode(options, 'source.mp4', bitrates, resolutions)
+
+    assert sorted([cmd[0] for cmd in commands]) == ['ffmpeg'] + ['mp4fragment']*4
+    with open(str(tmp_path / 'encode-timing.json')) as f:
+        report = json.load(f)
+    assert report['mode'] == 'single-decode'
+    assert [rung['bitrate'] for rung in report['rungs']] == [int(bitrate) for bitrate in bitrates]
+    for rung in report['rungs']:
+        assert os.path.exists(rung['output'])
+        assert not os.path.exists(rung['output']+'_')
+
+def test_encode_ladder_package(tmp_path):
+    # the encoder output is packaged directly, without fragmenting it first
+    fragmented = str(tmp_path / 'fragmented.mp4')
+    subprocess.check_call(['mp4fragment', VIDEO_H264_001_MP4, fragmented])
+    commands = []
+    def run_command(options, cmd):
+        commands.append(cmd)
+        shutil.copyfile(fragmented, cmd[-1])
+
+    output_dir = tmp_path / 'encoded'
+    output_dir.mkdir()
+    options = make_options(output_dir, bitrates=2, package=True, hls=True)
+    (bitrates, resolutions) = mp4dashencode.compute_bitrates_and_resolutions(options)
+    with patch.object(mp4dashencode, 'run_command', run_command):
+        mp4dashencode.encode_ladder(options, 'source.mp4', bitrates, resolutions)
+
+    assert [cmd[0] for cmd in commands] == ['ffmpeg']*2
+    for cmd in commands:
+        assert cmd[cmd.index('-movflags')+1] == 'frag_keyframe+empty_moov'
+        assert cmd[cmd.index('-x264opts')+1].endswith(':scenecut=0')
+        assert not cmd[-1].endswith('_')
+    assert os.path.exists(str(output_dir / 'output' / 'stream.mpd'))
+    assert os.path.exists(str(output_dir / 'output' / 'master.m3u8'))
+    with open(str(output_dir / 'encode-timing.json')) as f:
+        report = json.load(f)
+    assert report['package_time'] > 0
+
+FFPROBE_OUTPUT = json.dumps({
+    'format':  {'duration': '10.0'},
+    'streams': [{'codec_type': 'audio', 'duration': '9.5'},
+                {'codec_type': 'video', 'width': 1280, 'height': 720, 'avg_frame_rate': '30000/1001'}]
+})
+FFPROBE_PACKETS = json.dumps({
+    'packets': [{'pts_time': '%.3f' % (i/24.0), 'flags': 'K_' if i % 48 == 0 else '__'} for i in range(120)]
+})
+
+def test_media_source_probe_cache(tmp_path):
+    source = tmp_path / 'source.mov'
+    source.write_bytes(b'source')
+    commands = []
+    def run_command(options, cmd):
+        commands.append(cmd)
+        return FFPROBE_PACKETS if '-show_entries' in cmd else FFPROBE_OUTPUT
+
+    options = make_options(tmp_path)
+    cache = mp4dashencode.ProbeCache(str(tmp_path / 'cache'))
+    with patch.object(mp4dashencode, 'run_command', run_command):
+        media_source = mp4dashencode.MediaSource(options, str(source), cache)
+        assert (media_source.width, media_source.height) == (1280, 720)
+        assert abs(media_source.frame_rate-29.97) < 0.01
+        assert media_source.duration == 10.0
+        assert media_source.get_stream_duration(media_source.streams[0]) == 9.5
+        assert media_source.get_stream_duration(media_source.video_stream) == 10.0
+        gop = media_source.get_gop_info()
+        assert gop['gop_sizes'] == [48, 48, 24]
+        assert gop['keyframe_times'] == [0.0, 2.0, 4.0]
+        assert commands[0][-1] == str(source)
+        assert len(commands) == 2
+
+        # the probe and the GOP info come from the cache
+        media_source = mp4dashencode.MediaSource(options, str(source), cache)
+        assert media_source.get_gop_info()['max_gop_size'] == 48
+        assert media_source.streams[1]['width'] == 1280
+        assert len(commands) == 2
+
+        # a modified file is probed again
+        source.write_bytes(b'modified source')
+        mp4dashencode.MediaSource(options, str(source), cache)
+        assert len(commands) == 3
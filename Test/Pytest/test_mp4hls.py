@@ -0,0 +1,90 @@
+from unittest.mock import patch
+from types import SimpleNamespace
+import sys
+import os
+import time
+import importlib
+import pytest
+import mp4utils
+mp4hls = importlib.import_module("mp4-hls")
+
+BENTO4_HOME = os.environ['BENTO4_HOME']
+VIDEO_H264_001_MP4 = os.path.join(BENTO4_HOME, "Test/Data/video-h264-001.mp4")
+VIDEO_H264_002_MP4 = os.path.join(BENTO4_HOME, "Test/Data/video-h264-002.mp4")
+AUDIO_AAC_002_MP4 = os.path.join(BENTO4_HOME, "Test/Data/audio-aac-002.mp4")
+
+def run_mp4hls(extra_args, output_dir, input_files):
+    args = ["mp4-hls"] + extra_args + ["-f", "-o", output_dir] + input_files
+    with patch.object(sys, 'argv', args):
+        mp4hls.main()
+
+def read_playlists(output_dir):
+    playlists = {}
+    for (dirpath, _, filenames) in os.walk(output_dir):
+        for filename in filenames:
+            if filename.endswith('.m3u8'):
+                with open(os.path.join(dirpath, filename)) as f:
+                    playlists[os.path.relpath(os.path.join(dirpath, filename), output_dir)] = f.read()
+    return playlists
+
+def test_mp4hls_parallel(tmp_path):
+    input_files = [VIDEO_H264_001_MP4, VIDEO_H264_002_MP4, '[type=audio,language=fr]'+AUDIO_AAC_002_MP4]
+    run_mp4hls(["-j", "1"], str(tmp_path / "serial"), input_files)
+    run_mp4hls(["-j", "4"], str(tmp_path / "parallel"), input_files)
+    serial = read_playlists(str(tmp_path / "serial"))
+    parallel = read_playlists(str(tmp_path / "parallel"))
+    assert 'audio/aac/und/stream.m3u8' in serial
+    assert serial == parallel
+    master = parallel['master.m3u8'].splitlines()
+    assert master.index('media-1/stream.m3u8') < master.index('media-2/stream.m3u8')
+
+def test_run_jobs_order():
+    def job(delay, value):
+        time.sleep(delay)
+        return value
+    options = SimpleNamespace(jobs=4)
+    assert mp4hls.RunJobs(options, [(job, (0.05*(4-i), i)) for i in range(4)]) == [0, 1, 2, 3]
+
+def test_run_jobs_fail_fast():
+    started = []
+    def job(i):
+        started.append(i)
+        if i == 0:
+            raise Exception('ERROR: job failed')
+        time.sleep(0.1)
+    options = SimpleNamespace(jobs=2)
+    with pytest.raises(Exception, match='job failed'):
+        mp4hls.RunJobs(options, [(job, (i,)) for i in range(10)])
+    assert len(started) < 10
+
+def test_mp4hls_no_dump(tmp_path):
+    commands = []
+    bento4_command = mp4utils.Bento4Command
+    def record_command(options, name, *args, **kwargs):
+        commands.append(name)
+        return bento4_command(options, name, *args, **kwargs)
+    with patch.object(mp4utils, 'Bento4Command', record_command):
+        run_mp4hls([], str(tmp_path / "output"), [VIDEO_H264_001_MP4, AUDIO_AAC_002_MP4])
+    assert 'mp4dump' not in commands
+    assert commands.count('mp42hls') == 3
+
+def test_lazy_mp4file():
+    options = SimpleNamespace(debug=False, exec_dir='-', min_buffer_time=0.0)
+    media_source = mp4utils.MediaSource(options, VIDEO_H264_001_MP4)
+    mp4_file = mp4utils.Mp4File(options, media_source, lazy=True)
+    track = mp4_file.find_tracks_by_type('audio')[0]
+    assert (track.id, track.codec_family, track.channels, track.language) == (2, 'mp4a', 2, 'eng')
+    assert not mp4_file.loaded
+
+    # segment-level attributes load the file
+    assert track.timescale == 22050
+    assert mp4_file.loaded
+    assert mp4_file.init_segment.type == 'moov'
+    with pytest.raises(AttributeError):
+        track.frame_rate
+
+    options.min_buffer_time = 0.0
+    full_file = mp4utils.Mp4File(options, media_source)
+    for track_id in full_file.tracks:
+        for name in mp4utils.Mp4Track.SEGMENT_INFO_ATTRIBUTES:
+            assert getattr(mp4_file.tracks[track_id], name, None) == getattr(full_file.tracks[track_id], name, None)
@@ -0,0 +1,215 @@
+from unittest.mock import patch
+import sys
+import os
+import subprocess
+import importlib
+import pytest
+from mp4atoms import ParseAtoms
+from fetchutils import Fetcher
+mp4hlsclone = importlib.import_module("mp4-hls-clone")
+
+BENTO4_HOME = os.environ['BENTO4_HOME']
+VIDEO_H264_001_MP4 = os.path.join(BENTO4_HOME, "Test/Data/video-h264-001.mp4")
+SEGMENT_SIZE = 4096
+
+KID = '000102030405060708090a0b0c0d0e0f'
+KEY = '00112233445566778899aabbccddeeff'
+
+MASTER_PLAYLIST = """#EXTM3U
+#EXT-X-MEDIA:TYPE=AUDIO,GROUP-ID="audio",NAME="English",DEFAULT=YES,URI="audio/prog.m3u8"
+#EXT-X-STREAM-INF:BANDWIDTH=500000,CODECS="avc1.42c01e,mp4a.40.2",AUDIO="audio"
+video/prog.m3u8
+#EXT-X-STREAM-INF:BANDWIDTH=400000,CODECS="avc1.42c01e,mp4a.40.2",AUDIO="audio"
+{base_url}single/prog.m3u8?token=abc
+#EXT-X-I-FRAME-STREAM-INF:BANDWIDTH=100000,URI="video/iframes.m3u8"
+"""
+
+def media_playlist(entries):
+    lines = ['#EXTM3U', '#EXT-X-VERSION:7', '#EXT-X-TARGETDURATION:2', '#EXT-X-PLAYLIST-TYPE:VOD']
+    for entry in entries:
+        lines += entry
+    return '\n'.join(lines+['#EXT-X-ENDLIST'])+'\n'
+
+def make_hls_source(root, base_url):
+    with open(VIDEO_H264_001_MP4, 'rb') as f:
+        data = f.read()
+    chunks = [data[i:i+SEGMENT_SIZE] for i in range(0, len(data), SEGMENT_SIZE)]
+    for dir in ['video', 'audio', 'single']:
+        os.makedirs(os.path.join(root, dir))
+    files = {}
+
+    # one file per segment
+    for (index, chunk) in enumerate(chunks):
+        for dir in ['video', 'audio']:
+            name = '%s/seg-%d.ts' % (dir, index)
+            with open(os.path.join(root, name), 'wb') as f:
+                f.write(chunk)
+            files[name] = chunk
+    for dir in ['video', 'audio']:
+        with open(os.path.join(root, dir, 'prog.m3u8'), 'w') as f:
+            f.write(media_playlist([['#EXTINF:2.0,', 'seg-%d.ts' % index] for index in range(len(chunks))]))
+
+    # I-frame playlist with byte ranges in the video segments
+    with open(os.path.join(root, 'video', 'iframes.m3u8'), 'w') as f:
+        f.write(media_playlist([['#EXTINF:2.0,', '#EXT-X-BYTERANGE:1000@%d' % (index*100), 'seg-%d.ts' % index]
+                                for index in range(len(chunks))]))
+
+    # single file with byte ranges, the last 100 bytes are not referenced
+    with open(os.path.join(root, 'single', 'all.ts'), 'wb') as f:
+        f.write(data)
+    segments = [['#EXTINF:2.0,', '#EXT-X-BYTERANGE:%d@0' % SEGMENT_SIZE, 'all.ts']]
+    segments += [['#EXTINF:2.0,', '#EXT-X-BYTERANGE:%d' % len(chunk), 'all.ts'] for chunk in chunks[1:-1]]
+    segments += [['#EXTINF:2.0,', '#EXT-X-BYTERANGE:%d' % (len(chunks[-1])-100), 'all.ts']]
+    with open(os.path.join(root, 'single', 'prog.m3u8'), 'w') as f:
+        f.write(media_playlist(segments))
+    files['single/all.ts'] = data[:-100]
+
+    with open(os.path.join(root, 'master.m3u8'), 'w') as f:
+        f.write(MASTER_PLAYLIST.format(base_url=base_url))
+    return files
+
+def run_mp4hlsclone(extra_args, url, output_dir):
+    args = ["mp4hlsclone", "--quiet"] + extra_args + [url, str(output_dir)]
+    with patch.object(sys, 'argv', args):
+        mp4hlsclone.main()
+
+def read_playlist(filename):
+    with open(filename) as f:
+        return [line.strip() for line in f if line.strip()]
+
+def test_hls_clone(http_server, tmp_path):
+    files = make_hls_source(str(http_server.root), http_server.base_url)
+    output_dir = tmp_path / "clone"
+    run_mp4hlsclone([], http_server.base_url+'master.m3u8', output_dir)
+
+    for (name, data) in files.items():
+        with open(str(output_dir / name), 'rb') as f:
+            assert f.read() == data
+
+    # the adjacent byte ranges are fetched with a single request
+    assert [byte_range for (request_path, byte_range) in http_server.ranges] == ['bytes=0-%d' % (len(files['single/all.ts'])-1)]
+    # the I-frame byte ranges are served from the complete segment files
+    assert len([p for p in http_server.paths if p.startswith('/video/seg-')]) == len([n for n in files if n.startswith('video/')])
+
+    # the URIs are rewritten to local, relative, paths
+    master = read_playlist(str(output_dir / 'master.m3u8'))
+    single_playlist = [line for line in master if line.startswith('single/')][0]
+    assert single_playlist.startswith('single/prog-')
+    assert 'URI="audio/prog.m3u8"' in master[1]
+    assert 'URI="video/iframes.m3u8"' in master[-1]
+    single = read_playlist(str(output_dir / single_playlist))
+    single_file = [line for line in single if not line.startswith('#')][0]
+    assert single_file == 'all.ts'
+    offset = 0
+    for line in single:
+        if line.startswith('#EXT-X-BYTERANGE:'):
+            (size, start) = line[17:].split('@')
+            assert int(start) == offset
+            offset += int(size)
+    assert offset == len(files['single/all.ts'])
+    iframes = read_playlist(str(output_dir / 'video' / 'iframes.m3u8'))
+    assert '#EXT-X-BYTERANGE:1000@100' in iframes
+
+def test_hls_clone_resume(http_server, tmp_path):
+    files = make_hls_source(str(http_server.root), http_server.base_url)
+    output_dir = tmp_path / "clone"
+    run_mp4hlsclone([], http_server.base_url+'master.m3u8', output_dir)
+    os.unlink(str(output_dir / 'audio' / 'seg-2.ts'))
+    del http_server.paths[:]
+
+    run_mp4hlsclone(["--resume"], http_server.base_url+'master.m3u8', output_dir)
+    assert [p for p in http_server.paths if not p.split('?')[0].endswith('.m3u8')] == ['/audio/seg-2.ts']
+    with open(str(output_dir / 'audio' / 'seg-2.ts'), 'rb') as f:
+        assert f.read() == files['audio/seg-2.ts']
+
+def test_fetch_spans_within_budget(http_server, tmp_path):
+    data = os.urandom(3000)
+    with open(str(http_server.root / 'file.mp4'), 'wb') as f:
+        f.write(data)
+
+    # the spans together exceed the budget, but are fetched one after the other
+    with Fetcher(parallel=1, max_in_flight_bytes=1000) as fetcher:
+        filename = str(tmp_path / 'spans.mp4')
+        fetcher.Submit(http_server.base_url+'file.mp4', filename, spans=[(0, 600), (2000, 600)]).result(timeout=10)
+        with open(filename, 'rb') as f:
+            assert f.read() == data[:600]+data[2000:2600]
+
+        filename = str(tmp_path / 'processed.mp4')
+        process = lambda mapped: [mapped[:10], mapped[-10:]]
+        fetcher.Submit(http_server.base_url+'file.mp4', filename, process, spans=[(0, 600), (2000, 600)]).result(timeout=10)
+        with open(filename, 'rb') as f:
+            assert f.read() == data[:10]+data[2590:2600]
+        assert fetcher.budget.in_use == 0
+    assert [name for name in os.listdir(str(tmp_path)) if name.endswith('.tmp')] == []
+
+def make_fmp4_source(root):
+    fragmented = os.path.join(root, 'fragmented.mp4')
+    subprocess.check_call(['mp4fragment', '--fragment-duration', '1000', VIDEO_H264_001_MP4, fragmented])
+    subprocess.check_call(['mp4split', '--init-segment', os.path.join(root, 'init.mp4'),
+                           '--media-segment', os.path.join(root, 'seg-%llu.m4s'), '--video', fragmented])
+    segments = sorted([name for name in os.listdir(root) if name.startswith('seg-')], key=lambda name: int(name[4:-4]))
+
+    # a playlist with one file per segment, and one with byte ranges in a single file
+    with open(os.path.join(root, 'files.m3u8'), 'w') as f:
+        f.write(media_playlist([['#EXT-X-MAP:URI="init.mp4"']]+[['#EXTINF:1.0,', name] for name in segments]))
+    entries = []
+    offset = 0
+    with open(os.path.join(root, 'single.mp4'), 'wb') as single:
+        for name in ['init.mp4']+segments:
+            with open(os.path.join(root, name), 'rb') as f:
+                data = f.read()
+            single.write(data)
+            if name == 'init.mp4':
+                entries.append(['#EXT-X-MAP:URI="single.mp4",BYTERANGE="%d@0"' % len(data)])
+            else:
+                entries.append(['#EXTINF:1.0,', '#EXT-X-BYTERANGE:%d@%d' % (len(data), offset), 'single.mp4'])
+            offset += len(data)
+    with open(os.path.join(root, 'single.m3u8'), 'w') as f:
+        f.write(media_playlist(entries))
+    return len(segments)
+
+def check_encrypted(filename, byte_range=None):
+    with open(filename, 'rb') as f:
+        data = f.read()
+    if byte_range is not None:
+        (size, offset) = [int(x) for x in byte_range.split('@')]
+        data = data[offset:offset+size]
+        assert len(data) == size
+    atoms = ParseAtoms(data)
+    if atoms[0].type == 'ftyp':
+        assert atoms[1].FindChild('trak/mdia/minf/stbl/stsd') is not None
+        assert b'encv' in data
+    else:
+        assert [atom.type for atom in atoms] == ['moof', 'mdat']
+        assert atoms[0].FindChild('traf/senc') is not None
+
+def test_hls_clone_encrypt(tmp_path):
+    pytest.importorskip('cryptography')
+    source_dir = tmp_path / "source"
+    source_dir.mkdir()
+    segment_count = make_fmp4_source(str(source_dir))
+
+    for playlist in ['files.m3u8', 'single.m3u8']:
+        output_dir = tmp_path / ("clone-"+playlist)
+        run_mp4hlsclone(["--encrypt", KID+':'+KEY], str(source_dir / playlist), output_dir)
+        lines = read_playlist(str(output_dir / playlist))
+        assert '#EXT-X-KEY:METHOD=SAMPLE-AES-CTR,URI="urn:marlin:kid:%s"' % KID in lines
+        byte_range = None
+        checked = 0
+        for line in lines:
+            if line.startswith('#EXT-X-MAP:'):
+                attributes = mp4hlsclone.ParseAttributeList(line[11:])
+                check_encrypted(str(output_dir / mp4hlsclone.GetAttribute(attributes, 'URI')),
+                                mp4hlsclone.GetAttribute(attributes, 'BYTERANGE'))
+            elif line.startswith('#EXT-X-BYTERANGE:'):
+                byte_range = line[17:]
+            elif not line.startswith('#'):
+                check_encrypted(str(output_dir / line), byte_range)
+                checked += 1
+        assert checked == segment_count
+
+def test_parse_attribute_list():
+    attributes = mp4hlsclone.ParseAttributeList('BANDWIDTH=1000,CODECS="avc1.42c01e,mp4a.40.2",URI="a=b.m3u8"')
+    assert attributes == [['BANDWIDTH', '1000'], ['CODECS', '"avc1.42c01e,mp4a.40.2"'], ['URI', '"a=b.m3u8"']]
+    assert mp4hlsclone.GetAttribute(attributes, 'CODECS') == 'avc1.42c01e,mp4a.40.2'
+    assert mp4hlsclone.FormatAttributeList(attributes) == 'BANDWIDTH=1000,CODECS="avc1.42c01e,mp4a.40.2",URI="a=b.m3u8"'
@@ -0,0 +1,85 @@
+from unittest.mock import patch
+import sys
+import os
+import json
+import importlib
+import pytest
+import mp4synth
+import mp4atoms
+import mp4index
+mp4dash = importlib.import_module("mp4-dash")
+
+def make_source(tmp_path):
+    filename = str(tmp_path / "source.mp4")
+    tracks = [mp4synth.TrackSpec('video', fragment_duration=1.0), mp4synth.TrackSpec('audio', fragment_duration=1.0)]
+    mp4synth.WriteSyntheticMp4(filename, tracks, fragment_count=5)
+    return filename
+
+def run_mp4dash(extra_args, output_dir, input_files):
+    args = ["mp4dash"] + extra_args + ["-f", "-o", output_dir] + input_files
+    with patch.object(sys, 'argv', args):
+        mp4dash.main()
+
+def test_segment_index(tmp_path):
+    source = make_source(tmp_path)
+    output_dir = str(tmp_path / "output")
+    run_mp4dash(["--hippo", "--segment-index"], output_dir, [source])
+
+    with open(os.path.join(output_dir, "source.mp4"), 'rb') as f:
+        media = f.read()
+    atoms = mp4atoms.ParseAtoms(media)
+    tfras = dict([(tfra.track_id, tfra) for tfra in [mp4atoms.TrackFragmentRandomAccess(atom.payload)
+                                                     for atom in mp4atoms.FindAtom(atoms, 'mfra').FindChildren('tfra')]])
+
+    with open(os.path.join(output_dir, "stream.msm")) as f:
+        server_manifest = json.load(f)
+    for media_entry in server_manifest['media']:
+        with mp4index.SegmentIndexFile(os.path.join(output_dir, media_entry['segmentIndex']['file'])) as index:
+            assert index.track_id == media_entry['trackId']
+            assert len(index) == 5
+            records = [index[i] for i in range(len(index))]
+
+            # the records match the tfra index of the source, and cover the moof and mdat atoms
+            assert [(record.start_time, record.offset) for record in records] == [entry[:2] for entry in tfras[index.track_id].entries]
+            for record in records:
+                assert record.is_sync
+                segment_atoms = [atom for atom in atoms if record.offset <= atom.position < record.offset+record.size]
+                assert [atom.type for atom in segment_atoms] == ['moof', 'mdat']
+                assert segment_atoms[-1].position+segment_atoms[-1].size == record.offset+record.size
+            for (record, next_record) in zip(records, records[1:]):
+                assert record.start_time+record.duration == next_record.start_time
+
+            # time lookups
+            assert index.find(0) == 0
+            assert index.find(records[2].start_time) == 2
+            assert index.find(records[2].start_time-1) == 1
+            assert index.find(records[-1].start_time+records[-1].duration-1) == 4
+            assert index.find(records[-1].start_time+records[-1].duration) is None
+            assert index[-1] == records[-1]
+            with pytest.raises(IndexError):
+                index[5]
+
+def test_segment_index_requires_media_files(tmp_path):
+    source = make_source(tmp_path)
+    with pytest.raises(Exception, match='--segment-index'):
+        run_mp4dash(["--segment-index"], str(tmp_path / "output"), [source])
+
+def test_segment_index_file(tmp_path):
+    records = [mp4index.SegmentIndexRecord(1000*i, 1000, 100+10*i, 10, i % 2 == 0) for i in range(100)]
+    filename = str(tmp_path / "index.idx")
+    with open(filename, 'wb') as f:
+        f.write(mp4index.MakeSegmentIndex(7, 1000, records))
+    with mp4index.SegmentIndexFile(filename) as index:
+        assert (index.track_id, index.timescale, len(index)) == (7, 1000, 100)
+        assert [index[i] for i in range(100)] == records
+        assert [index.find(time) for time in [0, 999, 1000, 54321, 99999, 100000]] == [0, 0, 1, 54, 99, None]
+
+    with open(filename, 'wb') as f:
+        f.write(mp4index.MakeSegmentIndex(7, 1000, records)[:-1])
+    with pytest.raises(ValueError, match='truncated'):
+        mp4index.SegmentIndexFile(filename)
+
+    with open(filename, 'wb') as f:
+        f.write(b'\0' * 64)
+    with pytest.raises(ValueError, match='not a segment index'):
+        mp4index.SegmentIndexFile(filename)
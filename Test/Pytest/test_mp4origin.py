@@ -0,0 +1,124 @@
+from unittest.mock import patch
+from types import SimpleNamespace
+import os
+import asyncio
+import importlib
+import http.client
+import mp4synth
+import mp4utils
+mp4dash = importlib.import_module("mp4-dash")
+mp4origin = importlib.import_module("mp4-origin")
+
+def make_source(tmp_path):
+    filename = str(tmp_path / "source.mp4")
+    tracks = [mp4synth.TrackSpec('video', fragment_duration=1.0), mp4synth.TrackSpec('audio', fragment_duration=1.0)]
+    mp4synth.WriteSyntheticMp4(filename, tracks, fragment_count=4)
+    return filename
+
+def make_origin(tmp_path, source, init_cache_size=16):
+    options = SimpleNamespace(verbose=False, init_cache_size=init_cache_size, analysis_cache_dir=str(tmp_path / "cache"))
+    return mp4origin.Origin(options, ['--hls', source])
+
+def fetch_all(port, requests):
+    # fetch all the urls on a single keep-alive connection
+    connection = http.client.HTTPConnection('127.0.0.1', port)
+    responses = []
+    for (method, url, headers) in requests:
+        connection.request(method, url, headers=headers)
+        response = connection.getresponse()
+        responses.append((response.status, dict(response.getheaders()), response.read()))
+    connection.close()
+    return responses
+
+def serve_requests(origin, requests):
+    async def run():
+        server = await mp4origin.StartServer(origin, '127.0.0.1', 0)
+        port = server.sockets[0].getsockname()[1]
+        async with server:
+            return await asyncio.get_running_loop().run_in_executor(None, fetch_all, port, requests)
+    return asyncio.run(run())
+
+def read_file(filename):
+    with open(filename, 'rb') as f:
+        return f.read()
+
+def test_origin_matches_packager(tmp_path):
+    source = make_source(tmp_path)
+    packaged_dir = str(tmp_path / "packaged")
+    mp4dash.main(['--hls', '-o', packaged_dir, source])
+
+    origin = make_origin(tmp_path, source)
+    try:
+        urls = ['/stream.mpd', '/720p.m3u8']
+        for representation_id in ['video/avc1', 'audio/und/mp4a.40.2']:
+            urls.append('/'+representation_id+'/init.mp4')
+            for number in range(1, 5):
+                urls.append('/%s/seg-%d.m4s' % (representation_id, number))
+        responses = serve_requests(origin, [('GET', url, {}) for url in urls])
+    finally:
+        origin.close()
+
+    for (url, (status, headers, body)) in zip(urls, responses):
+        assert status == 200, url
+        assert body == read_file(os.path.join(packaged_dir, *url[1:].split('/'))), url
+    assert responses[0][1]['Content-Type'] == 'application/dash+xml'
+    assert origin.stats['segments'] == 8
+    assert origin.stats['init_segments_generated'] == 2
+
+def test_origin_requests(tmp_path):
+    source = make_source(tmp_path)
+    origin = make_origin(tmp_path, source, init_cache_size=1)
+    try:
+        (offset, size) = origin.tracks['video/avc1'].segments[1]
+        responses = serve_requests(origin, [
+            ('GET',  '/video/avc1/seg-2.m4s', {'Range': 'bytes=10-19'}),
+            ('GET',  '/video/avc1/seg-2.m4s', {'Range': 'bytes=-4'}),
+            ('GET',  '/video/avc1/seg-2.m4s', {'Range': 'bytes=%d-' % size}),
+            ('HEAD', '/video/avc1/seg-2.m4s', {}),
+            ('GET',  '/video/avc1/seg-5.m4s', {}),
+            ('GET',  '/video/avc1/../../source.mp4', {}),
+            ('POST', '/stream.mpd', {}),
+            ('GET',  '/video/avc1/init.mp4', {}),
+            ('GET',  '/video/avc1/init.mp4', {}),
+            ('GET',  '/audio/und/mp4a.40.2/init.mp4', {}),
+            ('GET',  '/video/avc1/init.mp4', {})
+        ])
+    finally:
+        origin.close()
+
+    data = read_file(source)[offset:offset+size]
+    assert responses[0][0] == 206
+    assert responses[0][1]['Content-Range'] == 'bytes 10-19/%d' % size
+    assert responses[0][2] == data[10:20]
+    assert responses[1][2] == data[-4:]
+    assert responses[2][0] == 416
+    assert responses[3][0] == 200 and responses[3][1]['Content-Length'] == str(size) and responses[3][2] == b''
+    assert [response[0] for response in responses[4:7]] == [404, 404, 405]
+    assert responses[7][2] == responses[8][2] == responses[10][2]
+    assert responses[7][2][4:8] == b'ftyp'
+    # the cache only holds one init segment, so the video init segment is generated again
+    assert origin.stats['init_segments_generated'] == 3
+    assert origin.stats['init_cache_hits'] == 1
+
+def test_analysis_cache(tmp_path):
+    source = make_source(tmp_path)
+    make_origin(tmp_path, source).close()
+
+    commands = []
+    bento4_command = mp4utils.Bento4Command
+    def record_command(options, name, *args, **kwargs):
+        commands.append(name)
+        return bento4_command(options, name, *args, **kwargs)
+    with patch.object(mp4utils, 'Bento4Command', record_command):
+        make_origin(tmp_path, source).close()
+    assert 'mp4info' not in commands
+    assert 'mp4dump' not in commands
+
+def test_lru_cache():
+    cache = mp4origin.LruCache(2)
+    cache.put('a', b'1')
+    cache.put('b', b'2')
+    assert cache.get('a') == b'1'
+    cache.put('c', b'3')
+    assert cache.get('b') is None
+    assert (cache.get('a'), cache.get('c'), len(cache)) == (b'1', b'3', 2)
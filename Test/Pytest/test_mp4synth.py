@@ -0,0 +1,100 @@
+from unittest.mock import patch
+import sys
+import subprocess
+import importlib
+import random
+import pytest
+import mp4synth
+from mp4atoms import ParseAtoms, TrackFragmentHeader, TrackRun, TrackExtends, TFHD_DEFAULT_SAMPLE_SIZE_PRESENT, \
+                     TRUN_SAMPLE_SIZE_PRESENT, TRUN_SAMPLE_FLAGS_PRESENT, TRUN_FIRST_SAMPLE_FLAGS_PRESENT
+checkindexes = importlib.import_module("check-indexes")
+
+def read_atoms(filename):
+    with open(filename, 'rb') as f:
+        return ParseAtoms(f.read())
+
+def test_synth_structure(tmp_path):
+    filename = str(tmp_path / "synth.mp4")
+    tracks = [mp4synth.TrackSpec('video', fragment_duration=1.0), mp4synth.TrackSpec('audio', fragment_duration=1.0)]
+    stats = mp4synth.WriteSyntheticMp4(filename, tracks, fragment_count=5)
+    assert stats == {'fragments': 10, 'samples': 5*30+5*47}
+
+    atoms = read_atoms(filename)
+    assert [atom.type for atom in atoms[:2]] == ['ftyp', 'moov']
+    assert atoms[-1].type == 'mfra'
+    trexs = [TrackExtends(atom.payload) for atom in atoms[1].FindChild('mvex').FindChildren('trex')]
+    assert [trex.track_id for trex in trexs] == [1, 2]
+    assert [trex.default_sample_duration for trex in trexs] == [3000, 1024]
+
+    # one traf per moof, interleaved by time
+    moofs = [atom for atom in atoms if atom.type == 'moof']
+    assert len(moofs) == 10
+    track_ids = [TrackFragmentHeader(moof.FindChild('traf/tfhd').payload).track_id for moof in moofs]
+    assert track_ids == [1, 2]*5
+    for moof in moofs:
+        assert len(moof.FindChildren('traf')) == 1
+        trun = TrackRun(moof.FindChild('traf/trun').payload)
+        assert trun.flags & TRUN_SAMPLE_SIZE_PRESENT
+        # video: a sync sample at the start of each fragment, audio: all sync samples
+        if TrackFragmentHeader(moof.FindChild('traf/tfhd').payload).track_id == 1:
+            assert trun.flags & TRUN_FIRST_SAMPLE_FLAGS_PRESENT
+
+    report = checkindexes.VerifyFile(filename, require_index=True)
+    assert report['status'] == 'ok'
+    assert report['tfra_entry_count'] == 10
+
+def test_synth_defaults(tmp_path):
+    filename = str(tmp_path / "synth.mp4")
+    track = mp4synth.TrackSpec('video', samples_per_fragment=4, sample_size='constant:100', sync_interval=2)
+    mp4synth.WriteSyntheticMp4(filename, [track], fragment_count=3, mfra=False)
+    atoms = read_atoms(filename)
+    assert atoms[-1].type == 'mdat'
+    for moof in [atom for atom in atoms if atom.type == 'moof']:
+        tfhd = TrackFragmentHeader(moof.FindChild('traf/tfhd').payload)
+        assert tfhd.flags & TFHD_DEFAULT_SAMPLE_SIZE_PRESENT
+        assert tfhd.default_sample_size == 100
+        trun = TrackRun(moof.FindChild('traf/trun').payload)
+        assert trun.flags & TRUN_SAMPLE_FLAGS_PRESENT
+        assert not trun.flags & TRUN_SAMPLE_SIZE_PRESENT
+        assert trun.sample_flags == [mp4synth.SYNC_SAMPLE_FLAGS, mp4synth.NON_SYNC_SAMPLE_FLAGS]*2
+
+def test_synth_mp4info(tmp_path):
+    filename = str(tmp_path / "synth.mp4")
+    tracks = [mp4synth.TrackSpec('video', width=640, height=360, sample_size='normal:5000:1000'), mp4synth.TrackSpec('audio', sample_rate=44100)]
+    mp4synth.WriteSyntheticMp4(filename, tracks, duration=10)
+    info = subprocess.check_output(['mp4info', filename]).decode('utf-8')
+    assert 'sample count with fragments: 300' in info
+    assert 'sample count with fragments: %d' % round(10*44100/1024.0) in info
+    assert 'Codec String: avc1.42C01F' in info
+    assert 'Codec String: mp4a.40.2' in info
+
+def test_synth_sample_size_distribution():
+    rng = random.Random(1)
+    assert mp4synth.ParseSampleSizeDistribution('constant:7')(rng, 0) == 7
+    uniform = mp4synth.ParseSampleSizeDistribution('uniform:10:20')
+    assert all(10 <= uniform(rng, i) <= 20 for i in range(100))
+    for spec in ['constant', 'uniform:1', 'gamma:1:2', 'constant:x']:
+        with pytest.raises(Exception):
+            mp4synth.ParseSampleSizeDistribution(spec)
+
+def test_synth_avc_parameter_sets():
+    (sps, pps) = mp4synth.MakeAvcParameterSets(1280, 720)
+    assert sps == bytes.fromhex('6742c01fda014016e4')
+    assert pps[0] == 0x68
+    (sps, pps) = mp4synth.MakeAvcParameterSets(1920, 1080)
+    # 1080 is not a multiple of 16: the frame is cropped
+    assert b'\x00\x00\x00' not in sps
+
+def test_synth_fragment_limit(tmp_path):
+    with pytest.raises(Exception):
+        mp4synth.WriteSyntheticMp4(str(tmp_path / "synth.mp4"), [mp4synth.TrackSpec('audio', samples_per_fragment=1)],
+                                   fragment_count=mp4synth.MAX_FRAGMENT_COUNT+1)
+
+def test_synth_command_line(tmp_path):
+    filename = str(tmp_path / "synth.mp4")
+    args = ["mp4synth", "--fragments", "4", "--video", "2", "--audio", "0", "--no-mfra", filename]
+    with patch.object(sys, 'argv', args):
+        mp4synth.main()
+    atoms = read_atoms(filename)
+    assert len(atoms[1].FindChildren('trak')) == 2
+    assert len([atom for atom in atoms if atom.type == 'moof']) == 8
@@ -0,0 +1,39 @@
+import os
+import sys
+import subprocess
+import mp4utils
+
+SCRIPT_DIR = os.path.dirname(mp4utils.__file__)
+SEED_BASE64 = "XVBovsmzhP9gRIZxWfFta3VVRPzVEWmJsazEJ46I"
+KID_KEY_VECTORS = [
+    ("00112233445566778899aabbccddeeff", "cc93a30d9a68a1699ca45b168c83743e", "4c171e67130eaa55d1e788ca06fc68e4"),
+    ("0123456789abcdef0123456789abcdef", "d0d06baa4cd3668044aa3236cb10c96d", "7da81252837ecc590bf68f51e2abb8cd"),
+]
+
+def test_derive_playready_key():
+    seed = mp4utils.Base64Decode(SEED_BASE64)
+    for (kid, key, key_no_swap) in KID_KEY_VECTORS:
+        assert mp4utils.DerivePlayReadyKey(seed, bytes.fromhex(kid)).hex() == key
+        assert mp4utils.DerivePlayReadyKey(seed, bytes.fromhex(kid), False).hex() == key_no_swap
+
+def test_derive_playready_keys():
+    seed = mp4utils.Base64Decode(SEED_BASE64)
+    kids = [bytes.fromhex(kid) for (kid, _, _) in KID_KEY_VECTORS] + [os.urandom(16) for _ in range(100)]
+    keys = mp4utils.DerivePlayReadyKeys(seed, kids)
+    assert keys == [mp4utils.DerivePlayReadyKey(seed, kid) for kid in kids]
+    assert [key.hex() for key in keys[:2]] == [key for (_, key, _) in KID_KEY_VECTORS]
+
+def run_pr_derive_key(args, stdin=None):
+    return subprocess.run([sys.executable, os.path.join(SCRIPT_DIR, "pr-derive-key.py")] + args,
+                          input=stdin, capture_output=True, text=True, check=True).stdout
+
+def test_pr_derive_key_single():
+    (kid, key, key_no_swap) = KID_KEY_VECTORS[0]
+    assert run_pr_derive_key([SEED_BASE64, kid]).strip() == key
+    assert run_pr_derive_key(["--no-swap", SEED_BASE64, kid]).strip() == key_no_swap
+
+def test_pr_derive_key_batch():
+    kids = "".join(kid+"\n" for (kid, _, _) in KID_KEY_VECTORS) * 3
+    expected = "".join(kid+" "+key+"\n" for (kid, key, _) in KID_KEY_VECTORS) * 3
+    assert run_pr_derive_key(["--kids", "-", SEED_BASE64], kids) == expected
+    assert run_pr_derive_key(["--kids", "-", "--jobs", "2", "--chunk-size", "2", SEED_BASE64], kids) == expected
@@ -0,0 +1,260 @@
+from unittest.mock import patch
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+import sys
+import os
+import re
+import html
+import uuid
+import hashlib
+import datetime
+import importlib
+import threading
+import urllib.parse
+import pytest
+import mp4synth
+from sinkutils import S3Sink, S3Credentials, UploadError, SignS3Request, ListFiles, ContentAddressedStore, HashFile
+mp4dash = importlib.import_module("mp4-dash")
+
+CREDENTIALS = S3Credentials('AKIDEXAMPLE', 'secret/key')
+
+class S3StandIn(ThreadingHTTPServer):
+    """A minimal in-process S3-compatible server, that keeps the objects in memory"""
+    daemon_threads = True
+
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), S3RequestHandler)
+        self.lock     = threading.Lock()
+        self.objects  = {}
+        self.uploads  = {}
+        self.stored   = []  # keys, in the order in which the objects were stored
+        self.requests = []
+        self.failures = {}  # (method, key, query names) -> list of statuses to return before succeeding
+        self.thread   = threading.Thread(target=self.serve_forever, daemon=True)
+        self.thread.start()
+
+    def url(self, bucket_and_prefix):
+        return 'http://127.0.0.1:%d/%s' % (self.server_address[1], bucket_and_prefix)
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+class S3RequestHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+    def reply(self, status, body=b'', headers={}):
+        self.send_response(status)
+        for (name, value) in headers.items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def check_signature(self, uri, query_string, body):
+        authorization = self.headers['Authorization']
+        signed_header_names = re.search('SignedHeaders=([^,]+)', authorization).group(1).split(';')
+        headers = dict([(name, self.headers[name]) for name in signed_header_names
+                        if name not in ('x-amz-date', 'x-amz-content-sha256')])
+        now = datetime.datetime.strptime(self.headers['x-amz-date'], '%Y%m%dT%H%M%SZ')
+        SignS3Request(self.command, uri, query_string, headers, hashlib.sha256(body).hexdigest(), CREDENTIALS, 'us-east-1', now)
+        return headers['Authorization'] == authorization and self.headers['x-amz-content-sha256'] == hashlib.sha256(body).hexdigest()
+
+    def handle_request(self):
+        server = self.server
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        (uri, _, query_string) = self.path.partition('?')
+        query = dict(urllib.parse.parse_qsl(query_string, keep_blank_values=True))
+        key = urllib.parse.unquote(uri)
+        with server.lock:
+            server.requests.append((self.command, key, sorted(query)))
+            failures = server.failures.get((self.command, key, ','.join(sorted(query))))
+            if failures:
+                self.reply(failures.pop(0))
+                return
+        if not self.check_signature(uri, query_string, body):
+            self.reply(403, b'<Error><Code>SignatureDoesNotMatch</Code></Error>')
+            return
+
+        with server.lock:
+            if self.command == 'PUT' and 'partNumber' in query:
+                server.uploads[query['uploadId']][int(query['partNumber'])] = body
+                self.reply(200, headers={'ETag': '"%s"' % hashlib.md5(body).hexdigest()})
+            elif self.command == 'PUT':
+                server.objects[key] = body
+                server.stored.append(key)
+                self.reply(200, headers={'ETag': '"%s"' % hashlib.md5(body).hexdigest()})
+            elif self.command == 'POST' and 'uploads' in query:
+                upload_id = uuid.uuid4().hex
+                server.uploads[upload_id] = {}
+                self.reply(200, ('<InitiateMultipartUploadResult xmlns="http://s3.amazonaws.com/doc/2006-03-01/">' +
+                                 '<UploadId>%s</UploadId></InitiateMultipartUploadResult>' % upload_id).encode('utf-8'))
+            elif self.command == 'POST' and 'uploadId' in query:
+                parts = server.uploads.pop(query['uploadId'])
+                part_numbers = [int(number) for number in re.findall(r'<PartNumber>(\d+)</PartNumber>', body.decode('utf-8'))]
+                etags = [html.unescape(etag) for etag in re.findall(r'<ETag>([^<]+)</ETag>', body.decode('utf-8'))]
+                if part_numbers != sorted(parts) or etags != ['"%s"' % hashlib.md5(parts[number]).hexdigest() for number in part_numbers]:
+                    self.reply(200, b'<Error><Code>InvalidPart</Code></Error>')
+                    return
+                server.objects[key] = b''.join([parts[number] for number in part_numbers])
+                server.stored.append(key)
+                self.reply(200, b'<CompleteMultipartUploadResult></CompleteMultipartUploadResult>')
+            elif self.command == 'DELETE' and 'uploadId' in query:
+                server.uploads.pop(query['uploadId'], None)
+                self.reply(204)
+            else:
+                self.reply(400)
+
+    do_PUT    = handle_request
+    do_POST   = handle_request
+    do_DELETE = handle_request
+
+@pytest.fixture
+def s3():
+    server = S3StandIn()
+    yield server
+    server.stop()
+
+def write_file(filename, data):
+    os.makedirs(os.path.dirname(filename), exist_ok=True)
+    with open(filename, 'wb') as f:
+        f.write(data)
+
+def make_sink(s3, **kwargs):
+    return S3Sink(s3.url('bucket/some/prefix'), part_size=64*1024, credentials=CREDENTIALS, backoff=0.01, **kwargs)
+
+def test_s3_sink(s3):
+    sink = make_sink(s3, jobs=4)
+    files = {'stream.mpd': b'<MPD/>', 'video/init.mp4': os.urandom(1000), 'media.mp4': os.urandom(4*64*1024+17), 'kept.mp4': os.urandom(10)}
+    for (name, data) in files.items():
+        write_file(os.path.join(sink.staging_dir, name), data)
+        sink.PutFile(name, os.path.join(sink.staging_dir, name), keep=(name == 'kept.mp4'))
+    sink.Flush()
+
+    assert s3.objects == dict([('/bucket/some/prefix/'+name, data) for (name, data) in files.items()])
+    assert ListFiles(sink.staging_dir) == ['kept.mp4']
+    assert (sink.stats['objects'], sink.stats['parts']) == (4, 5)
+    assert not s3.uploads
+    sink.Close()
+    assert not os.path.exists(sink.staging_dir)
+
+def test_s3_sink_retries(s3):
+    sink = make_sink(s3)
+    s3.failures[('PUT', '/bucket/some/prefix/segment.m4s', '')] = [503, 500]
+    write_file(os.path.join(sink.staging_dir, 'segment.m4s'), b'data')
+    sink.PutFile('segment.m4s', os.path.join(sink.staging_dir, 'segment.m4s'))
+    sink.Close()
+    assert s3.objects == {'/bucket/some/prefix/segment.m4s': b'data'}
+
+def test_s3_sink_errors(s3):
+    sink = make_sink(s3, jobs=1)
+    s3.failures[('POST', '/bucket/some/prefix/large.mp4', 'uploadId')] = [403]
+    write_file(os.path.join(sink.staging_dir, 'large.mp4'), os.urandom(3*64*1024))
+    sink.PutFile('large.mp4', os.path.join(sink.staging_dir, 'large.mp4'))
+
+    # the completion of the multipart upload fails, and the upload is aborted
+    with pytest.raises(UploadError, match='HTTP error 403'):
+        sink.Close()
+    assert ('DELETE', '/bucket/some/prefix/large.mp4', ['uploadId']) in s3.requests
+    assert not s3.uploads and not s3.objects
+    assert not os.path.exists(sink.staging_dir)
+
+    sink = S3Sink(s3.url('bucket'), credentials=S3Credentials('AKIDEXAMPLE', 'wrong'), retries=0)
+    write_file(os.path.join(sink.staging_dir, 'a.mp4'), b'a')
+    sink.PutFile('a.mp4', os.path.join(sink.staging_dir, 'a.mp4'))
+    with pytest.raises(UploadError, match='HTTP error 403'):
+        sink.Flush()
+    with pytest.raises(UploadError):
+        sink.PutFile('b.mp4', os.path.join(sink.staging_dir, 'a.mp4'))
+    sink.Abort()
+
+def test_s3_sink_url():
+    with patch.dict(os.environ, {'AWS_ENDPOINT_URL': 'http://localhost:9000', 'AWS_ACCESS_KEY_ID': 'id', 'AWS_SECRET_ACCESS_KEY': 'key'}):
+        sink = S3Sink('s3://bucket/title/')
+        assert sink.GetUrl('stream.mpd') == 'http://localhost:9000/bucket/title/stream.mpd'
+        assert sink.credentials.access_key_id == 'id'
+        sink.Close()
+    with pytest.raises(UploadError, match='unsupported URL scheme'):
+        S3Sink('ftp://host/bucket')
+
+def run_mp4dash(extra_args, input_files):
+    with patch.object(sys, 'argv', ["mp4dash"] + extra_args + input_files):
+        return mp4dash.main()
+
+@pytest.mark.parametrize('extra_args', [['--hls'], ['--no-split', '--hls', '--upload-part-size', '5']])
+def test_mp4dash_output_sink(s3, tmp_path, extra_args):
+    source = str(tmp_path / "source.mp4")
+    mp4synth.WriteSyntheticMp4(source, [mp4synth.TrackSpec('video'), mp4synth.TrackSpec('audio')], fragment_count=10)
+    local_dir = str(tmp_path / "local")
+    run_mp4dash(extra_args + ['-o', local_dir], [source])
+
+    with patch.dict(os.environ, {'AWS_ACCESS_KEY_ID': CREDENTIALS.access_key_id, 'AWS_SECRET_ACCESS_KEY': CREDENTIALS.secret_access_key}):
+        (options, _, _) = run_mp4dash(extra_args + ['--output-sink', s3.url('bucket/title'), '--upload-jobs', '4'], [source])
+
+    expected = {}
+    for name in ListFiles(local_dir):
+        with open(os.path.join(local_dir, name), 'rb') as f:
+            expected['/bucket/title/'+name] = f.read()
+    assert s3.objects == expected
+    assert not os.path.exists(options.output_dir)
+    if '--no-split' in extra_args:
+        assert ('POST', '/bucket/title/source.mp4', ['uploads']) in s3.requests
+
+    # the manifests are stored after all the media
+    manifests = [key for key in s3.stored if key.endswith('.mpd') or key.endswith('.m3u8')]
+    assert s3.stored[-len(manifests):] == manifests
+
+def test_content_addressed_store(tmp_path):
+    store = ContentAddressedStore(str(tmp_path / "store"))
+    files = [str(tmp_path / name) for name in ['a.m4s', 'b.m4s', 'c.m4s']]
+    for (filename, data) in zip(files, [b'same', b'same', b'other']):
+        write_file(filename, data)
+    digests = [store.Add(filename) for filename in files]
+
+    assert digests[0] == digests[1] == hashlib.sha256(b'same').hexdigest()
+    assert ListFiles(store.store_dir) == sorted([digest[:2]+'/'+digest for digest in set(digests)])
+    for (filename, digest) in zip(files, digests):
+        assert os.path.samefile(filename, store.GetBlobPath(digest))
+    assert (store.stats['files'], store.stats['blobs'], store.stats['duplicates'], store.stats['bytes_saved']) == (3, 2, 1, 4)
+
+    # adding a file again is a no-op
+    assert store.Add(files[0]) == digests[0]
+    assert store.stats['blobs'] == 2 and store.stats['duplicates'] == 1
+
+def read_files(root_dir):
+    files = {}
+    for name in ListFiles(root_dir):
+        with open(os.path.join(root_dir, name), 'rb') as f:
+            files[name] = f.read()
+    return files
+
+@pytest.mark.parametrize('extra_args', [['--hls'], ['--no-split', '--hippo', '--segment-index']])
+def test_mp4dash_dedup_store(tmp_path, extra_args):
+    source = str(tmp_path / "source.mp4")
+    mp4synth.WriteSyntheticMp4(source, [mp4synth.TrackSpec('video'), mp4synth.TrackSpec('audio')], fragment_count=5)
+    store_dir = str(tmp_path / "store")
+    local_dir = str(tmp_path / "local")
+    run_mp4dash(extra_args + ['-o', local_dir], [source])
+    expected = read_files(local_dir)
+
+    (options, _, _) = run_mp4dash(extra_args + ['-o', str(tmp_path / "title1"), '--dedup-store', store_dir], [source])
+    stats = options.sink.store.stats
+    assert stats['files'] > 0 and stats['blobs'] == len(set(options.sink.digests.values()))
+    assert read_files(options.output_dir) == expected
+    for (name, digest) in options.sink.digests.items():
+        assert os.path.samefile(os.path.join(options.output_dir, name), options.sink.store.GetBlobPath(digest))
+    # the manifests are not stored
+    assert not [name for name in options.sink.digests if name.endswith('.mpd') or name.endswith('.m3u8')]
+
+    # packaging the same title again stores nothing new, including when overwriting an output
+    for title in ['title2', 'title1']:
+        (options, _, _) = run_mp4dash(extra_args + ['-f', '-o', str(tmp_path / title), '--dedup-store', store_dir], [source])
+        assert options.sink.store.stats['blobs'] == 0
+        assert read_files(options.output_dir) == expected
+    for name in ListFiles(store_dir):
+        assert HashFile(os.path.join(store_dir, name)) == os.path.basename(name)
+
+    with pytest.raises(Exception, match='--dedup-store'):
+        run_mp4dash(['--dedup-store', store_dir, '--output-sink', 's3://bucket', '-o', local_dir], [source])
@@ -0,0 +1,51 @@
+import os
+import skm
+import pytest
+
+# RFC 3394 section 4 test vectors: (kek, key, wrapped key)
+RFC3394_VECTORS = [
+    ("000102030405060708090A0B0C0D0E0F",
+     "00112233445566778899AABBCCDDEEFF",
+     "1FA68B0A8112B447AEF34BD8FB5A7B829D3E862371D2CFE5"),
+    ("000102030405060708090A0B0C0D0E0F1011121314151617",
+     "00112233445566778899AABBCCDDEEFF",
+     "96778B25AE6CA435F92B5B97C050AED2468AB8A17AD84E5D"),
+    ("000102030405060708090A0B0C0D0E0F101112131415161718191A1B1C1D1E1F",
+     "00112233445566778899AABBCCDDEEFF",
+     "64E8C3F9CE0F5BA263E9777905818A2A93C8191E7D6E8AE7"),
+    ("000102030405060708090A0B0C0D0E0F1011121314151617",
+     "00112233445566778899AABBCCDDEEFF0001020304050607",
+     "031D33264E15D33268F24EC260743EDCE1C6C7DDEE725A936BA814915C6762D2"),
+    ("000102030405060708090A0B0C0D0E0F101112131415161718191A1B1C1D1E1F",
+     "00112233445566778899AABBCCDDEEFF0001020304050607",
+     "A8F9BC1612C68B3FF6E6F4FBE30E71E4769C8B80A32CB8958CD5D17D6B254DA1"),
+    ("000102030405060708090A0B0C0D0E0F101112131415161718191A1B1C1D1E1F",
+     "00112233445566778899AABBCCDDEEFF000102030405060708090A0B0C0D0E0F",
+     "28C9F404C4B810F4CBCCB35CFB87F8263F5786E2D80ED326CBC7F0E71A99F43BFB988B9B7A02DD21"),
+]
+
+def test_wrap_key():
+    wk = skm.WrapKey("00112233445566778899AABBCCDDEEFF", "000102030405060708090A0B0C0D0E0F")
+    assert wk.hex().upper() == "1FA68B0A8112B447AEF34BD8FB5A7B829D3E862371D2CFE5"
+
+def test_unwrap_key():
+    uk = skm.UnwrapKey("1FA68B0A8112B447AEF34BD8FB5A7B829D3E862371D2CFE5", "000102030405060708090A0B0C0D0E0F")
+    assert uk.hex().upper() == "00112233445566778899AABBCCDDEEFF"
+
+@pytest.mark.parametrize("kek,key,wrapped", RFC3394_VECTORS)
+def test_wrap_keys_rfc3394(kek, key, wrapped):
+    assert skm.WrapKeys([bytes.fromhex(key)], kek) == [bytes.fromhex(wrapped)]
+    assert skm.UnwrapKeys([bytes.fromhex(wrapped)], kek) == [bytes.fromhex(key)]
+
+def test_wrap_keys_batch():
+    kek = os.urandom(16)
+    keys = [os.urandom(16) for _ in range(50)] + [os.urandom(24), os.urandom(32)] + [os.urandom(16) for _ in range(10)]
+    wrapped = skm.WrapKeys(keys, kek)
+    assert wrapped[:50] == [skm.WrapKey(key, kek) for key in keys[:50]]
+    assert skm.UnwrapKeys(wrapped, kek) == keys
+
+def test_unwrap_keys_wrong_kek():
+    kek = os.urandom(16)
+    wrapped = skm.WrapKeys([os.urandom(16) for _ in range(4)], kek)
+    with pytest.raises(Exception):
+        skm.UnwrapKeys(wrapped, bytes(16))
@@ -0,0 +1,74 @@
+from types import SimpleNamespace
+import xml.etree.ElementTree as ET
+import pytest
+from subtitles import SubtitlesFile, WebvttSegmenter, parse_webvtt_timestamp, format_webvtt_timestamp
+
+TTML_HEADER = ('<?xml version="1.0" encoding="UTF-8"?>\n'
+               '<tt xmlns="http://www.w3.org/ns/ttml" xml:lang="fr"><body><div>')
+
+def make_subtitles_file(tmp_path, content, format='ttml', spec=None):
+    filename = tmp_path / ('subtitles.'+('xml' if format == 'ttml' else 'vtt'))
+    filename.write_text(content)
+    options = SimpleNamespace(debug=False, rename_media=False)
+    media_source = SimpleNamespace(filename=str(filename), format=format, spec=spec or {})
+    return SubtitlesFile(options, media_source)
+
+def test_ttml_language_from_root_only(tmp_path):
+    # the document is only read up to the root element, the rest is not even well formed
+    image = 'A'*(1024*1024)
+    content = TTML_HEADER + '<p><image>'+image+'</image></p>' + '<p>unterminated'
+    subtitles = make_subtitles_file(tmp_path, content)
+    assert subtitles.format == 'ttml'
+    assert subtitles.language == 'fr'
+    assert subtitles.size == len(content)
+    with pytest.raises(ET.ParseError):
+        subtitles.get_xml_tree()
+
+def test_ttml_full_parse_on_demand(tmp_path):
+    subtitles = make_subtitles_file(tmp_path, TTML_HEADER+'<p>Bonjour</p></div></body></tt>', spec={'+language': 'deu'})
+    assert subtitles.language == 'fr'
+    assert subtitles.get_xml_tree().getroot().find('.//{http://www.w3.org/ns/ttml}p').text == 'Bonjour'
+    assert subtitles.get_xml_tree() is subtitles.get_xml_tree()
+
+def test_webvtt_language_from_spec(tmp_path):
+    subtitles = make_subtitles_file(tmp_path, 'WEBVTT\n', format='webvtt', spec={'+language': 'deu'})
+    assert (subtitles.format, subtitles.mime_type) == ('webvtt', 'text/vtt')
+    assert subtitles.language == 'de'
+
+def read_segment_cues(filename):
+    with open(filename) as f:
+        return [line for line in f.read().split('\n') if line.startswith('Cue')]
+
+def test_webvtt_segmenter(tmp_path):
+    webvtt = tmp_path / 'subtitles.vtt'
+    webvtt.write_text('﻿WEBVTT\nX-TIMESTAMP-MAP=MPEGTS:0,LOCAL:00:00:00.000\n\n'
+                      'STYLE\n::cue { color: red }\n\n'
+                      'NOTE a comment\n\n'
+                      '00:00.500 --> 00:01.000\nCue 1\n\n'
+                      'id-2\n00:00:01.500 --> 00:00:05.000 line:0\nCue 2\n\n'
+                      '00:00:09.000 --> 00:00:09.500\nCue 3\n')
+    output_dir = tmp_path / 'segments'
+    output_dir.mkdir()
+    segmenter = WebvttSegmenter(str(webvtt), [2.002, 2.002, 2.002, 2.002, 2.002], mpegts=10000)
+    names = segmenter.segment(str(output_dir), 'seg-%d.vtt')
+    assert names == ['seg-%d.vtt' % i for i in range(1, 6)]
+
+    with open(str(output_dir / 'seg-1.vtt')) as f:
+        first = f.read()
+    assert first.startswith('WEBVTT\nX-TIMESTAMP-MAP=MPEGTS:10000,LOCAL:00:00:00.000\n\nSTYLE\n::cue { color: red }\n')
+    assert first.count('X-TIMESTAMP-MAP') == 1
+    assert 'NOTE' not in first
+    assert 'id-2\n00:00:01.500 --> 00:00:05.000 line:0\nCue 2' in first
+
+    # the cues that span segment boundaries are repeated, and the empty segments are still valid files
+    assert [read_segment_cues(str(output_dir / name)) for name in names] == [
+        ['Cue 1', 'Cue 2'], ['Cue 2'], ['Cue 2'], [], ['Cue 3']]
+    with open(str(output_dir / 'seg-4.vtt')) as f:
+        assert f.read().startswith('WEBVTT\n')
+
+def test_webvtt_timestamps():
+    assert parse_webvtt_timestamp('01:02.345') == 62345
+    assert parse_webvtt_timestamp('10:00:00.001') == 36000001
+    assert format_webvtt_timestamp(36062345) == '10:01:02.345'
+    with pytest.raises(Exception):
+        parse_webvtt_timestamp('1:2.3')
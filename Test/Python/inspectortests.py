@@ -8,4 +8,4 @@ BENTO4_TEST_DATA_DIR = path.join(path.dirname(__file__), '..', 'Data')
 file = bt4core.File(path.join(BENTO4_TEST_DATA_DIR, 'test-001.mp4'))
 inspector = bt4inspect.XmlInspector()
 file.inspect(inspector)
-print xml.etree.ElementTree.tostring(inspector.root)
+print(xml.etree.ElementTree.tostring(inspector.root))